@@ -37,10 +37,102 @@
     // 配置
     const API_URL = 'http://localhost:8889';
 
+    // 用户标识: 服务端按它保存语言偏好和常用指令，用于生成解码提示
+    const CLIENT_ID = (() => {
+        let id = localStorage.getItem('voice_client_id');
+        if (!id) {
+            id = (crypto.randomUUID && crypto.randomUUID()) || `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+            localStorage.setItem('voice_client_id', id);
+        }
+        return id;
+    })();
+
+    // 上传音频格式: 16kHz单声道低码率Opus，语音识别足够且体积远小于默认录音
+    const AUDIO_CONFIG = {
+        sampleRate: 16000,
+        channelCount: 1,
+        bitsPerSecond: 16000,
+        mimeTypes: ['audio/webm;codecs=opus', 'audio/ogg;codecs=opus']
+    };
+
+    // 客户端语音活动检测 (VAD)
+    const VAD_CONFIG = {
+        enabled: true,
+        threshold: 0.015,      // 最低RMS能量阈值，实际阈值会随环境噪声自适应抬高
+        minSpeechMs: 120,      // 连续超过阈值多久才算开始说话
+        silenceMs: 1200,       // 说话后静音多久自动停止
+        preRollMs: 300,        // 说话开始前保留的音频，避免吞掉首字
+        startOnSpeech: true,   // 检测到说话才开始录音编码 (裁掉开头静音)
+        autoStop: true         // 结尾静音超时后自动停止，无需一直按住
+    };
+
+    // VAD AudioWorklet处理器源码，运行在音频线程
+    const VAD_WORKLET_SOURCE = `
+        class VoiceActivityDetector extends AudioWorkletProcessor {
+            constructor(options) {
+                super();
+                const opts = options.processorOptions;
+                this.threshold = opts.threshold;
+                this.minSpeechFrames = Math.ceil(opts.minSpeechMs / 1000 * sampleRate / 128);
+                this.silenceFrames = Math.ceil(opts.silenceMs / 1000 * sampleRate / 128);
+                this.delay = new Float32Array(Math.max(128, Math.round(opts.preRollMs / 1000 * sampleRate)));
+                this.delayIndex = 0;
+                this.noiseFloor = opts.threshold / 3;
+                this.voicedRun = 0;
+                this.silentRun = 0;
+                this.speaking = false;
+            }
+
+            process(inputs, outputs) {
+                const input = inputs[0][0];
+                const output = outputs[0][0];
+                if (!input) return true;
+
+                let energy = 0;
+                for (let i = 0; i < input.length; i++) energy += input[i] * input[i];
+                const rms = Math.sqrt(energy / input.length);
+
+                // 自适应阈值: 噪声底只在非说话状态下缓慢跟踪
+                if (!this.speaking) this.noiseFloor = this.noiseFloor * 0.995 + rms * 0.005;
+                const voiced = rms > Math.max(this.threshold, this.noiseFloor * 3);
+
+                if (voiced) {
+                    this.voicedRun++;
+                    this.silentRun = 0;
+                    if (!this.speaking && this.voicedRun >= this.minSpeechFrames) {
+                        this.speaking = true;
+                        this.port.postMessage({ type: 'speech-start' });
+                    }
+                } else {
+                    this.voicedRun = 0;
+                    this.silentRun++;
+                    if (this.speaking && this.silentRun >= this.silenceFrames) {
+                        this.speaking = false;
+                        this.port.postMessage({ type: 'speech-end' });
+                    }
+                }
+
+                // 环形缓冲延迟输出
+                for (let i = 0; i < input.length; i++) {
+                    output[i] = this.delay[this.delayIndex];
+                    this.delay[this.delayIndex] = input[i];
+                    this.delayIndex = (this.delayIndex + 1) % this.delay.length;
+                }
+                return true;
+            }
+        }
+        registerProcessor('voice-activity-detector', VoiceActivityDetector);
+    `;
+
     // 全局变量
     let isRecording = false;
     let mediaRecorder = null;
+    let mediaStream = null;
     let audioChunks = [];
+    let audioContext = null;
+    let vadNode = null;
+    // 进行中的 /voice 请求: 开始新的录音时中止它，并通知服务端停止推理
+    let inflightRequest = null;
 
     // 创建样式
     function createStyles() {
@@ -187,21 +279,25 @@
 
     // 开始录音
     async function startRecording() {
-        if (isRecording) return;
+        // 上一段录音仍在收尾 (等待preRoll缓冲输出) 时不重复开始
+        if (isRecording || (mediaRecorder && mediaRecorder.state === 'recording')) return;
 
         console.log('🎤 开始录音...');
         showStatus('🎤 录音中...', 'recording');
+        cancelInflightRequest();
 
         try {
-            const stream = await navigator.mediaDevices.getUserMedia({
+            mediaStream = await navigator.mediaDevices.getUserMedia({
                 audio: {
                     echoCancellation: true,
                     noiseSuppression: true,
-                    autoGainControl: true
+                    autoGainControl: true,
+                    channelCount: AUDIO_CONFIG.channelCount,
+                    sampleRate: AUDIO_CONFIG.sampleRate
                 }
             });
 
-            mediaRecorder = new MediaRecorder(stream);
+            mediaRecorder = await createRecorder(mediaStream);
             audioChunks = [];
             isRecording = true;
 
@@ -213,52 +309,206 @@
             };
 
             mediaRecorder.onstop = () => {
-                stream.getTracks().forEach(track => track.stop());
+                releaseAudio();
                 processAudio();
             };
 
-            mediaRecorder.start();
+            if (vadNode && VAD_CONFIG.startOnSpeech) {
+                // 等到检测到说话才开始编码，开头的静音不会被上传
+                showStatus('🎤 请说话...', 'recording');
+            } else {
+                mediaRecorder.start();
+            }
 
         } catch (error) {
             console.error('录音失败:', error);
             showStatus('❌ 无法访问麦克风', 'error');
+            releaseAudio();
             isRecording = false;
         }
     }
 
+    // 取消上一段还在处理的录音: 断开连接的同时显式发送取消，服务端立即释放推理槽位
+    function cancelInflightRequest() {
+        if (!inflightRequest) return;
+        const { id, controller } = inflightRequest;
+        inflightRequest = null;
+        controller.abort();
+        fetch(`${API_URL}/cancel`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'X-Client-Id': CLIENT_ID },
+            body: JSON.stringify({ request_id: id }),
+            keepalive: true
+        }).catch(() => {});
+        console.log('🚫 已取消上一段录音的处理:', id);
+    }
+
+    // 选择浏览器支持的Opus封装格式
+    function pickMimeType() {
+        if (typeof MediaRecorder.isTypeSupported !== 'function') return '';
+        return AUDIO_CONFIG.mimeTypes.find(type => MediaRecorder.isTypeSupported(type)) || '';
+    }
+
+    // 创建录音器: 先经 16kHz AudioContext 重采样为单声道，再以低码率Opus编码
+    async function createRecorder(stream) {
+        let recordStream = stream;
+
+        try {
+            audioContext = new AudioContext({ sampleRate: AUDIO_CONFIG.sampleRate });
+            const source = audioContext.createMediaStreamSource(stream);
+            const destination = audioContext.createMediaStreamDestination();
+            destination.channelCount = AUDIO_CONFIG.channelCount;
+
+            vadNode = VAD_CONFIG.enabled ? await createVadNode(audioContext) : null;
+            if (vadNode) {
+                source.connect(vadNode);
+                vadNode.connect(destination);
+            } else {
+                source.connect(destination);
+            }
+            recordStream = destination.stream;
+        } catch (error) {
+            // 部分浏览器不支持指定采样率，退回原始音频流
+            console.warn('⚠️ 客户端重采样不可用，使用原始采样率:', error);
+            closeAudioContext();
+        }
+
+        const options = { audioBitsPerSecond: AUDIO_CONFIG.bitsPerSecond };
+        const mimeType = pickMimeType();
+        if (mimeType) options.mimeType = mimeType;
+
+        return new MediaRecorder(recordStream, options);
+    }
+
+    // 创建VAD节点: AudioWorklet中按帧计算能量，并把音频延迟preRollMs输出，
+    // 这样在"开始说话"事件之后才启动录音器也不会丢掉语音开头
+    async function createVadNode(context) {
+        if (!context.audioWorklet) {
+            console.warn('⚠️ 浏览器不支持AudioWorklet，VAD已禁用');
+            return null;
+        }
+
+        try {
+            const moduleUrl = URL.createObjectURL(new Blob([VAD_WORKLET_SOURCE], { type: 'application/javascript' }));
+            await context.audioWorklet.addModule(moduleUrl);
+            URL.revokeObjectURL(moduleUrl);
+        } catch (error) {
+            console.warn('⚠️ VAD模块加载失败，VAD已禁用:', error);
+            return null;
+        }
+
+        const node = new AudioWorkletNode(context, 'voice-activity-detector', {
+            numberOfInputs: 1,
+            numberOfOutputs: 1,
+            outputChannelCount: [1],
+            processorOptions: {
+                threshold: VAD_CONFIG.threshold,
+                minSpeechMs: VAD_CONFIG.minSpeechMs,
+                silenceMs: VAD_CONFIG.silenceMs,
+                preRollMs: VAD_CONFIG.preRollMs
+            }
+        });
+        node.port.onmessage = handleVadEvent;
+        return node;
+    }
+
+    // 处理VAD事件
+    function handleVadEvent(event) {
+        if (!isRecording || !mediaRecorder) return;
+
+        if (event.data.type === 'speech-start') {
+            console.log('🗣️ 检测到说话');
+            if (mediaRecorder.state === 'inactive') {
+                mediaRecorder.start();
+                showStatus('🎤 录音中...', 'recording');
+            }
+        } else if (event.data.type === 'speech-end' && VAD_CONFIG.autoStop) {
+            console.log(`🔇 静音超过${VAD_CONFIG.silenceMs}ms，自动停止录音`);
+            stopRecording();
+        }
+    }
+
+    function closeAudioContext() {
+        if (vadNode) {
+            vadNode.port.onmessage = null;
+            vadNode = null;
+        }
+        if (audioContext) {
+            audioContext.close().catch(() => {});
+            audioContext = null;
+        }
+    }
+
+    // 释放麦克风和音频处理资源
+    function releaseAudio() {
+        if (mediaStream) {
+            mediaStream.getTracks().forEach(track => track.stop());
+            mediaStream = null;
+        }
+        closeAudioContext();
+    }
+
     // 停止录音
     function stopRecording() {
         if (!isRecording) return;
 
-        console.log('⏹️ 停止录音...');
-        showStatus('🔄 处理中...', 'processing');
-
-        mediaRecorder.stop();
         isRecording = false;
-
         const button = document.getElementById('force-voice-btn');
         button.classList.remove('recording');
+
+        if (mediaRecorder.state === 'inactive') {
+            // 从未检测到说话，不上传任何音频
+            console.log('🔇 未检测到说话，取消上传');
+            releaseAudio();
+            showStatus('❌ 未检测到语音', 'error');
+            return;
+        }
+
+        console.log('⏹️ 停止录音...');
+        showStatus('🔄 处理中...', 'processing');
+
+        // VAD节点输出有preRoll延迟，稍等片刻让末尾的语音也进入录音器
+        const recorder = mediaRecorder;
+        setTimeout(() => recorder.stop(), vadNode ? VAD_CONFIG.preRollMs : 0);
     }
 
-    // 处理音频
+    // 处理音频 - 通过 /voice 一次往返完成转录、指令检测和执行
     async function processAudio() {
+        const requestId = (crypto.randomUUID && crypto.randomUUID()) || `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+        const controller = new AbortController();
+        inflightRequest = { id: requestId, controller };
         try {
-            const audioBlob = new Blob(audioChunks, { type: 'audio/wav' });
+            // 按录音器实际输出格式标注，而不是笼统地标为wav
+            const mimeType = mediaRecorder.mimeType || 'audio/webm';
+            const extension = mimeType.includes('ogg') ? 'ogg' : 'webm';
+            const audioBlob = new Blob(audioChunks, { type: mimeType });
 
             const formData = new FormData();
-            formData.append('audio_file', audioBlob, 'recording.wav');
+            formData.append('audio_file', audioBlob, `recording.${extension}`);
+            formData.append('execute_commands', 'true');
+            formData.append('speak', 'true');  // 服务端启用语音合成时返回回复语音
 
-            const response = await fetch(`${API_URL}/transcribe`, {
+            const requestStart = performance.now();
+            const response = await fetch(`${API_URL}/voice`, {
                 method: 'POST',
-                body: formData
+                headers: { 'X-Client-Id': CLIENT_ID, 'X-Request-Id': requestId },
+                body: formData,
+                signal: controller.signal
             });
 
+            if (response.status === 429) {
+                const retryAfter = response.headers.get('Retry-After');
+                showStatus(`⏳ 请求过多，请${retryAfter ? ` ${retryAfter} 秒后` : '稍后'}再试`, 'error');
+                return;
+            }
             if (!response.ok) {
-                throw new Error(`转录失败: ${response.status}`);
+                throw new Error(`语音处理失败: ${response.status}`);
             }
 
             const result = await response.json();
             const text = result.transcribed_text;
+            console.log(`⏱️ 往返耗时: ${Math.round(performance.now() - requestStart)}ms`, result.timings);
+            console.log(`📦 上传: ${audioBlob.size} 字节 (${mimeType})`, result.upload);
 
             if (!text || text.trim() === '') {
                 showStatus('❌ 未检测到语音', 'error');
@@ -268,28 +518,53 @@
             console.log('✅ 转录结果:', text);
             console.log('🔍 指令检测:', result.is_command ? `${result.command_type} - ${result.command_target}` : '普通对话');
 
-            // 显示转录结果和指令类型
-            const statusText = result.is_command ?
-                `🎯 指令: "${text}"` :
-                `💬 对话: "${text}"`;
-            showStatus(statusText, 'success');
-
-            // 使用后端的智能判断结果
+            // 使用后端的智能判断结果，指令已在服务端执行
             if (result.is_command) {
-                console.log('🎯 检测到语音指令:', text);
-                showStatus('🔧 执行指令中...', 'processing');
-                handleVoiceCommand(text);
+                showCommandResult(text, result);
             } else {
                 console.log('💬 普通文本消息:', text);
+                showStatus(`💬 对话: "${text}"`, 'success');
                 insertTextToChat(text);
             }
 
         } catch (error) {
+            if (error.name === 'AbortError') return;  // 被新的录音取消
             console.error('处理失败:', error);
             showStatus(`❌ ${error.message}`, 'error');
+        } finally {
+            if (inflightRequest && inflightRequest.id === requestId) inflightRequest = null;
+        }
+    }
+
+    // 显示指令执行结果
+    function showCommandResult(text, result) {
+        console.log('🎯 检测到语音指令:', text);
+
+        if (result.command_executed) {
+            showStatus(`✅ 已执行: ${text}`, 'success', 5000);
+            playReplyAudio(result.reply_audio);
+            console.log('指令执行结果:', result.command_result);
+
+            // 显示执行结果
+            if (result.command_result) {
+                setTimeout(() => {
+                    showStatus(`结果: ${result.command_result}`, 'info', 8000);
+                }, 2000);
+            }
+        } else {
+            // 指令未能执行，当作普通文本处理
+            insertTextToChat(text);
         }
     }
 
+    // 播放服务端合成的回复语音 (base64 WAV)，未启用语音合成时为null
+    function playReplyAudio(base64Wav) {
+        if (!base64Wav) return;
+        new Audio(`data:audio/wav;base64,${base64Wav}`).play().catch(error => {
+            console.warn('回复语音播放失败:', error);
+        });
+    }
+
     // 检查是否为语音指令
     function isVoiceCommand(text) {
         const commands = [
@@ -308,7 +583,8 @@
             const response = await fetch(`${API_URL}/process`, {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    'X-Client-Id': CLIENT_ID
                 },
                 body: JSON.stringify({
                     text: text,
@@ -321,21 +597,7 @@
             }
 
             const result = await response.json();
-
-            if (result.command_executed) {
-                showStatus(`✅ 已执行: ${text}`, 'success', 5000);
-                console.log('指令执行结果:', result.command_result);
-
-                // 显示执行结果
-                if (result.command_result) {
-                    setTimeout(() => {
-                        showStatus(`结果: ${result.command_result}`, 'info', 8000);
-                    }, 2000);
-                }
-            } else {
-                // 如果不是指令，当作普通文本处理
-                insertTextToChat(text);
-            }
+            showCommandResult(text, result);
 
         } catch (error) {
             console.error('指令处理失败:', error);
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+推理准入控制
+- 每个客户端一个令牌桶，按音频秒数计费，超出速率直接返回429 (批量任务不计费，只排队)
+- 推理槽位有限，排队请求分两个优先级: 短指令音频优先于长听写
+- 同一优先级内按加权公平排队 (WFQ)，连续提交长录音的客户端不会饿死其他人
+- 准入、排队、拒绝都记入指标
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Optional
+
+from metrics import metrics
+
+PRIORITY_COMMAND = 0
+PRIORITY_DICTATION = 1
+PRIORITY_NAMES = {PRIORITY_COMMAND: "command", PRIORITY_DICTATION: "dictation"}
+
+
+class AdmissionRejected(Exception):
+    """请求未被准入 (reason: rate_limited / queue_full / queue_timeout / cancelled)"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """令牌桶: rate 为每秒补充的令牌数，capacity 为桶容量"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, cost: float, now: Optional[float] = None) -> float:
+        """扣除令牌，成功返回0，否则返回还需等待的秒数"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        # 超过桶容量的请求按满桶计费，长录音也能在桶满时通过
+        cost = min(cost, self.capacity)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def refund(self, cost: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + min(cost, self.capacity))
+
+
+@dataclass
+class _ClientState:
+    bucket: TokenBucket
+    last_finish: float = 0.0
+    weight: float = 1.0
+
+
+@dataclass(order=True)
+class _Ticket:
+    priority: int
+    finish: float
+    seq: int
+    start: float = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    cancelled: bool = field(default=False, compare=False)
+
+
+class AdmissionController:
+    """按客户端限速、分级、公平排队的推理准入 (单个事件循环内使用)"""
+
+    def __init__(self, concurrency: int = 1, rate: float = 1.0, burst: float = 120.0,
+                 max_queue: int = 32, queue_timeout: float = 30.0,
+                 short_clip_seconds: float = 8.0, max_clients: int = 4096):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.short_clip_seconds = short_clip_seconds
+        self.max_clients = max_clients
+        self._clients: "OrderedDict[str, _ClientState]" = OrderedDict()
+        self._queue = []
+        self._queued = 0
+        self._active = 0
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+
+    def classify(self, audio_seconds: float) -> int:
+        return PRIORITY_COMMAND if audio_seconds <= self.short_clip_seconds else PRIORITY_DICTATION
+
+    def _client(self, client: str) -> _ClientState:
+        state = self._clients.get(client)
+        if state is None:
+            state = self._clients[client] = _ClientState(TokenBucket(self.rate, self.burst))
+        self._clients.move_to_end(client)
+        while len(self._clients) > self.max_clients:
+            self._clients.popitem(last=False)
+        return state
+
+    def _enqueue(self, state: _ClientState, priority: int, cost: float) -> _Ticket:
+        # 起始标签取系统虚拟时间与该客户端上一个请求完成标签的较大者
+        start = max(self._virtual_time, state.last_finish)
+        finish = start + cost / state.weight
+        state.last_finish = finish
+        ticket = _Ticket(priority, finish, next(self._seq), start,
+                         asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, ticket)
+        self._queued += 1
+        return ticket
+
+    def _dispatch(self) -> None:
+        """有空闲槽位时按 (优先级, 完成标签) 唤醒下一个排队请求"""
+        while self._active < self.concurrency and self._queue:
+            ticket = heapq.heappop(self._queue)
+            if ticket.cancelled:
+                continue
+            self._queued -= 1
+            self._active += 1
+            self._virtual_time = max(self._virtual_time, ticket.start)
+            ticket.future.set_result(True)
+
+    def _release(self) -> None:
+        self._active -= 1
+        self._dispatch()
+
+    async def _wait(self, ticket: _Ticket, cancelled: Optional[asyncio.Event]) -> None:
+        """等待被分配槽位；cancelled 先置位时放弃排队"""
+        if cancelled is None:
+            await asyncio.shield(ticket.future)
+            return
+        waiter = asyncio.ensure_future(cancelled.wait())
+        try:
+            await asyncio.wait({ticket.future, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+        if not ticket.future.done():
+            raise AdmissionRejected("cancelled", 0.0)
+
+    @asynccontextmanager
+    async def admit(self, client: str, audio_seconds: float, cancelled: Optional[asyncio.Event] = None,
+                    charge: bool = True):
+        """持有一个推理槽位，未准入时抛出 AdmissionRejected
+
+        cancelled 为请求的取消事件: 排队期间被置位 (客户端断开、超时或显式取消) 时直接移出队列。
+        charge=False 时不扣该客户端的令牌 (批量任务)，仍占用槽位并参与公平排队。
+        """
+        state = self._client(client)
+        priority = self.classify(audio_seconds)
+        cost = max(1.0, audio_seconds)
+        fee = cost if charge else 0.0
+        name = PRIORITY_NAMES[priority]
+
+        wait = state.bucket.try_take(fee)
+        if wait > 0:
+            metrics.incr("admission_rejected_rate_limited")
+            raise AdmissionRejected("rate_limited", wait)
+
+        start = time.perf_counter()
+        if self._active < self.concurrency and not self._queued:
+            self._active += 1
+            state.last_finish = max(self._virtual_time, state.last_finish) + cost / state.weight
+        else:
+            if self._queued >= self.max_queue:
+                state.bucket.refund(fee)
+                metrics.incr("admission_rejected_queue_full")
+                raise AdmissionRejected("queue_full", self.queue_timeout)
+            ticket = self._enqueue(state, priority, cost)
+            metrics.incr(f"admission_queued_{name}")
+            try:
+                await asyncio.wait_for(self._wait(ticket, cancelled), self.queue_timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError, AdmissionRejected) as e:
+                if ticket.future.done():
+                    # 刚好在超时/取消的同时被分配了槽位，归还给下一个请求
+                    self._release()
+                else:
+                    ticket.cancelled = True
+                    self._queued -= 1
+                state.bucket.refund(fee)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                if isinstance(e, AdmissionRejected):
+                    metrics.incr("admission_cancelled_queued")
+                    raise
+                metrics.incr("admission_rejected_queue_timeout")
+                raise AdmissionRejected("queue_timeout", self.queue_timeout)
+
+        metrics.incr(f"admission_admitted_{name}")
+        metrics.observe(f"admission_wait_{name}", time.perf_counter() - start)
+        try:
+            yield priority
+        finally:
+            self._release()
+
+    def status(self) -> dict:
+        return {
+            "active": self._active,
+            "queued": self._queued,
+            "concurrency": self.concurrency,
+            "clients": len(self._clients),
+        }
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+语音识别引擎抽象
+- ASREngine 统一转录、批量转录、语言识别接口，capabilities 声明引擎支持的能力
+- whisper: 现有的 openai-whisper 路径 (特征缓存、用户档案提示、协作式取消都作用于它)
+- faster-whisper: CTranslate2后端，CPU上int8量化，需要 pip install faster-whisper
+- stub: 不加载模型，返回固定文本，用于联调和压测其余流水线
+- 由 Config.ASR_ENGINE 选择；新增引擎时继承 ASREngine 并登记到 ENGINES
+"""
+
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from cancellation import check_cancelled
+
+SAMPLE_RATE = 16000
+
+
+@dataclass(frozen=True)
+class EngineCapabilities:
+    """引擎能力"""
+    batching: bool = False          # 多条音频一次前向
+    streaming: bool = False         # 边解码边产出分段
+    quantization: bool = False      # int8等量化推理
+    word_timestamps: bool = False   # 词级时间戳
+    language_id: bool = False       # 自动语言识别
+    prompt_tokens: bool = False     # 预分词提示与词汇偏置 (用户档案)，否则只用文本提示
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class ASREngine:
+    """语音识别引擎基类
+
+    transcribe 返回与 whisper.transcribe 相同结构的字典: text、language、segments
+    (每段含 start/end/text，开启词级时间戳时另含 words)；实现应在分段之间调用
+    check_cancelled()，以便客户端断开或超时时尽早停止。
+    """
+
+    name = "base"
+    capabilities = EngineCapabilities()
+
+    def transcribe(self, audio: np.ndarray, language: Optional[str] = None,
+                   initial_prompt: Optional[str] = None, word_timestamps: bool = False,
+                   fp16: bool = False) -> dict:
+        raise NotImplementedError
+
+    def transcribe_stream(self, audio: np.ndarray, language: Optional[str] = None,
+                          initial_prompt: Optional[str] = None) -> Iterator[dict]:
+        """逐段产出转录结果，不支持流式的引擎一次产出全部分段"""
+        yield from self.transcribe(audio, language, initial_prompt)["segments"]
+
+    def transcribe_batch(self, audios: Sequence[np.ndarray], language: Optional[str] = None,
+                         initial_prompt: Optional[str] = None) -> List[dict]:
+        return [self.transcribe(audio, language, initial_prompt) for audio in audios]
+
+    def detect_language(self, audio: np.ndarray, candidates: Sequence[str]) -> Tuple[str, float]:
+        """在 candidates 中识别语言 - 返回(语言, 候选内归一化概率)"""
+        raise NotImplementedError
+
+    def memory_bytes(self) -> int:
+        return 0
+
+    def describe(self) -> dict:
+        return {"name": self.name, "capabilities": self.capabilities.to_dict()}
+
+
+def _pick_language(probs: Dict[str, float], candidates: Sequence[str]) -> Tuple[str, float]:
+    scores = {lang: probs.get(lang, 0.0) for lang in candidates}
+    total = sum(scores.values()) or 1.0
+    language = max(scores, key=scores.get)
+    return language, scores[language] / total
+
+
+class WhisperEngine(ASREngine):
+    """openai-whisper
+
+    模型由 provider 提供 (服务端的空闲卸载、显存仲裁会替换或移动模型，引擎不持有固定引用)。
+    """
+
+    name = "whisper"
+    capabilities = EngineCapabilities(batching=True, word_timestamps=True, language_id=True, prompt_tokens=True)
+
+    def __init__(self, provider: Callable, temperatures: Sequence[float] = (0.0, 0.2, 0.4), beam_size: int = 5):
+        self.provider = provider
+        self.temperatures = tuple(temperatures)
+        self.beam_size = beam_size
+
+    @property
+    def model(self):
+        return self.provider()
+
+    def transcribe(self, audio, language=None, initial_prompt=None, word_timestamps=False, fp16=False) -> dict:
+        return self.model.transcribe(
+            audio,
+            language=language,
+            initial_prompt=initial_prompt,
+            temperature=self.temperatures,  # 首次0.0，未通过下面的阈值时依次回退
+            beam_size=self.beam_size,
+            best_of=self.beam_size,
+            fp16=fp16,
+            condition_on_previous_text=False,  # 不依赖前文
+            no_speech_threshold=0.6,
+            logprob_threshold=-1.0,
+            compression_ratio_threshold=2.4,
+            word_timestamps=word_timestamps
+        )
+
+    def transcribe_batch(self, audios, language=None, initial_prompt=None) -> List[dict]:
+        """30秒以内的音频一次批量推理，未通过质量阈值或更长的音频逐条转录"""
+        from batch_transcription import transcribe_batch
+
+        results: List[Optional[dict]] = [None] * len(audios)
+        short = [i for i, audio in enumerate(audios) if len(audio) <= 30 * SAMPLE_RATE]
+        if short and language:
+            batched = transcribe_batch(self.model, [audios[i] for i in short], language)
+            for i, item in zip(short, batched):
+                if not item.needs_fallback:
+                    results[i] = {"text": item.text, "language": item.language, "segments": []}
+        return [result or self.transcribe(audio, language, initial_prompt)
+                for audio, result in zip(audios, results)]
+
+    def detect_language(self, audio, candidates) -> Tuple[str, float]:
+        import whisper
+
+        model = self.model
+        if not model.is_multilingual:
+            return "en", 1.0
+        mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), model.dims.n_mels).to(model.device)
+        _, probs = model.detect_language(mel)
+        return _pick_language(probs, candidates)
+
+    def memory_bytes(self) -> int:
+        model = self.model
+        return sum(p.numel() * p.element_size() for p in model.parameters()) if model is not None else 0
+
+
+class FasterWhisperEngine(ASREngine):
+    """faster-whisper (CTranslate2)，CPU上默认int8量化
+
+    分段是惰性生成的，每产出一段检查一次取消令牌；批量转录逐条进行
+    (BatchedInferencePipeline 只批量处理单条长音频内的分片)。
+    """
+
+    name = "faster-whisper"
+    capabilities = EngineCapabilities(streaming=True, quantization=True, word_timestamps=True, language_id=True)
+
+    def __init__(self, model: str = "large-v3-turbo", device: str = "auto", compute_type: str = "int8",
+                 cpu_threads: int = 0, temperatures: Sequence[float] = (0.0, 0.2, 0.4), beam_size: int = 5):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            raise RuntimeError("faster-whisper 引擎需要先安装: pip install faster-whisper")
+        self.model_name = model
+        self.compute_type = compute_type
+        self.temperatures = list(temperatures)
+        self.beam_size = beam_size
+        self.model = WhisperModel(model, device=device, compute_type=compute_type, cpu_threads=cpu_threads)
+
+    def _segments(self, audio, language, initial_prompt, word_timestamps=False):
+        segments, info = self.model.transcribe(
+            audio,
+            language=language,
+            initial_prompt=initial_prompt,
+            beam_size=self.beam_size,
+            best_of=self.beam_size,
+            temperature=self.temperatures,
+            condition_on_previous_text=False,
+            no_speech_threshold=0.6,
+            log_prob_threshold=-1.0,
+            compression_ratio_threshold=2.4,
+            word_timestamps=word_timestamps
+        )
+        return segments, info
+
+    @staticmethod
+    def _segment_dict(segment) -> dict:
+        item = {"start": segment.start, "end": segment.end, "text": segment.text,
+                "avg_logprob": segment.avg_logprob, "no_speech_prob": segment.no_speech_prob}
+        if segment.words:
+            item["words"] = [{"start": w.start, "end": w.end, "word": w.word, "probability": w.probability}
+                             for w in segment.words]
+        return item
+
+    def transcribe_stream(self, audio, language=None, initial_prompt=None) -> Iterator[dict]:
+        segments, _ = self._segments(audio, language, initial_prompt)
+        for segment in segments:
+            check_cancelled()
+            yield self._segment_dict(segment)
+
+    def transcribe(self, audio, language=None, initial_prompt=None, word_timestamps=False, fp16=False) -> dict:
+        segments, info = self._segments(audio, language, initial_prompt, word_timestamps)
+        items = []
+        for segment in segments:
+            check_cancelled()
+            items.append(self._segment_dict(segment))
+        return {"text": "".join(item["text"] for item in items), "language": info.language, "segments": items}
+
+    def detect_language(self, audio, candidates) -> Tuple[str, float]:
+        # 不迭代分段时只做语言识别，不会解码
+        _, info = self.model.transcribe(audio[:30 * SAMPLE_RATE], language=None)
+        return _pick_language(dict(info.all_language_probs or []), candidates)
+
+
+class StubEngine(ASREngine):
+    """不加载模型的桩引擎: 返回固定文本，可按音频时长模拟推理耗时 (rtf)"""
+
+    name = "stub"
+    capabilities = EngineCapabilities(batching=True, streaming=True, word_timestamps=True, language_id=True)
+
+    def __init__(self, text: str = "打开记事本", language: str = "zh", rtf: float = 0.0):
+        self.text = text
+        self.language = language
+        self.rtf = rtf
+
+    def _simulate(self, seconds: float) -> None:
+        deadline = time.monotonic() + seconds
+        while True:
+            check_cancelled()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(0.01, remaining))
+
+    def transcribe(self, audio, language=None, initial_prompt=None, word_timestamps=False, fp16=False) -> dict:
+        duration = len(audio) / SAMPLE_RATE
+        self._simulate(duration * self.rtf)
+        segment = {"start": 0.0, "end": round(duration, 2), "text": self.text}
+        if word_timestamps:
+            segment["words"] = [{"start": 0.0, "end": round(duration, 2), "word": self.text, "probability": 1.0}]
+        return {"text": self.text, "language": language or self.language, "segments": [segment]}
+
+    def transcribe_batch(self, audios, language=None, initial_prompt=None) -> List[dict]:
+        # 模拟批量推理: 耗时取最长的一条
+        self._simulate(max((len(a) for a in audios), default=0) / SAMPLE_RATE * self.rtf)
+        return [{"text": self.text, "language": language or self.language,
+                 "segments": [{"start": 0.0, "end": round(len(a) / SAMPLE_RATE, 2), "text": self.text}]}
+                for a in audios]
+
+    def detect_language(self, audio, candidates) -> Tuple[str, float]:
+        return (self.language, 1.0) if self.language in candidates else (candidates[0], 1.0 / len(candidates))
+
+
+ENGINES = {
+    WhisperEngine.name: WhisperEngine,
+    FasterWhisperEngine.name: FasterWhisperEngine,
+    StubEngine.name: StubEngine,
+}
+
+
+def create_engine(name: str, **kwargs) -> ASREngine:
+    try:
+        engine_class = ENGINES[name]
+    except KeyError:
+        raise ValueError(f"未知的识别引擎: {name} (可选: {', '.join(ENGINES)})")
+    return engine_class(**kwargs)
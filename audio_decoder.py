@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+上传音频流式解码
+- 直接把上传内容分块送入 ffmpeg 管道，不落地临时文件
+- 输出 16kHz 单声道 float32 PCM，可直接交给 Whisper
+- 浏览器插件上传的 webm/ogg Opus 可边读边解码
+- 可限制同时运行的ffmpeg数量，并把ffmpeg绑定到预留的CPU上 (见 cpu_topology)
+"""
+
+import logging
+import os
+import subprocess
+import threading
+from contextlib import nullcontext
+from typing import BinaryIO, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+CHUNK_SIZE = 64 * 1024
+
+_decode_slots: Optional[threading.BoundedSemaphore] = None
+_decode_cpus: Optional[Sequence[int]] = None
+
+
+class AudioDecodeError(RuntimeError):
+    """音频解码失败"""
+
+
+def configure_decoding(slots: Optional[int] = None, cpus: Optional[Sequence[int]] = None) -> None:
+    """限制本进程同时运行的ffmpeg数 (None为不限)，cpus 不为空时ffmpeg只在这些CPU上运行"""
+    global _decode_slots, _decode_cpus
+    _decode_slots = threading.BoundedSemaphore(slots) if slots else None
+    _decode_cpus = list(cpus) if cpus else None
+
+
+def decode_audio_stream(source: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Tuple[np.ndarray, int]:
+    """从文件对象流式解码音频 - 返回(16kHz float32波形, 接收字节数)
+
+    写入线程把 source 分块送进 ffmpeg 的 stdin，当前线程读取 stdout，另一线程读取 stderr，
+    三个管道并行推进，避免任一管道缓冲区写满造成死锁。
+    """
+    with _decode_slots or nullcontext():
+        return _decode(source, chunk_size)
+
+
+def _decode(source: BinaryIO, chunk_size: int) -> Tuple[np.ndarray, int]:
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        # 每个解码槽位按一个核规划，音频解码单线程即可
+        "-threads", "1",
+        "-i", "pipe:0",
+        "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-acodec", "pcm_s16le",
+        "pipe:1"
+    ]
+    try:
+        process = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+    except FileNotFoundError:
+        raise AudioDecodeError("未找到ffmpeg，请先安装ffmpeg并加入PATH")
+    if _decode_cpus and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(process.pid, _decode_cpus)
+        except OSError:
+            pass  # ffmpeg已退出或CPU不在允许范围内，不影响解码
+
+    bytes_received = 0
+    write_error = []
+
+    def feed():
+        nonlocal bytes_received
+        try:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                bytes_received += len(chunk)
+                process.stdin.write(chunk)
+        except (BrokenPipeError, OSError) as e:
+            # ffmpeg提前退出时写端会断开，错误信息以stderr为准
+            write_error.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    stderr_chunks = []
+
+    def drain_stderr():
+        # stderr 单独读取: 损坏的输入可能让ffmpeg写出大量错误，写满管道后会卡住stdout
+        stderr_chunks.append(process.stderr.read())
+
+    writer = threading.Thread(target=feed, daemon=True)
+    reader = threading.Thread(target=drain_stderr, daemon=True)
+    writer.start()
+    reader.start()
+    pcm = process.stdout.read()
+    process.wait()
+    writer.join()
+    reader.join()
+    stderr = b"".join(stderr_chunks)
+
+    if process.returncode != 0:
+        raise AudioDecodeError(f"ffmpeg解码失败: {stderr.decode(errors='ignore').strip()}")
+    if write_error and not pcm:
+        raise AudioDecodeError(f"音频数据写入失败: {write_error[0]}")
+
+    audio = np.frombuffer(pcm, np.int16).astype(np.float32) / 32768.0
+    return audio, bytes_received
+
+
+def upload_stats(bytes_received: int, audio: np.ndarray) -> dict:
+    """上传统计 - 每秒音频对应的上传字节数"""
+    audio_seconds = len(audio) / SAMPLE_RATE
+    return {
+        "bytes": bytes_received,
+        "audio_seconds": round(audio_seconds, 3),
+        "bytes_per_audio_second": round(bytes_received / audio_seconds, 1) if audio_seconds > 0 else None
+    }
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+指令与转录审计日志
+- SQLite (WAL模式) 持久化转录文本、识别的指令、执行结果和各阶段耗时
+- 请求路径只把记录放进内存队列，后台线程批量写盘，请求不等待磁盘
+- 按时间、按客户端+时间建索引，历史查询使用游标分页
+"""
+
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS audit (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    client TEXT,
+    endpoint TEXT,
+    text TEXT,
+    language TEXT,
+    is_command INTEGER,
+    command_type TEXT,
+    command_target TEXT,
+    command_executed INTEGER,
+    command_result TEXT,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_audit_ts ON audit(ts);
+CREATE INDEX IF NOT EXISTS idx_audit_client_ts ON audit(client, ts);
+"""
+
+COLUMNS = ("ts", "client", "endpoint", "text", "language", "is_command", "command_type",
+           "command_target", "command_executed", "command_result", "timings")
+
+_STOP = object()
+
+
+class AuditLog:
+    """异步批量写入的审计日志
+
+    record() 只做一次入队 (微秒级)；队列满时丢弃记录并计数，绝不阻塞请求。
+    """
+
+    def __init__(self, path: Union[str, Path], batch_size: int = 200,
+                 flush_interval: float = 0.5, max_pending: int = 10000):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self._thread: Optional[threading.Thread] = None
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL下NORMAL只在检查点时fsync，断电最多丢失最近一批记录
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._writer, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def record(self, client: str, endpoint: str, text: str = "", language: str = "",
+               is_command: bool = False, command_type: str = "", command_target: str = "",
+               command_executed: bool = False, command_result: Optional[str] = None,
+               timings: Optional[dict] = None) -> None:
+        """记录一次请求 (请求路径调用，不做任何IO)"""
+        row = (time.time(), client, endpoint, text, language, int(is_command), command_type,
+               command_target, int(command_executed), command_result, timings)
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            metrics.incr("audit_dropped")
+
+    def _writer(self) -> None:
+        conn = self._connect()
+        insert = f"INSERT INTO audit ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            # 攒够一批或队列暂时取空就写一次，一个事务提交整批
+            while item is not None:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+            if batch:
+                start = time.perf_counter()
+                try:
+                    with conn:
+                        conn.executemany(insert, [
+                            row[:-1] + (json.dumps(row[-1], ensure_ascii=False) if row[-1] else None,)
+                            for row in batch
+                        ])
+                    metrics.incr("audit_written", len(batch))
+                    metrics.observe("audit_flush", time.perf_counter() - start)
+                except sqlite3.Error as e:
+                    metrics.incr("audit_write_errors")
+                    logger.error(f"审计日志写入失败: {e}")
+        conn.close()
+
+    def close(self, timeout: float = 5) -> None:
+        """写完队列中剩余的记录后停止"""
+        if self._thread:
+            self._queue.put(_STOP)
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def query(self, client: Optional[str] = None, limit: int = 50,
+              before: Optional[str] = None) -> Tuple[list, Optional[str]]:
+        """按时间倒序查询历史，返回 (记录列表, 下一页游标)
+
+        游标为上一页最后一条的 "ts:id"，时间相同时再按id区分。
+        """
+        conditions, params = [], []
+        if client:
+            conditions.append("client = ?")
+            params.append(client)
+        if before:
+            ts, row_id = before.split(":")
+            conditions.append("(ts < ? OR (ts = ? AND id < ?))")
+            params += [float(ts), float(ts), int(row_id)]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = (f"SELECT id, {', '.join(COLUMNS)} FROM audit {where} "
+               f"ORDER BY ts DESC, id DESC LIMIT ?")
+        params.append(limit)
+
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+        items = []
+        for row in rows:
+            item = dict(row)
+            item["is_command"] = bool(item["is_command"])
+            item["command_executed"] = bool(item["command_executed"])
+            item["timings"] = json.loads(item["timings"]) if item["timings"] else None
+            items.append(item)
+        next_cursor = f"{rows[-1]['ts']!r}:{rows[-1]['id']}" if len(rows) == limit else None
+        return items, next_cursor
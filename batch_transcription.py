@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+批量转录
+- 展开上传的多个文件或 zip/tar 压缩包，只保留音频文件
+- 30秒以内的音频按批送入模型: 一次log-mel、一次编码器前向、一次批量解码
+- 批量结果未通过与 whisper.transcribe 相同的质量阈值时，由调用方逐条回退到温度回退解码
+- 大批量任务的进度和结果写入磁盘 (NDJSON)，prefork的任一worker都能响应轮询
+"""
+
+import io
+import json
+import os
+import re
+import tarfile
+import time
+import uuid
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+
+from feature_cache import request_features
+
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".m4a", ".aac", ".ogg", ".oga", ".opus", ".webm", ".flac", ".amr", ".mp4"}
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+# 与服务端 whisper.transcribe 的参数一致
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+
+
+class BatchInputError(ValueError):
+    """上传内容不合法 (文件过多、压缩包过大或损坏)"""
+
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def is_audio(filename: str) -> bool:
+    return Path(filename).suffix.lower() in AUDIO_EXTENSIONS
+
+
+def expand_upload(filename: str, data: bytes, max_files: int, max_bytes: int) -> List[Tuple[str, bytes]]:
+    """把一个上传文件展开为 [(文件名, 内容)]，压缩包按成员展开
+
+    解压前先按声明的大小检查总量，防止压缩炸弹。
+    """
+    if not is_archive(filename):
+        return [(filename, data)]
+
+    items = []
+    try:
+        if filename.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                members = [m for m in archive.infolist() if not m.is_dir() and is_audio(m.filename)]
+                _check_limits(filename, len(members), sum(m.file_size for m in members), max_files, max_bytes)
+                for member in members:
+                    items.append((f"{filename}/{member.filename}", archive.read(member)))
+        else:
+            with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+                members = [m for m in archive.getmembers() if m.isfile() and is_audio(m.name)]
+                _check_limits(filename, len(members), sum(m.size for m in members), max_files, max_bytes)
+                for member in members:
+                    items.append((f"{filename}/{member.name}", archive.extractfile(member).read()))
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise BatchInputError(f"无法解压 {filename}: {e}")
+    return items
+
+
+def _check_limits(filename: str, count: int, size: int, max_files: int, max_bytes: int) -> None:
+    if count > max_files:
+        raise BatchInputError(f"{filename} 包含 {count} 个音频文件，超过上限 {max_files}")
+    if size > max_bytes:
+        raise BatchInputError(f"{filename} 解压后 {size / 1024**2:.0f}MB，超过上限 {max_bytes / 1024**2:.0f}MB")
+
+
+def batch_log_mel(model, audios: Sequence[np.ndarray]) -> torch.Tensor:
+    """每条音频补齐/截断到30秒后计算log-mel并堆叠为一个批次"""
+    import whisper
+
+    return torch.stack([
+        whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(audio)), model.dims.n_mels)
+        for audio in audios
+    ]).to(model.device)
+
+
+def detect_languages(model, mel: torch.Tensor, candidates: Sequence[str]) -> List[Tuple[str, float]]:
+    """批量语言识别，只在 candidates 中取概率最高者 - 返回 [(语言, 候选内归一化概率)]"""
+    if not model.is_multilingual:
+        return [("en", 1.0)] * len(mel)
+    _, probs = model.detect_language(mel)
+    detected = []
+    for item in probs:
+        scores = {lang: item.get(lang, 0.0) for lang in candidates}
+        total = sum(scores.values()) or 1.0
+        language = max(scores, key=scores.get)
+        detected.append((language, scores[language] / total))
+    return detected
+
+
+@dataclass
+class BatchItemResult:
+    text: str
+    language: str
+    avg_logprob: float
+    no_speech_prob: float
+    compression_ratio: float
+
+    @property
+    def no_speech(self) -> bool:
+        return self.no_speech_prob > NO_SPEECH_THRESHOLD and self.avg_logprob < LOGPROB_THRESHOLD
+
+    @property
+    def needs_fallback(self) -> bool:
+        """贪心/束搜索结果未通过质量阈值，需要温度回退重新解码"""
+        if self.no_speech:
+            return False
+        return (self.compression_ratio > COMPRESSION_RATIO_THRESHOLD
+                or self.avg_logprob < LOGPROB_THRESHOLD)
+
+
+def transcribe_batch(model, audios: Sequence[np.ndarray], languages: Union[str, Callable],
+                     fp16: bool = False, beam_size: Optional[int] = None,
+                     prompt_scope: Optional[Callable] = None) -> List[BatchItemResult]:
+    """批量转录30秒以内的音频
+
+    languages 为固定语言，或接收mel批次、返回每条语言的函数；
+    同一语言的音频合并为一次解码，prompt_scope(language) 返回该语言解码期间使用的上下文
+    (用于注入用户档案提示)。编码器输出在语言识别和解码之间复用。
+
+    默认贪心解码: 当前版本whisper的束搜索在批次大于1时kv缓存形状不匹配；
+    贪心结果未通过质量阈值的条目由调用方回退到单条路径 (束搜索 + 温度回退)。
+    """
+    from contextlib import nullcontext
+    from whisper.decoding import DecodingOptions
+
+    with request_features(max_windows=len(audios)):
+        mel = batch_log_mel(model, audios)
+        if fp16:
+            mel = mel.half()
+        per_item = [languages] * len(audios) if isinstance(languages, str) else languages(mel)
+
+        results: List[Optional[BatchItemResult]] = [None] * len(audios)
+        for language in dict.fromkeys(per_item):
+            indexes = [i for i, lang in enumerate(per_item) if lang == language]
+            options = DecodingOptions(language=language, beam_size=beam_size, fp16=fp16,
+                                      without_timestamps=True)
+            with prompt_scope(language) if prompt_scope else nullcontext():
+                decoded = model.decode(mel[indexes], options)
+            for i, result in zip(indexes, decoded):
+                results[i] = BatchItemResult(
+                    text="" if result.no_speech_prob > NO_SPEECH_THRESHOLD
+                    and result.avg_logprob < LOGPROB_THRESHOLD else result.text.strip(),
+                    language=language,
+                    avg_logprob=result.avg_logprob,
+                    no_speech_prob=result.no_speech_prob,
+                    compression_ratio=result.compression_ratio,
+                )
+    return results
+
+
+class BatchJobStore:
+    """批量任务的磁盘存储: <id>.json 为状态，<id>.ndjson 为按完成顺序追加的结果"""
+
+    def __init__(self, directory: Union[str, Path], ttl_hours: float = 24):
+        self.directory = Path(directory)
+        self.ttl_seconds = ttl_hours * 3600
+
+    def _status_path(self, job_id: str) -> Path:
+        return self.directory / f"{job_id}.json"
+
+    def _results_path(self, job_id: str) -> Path:
+        return self.directory / f"{job_id}.ndjson"
+
+    def create(self, total: int) -> str:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.cleanup()
+        job_id = uuid.uuid4().hex
+        self._results_path(job_id).touch()
+        self._write_status(job_id, {
+            "job_id": job_id, "status": "running", "total": total, "completed": 0, "failed": 0,
+            "created": time.time(), "updated": time.time(),
+        })
+        return job_id
+
+    def _write_status(self, job_id: str, status: dict) -> None:
+        path = self._status_path(job_id)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(status, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+
+    def append(self, job_id: str, record: dict) -> None:
+        """追加一条结果并更新进度"""
+        with open(self._results_path(job_id), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        status = self.status(job_id)
+        status["failed" if record.get("type") == "error" else "completed"] += 1
+        status["updated"] = time.time()
+        self._write_status(job_id, status)
+
+    def finish(self, job_id: str, error: Optional[str] = None) -> None:
+        status = self.status(job_id)
+        status.update(status="failed" if error else "done", updated=time.time())
+        if error:
+            status["error"] = error
+        self._write_status(job_id, status)
+
+    def status(self, job_id: str) -> Optional[dict]:
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        try:
+            return json.loads(self._status_path(job_id).read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def results(self, job_id: str, offset: int = 0, limit: int = 1000) -> List[dict]:
+        with open(self._results_path(job_id), encoding="utf-8") as f:
+            lines = f.readlines()[offset:offset + limit]
+        return [json.loads(line) for line in lines if line.endswith("\n")]
+
+    def cleanup(self) -> None:
+        """删除超过保留时间的任务文件"""
+        deadline = time.time() - self.ttl_seconds
+        for path in self.directory.glob("*.json*"):
+            try:
+                if path.stat().st_mtime < deadline:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
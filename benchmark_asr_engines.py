@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+识别引擎对比基准
+- 用同一份回放语料 (replay_corpus 的 manifest.jsonl) 依次测试各个识别引擎
+- 每个引擎在独立子进程中运行，统计字错率、意图准确率、实时率(RTF)、加载耗时和峰值内存
+- 新增引擎 (asr_engines.ENGINES) 后用 --engines 加入对比，确认准确率不退步再切换 ASR_ENGINE
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from benchmark_model_load import peak_rss_mb
+from replay_corpus import MANIFEST
+
+
+def run_single(engine: str, corpus: str) -> dict:
+    """子进程内加载一个引擎并回放整份语料 (单进程，便于统计内存)"""
+    os.environ["ASR_ENGINE"] = engine
+    from replay_corpus import _init_worker, load_manifest, replay_entry, summarize
+
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    _init_worker("full", None, os.cpu_count() or 1)
+    load_seconds = time.perf_counter() - start
+
+    results = [replay_entry(entry, corpus, "full") for entry in load_manifest(Path(corpus))]
+    summary = summarize(results)
+    return {
+        "engine": engine,
+        "load_s": round(load_seconds, 2),
+        "cer": summary["cer"],
+        "intent_accuracy": summary["intent_accuracy"],
+        "rtf": summary.get("rtf"),
+        "transcribe_p50_ms": summary["stages"].get("transcribe_ms", {}).get("p50_ms"),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "load_peak_delta_mb": round(peak_rss_mb() - baseline, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用回放语料对比各识别引擎的准确率、实时率和内存")
+    parser.add_argument("corpus", help=f"语料目录 (包含音频文件和 {MANIFEST})")
+    parser.add_argument("--engines", default="whisper,faster-whisper", help="逗号分隔的引擎名")
+    parser.add_argument("--output", help="保存对比结果 (JSON)")
+    parser.add_argument("--single", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args.single, args.corpus)))
+        return
+
+    if not (Path(args.corpus) / MANIFEST).exists():
+        print(f"❌ 未找到 {Path(args.corpus) / MANIFEST}")
+        sys.exit(1)
+
+    engines = [name.strip() for name in args.engines.split(",") if name.strip()]
+    print(f"📊 识别引擎基准: {args.corpus} ({', '.join(engines)})")
+    print(f"{'引擎':<16}{'CER':>8}{'意图准确率':>12}{'RTF':>8}{'转录P50(ms)':>14}{'加载(s)':>10}{'峰值RSS(MB)':>14}")
+    rows = []
+    for engine in engines:
+        cmd = [sys.executable, __file__, args.corpus, "--single", engine]
+        completed = subprocess.run(cmd, capture_output=True, text=True)
+        if completed.returncode != 0:
+            error = (completed.stderr.strip().splitlines() or ["未知错误"])[-1]
+            print(f"{engine:<16}❌ {error}")
+            continue
+        r = json.loads(completed.stdout.strip().splitlines()[-1])
+        rows.append(r)
+        rtf = "-" if r["rtf"] is None else r["rtf"]
+        p50 = "-" if r["transcribe_p50_ms"] is None else r["transcribe_p50_ms"]
+        print(f"{r['engine']:<16}{r['cer']:>8}{r['intent_accuracy']:>12}{rtf:>8}"
+              f"{p50:>14}{r['load_s']:>10}{r['peak_rss_mb']:>14}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+指令识别基准测试与模糊语料
+- 由 COMMAND_PATTERNS / EN_COMMAND_PATTERNS 生成大批合成语句: 语气词、标点、大小写、
+  同音误识别、中英混说、打字脱漏，以及不应识别为指令的闲聊
+- 测量识别吞吐 (条/秒)、单条耗时分位数和内存分配
+- 固定的期望意图表 (test/command_intents.jsonl) 锁定当前行为；
+  新的匹配引擎可用 --engine 接入，同时对比速度和识别结果是否一致
+"""
+
+import argparse
+import importlib
+import json
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from command_detection import COMMAND_TABLES, smart_command_detection
+
+PINNED_PATH = Path(__file__).parent / "test" / "command_intents.jsonl"
+PINNED_COUNT = 600
+PINNED_SEED = 0
+
+PREFIXES = {
+    "zh": ["", "", "请", "帮我", "麻烦", "嗯", "那个", "给我", "快点"],
+    "en": ["", "", "please ", "can you ", "hey, ", "um ", "could you "],
+}
+SUFFIXES = {
+    "zh": ["", "", "吧", "一下", "。", "！", "好吗", "呀"],
+    "en": ["", "", ".", "!", " please", " now", " for me"],
+}
+# Whisper常见的同音/近音误识别 (部分可被 preprocess_chinese_text 纠正，部分不能)
+HOMOPHONES = {
+    "记事本": ["记事版", "计时版", "记事簿", "既是本"],
+    "计算器": ["计时器", "计算机", "计算机器", "寄算器"],
+    "打开": ["大开", "打凯"],
+    "知乎": ["知呼", "之乎"],
+    "微博": ["微波"],
+    "淘宝": ["掏宝"],
+    "截图": ["节图", "接图"],
+    "锁屏": ["所屏"],
+    "关机": ["观机"],
+    "浏览器": ["流览器"],
+}
+CHITCHAT = {
+    "zh": ["今天天气怎么样", "给我讲个笑话", "你叫什么名字", "明天会下雨吗", "帮我写一首诗",
+           "现在几点了", "推荐一部电影", "这个问题怎么解决", "我有点累了", "https网站打不开怎么办"],
+    "en": ["what's the weather like today", "tell me a joke", "what is your name",
+           "I want to run a marathon", "how do I cook rice", "who won the game last night",
+           "the stopwatch is broken", "explain quantum computing",
+           "I did not sleep well last night, tell me a joke", "how do I lock a git branch",
+           "can you restart the story from the beginning", "what time should I go to sleep",
+           "how do I turn off dark mode", "the screen lock on my phone is annoying"],
+}
+# 原样追加到期望意图表的短句: 只含系统操作的目标名，不应触发关机、休眠等
+SHORT_NEGATIVES = [("Sleep tight", "en"), ("Sleep well", "en"), ("lock it", "en"), ("Turn off", "en"),
+                   ("Restart.", "en"), ("Sleep well", "zh"), ("lock it", "zh")]
+
+
+def _decorate(rng: random.Random, text: str, language: str) -> str:
+    text = rng.choice(PREFIXES[language]) + text + rng.choice(SUFFIXES[language])
+    roll = rng.random()
+    if roll < 0.15:
+        text = text.upper()
+    elif roll < 0.3:
+        text = text.title()
+    return text
+
+
+def _homophone(rng: random.Random, text: str) -> str:
+    for word, variants in HOMOPHONES.items():
+        if word in text:
+            return text.replace(word, rng.choice(variants), 1)
+    return text
+
+
+def _drop_char(rng: random.Random, text: str) -> str:
+    if len(text) < 3:
+        return text
+    i = rng.randrange(len(text))
+    return text[:i] + text[i + 1:]
+
+
+def generate_utterances(count: int, seed: int = 0) -> List[dict]:
+    """生成合成语句 - 每条为 {"text", "language", "kind"}，同一seed结果固定"""
+    rng = random.Random(seed)
+    entries = [
+        (lang, other, cmd_type, keyword, target, alias)
+        for lang, other in (("zh", "en"), ("en", "zh"))
+        for cmd_type, config in COMMAND_TABLES[lang].items()
+        for keyword in config["keywords"]
+        for target, aliases in config["targets"].items()
+        for alias in aliases
+    ]
+    # 同音误识别只针对含易错词的中文组合
+    homophone_entries = [e for e in entries if e[0] == "zh" and any(w in e[3] + e[5] for w in HOMOPHONES)]
+    utterances = []
+    while len(utterances) < count:
+        lang, other, cmd_type, keyword, target, alias = rng.choice(entries)
+        sep = " " if lang == "en" else rng.choice(["", "", " "])
+        kind = rng.choices(
+            ["clean", "homophone", "mixed", "bare", "typo", "chitchat"],
+            weights=[30, 15, 15, 15, 10, 15]
+        )[0]
+        if kind == "homophone":
+            lang, other, cmd_type, keyword, target, alias = rng.choice(homophone_entries)
+            sep = rng.choice(["", "", " "])
+        language = lang
+        if kind == "clean":
+            text = keyword + sep + alias
+        elif kind == "homophone":
+            text = _homophone(rng, keyword + sep + alias)
+        elif kind == "mixed":
+            # 关键词用一种语言，目标用另一种语言的别名
+            aliases = COMMAND_TABLES[other].get(cmd_type, {}).get("targets", {}).get(target) or [target]
+            text = keyword + " " + rng.choice(aliases)
+            language = rng.choice([lang, other])
+        elif kind == "bare":
+            text = alias
+        elif kind == "typo":
+            text = _drop_char(rng, keyword + sep + alias)
+        else:
+            language = rng.choice(["zh", "en"])
+            text = rng.choice(CHITCHAT[language])
+        utterances.append({"text": _decorate(rng, text, lang), "language": language, "kind": kind})
+    return utterances
+
+
+def load_engine(spec: Optional[str]) -> Callable:
+    """按 "模块:函数" 加载识别函数，签名同 smart_command_detection"""
+    if not spec:
+        return smart_command_detection
+    module, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module), name or "smart_command_detection")
+
+
+def measure(detect: Callable, utterances: List[dict], repeat: int = 5) -> dict:
+    """吞吐取多轮中位数；内存为单独一轮内 tracemalloc 统计的峰值"""
+    pairs = [(u["text"], u["language"]) for u in utterances]
+    for text, language in pairs[:100]:
+        detect(text, language)
+
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text, language in pairs:
+            detect(text, language)
+        rounds.append(time.perf_counter() - start)
+    rounds.sort()
+    seconds = rounds[len(rounds) // 2]
+
+    samples = []
+    for text, language in pairs[:2000]:
+        start = time.perf_counter()
+        detect(text, language)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+
+    tracemalloc.start()
+    for text, language in pairs:
+        detect(text, language)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "utterances": len(pairs),
+        "utt_per_s": round(len(pairs) / seconds),
+        "p50_us": round(samples[len(samples) // 2] * 1e6, 2),
+        "p99_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6, 2),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def mismatches(detect: Callable, utterances: List[dict], reference: Callable = smart_command_detection) -> List[dict]:
+    """识别结果与参考实现 (或固定表中的 expected) 不一致的语句"""
+    diff = []
+    for u in utterances:
+        expected = tuple(u["expected"]) if "expected" in u else reference(u["text"], u["language"])
+        actual = tuple(detect(u["text"], u["language"]))
+        if actual != expected:
+            diff.append({**u, "expected": list(expected), "actual": list(actual)})
+    return diff
+
+
+def load_pinned(path: Path = PINNED_PATH) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_pinned(path: Path = PINNED_PATH, count: int = PINNED_COUNT, seed: int = PINNED_SEED) -> int:
+    """用当前实现重新生成期望意图表 (有意修改识别行为后再运行)"""
+    utterances = generate_utterances(count, seed)
+    utterances += [{"text": text, "language": language, "kind": "short"} for text, language in SHORT_NEGATIVES]
+    with open(path, "w", encoding="utf-8") as f:
+        for u in utterances:
+            u["expected"] = list(smart_command_detection(u["text"], u["language"]))
+            f.write(json.dumps(u, ensure_ascii=False) + "\n")
+    return len(utterances)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="指令识别吞吐与一致性基准")
+    parser.add_argument("--count", type=int, default=20000, help="合成语句数量")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="吞吐测量轮数，取中位数")
+    parser.add_argument("--engine", help="待测识别函数 (模块:函数)，与当前实现对比速度和结果")
+    parser.add_argument("--write-pinned", action="store_true", help=f"用当前实现重新生成 {PINNED_PATH.name}")
+    args = parser.parse_args()
+
+    if args.write_pinned:
+        print(f"💾 已写入 {write_pinned()} 条期望意图: {PINNED_PATH}")
+        return
+
+    utterances = generate_utterances(args.count, args.seed)
+    kinds = {}
+    for u in utterances:
+        kinds[u["kind"]] = kinds.get(u["kind"], 0) + 1
+    print(f"📊 指令识别基准: {len(utterances)} 条合成语句 (seed={args.seed}) "
+          + " ".join(f"{k}={v}" for k, v in sorted(kinds.items())))
+
+    engines = [("当前实现", smart_command_detection)]
+    if args.engine:
+        engines.append((args.engine, load_engine(args.engine)))
+    print(f"{'引擎':<24}{'条/秒':>12}{'P50(µs)':>10}{'P99(µs)':>10}{'峰值内存(KB)':>14}{'固定表不一致':>14}")
+    failed = False
+    results = []
+    for name, detect in engines:
+        stats = measure(detect, utterances, args.repeat)
+        pinned_diff = mismatches(detect, load_pinned()) if PINNED_PATH.exists() else []
+        failed |= bool(pinned_diff)
+        results.append(stats)
+        print(f"{name:<24}{stats['utt_per_s']:>12}{stats['p50_us']:>10}{stats['p99_us']:>10}"
+              f"{stats['peak_kb']:>14}{len(pinned_diff):>14}")
+        for item in pinned_diff[:10]:
+            print(f"   ❌ {item['text']!r} ({item['language']}): 期望 {item['expected']}，实际 {item['actual']}")
+
+    if args.engine:
+        diff = mismatches(engines[1][1], utterances)
+        print(f"⚡ 速度: {results[1]['utt_per_s'] / results[0]['utt_per_s']:.2f}x，"
+              f"合成语句中与当前实现不一致 {len(diff)} 条")
+        for item in diff[:10]:
+            print(f"   ❌ {item['text']!r} ({item['language']}): 当前 {item['expected']}，新引擎 {item['actual']}")
+        failed |= bool(diff)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+CPU规划基准测试
+- 按不同的 worker数 × 推理线程数 (可选绑核) 启动多个进程，每个进程反复 解码 + 转录 同一段音频
+- 统计总吞吐 (每秒处理的音频秒数)、每分钟请求数和单次请求耗时分位数
+- 与torch默认线程数 (单进程、不限制解码) 对比，确认 cpu_topology 的自动规划在本机上是否最优
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from typing import List, Optional
+
+from cpu_topology import CPUPlan, available_cpus, cgroup_cpu_quota, physical_cores, plan_cpus
+
+
+def _worker(plan: Optional[CPUPlan], index: int, model_name: str, audio_path: str, language: str,
+            duration: float, barrier, results) -> None:
+    """子进程: 按规划绑核和设置线程数，加载模型后在统一起点开始计时"""
+    import torch
+    import whisper
+    from asr_engines import WhisperEngine
+    from audio_decoder import SAMPLE_RATE, configure_decoding, decode_audio_stream
+    from convert_whisper_weights import load_mmap_model, mmap_weights_path
+
+    if plan is not None:
+        cpus = plan.cpus_for_worker(index)
+        if cpus:
+            os.sched_setaffinity(0, cpus)
+        torch.set_num_threads(plan.torch_threads)
+        configure_decoding(plan.decode_slots, plan.decode_cpus)
+    mmap_path = mmap_weights_path(model_name)
+    model = (load_mmap_model(mmap_path, device="cpu") if mmap_path.exists()
+             else whisper.load_model(model_name, device="cpu"))
+    engine = WhisperEngine(lambda: model)
+
+    def request() -> float:
+        with open(audio_path, "rb") as f:
+            audio, _ = decode_audio_stream(f)
+        engine.transcribe(audio, language=language)
+        return len(audio) / SAMPLE_RATE
+
+    request()  # 预热
+    barrier.wait()
+    began = time.time()
+    deadline = time.perf_counter() + duration
+    latencies, audio_seconds = [], 0.0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        audio_seconds += request()
+        latencies.append(time.perf_counter() - start)
+    results.put({"latencies": latencies, "audio_seconds": audio_seconds, "began": began, "ended": time.time()})
+
+
+def run_plan(plan: Optional[CPUPlan], model_name: str, audio_path: str, language: str, duration: float) -> dict:
+    """按一个规划启动全部worker并汇总吞吐 (plan为None时为单进程torch默认线程数)"""
+    ctx = multiprocessing.get_context("spawn")
+    workers = plan.workers if plan else 1
+    barrier, results = ctx.Barrier(workers), ctx.Queue()
+    processes = [
+        ctx.Process(target=_worker, args=(plan, i, model_name, audio_path, language, duration, barrier, results))
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    collected = []
+    while len(collected) < workers:
+        try:
+            collected.append(results.get(timeout=1))
+        except queue.Empty:
+            # 任一worker异常退出时其余worker会卡在barrier上，全部终止
+            if any(process.exitcode not in (None, 0) for process in processes):
+                for process in processes:
+                    process.terminate()
+                raise RuntimeError("worker异常退出")
+    for process in processes:
+        process.join()
+    wall = max(item["ended"] for item in collected) - min(item["began"] for item in collected)
+
+    latencies = sorted(x for item in collected for x in item["latencies"])
+    audio_seconds = sum(item["audio_seconds"] for item in collected)
+    return {
+        "workers": workers,
+        "torch_threads": plan.torch_threads if plan else None,
+        "decode_slots": plan.decode_slots if plan else None,
+        "pinned": bool(plan and plan.worker_cpus),
+        "requests": len(latencies),
+        "requests_per_min": round(len(latencies) / wall * 60, 1),
+        "audio_x_realtime": round(audio_seconds / wall, 2),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1) if latencies else None,
+    }
+
+
+def candidate_plans(cpus: List[int], quota: Optional[float], groups: List[List[int]], pin: bool,
+                    specs: Optional[str]) -> List[CPUPlan]:
+    """待测规划: --plans 指定的 "workers x threads" 列表，或自动规划加上 1/2/4/... 个worker均分"""
+    auto = plan_cpus(cpus, quota, groups, pin=pin)
+    if specs:
+        plans = []
+        for spec in specs.split(","):
+            workers, _, threads = spec.strip().partition("x")
+            plans.append(plan_cpus(cpus, quota, groups, workers=int(workers), torch_threads=int(threads or 0), pin=pin))
+        return plans
+    plans, workers = [auto], 1
+    while workers <= auto.budget:
+        if workers != auto.workers:
+            plans.append(plan_cpus(cpus, quota, groups, workers=workers, pin=pin))
+        workers *= 2
+    return plans
+
+
+def main():
+    parser = argparse.ArgumentParser(description="扫描 worker数 × 推理线程数 的组合，测量转录吞吐")
+    parser.add_argument("audio", help="测试音频 (每次请求都重新用ffmpeg解码)")
+    parser.add_argument("--model", default="large-v3-turbo", help="Whisper模型名")
+    parser.add_argument("--language", default="zh")
+    parser.add_argument("--duration", type=float, default=60, help="每个规划的测量时长(秒)")
+    parser.add_argument("--plans", help='逗号分隔的 "workers x threads"，如 1x28,4x7,7x4；默认自动规划加2的幂个worker')
+    parser.add_argument("--pin", action="store_true", help="绑核")
+    parser.add_argument("--output", help="保存结果 (JSON)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.audio):
+        print(f"❌ 未找到音频: {args.audio}")
+        sys.exit(1)
+
+    cpus = available_cpus()
+    quota = cgroup_cpu_quota()
+    groups = physical_cores(cpus)
+    plans = candidate_plans(cpus, quota, groups, args.pin, args.plans)
+    print(f"📊 CPU规划基准: {len(cpus)} 个逻辑CPU / {len(groups)} 个物理核"
+          + (f"，cgroup配额 {quota:g} 核" if quota else "") + f"，每项 {args.duration:g} 秒")
+    print(f"{'规划':<22}{'请求/分':>10}{'音频倍速':>10}{'P50(ms)':>10}{'P95(ms)':>10}")
+
+    cases = [("torch默认 (1 worker)", None)]
+    for i, plan in enumerate(plans):
+        label = f"{plan.workers}×{plan.torch_threads}" + (" 绑核" if plan.worker_cpus else "")
+        # 未指定 --plans 时第一项为自动规划
+        cases.append((label + (" ⭐" if i == 0 and not args.plans else ""), plan))
+
+    rows = []
+    for label, plan in cases:
+        r = run_plan(plan, args.model, args.audio, args.language, args.duration)
+        r["label"] = label
+        rows.append(r)
+        print(f"{label:<22}{r['requests_per_min']:>10}{r['audio_x_realtime']:>10}{r['p50_ms'] or '-':>10}{r['p95_ms'] or '-':>10}")
+
+    best = max(rows, key=lambda r: r["audio_x_realtime"])
+    print(f"🏆 吞吐最高: {best['label']} ({best['audio_x_realtime']}x 实时)")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
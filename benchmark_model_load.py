@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+模型加载基准测试
+- 对比 whisper.load_model(.pt) 与 safetensors 内存映射加载
+- 每种方式在独立子进程中运行，统计加载耗时与峰值内存
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from convert_whisper_weights import WHISPER_CACHE
+
+
+def peak_rss_mb() -> float:
+    """当前进程峰值常驻内存(MB)"""
+    try:
+        import resource
+        # Linux下 ru_maxrss 单位为KB
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024**2
+
+
+def run_single(method: str, path: str, in_memory: bool) -> dict:
+    """子进程内执行一次加载"""
+    import torch
+    import whisper
+    from convert_whisper_weights import load_mmap_model
+
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    if method == "pt":
+        model = whisper.load_model(path, device="cpu", in_memory=in_memory)
+    else:
+        model = load_mmap_model(path, device="cpu")
+    load_seconds = time.perf_counter() - start
+
+    # 跑一次编码器，确认权重可用并计入首次访问缺页的开销
+    start = time.perf_counter()
+    with torch.no_grad():
+        model.encoder(torch.zeros(1, model.dims.n_mels, 3000))
+    first_forward = time.perf_counter() - start
+
+    return {
+        "method": method + ("(in_memory)" if in_memory else ""),
+        "load_s": round(load_seconds, 3),
+        "first_forward_s": round(first_forward, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "load_peak_delta_mb": round(peak_rss_mb() - baseline, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比.pt与safetensors内存映射的加载耗时和峰值内存")
+    parser.add_argument("model", nargs="?", default="large-v3-turbo", help="模型名，需已存在.pt和.safetensors文件")
+    parser.add_argument("--repeat", type=int, default=3, help="每种方式重复次数")
+    parser.add_argument("--single", choices=["pt", "mmap"], help=argparse.SUPPRESS)
+    parser.add_argument("--in-memory", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args.single, args.path, args.in_memory)))
+        return
+
+    pt_path = WHISPER_CACHE / f"{args.model}.pt"
+    st_path = WHISPER_CACHE / f"{args.model}.safetensors"
+    if not pt_path.exists() or not st_path.exists():
+        print(f"❌ 需要同时存在 {pt_path} 和 {st_path}")
+        print(f"💡 先运行: python convert_whisper_weights.py {args.model}")
+        sys.exit(1)
+
+    cases = [("pt", pt_path, True), ("pt", pt_path, False), ("mmap", st_path, False)]
+    print(f"📊 模型加载基准: {args.model} (每项 {args.repeat} 次，取中位数)")
+    print(f"{'方式':<16}{'加载(s)':>10}{'首次前向(s)':>14}{'峰值RSS(MB)':>14}{'加载增量(MB)':>14}")
+    for method, path, in_memory in cases:
+        runs = []
+        for _ in range(args.repeat):
+            cmd = [sys.executable, __file__, "--single", method, "--path", str(path)]
+            if in_memory:
+                cmd.append("--in-memory")
+            output = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        runs.sort(key=lambda r: r["load_s"])
+        r = runs[len(runs) // 2]
+        print(f"{r['method']:<16}{r['load_s']:>10}{r['first_forward_s']:>14}{r['peak_rss_mb']:>14}{r['load_peak_delta_mb']:>14}")
+
+
+if __name__ == "__main__":
+    main()
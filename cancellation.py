@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+推理协作式取消
+- 每个转录请求一个取消令牌: 客户端断开、超过截止时间或显式取消时置位
+- 令牌通过contextvar绑定到推理线程；编码器每个窗口、解码器每一步前检查，
+  置位后抛出 InferenceCancelled，whisper的解码循环会在finally里清理kv缓存
+- 还在排队的请求由准入控制直接移出队列，不占用推理槽位
+"""
+
+import asyncio
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Set
+
+_current_token: ContextVar[Optional["CancelToken"]] = ContextVar("cancel_token", default=None)
+
+WINDOW_SECONDS = 30
+
+
+class InferenceCancelled(Exception):
+    """推理被取消 (reason: disconnected / deadline / cancelled)"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CancelToken:
+    """跨线程的取消标记: 推理线程轮询 check()，事件循环一侧可等待 event"""
+
+    def __init__(self, deadline: Optional[float] = None):
+        self.deadline = deadline
+        self.reason: Optional[str] = None
+        self.windows = 0
+        self._flag = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.event: Optional[asyncio.Event] = None
+        try:
+            self._loop = asyncio.get_running_loop()
+            self.event = asyncio.Event()
+        except RuntimeError:
+            pass
+
+    @property
+    def cancelled(self) -> bool:
+        return self._flag.is_set()
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        """可在任意线程调用，只记录第一次的原因"""
+        if self._flag.is_set():
+            return
+        self.reason = reason
+        self._flag.set()
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.event.set)
+
+    def check(self) -> None:
+        if self.deadline is not None and not self._flag.is_set() and time.monotonic() >= self.deadline:
+            self.cancel("deadline")
+        if self._flag.is_set():
+            raise InferenceCancelled(self.reason)
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+
+class CancelRegistry:
+    """按客户端登记进行中的请求，支持按请求ID或整个客户端显式取消"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, Dict[Optional[str], Set[CancelToken]]] = defaultdict(lambda: defaultdict(set))
+
+    @contextmanager
+    def register(self, client: str, request_id: Optional[str] = None, timeout: Optional[float] = None):
+        token = CancelToken(time.monotonic() + timeout if timeout else None)
+        with self._lock:
+            self._tokens[client][request_id].add(token)
+        try:
+            yield token
+        finally:
+            with self._lock:
+                requests = self._tokens.get(client)
+                if requests is not None:
+                    requests[request_id].discard(token)
+                    if not requests[request_id]:
+                        del requests[request_id]
+                    if not requests:
+                        del self._tokens[client]
+
+    def cancel(self, client: str, request_id: Optional[str] = None, reason: str = "cancelled") -> int:
+        """取消该客户端的指定请求 (request_id为空时取消全部)，返回取消的数量"""
+        with self._lock:
+            requests = self._tokens.get(client, {})
+            if request_id is None:
+                tokens = [token for group in requests.values() for token in group]
+            else:
+                tokens = list(requests.get(request_id, ()))
+        for token in tokens:
+            token.cancel(reason)
+        return len(tokens)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return sum(len(group) for requests in self._tokens.values() for group in requests.values())
+
+
+@contextmanager
+def cancel_scope(token: Optional[CancelToken]):
+    """在当前上下文 (推理线程) 中绑定取消令牌"""
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+def check_cancelled() -> None:
+    token = _current_token.get()
+    if token is not None:
+        token.check()
+
+
+def enable_cancellation(model) -> None:
+    """在编码器 (每个窗口) 和解码器 (每一步) 前检查取消令牌，令牌之外行为不变
+
+    与特征缓存一样替换实例的forward；模型重新加载后需要再次调用。
+    """
+    if getattr(model, "_cancellation_enabled", False):
+        return
+    encoder_forward = model.encoder.forward
+    decoder_forward = model.decoder.forward
+
+    def encoder(mel, *args, **kwargs):
+        token = _current_token.get()
+        if token is not None:
+            token.check()
+            token.windows += 1
+        return encoder_forward(mel, *args, **kwargs)
+
+    def decoder(*args, **kwargs):
+        check_cancelled()
+        return decoder_forward(*args, **kwargs)
+
+    model.encoder.forward = encoder
+    model.decoder.forward = decoder
+    model._cancellation_enabled = True
+
+
+def avoided_audio_seconds(token: CancelToken, audio_seconds: float) -> float:
+    """取消时尚未开始解码的音频时长 (按30秒窗口估算)"""
+    return max(0.0, audio_seconds - token.windows * WINDOW_SECONDS)
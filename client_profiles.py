@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+按用户的解码提示与词汇偏置
+- 每个用户维护最近使用的指令目标和自定义应用名称，存储有上限，按LRU淘汰
+- 由用户档案生成解码提示 (initial prompt)，提示token预先分词并缓存，
+  档案不变时热路径上只是一次字典查找
+- 档案里的词汇同时用于token级偏置: 解码时已输出词汇的前缀，就提高后续token的logit；
+  词首token只在词边界上提高
+- 提示和偏置通过contextvar绑定到当前请求，由模型的decode包装注入
+"""
+
+import threading
+import unicodedata
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, replace
+from typing import Dict, FrozenSet, List, Optional, Sequence, Set, Tuple
+
+import torch
+
+from language_id import INITIAL_PROMPTS
+from metrics import metrics
+
+_current_prompt: ContextVar[Optional["ProfilePrompt"]] = ContextVar("profile_prompt", default=None)
+
+
+@dataclass
+class ClientProfile:
+    """单个用户的上下文档案"""
+    recent_commands: deque = field(default_factory=deque)
+    custom_terms: List[str] = field(default_factory=list)
+    version: int = 0
+
+    def terms(self) -> List[str]:
+        """提示与偏置使用的词汇: 最近的指令目标在前，自定义名称在后，去重"""
+        seen = []
+        for term in list(reversed(self.recent_commands)) + self.custom_terms:
+            if term not in seen:
+                seen.append(term)
+        return seen
+
+    def to_dict(self) -> dict:
+        return {
+            "recent_commands": list(reversed(self.recent_commands)),
+            "custom_terms": list(self.custom_terms),
+            "version": self.version,
+        }
+
+
+class VocabularyBias:
+    """token级词汇偏置 (whisper LogitFilter 接口)
+
+    prefixes 把词汇token序列的每个前缀映射到可能的下一个token；
+    解码输出的末尾与某个前缀吻合时，给对应的下一个token加 bias。
+    词首token只在词边界上加一半 (输出开头、空白/标点/特殊token之后)，
+    以空格开头的词首token还可以跟在英文单词之后；不在句中任意位置推高空格或半个汉字的字节token。
+    """
+
+    def __init__(self, sequences: Sequence[Sequence[int]], bias: float, sample_begin: int = 0,
+                 boundaries: Optional["TokenBoundaries"] = None):
+        self.bias = bias
+        self.sample_begin = sample_begin
+        self.first_tokens: List[int] = sorted({seq[0] for seq in sequences if seq})
+        self.word_ends: FrozenSet[int] = boundaries.word_ends if boundaries else frozenset()
+        self.latin_ends: FrozenSet[int] = boundaries.latin_ends if boundaries else frozenset()
+        self.spaced_first_tokens: List[int] = (
+            [t for t in self.first_tokens if t in boundaries.spaced] if boundaries else [])
+        self.prefixes: Dict[Tuple[int, ...], Set[int]] = {}
+        for seq in sequences:
+            for i in range(1, len(seq)):
+                self.prefixes.setdefault(tuple(seq[:i]), set()).add(seq[i])
+        self.max_prefix = max((len(prefix) for prefix in self.prefixes), default=0)
+
+    def for_task(self, sample_begin: int) -> "VocabularyBias":
+        bound = VocabularyBias.__new__(VocabularyBias)
+        bound.__dict__.update(self.__dict__, sample_begin=sample_begin)
+        return bound
+
+    def apply(self, logits: torch.Tensor, tokens: torch.Tensor) -> None:
+        generated = tokens[:, self.sample_begin:].tolist()
+        for row, sequence in enumerate(generated):
+            last = sequence[-1] if sequence else None
+            if self.first_tokens:
+                if last is None or last in self.word_ends:
+                    logits[row, self.first_tokens] += self.bias / 2
+                elif self.spaced_first_tokens and last in self.latin_ends:
+                    logits[row, self.spaced_first_tokens] += self.bias / 2
+            boosted = set()
+            for k in range(1, min(self.max_prefix, len(sequence)) + 1):
+                boosted |= self.prefixes.get(tuple(sequence[-k:]), set())
+            if boosted:
+                logits[row, list(boosted)] += self.bias
+
+
+@dataclass(frozen=True)
+class TokenBoundaries:
+    """按token文本划分的词边界 (每种分词编码计算一次)"""
+    word_ends: FrozenSet[int]     # 以空白或标点结尾的token，以及特殊token和时间戳
+    latin_ends: FrozenSet[int]    # 以英文字母或数字结尾的token
+    spaced: FrozenSet[int]        # 以空格开头的token
+
+
+_boundaries: Dict[str, TokenBoundaries] = {}
+_boundaries_lock = threading.Lock()
+
+
+def token_boundaries(tokenizer) -> TokenBoundaries:
+    encoding = tokenizer.encoding
+    with _boundaries_lock:
+        cached = _boundaries.get(encoding.name)
+        if cached is not None:
+            return cached
+        word_ends, latin_ends, spaced = set(range(tokenizer.eot, encoding.n_vocab)), set(), set()
+        for token in range(tokenizer.eot):
+            data = encoding.decode_single_token_bytes(token)
+            text = data.decode("utf-8", errors="replace")
+            if not text:
+                continue
+            if text[0] == " ":
+                spaced.add(token)
+            last = text[-1]
+            if last == "\ufffd":
+                continue    # 多字节字符的一部分
+            if last.isspace() or unicodedata.category(last)[0] in "PS":
+                word_ends.add(token)
+            elif last.isascii() and last.isalnum():
+                latin_ends.add(token)
+        cached = _boundaries[encoding.name] = TokenBoundaries(
+            frozenset(word_ends), frozenset(latin_ends), frozenset(spaced))
+        return cached
+
+
+@dataclass
+class ProfilePrompt:
+    """预先分词的提示与偏置"""
+    text: str
+    tokens: List[int]
+    bias: Optional[VocabularyBias] = None
+
+
+def build_prompt_text(language: str, terms: Sequence[str]) -> str:
+    base = INITIAL_PROMPTS.get(language, INITIAL_PROMPTS["zh"])
+    if not terms:
+        return base
+    if language == "en":
+        return f"{base} Frequently used: {', '.join(terms)}."
+    return f"{base}常用：{'、'.join(terms)}。"
+
+
+class ClientProfileStore:
+    """用户档案存储 (内存，LRU淘汰)"""
+
+    def __init__(self, max_clients: int = 1024, max_recent: int = 5, max_terms: int = 20,
+                 max_prompt_tokens: int = 200, bias: float = 1.0):
+        self.max_clients = max_clients
+        self.max_recent = max_recent
+        self.max_terms = max_terms
+        self.max_prompt_tokens = max_prompt_tokens
+        self.bias = bias
+        self._profiles: "OrderedDict[str, ClientProfile]" = OrderedDict()
+        self._prompts: Dict[tuple, ProfilePrompt] = {}
+        self._lock = threading.Lock()
+
+    def get(self, client: str) -> Optional[ClientProfile]:
+        with self._lock:
+            profile = self._profiles.get(client)
+            if profile is not None:
+                self._profiles.move_to_end(client)
+            return profile
+
+    def _get_or_create(self, client: str) -> ClientProfile:
+        profile = self._profiles.get(client)
+        if profile is None:
+            profile = self._profiles[client] = ClientProfile(deque(maxlen=self.max_recent))
+        self._profiles.move_to_end(client)
+        while len(self._profiles) > self.max_clients:
+            evicted, _ = self._profiles.popitem(last=False)
+            self._drop_prompts(evicted)
+        return profile
+
+    def _drop_prompts(self, client: str) -> None:
+        for key in [key for key in self._prompts if key[0] == client]:
+            del self._prompts[key]
+
+    def record_command(self, client: str, target: str) -> None:
+        """记录识别出的指令目标 (与最近一次相同时不改变档案，提示缓存继续有效)"""
+        with self._lock:
+            profile = self._get_or_create(client)
+            if profile.recent_commands and profile.recent_commands[-1] == target:
+                return
+            if target in profile.recent_commands:
+                profile.recent_commands.remove(target)
+            profile.recent_commands.append(target)
+            profile.version += 1
+
+    def set_custom_terms(self, client: str, terms: Sequence[str]) -> ClientProfile:
+        with self._lock:
+            profile = self._get_or_create(client)
+            cleaned = []
+            for term in terms:
+                term = term.strip()
+                if term and term not in cleaned:
+                    cleaned.append(term)
+            profile.custom_terms = cleaned[:self.max_terms]
+            profile.version += 1
+            return profile
+
+    def prompt(self, client: Optional[str], language: str, tokenizer) -> ProfilePrompt:
+        """取用户的解码提示 (按档案版本缓存)"""
+        with self._lock:
+            profile = self._profiles.get(client) if client else None
+            version = profile.version if profile else -1
+            key = (client if profile else None, language, tokenizer.encoding.name)
+            cached = self._prompts.get(key)
+            if cached is not None and cached[0] == version:
+                metrics.incr("profile_prompt_hits")
+                return cached[1]
+            terms = profile.terms() if profile else []
+
+        metrics.incr("profile_prompt_misses")
+        built = self._build(language, terms, tokenizer)
+        with self._lock:
+            self._prompts[key] = (version, built)
+        return built
+
+    def _build(self, language: str, terms: List[str], tokenizer) -> ProfilePrompt:
+        text = build_prompt_text(language, terms)
+        tokens = tokenizer.encode(" " + text.strip())
+        while len(tokens) > self.max_prompt_tokens and terms:
+            # 超出提示长度预算时从最旧的词汇开始裁剪
+            terms = terms[:-1]
+            text = build_prompt_text(language, terms)
+            tokens = tokenizer.encode(" " + text.strip())
+        bias = None
+        if terms and self.bias > 0:
+            sequences = []
+            for term in terms:
+                sequences.append(tokenizer.encode(term))
+                if term.isascii():
+                    # 英文词首是否带空格会分成不同的token，两种形式都加入；中文词前没有空格
+                    sequences.append(tokenizer.encode(" " + term))
+            bias = VocabularyBias(sequences, self.bias, boundaries=token_boundaries(tokenizer))
+        return ProfilePrompt(text=text, tokens=tokens, bias=bias)
+
+    def __len__(self) -> int:
+        return len(self._profiles)
+
+
+@contextmanager
+def use_profile_prompt(prompt: Optional[ProfilePrompt]):
+    """在当前上下文中使用指定的提示与偏置"""
+    token = _current_prompt.set(prompt)
+    try:
+        yield prompt
+    finally:
+        _current_prompt.reset(token)
+
+
+def enable_profile_decoding(model) -> None:
+    """包装模型的decode，在请求上下文中注入预分词提示和词汇偏置
+
+    与 whisper.decoding.decode 相同，只是在创建 DecodingTask 后追加偏置过滤器；
+    模型重新加载后需要再次调用。
+    """
+    from whisper.decoding import DecodingOptions, DecodingTask
+
+    if getattr(model, "_profile_decoding_enabled", False):
+        return
+
+    @torch.no_grad()
+    def decode(mel: torch.Tensor, options: DecodingOptions = DecodingOptions(), **kwargs):
+        if single := mel.ndim == 2:
+            mel = mel.unsqueeze(0)
+        if kwargs:
+            options = replace(options, **kwargs)
+
+        prompt = _current_prompt.get()
+        if prompt is not None and prompt.tokens and not isinstance(options.prompt, str):
+            # 预分词提示放在前文之前，超长时whisper会从头部截断
+            options = replace(options, prompt=prompt.tokens + list(options.prompt or []))
+
+        task = DecodingTask(model, options)
+        if prompt is not None and prompt.bias is not None:
+            task.logit_filters.append(prompt.bias.for_task(task.sample_begin))
+        result = task.run(mel)
+        return result[0] if single else result
+
+    model.decode = decode
+    model._profile_decoding_enabled = True
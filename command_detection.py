@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+语音指令识别
+- 中文、英文两套指令词典，目标名统一使用中文规范名，执行层无需区分语言
+- 按识别出的语言选择主词典，另一种语言的关键词和别名合并在后面，
+  中英混说 ("打开 GitHub"、"open 记事本") 一次匹配完成
+- 纯ASCII别名按词边界匹配，避免 "ps"、"jd" 之类的短别名命中英文单词内部
+- 词典与纠错表编译为一版不可变的规则 (CommandRules)，热更新时整体替换，
+  每次识别只读取一次当前规则，不会用到半新半旧的词典
+"""
+
+import hashlib
+import json
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+# 扩展的指令识别词典
+COMMAND_PATTERNS = {
+    "应用程序": {
+        "keywords": ["打开", "启动", "运行", "开启"],
+        "targets": {
+            "记事本": ["记事本", "notepad", "文本编辑器"],
+            "计算器": ["计算器", "calculator", "计时器", "计时版", "计算机"],
+            "画图": ["画图", "画板", "绘图", "paint"],
+            "文件管理器": ["文件管理器", "资源管理器", "文件夹", "explorer"],
+            "浏览器": ["浏览器", "browser", "网页", "上网"],
+            "任务管理器": ["任务管理器", "进程管理", "task manager"],
+            "控制面板": ["控制面板", "设置", "系统设置"],
+            "命令提示符": ["命令提示符", "cmd", "终端", "控制台"],
+            "PowerShell": ["powershell", "ps", "power shell"]
+        }
+    },
+    "网站": {
+        "keywords": ["打开", "访问", "进入", "去", "看看"],
+        "targets": {
+            "百度": ["百度", "baidu"],
+            "谷歌": ["谷歌", "google", "搜索"],
+            "知乎": ["知乎", "zhihu"],
+            "微博": ["微博", "weibo"],
+            "哔哩哔哩": ["哔哩哔哩", "bilibili", "b站", "B站"],
+            "淘宝": ["淘宝", "taobao", "购物"],
+            "京东": ["京东", "jd", "商城"],
+            "GitHub": ["github", "代码", "开源"],
+            "YouTube": ["youtube", "油管", "视频"],
+            "网易云音乐": ["网易云", "音乐", "歌曲"]
+        }
+    },
+    "系统操作": {
+        "keywords": ["关闭", "退出", "结束", "停止", "重启", "关机", "锁屏", "休眠", "待机", "睡眠", "截图",
+                     "注销", "登出", "重新启动", "锁定屏幕"],
+        "targets": {
+            "关机": ["关机", "shutdown", "关闭电脑"],
+            "重启": ["重启", "restart", "重新启动"],
+            "注销": ["注销", "logout", "登出"],
+            "锁屏": ["锁屏", "lock", "锁定屏幕"],
+            "休眠": ["休眠", "sleep", "待机", "睡眠"],
+            "截图": ["截图", "screenshot", "屏幕截图"]
+        }
+    },
+    "文件操作": {
+        "keywords": ["新建", "创建", "删除", "复制", "移动"],
+        "targets": {
+            "新建文件夹": ["新建文件夹", "创建文件夹", "建文件夹"],
+            "新建文件": ["新建文件", "创建文件", "建文件"],
+            "截图": ["截图", "截屏", "抓图", "screenshot"]
+        }
+    }
+}
+
+# 英文指令词典 (目标名与中文词典一致)
+EN_COMMAND_PATTERNS = {
+    "应用程序": {
+        "keywords": ["open", "launch", "start", "run"],
+        "targets": {
+            "记事本": ["notepad", "text editor"],
+            "计算器": ["calculator", "calc"],
+            "画图": ["paint", "mspaint"],
+            "文件管理器": ["file explorer", "explorer", "file manager"],
+            "浏览器": ["browser", "edge", "chrome"],
+            "任务管理器": ["task manager"],
+            "控制面板": ["control panel", "settings"],
+            "命令提示符": ["command prompt", "cmd", "terminal", "console"],
+            "PowerShell": ["powershell", "power shell"]
+        }
+    },
+    "网站": {
+        "keywords": ["open", "go to", "visit", "browse", "show me"],
+        "targets": {
+            "百度": ["baidu"],
+            "谷歌": ["google"],
+            "知乎": ["zhihu"],
+            "微博": ["weibo"],
+            "哔哩哔哩": ["bilibili"],
+            "淘宝": ["taobao"],
+            "京东": ["jd", "jingdong"],
+            "GitHub": ["github", "git hub"],
+            "YouTube": ["youtube", "you tube"],
+            "网易云音乐": ["netease music", "netease cloud music"]
+        }
+    },
+    "系统操作": {
+        # 只认完整的指令说法 (动作+对象)，"sleep"、"lock"、"restart" 等单词在日常英文里太常见
+        "keywords": ["shut down the computer", "shut down my computer", "shut down the pc", "shutdown the computer",
+                     "turn off the computer", "turn off my computer", "power off the computer",
+                     "restart the computer", "restart my computer", "restart the pc",
+                     "reboot the computer", "reboot my computer", "reboot the pc",
+                     "log out of the computer", "log me out of the computer", "sign out of the computer",
+                     "log out of windows", "sign out of windows",
+                     "lock the screen", "lock my screen", "lock the computer", "lock my computer", "lock the pc",
+                     "put the computer to sleep", "put my computer to sleep", "put the pc to sleep",
+                     "hibernate the computer", "hibernate my computer",
+                     "take a screenshot", "take a screen shot", "capture the screen"],
+        "targets": {
+            "关机": ["shut down", "shutdown", "power off", "turn off"],
+            "重启": ["restart", "reboot"],
+            "注销": ["log out", "log me out", "sign out"],
+            "锁屏": ["lock"],
+            "休眠": ["sleep", "hibernate"],
+            "截图": ["screenshot", "screen shot", "capture"]
+        }
+    },
+    "文件操作": {
+        "keywords": ["new", "create", "make"],
+        "targets": {
+            "新建文件夹": ["new folder", "create folder", "create a folder"],
+            "新建文件": ["new file", "create file", "create a file"]
+        }
+    }
+}
+
+COMMAND_TABLES = {"zh": COMMAND_PATTERNS, "en": EN_COMMAND_PATTERNS}
+
+# 英文里不足3个词的短句视为直接说目标名
+SHORT_TEXT_CHARS = 10
+SHORT_TEXT_WORDS = 3
+# 关机、休眠等系统操作不能只凭目标名触发 ("Sleep well"、"Restart."): 必须命中关键词
+NO_BARE_TARGET_TYPES = frozenset({"系统操作"})
+
+
+def _term_pattern(term: str) -> re.Pattern:
+    """纯ASCII词条两侧要求不是字母数字，中文词条直接子串匹配"""
+    escaped = re.escape(term.lower())
+    if term.isascii():
+        return re.compile(rf"(?<![a-z0-9]){escaped}(?![a-z0-9])")
+    return re.compile(escaped)
+
+
+def _merge_tables(tables: Dict[str, dict], primary: str) -> List[Tuple[str, List[re.Pattern], List[Tuple[str, List[re.Pattern]]]]]:
+    """合并中英文词典，主语言的关键词和别名排在前面"""
+    order = [primary] + [lang for lang in tables if lang != primary]
+    merged: Dict[str, dict] = {}
+    for lang in order:
+        for cmd_type, config in tables[lang].items():
+            entry = merged.setdefault(cmd_type, {"keywords": [], "targets": {}})
+            entry["keywords"] += [k for k in config["keywords"] if k not in entry["keywords"]]
+            for target_name, aliases in config["targets"].items():
+                target = entry["targets"].setdefault(target_name, [])
+                target += [a for a in aliases if a not in target]
+    return [
+        (cmd_type,
+         [_term_pattern(k) for k in entry["keywords"]],
+         [(name, [_term_pattern(a) for a in aliases]) for name, aliases in entry["targets"].items()])
+        for cmd_type, entry in merged.items()
+    ]
+
+
+# 常见识别错误的纠正表 (按顺序替换)
+CORRECTIONS = {
+    # 常见的中文识别错误修正
+    "计时版": "记事本",
+    "计时器": "计算器",
+    "计算机": "计算器",
+    "记事版": "记事本",
+    "文件管理": "文件管理器",
+    "资源管理": "文件管理器",
+    "任务管理": "任务管理器",
+    "控制版": "控制面板",
+    "哔哩哔哩": "bilibili",
+    "B站": "bilibili",
+    "b站": "bilibili",
+    "网易云": "网易云音乐",
+    "谷歌": "google",
+    "百度一下": "百度",
+    # 新增的常见错误
+    "大开": "打开",
+    "打开浏览器访问": "打开",
+    "浏览器访问": "打开",
+    "访问知乎网站": "知乎",
+    "知乎网站": "知乎",
+    "百度网站": "百度",
+    "谷歌网站": "谷歌",
+    "微博网站": "微博",
+    "计算机器": "计算器",
+    "记事簿": "记事本",
+    "文本编辑": "记事本"
+}
+
+
+def _check_terms(terms, where: str) -> None:
+    if not isinstance(terms, list) or not all(isinstance(t, str) and t.strip() for t in terms):
+        raise ValueError(f"{where} 必须是非空字符串列表")
+
+
+def validate_rules(tables: Dict[str, dict], corrections: Dict[str, str]) -> None:
+    """校验词典与纠错表的结构，不合法时抛出 ValueError (指出出错的位置)"""
+    if not isinstance(tables, dict) or "zh" not in tables:
+        raise ValueError("指令词典必须包含 zh")
+    for lang, table in tables.items():
+        if not isinstance(table, dict):
+            raise ValueError(f"{lang} 词典必须是对象")
+        for cmd_type, config in table.items():
+            if not isinstance(config, dict) or not isinstance(config.get("targets"), dict):
+                raise ValueError(f"{lang}.{cmd_type} 需要 keywords 与 targets")
+            _check_terms(config.get("keywords"), f"{lang}.{cmd_type}.keywords")
+            for target_name, aliases in config["targets"].items():
+                _check_terms(aliases, f"{lang}.{cmd_type}.targets.{target_name}")
+    if not isinstance(corrections, dict) or not all(
+            isinstance(k, str) and k and isinstance(v, str) for k, v in corrections.items()):
+        raise ValueError("纠错表必须是 {误识别: 修正} 的字符串映射")
+
+
+@dataclass(frozen=True)
+class CommandRules:
+    """一版编译好的识别规则 (不可变，热更新时整体替换)"""
+    tables: Dict[str, dict]
+    corrections: Tuple[Tuple[str, str], ...]
+    compiled: Dict[str, list]
+    digest: str                  # 词典与纠错表内容的摘要，内容相同的规则摘要相同
+
+    def to_dict(self) -> dict:
+        return {"commands": self.tables, "corrections": dict(self.corrections)}
+
+
+def compile_rules(tables: Optional[Dict[str, dict]] = None,
+                  corrections: Optional[Dict[str, str]] = None) -> CommandRules:
+    """校验并编译一版规则 (耗时操作，在请求路径之外调用)"""
+    tables = COMMAND_TABLES if tables is None else tables
+    corrections = CORRECTIONS if corrections is None else corrections
+    validate_rules(tables, corrections)
+    canonical = json.dumps({"commands": tables, "corrections": corrections}, ensure_ascii=False, sort_keys=True)
+    return CommandRules(
+        tables=tables,
+        corrections=tuple(corrections.items()),
+        compiled={lang: _merge_tables(tables, lang) for lang in tables},
+        digest=hashlib.sha256(canonical.encode()).hexdigest()[:12],
+    )
+
+
+def load_rules_file(path: str) -> CommandRules:
+    """从JSON文件编译规则: {"commands": {"zh": {...}, "en": {...}}, "corrections": {...}}
+
+    文件中给出的部分 (某种语言的词典、纠错表) 整体替换内置的对应部分，未给出的沿用内置规则。
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("规则文件必须是JSON对象")
+    commands = data.get("commands", {})
+    if not isinstance(commands, dict):
+        raise ValueError("commands 必须是对象")
+    return compile_rules({**COMMAND_TABLES, **commands}, data.get("corrections", CORRECTIONS))
+
+
+_active_rules = compile_rules()
+
+
+def active_rules() -> CommandRules:
+    return _active_rules
+
+
+def install_rules(rules: CommandRules) -> CommandRules:
+    """替换当前规则 (单次引用赋值，正在进行的识别继续使用旧规则) - 返回被替换的规则"""
+    global _active_rules
+    previous, _active_rules = _active_rules, rules
+    return previous
+
+
+def preprocess_chinese_text(text: str, rules: Optional[CommandRules] = None) -> str:
+    """预处理中文文本，修正常见识别错误"""
+    corrected_text = text
+    for wrong, correct in (rules or _active_rules).corrections:
+        corrected_text = corrected_text.replace(wrong, correct)
+
+    return corrected_text
+
+
+def _is_short(text: str, language: str) -> bool:
+    if language == "en":
+        return len(text.split()) < SHORT_TEXT_WORDS
+    return len(text) <= SHORT_TEXT_CHARS
+
+
+def smart_command_detection(text: str, language: str = "zh") -> Tuple[bool, str, str]:
+    """智能指令检测 - 返回(是否为指令, 指令类型, 目标)
+
+    language 决定优先使用哪种语言的词典，未知语言按中文处理。
+    """
+    rules = _active_rules
+    text = preprocess_chinese_text(text.strip(), rules)
+    text_lower = text.lower()
+    table = rules.compiled.get(language, rules.compiled["zh"])
+
+    # 检查每种指令类型
+    for cmd_type, keywords, targets in table:
+        # 检查是否包含关键词
+        if any(keyword.search(text_lower) for keyword in keywords):
+            # 检查目标
+            for target_name, aliases in targets:
+                if any(alias.search(text_lower) for alias in aliases):
+                    return True, cmd_type, target_name
+
+    # 特殊情况：直接说目标名称 (扩展到所有指令类型)
+    if _is_short(text.strip().rstrip(".!?。！？"), language):
+        for cmd_type, keywords, targets in table:
+            if cmd_type in NO_BARE_TARGET_TYPES:
+                continue
+            for target_name, aliases in targets:
+                if any(alias.search(text_lower) for alias in aliases):
+                    return True, cmd_type, target_name
+
+    return False, "", ""
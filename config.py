@@ -4,7 +4,65 @@ AI语音助手配置文件
 """
 
 import os
-from typing import Optional
+import re
+from typing import Callable, Dict, Mapping, NamedTuple, Optional
+
+
+def _flag(value: str) -> bool:
+    return value.lower() == "true"
+
+
+def _items(value: str) -> tuple:
+    return tuple(item.strip() for item in value.split(",") if item.strip())
+
+
+def _floats(value: str) -> tuple:
+    return tuple(float(item) for item in value.split(",") if item.strip())
+
+
+def _whisper_languages() -> set:
+    from whisper.tokenizer import LANGUAGES
+    return set(LANGUAGES)
+
+
+def _check(condition: bool, message: str) -> None:
+    if not condition:
+        raise ValueError(message)
+
+
+def _check_languages(languages: tuple) -> None:
+    unknown = [lang for lang in languages if lang not in _whisper_languages()]
+    _check(bool(languages) and not unknown, f"未知的识别语言: {', '.join(unknown) or '(空)'}")
+
+
+class Reloadable(NamedTuple):
+    """可热更新的配置项: 默认值、解析函数、校验函数 (不合法时抛出 ValueError)"""
+    default: str
+    parse: Callable[[str], object]
+    check: Callable[[object], None]
+
+
+# 运行中可热更新的配置 (处理请求时读取)；其它配置 (模型、引擎、进程数、端口等) 改动后需重启才生效
+RELOADABLE_SETTINGS: Dict[str, Reloadable] = {
+    "WHISPER_LANGUAGE": Reloadable("zh", str, lambda v: v == "auto" or _check_languages((v,))),
+    "WHISPER_LANGUAGES": Reloadable("zh,en", _items, _check_languages),
+    "LANGUAGE_ID_MIN_PROB": Reloadable("0.6", float, lambda v: _check(0 <= v <= 1, "应在0到1之间")),
+    "WHISPER_TEMPERATURES": Reloadable(
+        "0.0,0.2,0.4", _floats, lambda v: _check(bool(v) and all(0 <= t <= 1 for t in v), "应为0到1之间的温度列表")),
+    "REQUEST_TIMEOUT_SECONDS": Reloadable("60", float, lambda v: _check(v >= 0, "不能为负数")),
+    "DISCONNECT_POLL_SECONDS": Reloadable("0.2", float, lambda v: _check(v > 0, "应大于0")),
+    "BATCH_MAX_FILES": Reloadable("500", int, lambda v: _check(v > 0, "应大于0")),
+    "BATCH_MAX_MB": Reloadable("500", int, lambda v: _check(v > 0, "应大于0")),
+    "AI_REPLY_ENABLED": Reloadable("true", _flag, lambda v: None),
+    "OLLAMA_KEEP_ALIVE": Reloadable(  # Ollama 的时长格式: 30m、1h、300 (秒)、-1 (常驻)
+        "30m", str, lambda v: _check(re.fullmatch(r"-?\d+(\.\d+)?(ms|s|m|h)?", v) is not None, "不是合法的时长")),
+}
+
+
+def _reloadable(name: str, env: Mapping[str, str] = os.environ):
+    setting = RELOADABLE_SETTINGS[name]
+    return setting.parse(env.get(name, setting.default))
+
 
 class Config:
     """配置类"""
@@ -13,18 +71,132 @@ class Config:
     API_HOST: str = os.getenv("VOICE_API_HOST", "0.0.0.0")
     API_PORT: int = int(os.getenv("VOICE_API_PORT", "8889"))
     
+    # 多进程配置 (仅CPU模式生效，>1时主进程预加载模型后fork出多个worker共享权重；0为按CPU规划自动决定)
+    WORKERS: int = int(os.getenv("VOICE_API_WORKERS", "1"))
+    # CPU规划: 每个worker的torch推理线程数、每个worker同时运行的ffmpeg解码数 (0为自动)；是否绑核
+    TORCH_THREADS: int = int(os.getenv("TORCH_THREADS", "0"))
+    DECODE_SLOTS: int = int(os.getenv("DECODE_SLOTS", "0"))
+    CPU_PINNING: bool = os.getenv("CPU_PINNING", "false").lower() == "true"
+    
     # WebUI配置
     WEBUI_PORT: int = int(os.getenv("WEBUI_PORT", "8888"))
     
     # Whisper模型配置
     WHISPER_MODEL: str = os.getenv("WHISPER_MODEL", "large-v3-turbo")
     WHISPER_DEVICE: str = os.getenv("WHISPER_DEVICE", "auto")  # auto, cuda, cpu
+    # 识别引擎: whisper (openai-whisper)、faster-whisper (CTranslate2，需另行安装)、stub (不加载模型，固定返回 STUB_TRANSCRIPT)
+    ASR_ENGINE: str = os.getenv("ASR_ENGINE", "whisper")
+    ASR_COMPUTE_TYPE: str = os.getenv("ASR_COMPUTE_TYPE", "int8")  # faster-whisper的量化类型: int8, int8_float16, float16, float32
+    STUB_TRANSCRIPT: str = os.getenv("STUB_TRANSCRIPT", "打开记事本")
+    # 桩引擎模拟的实时率 (推理耗时 = 音频时长 × STUB_RTF)，用于多实例与压力测试
+    STUB_RTF: float = float(os.getenv("STUB_RTF", "0"))
+    # 模型下载 (model_download.py): 镜像地址模板 (逗号分隔，占位符 {name} {sha256} {file}，官方地址总是最后尝试)、并行线程数、分块大小
+    WHISPER_DOWNLOAD_MIRRORS: tuple = tuple(
+        url.strip() for url in os.getenv("WHISPER_DOWNLOAD_MIRRORS", "").split(",") if url.strip()
+    )
+    WHISPER_DOWNLOAD_WORKERS: int = int(os.getenv("WHISPER_DOWNLOAD_WORKERS", "4"))
+    WHISPER_DOWNLOAD_CHUNK_MB: float = float(os.getenv("WHISPER_DOWNLOAD_CHUNK_MB", "16"))
+    # 识别语言: zh/en 固定语言，auto 在第一个窗口上自动识别 (只在 WHISPER_LANGUAGES 中选择)
+    WHISPER_LANGUAGE: str = _reloadable("WHISPER_LANGUAGE")
+    WHISPER_LANGUAGES: tuple = _reloadable("WHISPER_LANGUAGES")
+    # 识别概率低于该值时改用该用户最近常用的语言
+    LANGUAGE_ID_MIN_PROB: float = _reloadable("LANGUAGE_ID_MIN_PROB")
+    # 请求截止时间 (秒，0为不限)；客户端断开检测间隔
+    REQUEST_TIMEOUT_SECONDS: float = _reloadable("REQUEST_TIMEOUT_SECONDS")
+    DISCONNECT_POLL_SECONDS: float = _reloadable("DISCONNECT_POLL_SECONDS")
+    
+    # 批量转录: 每批最多BATCH_SIZE条30秒以内的音频，凑批最多等待BATCH_LINGER_MS
+    BATCH_SIZE: int = int(os.getenv("BATCH_SIZE", "8"))
+    BATCH_LINGER_MS: float = float(os.getenv("BATCH_LINGER_MS", "50"))
+    BATCH_MAX_FILES: int = _reloadable("BATCH_MAX_FILES")
+    BATCH_MAX_MB: int = _reloadable("BATCH_MAX_MB")
+    BATCH_JOB_DIR: str = os.getenv("BATCH_JOB_DIR", "data/batch_jobs")
+    BATCH_JOB_TTL_HOURS: float = float(os.getenv("BATCH_JOB_TTL_HOURS", "24"))
+    
+    # 审计日志 (SQLite WAL)
+    AUDIT_LOG_ENABLED: bool = os.getenv("AUDIT_LOG_ENABLED", "true").lower() == "true"
+    AUDIT_DB_PATH: str = os.getenv("AUDIT_DB_PATH", "data/audit.sqlite3")
+    
+    # 调试剖析接口 (/debug/profile, /debug/tracemalloc): 默认关闭，开启后还需设置令牌 (请求头 X-Debug-Token)
+    DEBUG_ENDPOINTS: bool = os.getenv("DEBUG_ENDPOINTS", "false").lower() == "true"
+    DEBUG_TOKEN: str = os.getenv("DEBUG_TOKEN", "")
+    DEBUG_PROFILE_MAX_SECONDS: float = float(os.getenv("DEBUG_PROFILE_MAX_SECONDS", "60"))
+    
+    # 热更新: 指令规则文件 (JSON，不存在时使用内置词典)；检查规则文件与.env的间隔 (秒，0为不监视)
+    COMMAND_RULES_FILE: str = os.getenv("COMMAND_RULES_FILE", "command_rules.json")
+    CONFIG_WATCH_INTERVAL: float = float(os.getenv("CONFIG_WATCH_INTERVAL", "2"))
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")  # /admin 接口的访问令牌，为空时管理接口关闭
+    
+    # 客户端API Key (逗号分隔)；只有列在这里的Key才作为限速和用户身份，未列出的Key按来源IP处理
+    API_KEYS: tuple = _items(os.getenv("API_KEYS", ""))
+    
+    # 准入控制: 推理并发槽位、每个客户端的音频秒数令牌桶 (每秒补充/容量)、排队上限与超时
+    ADMISSION_ENABLED: bool = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+    ADMISSION_CONCURRENCY: int = int(os.getenv("ADMISSION_CONCURRENCY", "1"))
+    CLIENT_AUDIO_RATE: float = float(os.getenv("CLIENT_AUDIO_RATE", "1.0"))
+    CLIENT_AUDIO_BURST: float = float(os.getenv("CLIENT_AUDIO_BURST", "120"))
+    ADMISSION_MAX_QUEUE: int = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+    ADMISSION_QUEUE_TIMEOUT: float = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+    # 不超过该时长的音频视为短指令，排队时优先于长听写
+    SHORT_CLIP_SECONDS: float = float(os.getenv("SHORT_CLIP_SECONDS", "8"))
+    
+    # 用户档案: 最多保留的用户数，词汇偏置强度 (加到logit上，0表示只用提示不做偏置)
+    PROFILE_MAX_CLIENTS: int = int(os.getenv("PROFILE_MAX_CLIENTS", "1024"))
+    PROFILE_BIAS: float = float(os.getenv("PROFILE_BIAS", "1.0"))
+    # 温度回退序列: 解码未通过压缩率/对数概率阈值时依次用更高温度重试
+    WHISPER_TEMPERATURES: tuple = _reloadable("WHISPER_TEMPERATURES")
+    
+    # 空闲卸载配置 (0表示不卸载；目标: auto/cpu/mmap)
+    IDLE_OFFLOAD_MINUTES: float = float(os.getenv("IDLE_OFFLOAD_MINUTES", "30"))
+    IDLE_OFFLOAD_TARGET: str = os.getenv("IDLE_OFFLOAD_TARGET", "auto")
     
     # GPU内存配置
-    GPU_MEMORY_FRACTION: float = float(os.getenv("GPU_MEMORY_FRACTION", "0.5"))
+    GPU_MEMORY_FRACTION: float = float(os.getenv("GPU_MEMORY_FRACTION", "0.5"))  # 仅在关闭显存仲裁时生效
+    GPU_ARBITER: bool = os.getenv("GPU_ARBITER", "true").lower() == "true"
+    LLM_MEMORY_RESERVE_GB: float = float(os.getenv("LLM_MEMORY_RESERVE_GB", "6"))  # LLM显存需求初始估计
+    
+    # AI回复配置
+    AI_REPLY_ENABLED: bool = _reloadable("AI_REPLY_ENABLED")
+    
+    # AI回复缓存 (相同或相近的问题直接返回缓存的回复)
+    REPLY_CACHE_ENABLED: bool = os.getenv("REPLY_CACHE_ENABLED", "true").lower() == "true"
+    REPLY_CACHE_TTL_MINUTES: float = float(os.getenv("REPLY_CACHE_TTL_MINUTES", "360"))
+    REPLY_CACHE_MAX_MB: float = float(os.getenv("REPLY_CACHE_MAX_MB", "16"))
+    REPLY_CACHE_SIMILARITY: float = float(os.getenv("REPLY_CACHE_SIMILARITY", "0"))  # 近似匹配阈值，0为只精确匹配
+    REPLY_CACHE_BYPASS_KEYWORDS: list = [  # 含这些词的问题不缓存，为空时使用内置的时效性词表
+        k.strip() for k in os.getenv("REPLY_CACHE_BYPASS_KEYWORDS", "").split(",") if k.strip()
+    ]
+    
+    # 语音合成配置 (回复播报)
+    TTS_ENABLED: bool = os.getenv("TTS_ENABLED", "false").lower() == "true"
+    TTS_ENGINE: str = os.getenv("TTS_ENGINE", "pyttsx3")  # pyttsx3 / stub
+    TTS_VOICE: str = os.getenv("TTS_VOICE", "")  # 系统语音ID，为空时使用默认语音
+    TTS_RATE: int = int(os.getenv("TTS_RATE", "0"))  # 语速 (每分钟词数)，0为默认
+    TTS_WORKERS: int = int(os.getenv("TTS_WORKERS", "2"))  # 合成进程数，0为在服务进程内合成
+    TTS_CACHE_MB: float = float(os.getenv("TTS_CACHE_MB", "32"))  # 短语音频缓存上限
+    TTS_PRELOAD: bool = os.getenv("TTS_PRELOAD", "true").lower() == "true"  # 启动时预合成指令回复短语
+    TTS_TIMEOUT: float = float(os.getenv("TTS_TIMEOUT", "30"))
     
     # Ollama配置
     OLLAMA_BASE_URL: str = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/api")
+    AI_REPLY_MODEL: str = os.getenv("AI_REPLY_MODEL", "")  # 首选回复模型，为空时用内置列表的第一个
+    OLLAMA_KEEP_ALIVE: str = _reloadable("OLLAMA_KEEP_ALIVE")  # 每次调用后模型在Ollama中的保留时间
+    LLM_WARM_ENABLED: bool = os.getenv("LLM_WARM_ENABLED", "true").lower() == "true"  # 后台保温首选回复模型
+    LLM_WARM_INTERVAL_SECONDS: float = float(os.getenv("LLM_WARM_INTERVAL_SECONDS", "240"))
+    LLM_PREFETCH: bool = os.getenv("LLM_PREFETCH", "true").lower() == "true"  # 转录为普通对话时立即预加载LLM
+    
+    # 多实例路由配置 (python router.py，挡在多个API实例前面)
+    ROUTER_HOST: str = os.getenv("ROUTER_HOST", "0.0.0.0")
+    ROUTER_PORT: int = int(os.getenv("ROUTER_PORT", "8880"))
+    ROUTER_BACKENDS: tuple = tuple(
+        url.strip().rstrip("/") for url in os.getenv("ROUTER_BACKENDS", "").split(",") if url.strip()
+    )
+    ROUTER_HEALTH_INTERVAL: float = float(os.getenv("ROUTER_HEALTH_INTERVAL", "2"))  # 健康检查间隔 (秒)
+    ROUTER_UNHEALTHY_AFTER: int = int(os.getenv("ROUTER_UNHEALTHY_AFTER", "2"))  # 连续失败几次后摘除
+    ROUTER_MAX_OUTSTANDING: int = int(os.getenv("ROUTER_MAX_OUTSTANDING", "8"))  # 每个实例的最大并发转发数，0为不限
+    ROUTER_QUEUE_TIMEOUT: float = float(os.getenv("ROUTER_QUEUE_TIMEOUT", "30"))  # 全部实例满载时的排队上限 (秒)
+    ROUTER_AFFINITY_SLACK: int = int(os.getenv("ROUTER_AFFINITY_SLACK", "2"))  # 亲和/预热实例可比最空闲实例多出的请求数
+    ROUTER_STICKY_TTL_MINUTES: float = float(os.getenv("ROUTER_STICKY_TTL_MINUTES", "30"))
     
     # 日志配置
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
@@ -32,6 +204,9 @@ class Config:
     # 安全配置
     CORS_ORIGINS: list = os.getenv("CORS_ORIGINS", "*").split(",")
     
+    # 运行中可热更新的配置 (见 RELOADABLE_SETTINGS)
+    RELOADABLE: tuple = tuple(RELOADABLE_SETTINGS)
+    
     @classmethod
     def get_api_url(cls) -> str:
         """获取API完整URL"""
@@ -42,18 +217,43 @@ class Config:
         """获取WebUI完整URL"""
         return f"http://localhost:{cls.WEBUI_PORT}"
     
-    @classmethod
-    def load_from_env_file(cls, env_file: str = ".env") -> None:
-        """从.env文件加载配置"""
+    @staticmethod
+    def parse_env_file(env_file: str = ".env") -> Dict[str, str]:
+        """解析.env文件为字典 (不修改环境变量)，文件不存在时为空"""
+        values = {}
         try:
             with open(env_file, 'r', encoding='utf-8') as f:
                 for line in f:
                     line = line.strip()
                     if line and not line.startswith('#'):
                         key, value = line.split('=', 1)
-                        os.environ[key.strip()] = value.strip()
+                        values[key.strip()] = value.strip()
         except FileNotFoundError:
             pass  # .env文件不存在时忽略
+        return values
+    
+    @classmethod
+    def load_from_env_file(cls, env_file: str = ".env") -> None:
+        """从.env文件加载配置"""
+        os.environ.update(cls.parse_env_file(env_file))
+    
+    @classmethod
+    def read_env(cls, env_file: str = ".env") -> Dict[str, str]:
+        """启动时的环境变量叠加当前.env内容 (不修改环境变量)；.env 中删除的项恢复为启动时的值"""
+        return {**_startup_environ, **cls.parse_env_file(env_file)}
+    
+    @classmethod
+    def read_reloadable(cls, env: Mapping[str, str]) -> dict:
+        """按 RELOADABLE_SETTINGS 解析并校验可热更新的配置 - 任一项不合法时抛出 ValueError"""
+        values = {}
+        for name, setting in RELOADABLE_SETTINGS.items():
+            raw = env.get(name, setting.default)
+            try:
+                values[name] = setting.parse(raw)
+                setting.check(values[name])
+            except ValueError as e:
+                raise ValueError(f"{name}={raw} 不合法: {e}") from None
+        return values
     
     @classmethod
     def print_config(cls) -> None:
@@ -61,9 +261,39 @@ class Config:
         print("🔧 当前配置:")
         print(f"   API服务: {cls.get_api_url()}")
         print(f"   WebUI: {cls.get_webui_url()}")
+        print(f"   识别引擎: {cls.ASR_ENGINE}" + (f" ({cls.ASR_COMPUTE_TYPE})" if cls.ASR_ENGINE == "faster-whisper" else ""))
         print(f"   Whisper模型: {cls.WHISPER_MODEL}")
         print(f"   设备: {cls.WHISPER_DEVICE}")
-        print(f"   GPU内存分配: {cls.GPU_MEMORY_FRACTION * 100}%")
+        print(f"   识别语言: {cls.WHISPER_LANGUAGE}" + (f" ({'/'.join(cls.WHISPER_LANGUAGES)})" if cls.WHISPER_LANGUAGE == "auto" else ""))
+        if cls.GPU_ARBITER:
+            print(f"   GPU显存: 动态仲裁 (LLM预留 {cls.LLM_MEMORY_RESERVE_GB}GB)")
+        else:
+            print(f"   GPU内存分配: {cls.GPU_MEMORY_FRACTION * 100}%")
+        print(f"   Worker进程数: {cls.WORKERS or '自动'}")
+        print(f"   CPU规划: 推理线程 {cls.TORCH_THREADS or '自动'}，解码槽位 {cls.DECODE_SLOTS or '自动'}"
+              + ("，绑核" if cls.CPU_PINNING else ""))
+        if cls.ADMISSION_ENABLED:
+            print(f"   准入控制: {cls.ADMISSION_CONCURRENCY} 个推理槽位，每客户端 {cls.CLIENT_AUDIO_RATE} 音频秒/秒 (突发 {cls.CLIENT_AUDIO_BURST}秒)")
+        if cls.AUDIT_LOG_ENABLED:
+            print(f"   审计日志: {cls.AUDIT_DB_PATH}")
+        if cls.REPLY_CACHE_ENABLED:
+            print(f"   AI回复缓存: {cls.REPLY_CACHE_TTL_MINUTES:g} 分钟过期，上限 {cls.REPLY_CACHE_MAX_MB:g}MB"
+                  + (f"，近似匹配阈值 {cls.REPLY_CACHE_SIMILARITY}" if cls.REPLY_CACHE_SIMILARITY > 0 else ""))
+        if cls.LLM_WARM_ENABLED:
+            print(f"   LLM保温: keep_alive={cls.OLLAMA_KEEP_ALIVE}，每 {cls.LLM_WARM_INTERVAL_SECONDS:g} 秒检查"
+                  + ("，对话预取" if cls.LLM_PREFETCH else ""))
+        if cls.TTS_ENABLED:
+            print(f"   语音合成: {cls.TTS_ENGINE}，{cls.TTS_WORKERS} 个合成进程，短语缓存 {cls.TTS_CACHE_MB:g}MB")
+        if cls.DEBUG_ENDPOINTS:
+            print(f"   调试剖析接口: {'已启用' if cls.DEBUG_TOKEN else '未设置DEBUG_TOKEN，保持关闭'}")
+        if cls.IDLE_OFFLOAD_MINUTES > 0:
+            print(f"   空闲卸载: {cls.IDLE_OFFLOAD_MINUTES} 分钟 → {cls.IDLE_OFFLOAD_TARGET}")
+        if cls.CONFIG_WATCH_INTERVAL > 0:
+            print(f"   热更新: 每 {cls.CONFIG_WATCH_INTERVAL:g} 秒检查 {cls.COMMAND_RULES_FILE} 与 .env")
+        if cls.ROUTER_BACKENDS:
+            print(f"   多实例路由: {len(cls.ROUTER_BACKENDS)} 个实例，端口 {cls.ROUTER_PORT}，"
+                  f"每实例最多 {cls.ROUTER_MAX_OUTSTANDING or '不限'} 个并发")
 
-# 加载配置
+# 加载配置 (热更新以加载.env之前的环境变量为基准)
+_startup_environ = dict(os.environ)
 Config.load_from_env_file()
\ No newline at end of file
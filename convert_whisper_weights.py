@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Whisper权重格式转换与内存映射加载
+- 把 ~/.cache/whisper/*.pt 转换为 safetensors 格式
+- 加载时直接mmap映射权重文件，不再反序列化整个checkpoint
+- 冷启动更快，峰值内存更低，多进程之间天然共享页缓存
+"""
+
+import argparse
+import base64
+import gzip
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+import torch
+
+WHISPER_CACHE = Path.home() / ".cache" / "whisper"
+
+
+def mmap_weights_path(model_name: str) -> Path:
+    """模型名对应的safetensors文件路径"""
+    return WHISPER_CACHE / f"{model_name}.safetensors"
+
+
+def convert_checkpoint(source: Union[str, Path], target: Optional[Union[str, Path]] = None,
+                       dtype: str = "float32") -> Path:
+    """把Whisper的.pt checkpoint转换为safetensors
+
+    默认保存为float32，与 whisper.load_model 在内存中的精度一致，
+    加载时无需再做类型转换，张量可以直接指向映射的文件页。
+    """
+    from safetensors.torch import save_file
+    import whisper
+
+    source = Path(source)
+    target = Path(target) if target else source.with_suffix(".safetensors")
+
+    checkpoint = torch.load(source, map_location="cpu", weights_only=True)
+    torch_dtype = getattr(torch, dtype)
+    state_dict = {
+        name: tensor.to(torch_dtype).contiguous() if tensor.is_floating_point() else tensor.contiguous()
+        for name, tensor in checkpoint["model_state_dict"].items()
+    }
+
+    metadata = {
+        "format": "pt",
+        "dims": json.dumps(checkpoint["dims"]),
+        "dtype": dtype,
+    }
+    # 官方模型自带时间对齐头配置，一并写入元数据
+    alignment_heads = getattr(whisper, "_ALIGNMENT_HEADS", {}).get(source.stem)
+    if alignment_heads:
+        metadata["alignment_heads"] = alignment_heads.decode() if isinstance(alignment_heads, bytes) else alignment_heads
+
+    # 先写临时文件再原子替换，避免服务读到写了一半的文件
+    tmp_target = target.with_suffix(target.suffix + ".tmp")
+    save_file(state_dict, str(tmp_target), metadata=metadata)
+    tmp_target.replace(target)
+    return target
+
+
+def _set_alignment_heads(model, metadata: dict) -> None:
+    """恢复alignment_heads缓冲区 (persistent=False，不在权重文件中)"""
+    dims = model.dims
+    heads = metadata.get("alignment_heads")
+    array = None
+    if heads:
+        array = torch.frombuffer(bytearray(gzip.decompress(base64.b85decode(heads))), dtype=torch.bool)
+    if array is not None and array.numel() == dims.n_text_layer * dims.n_text_head:
+        mask = array.reshape(dims.n_text_layer, dims.n_text_head)
+    else:
+        mask = torch.zeros(dims.n_text_layer, dims.n_text_head, dtype=torch.bool)
+        mask[dims.n_text_layer // 2:] = True
+    model.register_buffer("alignment_heads", mask.to_sparse(), persistent=False)
+
+
+def _build_meta_model(dims):
+    """在meta设备上搭建Whisper结构，不为权重分配内存
+
+    Whisper.__init__ 中的 to_sparse 不支持meta张量，这里按同样的结构手动组装。
+    """
+    from whisper.model import AudioEncoder, TextDecoder, Whisper
+
+    model = Whisper.__new__(Whisper)
+    torch.nn.Module.__init__(model)
+    model.dims = dims
+    with torch.device("meta"):
+        model.encoder = AudioEncoder(
+            dims.n_mels, dims.n_audio_ctx, dims.n_audio_state, dims.n_audio_head, dims.n_audio_layer
+        )
+        model.decoder = TextDecoder(
+            dims.n_vocab, dims.n_text_ctx, dims.n_text_state, dims.n_text_head, dims.n_text_layer
+        )
+    return model
+
+
+def load_mmap_model(path: Union[str, Path], device: str = "cpu"):
+    """以内存映射方式加载safetensors格式的Whisper模型
+
+    模型结构先在meta设备上创建(不分配内存)，再用 assign=True 把映射出的张量
+    直接作为参数，整个过程不复制权重。
+    """
+    from safetensors import safe_open
+    from safetensors.torch import load_file
+    from whisper.model import ModelDimensions
+
+    path = str(path)
+    with safe_open(path, framework="pt") as f:
+        metadata = f.metadata() or {}
+    dims = ModelDimensions(**json.loads(metadata["dims"]))
+
+    model = _build_meta_model(dims)
+    state_dict = load_file(path, device="cpu")
+    model.load_state_dict(state_dict, assign=True)
+
+    # 非持久化缓冲区不在权重文件中，按Whisper的定义重新生成
+    mask = torch.empty(dims.n_text_ctx, dims.n_text_ctx).fill_(float("-inf")).triu_(1)
+    model.decoder.register_buffer("mask", mask, persistent=False)
+    _set_alignment_heads(model, metadata)
+
+    leftover = [name for name, tensor in model.state_dict(keep_vars=True).items() if tensor.is_meta]
+    if leftover:
+        raise RuntimeError(f"权重文件缺少参数: {', '.join(leftover[:5])}")
+    return model.to(device)
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="把Whisper .pt 权重转换为可内存映射的safetensors格式")
+    parser.add_argument("model", help="模型名 (如 large-v3-turbo) 或 .pt 文件路径")
+    parser.add_argument("--output", help="输出路径，默认与源文件同目录")
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"],
+                        help="保存精度 (float16 体积减半，但CPU推理时每次前向需要转换)")
+    args = parser.parse_args()
+
+    source = Path(args.model)
+    if not source.exists():
+        source = WHISPER_CACHE / f"{args.model}.pt"
+    if not source.exists():
+        print(f"❌ 未找到模型文件: {source}")
+        sys.exit(1)
+
+    print(f"🔄 转换 {source} ...")
+    start = time.perf_counter()
+    target = convert_checkpoint(source, args.output, args.dtype)
+    print(f"✅ 已保存到 {target} ({target.stat().st_size / 1024**3:.2f} GB, 耗时 {time.perf_counter() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
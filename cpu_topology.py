@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+CPU拓扑感知的线程与进程规划
+- 可用核数取进程亲和性 (taskset/cpuset) 与cgroup CPU配额 (容器 --cpus) 中较小者
+- 预留一部分核给ffmpeg解码子进程，其余按worker均分为torch推理线程，避免默认设置下
+  每个worker的torch线程数都等于全部核数、再叠加ffmpeg造成的超额订阅
+- 可选绑核: 每个worker独占连续的物理核 (超线程兄弟核放在同一个worker)，ffmpeg只在预留核上运行
+- workers/torch_threads/decode_slots 显式给出 (来自 Config) 时优先于自动规划
+"""
+
+import math
+import os
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+# 每个worker的目标推理线程数: 再多线程时单次推理加速有限，不如多开worker提高并发吞吐
+THREADS_PER_WORKER = 4
+# 每多少个核预留一个解码槽位
+CORES_PER_DECODE_SLOT = 8
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+CPU_SYSFS = Path("/sys/devices/system/cpu")
+
+
+def available_cpus() -> List[int]:
+    """当前进程可运行的逻辑CPU编号"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def cgroup_cpu_quota(root: Path = CGROUP_ROOT) -> Optional[float]:
+    """cgroup CPU配额 (可用核数，可为小数)，未限制时返回None
+
+    依次尝试 cgroup v2 的 cpu.max 和 v1 的 cpu.cfs_quota_us / cpu.cfs_period_us。
+    """
+    try:
+        quota, period = (root / "cpu.max").read_text().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        quota = int((root / "cpu" / "cpu.cfs_quota_us").read_text())
+        period = int((root / "cpu" / "cpu.cfs_period_us").read_text())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def physical_cores(cpus: Sequence[int], sysfs: Path = CPU_SYSFS) -> List[List[int]]:
+    """按物理核分组 (同一物理核的超线程兄弟在一组)，读不到拓扑时每个逻辑CPU单独一组"""
+    groups = {}
+    for cpu in cpus:
+        topology = sysfs / f"cpu{cpu}" / "topology"
+        try:
+            key = (int((topology / "physical_package_id").read_text()), int((topology / "core_id").read_text()))
+        except (OSError, ValueError):
+            key = (-1, cpu)
+        groups.setdefault(key, []).append(cpu)
+    return [sorted(group) for _, group in sorted(groups.items(), key=lambda item: min(item[1]))]
+
+
+@dataclass
+class CPUPlan:
+    """一次规划的结果"""
+    cpus: int                    # 可见的逻辑CPU数
+    quota: Optional[float]       # cgroup配额 (核)，未限制为None
+    budget: int                  # 实际参与分配的核数
+    physical_cores: int
+    workers: int
+    torch_threads: int           # 每个worker的推理线程数
+    decode_slots: int            # 每个worker同时运行的ffmpeg解码数
+    worker_cpus: Optional[List[List[int]]] = None   # 绑核时每个worker的CPU
+    decode_cpus: Optional[List[int]] = None         # 绑核时ffmpeg使用的CPU
+    overrides: List[str] = field(default_factory=list)
+
+    def cpus_for_worker(self, index: int) -> Optional[List[int]]:
+        return self.worker_cpus[index % len(self.worker_cpus)] if self.worker_cpus else None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def plan_cpus(cpus: Sequence[int], quota: Optional[float] = None, core_groups: Optional[List[List[int]]] = None,
+              workers: int = 0, torch_threads: int = 0, decode_slots: int = 0,
+              pin: bool = False, gpu: bool = False) -> CPUPlan:
+    """在可用核上分配worker、推理线程和解码槽位 (workers/torch_threads/decode_slots 为0时自动)
+
+    GPU推理只用一个worker (CUDA上下文无法跨fork共享)；
+    绑核要求每个worker的线程数与解码槽位都能分到独占的CPU，放不下时不绑核。
+    """
+    core_groups = core_groups or [[cpu] for cpu in cpus]
+    budget = len(cpus)
+    if quota is not None:
+        # 配额向下取整: 线程数超过配额时会被节流，宁可少开
+        budget = max(1, min(budget, math.floor(quota)))
+    overrides = [name for name, value in (("workers", workers), ("torch_threads", torch_threads),
+                                          ("decode_slots", decode_slots)) if value]
+
+    total_decode = max(1, budget // CORES_PER_DECODE_SLOT)
+    inference = budget - total_decode if budget > total_decode else budget
+    if gpu:
+        workers = 1
+    elif not workers:
+        workers = max(1, inference // THREADS_PER_WORKER)
+    torch_threads = torch_threads or max(1, inference // workers)
+    decode_slots = decode_slots or max(1, math.ceil(total_decode / workers))
+
+    plan = CPUPlan(
+        cpus=len(cpus), quota=quota, budget=budget, physical_cores=len(core_groups),
+        workers=workers, torch_threads=torch_threads, decode_slots=decode_slots, overrides=overrides
+    )
+    if pin:
+        # 按整个物理核分配，同一物理核的超线程不会分给两个worker；其后的核给ffmpeg
+        groups = iter(core_groups)
+        worker_cpus = []
+        for _ in range(workers):
+            assigned = []
+            for group in groups:
+                assigned += group
+                if len(assigned) >= torch_threads:
+                    break
+            worker_cpus.append(assigned)
+        rest = [cpu for group in groups for cpu in group]
+        if all(len(assigned) >= torch_threads for assigned in worker_cpus) and len(rest) >= total_decode:
+            plan.worker_cpus = worker_cpus
+            # 有配额时不超出配额对应的核数
+            plan.decode_cpus = rest[:max(total_decode, budget - sum(map(len, worker_cpus)))]
+    return plan
+
+
+def apply_worker_plan(plan: CPUPlan, index: int = 0) -> None:
+    """在worker进程中生效: 绑核 (如有) 并设置torch推理线程数"""
+    import torch
+
+    cpus = plan.cpus_for_worker(index)
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(plan.torch_threads)
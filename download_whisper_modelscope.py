@@ -92,28 +92,49 @@ def setup_whisper_cache(download_path, model_name):
         print(f"✅ 模型文件已复制到: {target_file}")
         print(f"📊 文件大小: {target_file.stat().st_size / 1024**3:.1f} GB")
         
+        convert_to_mmap_format(target_file)
         return True
         
     except Exception as e:
         print(f"❌ 设置缓存失败: {e}")
         return False
 
+def convert_to_mmap_format(model_file):
+    """转换为safetensors格式，服务启动时可内存映射快速加载"""
+    from model_download import convert_for_serving
+    convert_for_serving(Path(model_file))
+
+def download_direct(model_name):
+    """从官方地址/镜像并行分块下载 (断点续传、SHA-256校验)，失败时返回False"""
+    from config import Config
+    from model_download import DownloadError, download_model, print_progress
+    import time
+
+    print(f"🚀 并行下载: {model_name} ({Config.WHISPER_DOWNLOAD_WORKERS} 线程)")
+    try:
+        download_model(model_name, mirrors=Config.WHISPER_DOWNLOAD_MIRRORS,
+                       workers=Config.WHISPER_DOWNLOAD_WORKERS, chunk_mb=Config.WHISPER_DOWNLOAD_CHUNK_MB,
+                       progress=print_progress(time.perf_counter()))
+        return True
+    except (DownloadError, ValueError) as e:
+        print(f"\n⚠️ 直接下载失败: {e}")
+        return False
+
+def ensure_modelscope():
+    """检查ModelScope，未安装时询问是否安装"""
+    if check_modelscope():
+        return True
+    print("❌ ModelScope未安装")
+    response = input("是否安装ModelScope? (Y/n): ")
+    if response.lower() in ['', 'y', 'yes']:
+        return install_modelscope()
+    return False
+
 def main():
     """主函数"""
     print("🎤 Whisper模型快速下载工具 (ModelScope)")
     print("=" * 50)
     
-    # 检查ModelScope
-    if not check_modelscope():
-        print("❌ ModelScope未安装")
-        response = input("是否安装ModelScope? (Y/n): ")
-        if response.lower() in ['', 'y', 'yes']:
-            if not install_modelscope():
-                return
-        else:
-            print("👋 退出")
-            return
-    
     # 选择模型
     models = {
         "1": ("large-v3-turbo", "推荐: 显存占用少，速度快"),
@@ -133,7 +154,11 @@ def main():
         
         confirm = input("是否继续? (Y/n): ").strip().lower()
         if confirm in ['', 'y', 'yes']:
-            success = download_whisper_model(model_name)
+            # 优先并行直接下载 (可续传)，失败时改用ModelScope
+            success = download_direct(model_name)
+            if not success:
+                print("💡 改用ModelScope下载")
+                success = ensure_modelscope() and download_whisper_model(model_name)
             
             if success:
                 print(f"\n🎉 模型 {model_name} 下载完成!")
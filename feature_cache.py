@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+请求级音频特征缓存
+- 每个请求的log-mel频谱只计算一次，按(n_mels, 设备)缓存，语言识别和 whisper.transcribe 共用
+- 编码器输出按mel内容缓存，温度回退重新解码、语言识别、
+  以及编码器权重相同的其他模型都直接复用，不再重复跑编码器
+- 批量输入中只对未命中的行做一次批量编码
+- 缓存通过contextvar绑定到当前请求，请求结束即释放
+"""
+
+import hashlib
+import importlib
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+import torch
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 单个请求最多缓存的编码窗口数，重试总是紧跟在同一窗口之后，少量即可
+MAX_CACHED_WINDOWS = 4
+
+_current_features: ContextVar[Optional["RequestFeatures"]] = ContextVar("request_features", default=None)
+
+
+def _digest(tensor: torch.Tensor) -> bytes:
+    """张量内容摘要 (同一窗口每次重试都会重新切片，只能按内容匹配)"""
+    data = tensor.detach().contiguous().cpu().numpy().tobytes()
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def encoder_fingerprint(encoder: torch.nn.Module) -> str:
+    """编码器指纹 - 结构和权重抽样相同的编码器可以共享编码结果"""
+    digest = hashlib.blake2b(digest_size=16)
+    for name, param in encoder.named_parameters():
+        digest.update(f"{name}:{tuple(param.shape)}".encode())
+    params = list(encoder.parameters())
+    for param in (params[0], params[len(params) // 2], params[-1]):
+        digest.update(param.detach().flatten()[:256].float().cpu().numpy().tobytes())
+    return digest.hexdigest()
+
+
+class RequestFeatures:
+    """单个请求的特征缓存"""
+
+    def __init__(self, audio=None, max_windows: int = MAX_CACHED_WINDOWS):
+        self.audio = audio
+        self.max_windows = max_windows
+        self._mels = {}
+        self._encoded = OrderedDict()
+        self.encoder_passes = 0
+        self.encoder_cache_hits = 0
+
+    def log_mel(self, n_mels: int, device="cpu") -> torch.Tensor:
+        """整段音频的log-mel频谱 (含30秒尾部填充，与whisper.transcribe一致)"""
+        import whisper
+        from whisper.audio import N_SAMPLES
+
+        key = (n_mels, str(device))
+        if key not in self._mels:
+            self._mels[key] = whisper.log_mel_spectrogram(
+                self.audio, n_mels, padding=N_SAMPLES, device=device
+            )
+        return self._mels[key]
+
+    def encode(self, fingerprint: str, forward: Callable, mel: torch.Tensor) -> torch.Tensor:
+        """按行查缓存，未命中的行合并为一个批次送入编码器"""
+        batched = mel.dim() == 3
+        rows = mel if batched else mel.unsqueeze(0)
+        keys = [(fingerprint, str(row.device), row.dtype, tuple(row.shape), _digest(row)) for row in rows]
+
+        missing = [i for i, key in enumerate(keys) if key not in self._encoded]
+        encoded = None
+        if missing:
+            encoded = forward(rows if len(missing) == len(keys) else rows[missing])
+            for i, output in zip(missing, encoded):
+                self._encoded[keys[i]] = output
+            self.encoder_passes += len(missing)
+            metrics.incr("encoder_passes", len(missing))
+        hits = len(keys) - len(missing)
+        if hits:
+            self.encoder_cache_hits += hits
+            metrics.incr("encoder_cache_hits", hits)
+
+        for key in keys:
+            self._encoded.move_to_end(key)
+        result = encoded if not hits else torch.stack([self._encoded[key] for key in keys])
+        while len(self._encoded) > self.max_windows:
+            self._encoded.popitem(last=False)
+        return result if batched else result[0]
+
+    def stats(self) -> dict:
+        return {"passes": self.encoder_passes, "cache_hits": self.encoder_cache_hits}
+
+
+@contextmanager
+def request_features(audio=None, max_windows: int = MAX_CACHED_WINDOWS):
+    """在当前上下文中启用请求级特征缓存 (批量转录时 max_windows 不小于批大小)"""
+    features = RequestFeatures(audio, max_windows)
+    token = _current_features.set(features)
+    try:
+        yield features
+    finally:
+        _current_features.reset(token)
+
+
+def current_features() -> Optional[RequestFeatures]:
+    return _current_features.get()
+
+
+def enable_feature_cache(model) -> None:
+    """让模型的编码器在请求上下文中走缓存 (上下文之外行为不变)
+
+    直接替换编码器实例的forward，参数名和state_dict保持不变；
+    模型重新加载后需要再次调用。
+    """
+    encoder = model.encoder
+    if getattr(encoder, "_feature_cache_enabled", False):
+        return
+    fingerprint = encoder_fingerprint(encoder)
+    forward = encoder.forward
+
+    def cached_forward(mel: torch.Tensor) -> torch.Tensor:
+        features = _current_features.get()
+        if features is None:
+            return forward(mel)
+        return features.encode(fingerprint, forward, mel)
+
+    encoder.forward = cached_forward
+    encoder._feature_cache_enabled = True
+
+
+def enable_cached_log_mel() -> None:
+    """让 whisper.transcribe 在请求上下文中直接取缓存的log-mel (上下文之外或其他音频行为不变)
+
+    whisper.transcribe 只接受波形，每次都会重新计算整段频谱；auto模式下语言识别已经算过一次。
+    替换的是 whisper.transcribe 模块引用的 log_mel_spectrogram，全局调用一次即可。
+    """
+    from whisper.audio import N_SAMPLES
+
+    module = importlib.import_module("whisper.transcribe")
+    compute = module.log_mel_spectrogram
+    if getattr(compute, "_feature_cache_enabled", False):
+        return
+
+    def cached_log_mel(audio, n_mels=80, padding=0, device=None):
+        features = _current_features.get()
+        if features is None or audio is not features.audio or padding != N_SAMPLES or device is not None:
+            return compute(audio, n_mels, padding=padding, device=device)
+        return features.log_mel(n_mels)
+
+    cached_log_mel._feature_cache_enabled = True
+    module.log_mel_spectrogram = cached_log_mel
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+GPU显存仲裁
+- 取代固定的50%显存比例，按Whisper实际峰值占用和LLM需求动态分配
+- 转录期间LLM调用排队等待，转录优先
+- LLM需要显存时把空闲的Whisper卸载到CPU，下次转录前再搬回GPU
+- Whisper需要显存而LLM空闲时，通知Ollama卸载模型
+- 显存统计通过 MemoryAccountant 抽象，CPU环境下可用模拟实现测试
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+import requests
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+GB = 1024 ** 3
+
+
+class MemoryAccountant:
+    """设备显存统计接口"""
+
+    def total(self) -> int:
+        raise NotImplementedError
+
+    def free(self) -> int:
+        raise NotImplementedError
+
+    def reset_peak(self) -> None:
+        raise NotImplementedError
+
+    def peak(self) -> int:
+        """自上次 reset_peak 以来本进程的峰值占用"""
+        raise NotImplementedError
+
+    def release_cached(self) -> None:
+        """归还缓存的空闲显存"""
+
+
+class CudaMemoryAccountant(MemoryAccountant):
+    """基于torch.cuda的真实显存统计"""
+
+    def __init__(self, device: int = 0):
+        import torch
+        self._torch = torch
+        self.device = device
+
+    def total(self) -> int:
+        return self._torch.cuda.mem_get_info(self.device)[1]
+
+    def free(self) -> int:
+        # mem_get_info 统计整张卡，包含Ollama等其他进程的占用
+        return self._torch.cuda.mem_get_info(self.device)[0]
+
+    def reset_peak(self) -> None:
+        self._torch.cuda.reset_peak_memory_stats(self.device)
+
+    def peak(self) -> int:
+        return self._torch.cuda.max_memory_allocated(self.device)
+
+    def release_cached(self) -> None:
+        self._torch.cuda.empty_cache()
+
+
+class SimulatedMemoryAccountant(MemoryAccountant):
+    """模拟显存统计，供CPU环境测试使用"""
+
+    def __init__(self, total_bytes: int):
+        self._total = total_bytes
+        self._lock = threading.Lock()
+        self.allocations = {}
+        self._peak = 0
+
+    def allocate(self, owner: str, size: int) -> None:
+        with self._lock:
+            if self._used() - self.allocations.get(owner, 0) + size > self._total:
+                raise MemoryError(f"模拟显存不足: {owner} 需要 {size} 字节")
+            self.allocations[owner] = size
+            self._peak = max(self._peak, self._used())
+
+    def release(self, owner: str) -> None:
+        with self._lock:
+            self.allocations.pop(owner, None)
+
+    def _used(self) -> int:
+        return sum(self.allocations.values())
+
+    def total(self) -> int:
+        return self._total
+
+    def free(self) -> int:
+        with self._lock:
+            return self._total - self._used()
+
+    def reset_peak(self) -> None:
+        with self._lock:
+            self._peak = self._used()
+
+    def peak(self) -> int:
+        with self._lock:
+            return self._peak
+
+
+class OllamaMemoryClient:
+    """查询和释放Ollama占用的显存"""
+
+    def __init__(self, base_url: str, timeout: float = 5):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def running_models(self) -> list:
+        response = requests.get(f"{self.base_url}/ps", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json().get("models", [])
+
+    def vram_in_use(self) -> int:
+        return sum(model.get("size_vram", 0) for model in self.running_models())
+
+    def unload_all(self) -> int:
+        """卸载所有已加载的模型 (keep_alive=0)，返回释放的显存估计"""
+        freed = 0
+        for model in self.running_models():
+            requests.post(
+                f"{self.base_url}/generate",
+                json={"model": model["name"], "keep_alive": 0},
+                timeout=self.timeout
+            )
+            freed += model.get("size_vram", 0)
+            logger.info(f"🧹 已请求Ollama卸载模型: {model['name']}")
+        return freed
+
+
+class GPUMemoryArbiter:
+    """Whisper与LLM之间的显存仲裁器
+
+    move_model(device) 负责把Whisper搬到指定设备 ("cuda" 或 "cpu")；
+    whisper_bytes 为Whisper常驻显存的初始估计，实际转录峰值会持续更新该估计。
+    """
+
+    def __init__(self, accountant: MemoryAccountant, move_model: Callable[[str], None],
+                 whisper_bytes: int, llm_bytes: int,
+                 ollama: Optional[OllamaMemoryClient] = None, device: str = "cuda"):
+        self.accountant = accountant
+        self.move_model = move_model
+        self.ollama = ollama
+        self.device = device
+        self.whisper_bytes = whisper_bytes
+        self.whisper_peak = whisper_bytes
+        self.llm_bytes = llm_bytes
+        self.resident = True
+        self._cond = threading.Condition()
+        self._asr_active = 0
+        self._llm_active = 0
+        self._llm_waiting = 0
+
+    @property
+    def model_device(self) -> str:
+        return self.device if self.resident else "cpu"
+
+    def _move(self, device: str) -> None:
+        """在锁内搬移模型，调用方保证此时没有转录在使用模型"""
+        start = time.perf_counter()
+        self.move_model(device)
+        self.resident = device == self.device
+        if not self.resident:
+            self.accountant.release_cached()
+        seconds = time.perf_counter() - start
+        metrics.observe("whisper_reload" if self.resident else "whisper_offload", seconds)
+        logger.info(f"🔀 Whisper已移动到 {device}，耗时 {seconds:.2f}s")
+
+    def ensure_resident(self) -> bool:
+        """尽量把Whisper放回GPU (仅在无人使用模型且LLM空闲时)，返回是否在GPU上"""
+        with self._cond:
+            return self._ensure_resident_locked()
+
+    def _ensure_resident_locked(self) -> bool:
+        if self.resident:
+            return True
+        if self._asr_active or self._llm_active:
+            # 模型正被CPU转录使用或LLM正在占用显存，本次转录留在CPU
+            return False
+        if self.accountant.free() < self.whisper_peak and self.ollama:
+            try:
+                self.ollama.unload_all()
+                metrics.incr("ollama_unloads")
+            except Exception as e:
+                logger.warning(f"⚠️ 通知Ollama卸载模型失败: {e}")
+        if self.accountant.free() < self.whisper_peak:
+            logger.warning("⚠️ 显存不足，Whisper暂留CPU")
+            return False
+        self._move(self.device)
+        return True
+
+    def offload(self) -> bool:
+        """空闲时主动把Whisper卸载到CPU，模型正被使用时返回False"""
+        with self._cond:
+            if not self.resident:
+                return True
+            if self._asr_active or self._llm_active:
+                return False
+            self._move("cpu")
+            return True
+
+    @contextmanager
+    def transcription(self):
+        """转录期间持有: 优先使用GPU，LLM调用排队等待"""
+        with self._cond:
+            on_device = self._ensure_resident_locked()
+            self._asr_active += 1
+        if on_device:
+            self.accountant.reset_peak()
+        try:
+            yield self.model_device
+        finally:
+            with self._cond:
+                if on_device:
+                    self.whisper_peak = max(self.whisper_peak, self.accountant.peak())
+                self._asr_active -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def llm_call(self):
+        """LLM调用期间持有: 等待进行中的转录结束，必要时卸载Whisper腾出显存"""
+        with self._cond:
+            if self._asr_active:
+                self._llm_waiting += 1
+                metrics.incr("llm_queued")
+                start = time.perf_counter()
+                while self._asr_active:
+                    self._cond.wait()
+                self._llm_waiting -= 1
+                metrics.observe("llm_queue_wait", time.perf_counter() - start)
+            self._llm_active += 1
+            if self.resident and self.accountant.free() < self.llm_bytes:
+                logger.info("📤 LLM需要显存，临时把Whisper卸载到CPU")
+                self._move("cpu")
+        try:
+            yield
+        finally:
+            if self.ollama:
+                try:
+                    # 以Ollama实际占用更新LLM显存需求估计
+                    in_use = self.ollama.vram_in_use()
+                    if in_use:
+                        self.llm_bytes = in_use
+                except Exception:
+                    pass
+            with self._cond:
+                self._llm_active -= 1
+                self._cond.notify_all()
+
+    def status(self) -> dict:
+        """仲裁器状态，供 /health 展示"""
+        with self._cond:
+            return {
+                "whisper_device": self.model_device,
+                "whisper_peak_gb": round(self.whisper_peak / GB, 2),
+                "llm_reserve_gb": round(self.llm_bytes / GB, 2),
+                "free_gb": round(self.accountant.free() / GB, 2),
+                "active_transcriptions": self._asr_active,
+                "active_llm_calls": self._llm_active,
+                "queued_llm_calls": self._llm_waiting,
+            }
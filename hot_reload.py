@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+配置热更新 (不重启服务、不重新加载模型)
+- 监视指令规则文件 (COMMAND_RULES_FILE) 与 .env: 后台线程按间隔比较文件内容摘要，
+  变化时在后台线程中解析、校验并编译指令词典和纠错表，编译完成后一次性替换 (识别请求总是读到完整的一版)
+- .env 中可热更新的配置 (Config.RELOADABLE，解码与请求处理参数) 校验通过后直接生效；
+  其它配置 (模型、引擎、进程数、端口等) 的改动只列为待重启项；读取.env不修改进程的环境变量
+- 规则或配置不合法时保持当前版本不变，错误记入状态
+- 每次有改动生效版本号加一；POST /admin/reload 立即检查，GET /admin/config 查看当前版本
+- 多worker时每个worker各自监视文件，管理接口只作用于处理该请求的worker
+
+导出内置规则作为编辑起点:  python hot_reload.py --export command_rules.json
+上线前校验规则文件:        python hot_reload.py --check command_rules.json
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from command_detection import CommandRules, active_rules, compile_rules, install_rules, load_rules_file
+from config import Config
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def file_digest(path: str) -> Optional[str]:
+    """文件内容摘要，文件不存在时为None"""
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+class HotReloader:
+    """监视规则文件与.env，变化时编译并整体替换
+
+    on_config(changes) 在可热更新的配置生效后调用，用于同步已创建对象中保存的配置值 (如解码温度)；
+    on_rules(rules) 在指令规则替换后调用。
+    """
+
+    def __init__(self, rules_file: str, env_file: str = ".env", interval: float = 2.0,
+                 on_config: Optional[Callable[[dict], None]] = None,
+                 on_rules: Optional[Callable[[CommandRules], None]] = None):
+        self.rules_file = rules_file
+        self.env_file = env_file
+        self.interval = interval
+        self.on_config = on_config
+        self.on_rules = on_rules
+        self.version = 1
+        self.loaded_at = time.time()
+        self.pending_restart: list = []
+        self.last_error: Optional[str] = None
+        self.last_reload: Optional[dict] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # 启动时的环境变量与.env作为基准: 非热更新项与基准不同时列为待重启
+        self._baseline = Config.read_env(env_file)
+        self._digests: Dict[str, Optional[str]] = {env_file: file_digest(env_file)}
+
+    def reload(self, force: bool = False) -> dict:
+        """检查文件变化并应用 - 返回本次结果；规则或配置不合法时抛出 ValueError，当前版本保持不变
+
+        force 时即使文件摘要未变也重新读取 (内容相同的规则不会替换，版本号不变)。
+        """
+        with self._lock:
+            digests = {path: file_digest(path) for path in (self.rules_file, self.env_file)}
+            rules_changed = force or digests[self.rules_file] != self._digests.get(self.rules_file)
+            env_changed = force or digests[self.env_file] != self._digests.get(self.env_file)
+            if not rules_changed and not env_changed:
+                return {"version": self.version, "changed": False}
+
+            start = time.perf_counter()
+            try:
+                rules = None
+                if rules_changed:
+                    rules = load_rules_file(self.rules_file) if digests[self.rules_file] else compile_rules()
+                env = Config.read_env(self.env_file) if env_changed else None
+                fresh = Config.read_reloadable(env) if env_changed else None
+            except (OSError, ValueError) as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                metrics.incr("config_reload_errors")
+                logger.warning(f"⚠️ 热更新失败，继续使用 v{self.version}: {self.last_error}")
+                raise ValueError(self.last_error) from e
+            self._digests = digests
+            self.last_error = None
+
+            applied = {}
+            if fresh is not None:
+                applied = {name: value for name, value in fresh.items() if getattr(Config, name) != value}
+                self.pending_restart = sorted(name for name in set(env) | set(self._baseline)
+                                              if name not in Config.RELOADABLE
+                                              and env.get(name) != self._baseline.get(name))
+            swap_rules = rules is not None and rules.digest != active_rules().digest
+            if not swap_rules and not applied:
+                return {"version": self.version, "changed": False, "pending_restart": self.pending_restart}
+
+            if swap_rules:
+                install_rules(rules)
+            for name, value in applied.items():
+                setattr(Config, name, value)
+            self.version += 1
+            self.loaded_at = time.time()
+            elapsed = time.perf_counter() - start
+            metrics.incr("config_reloads")
+            metrics.observe("config_reload", elapsed)
+            self.last_reload = {
+                "version": self.version,
+                "at": self.loaded_at,
+                "rules_digest": active_rules().digest if swap_rules else None,
+                "config": applied,
+                "seconds": round(elapsed, 4),
+            }
+            logger.info(f"🔄 热更新 v{self.version}: "
+                        + ("指令规则 " + active_rules().digest + " " if swap_rules else "")
+                        + (f"配置 {', '.join(applied)} " if applied else "")
+                        + (f"(待重启: {', '.join(self.pending_restart)})" if self.pending_restart else ""))
+
+        # 回调在锁外执行，回调较慢时不阻塞下一次检查；回调失败不影响已生效的版本
+        try:
+            if swap_rules and self.on_rules:
+                self.on_rules(rules)
+            if applied and self.on_config:
+                self.on_config(applied)
+        except Exception as e:
+            logger.warning(f"⚠️ 热更新回调失败: {e}")
+        return {**self.last_reload, "changed": True, "pending_restart": self.pending_restart}
+
+    def start(self) -> None:
+        """启动后台监视线程 (interval 为0时不监视)"""
+        if self.interval <= 0:
+            return
+
+        def loop():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.reload()
+                except ValueError:
+                    pass  # 已记入 last_error，文件再次变化时重试
+
+        self._thread = threading.Thread(target=loop, name="hot-reload", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def status(self) -> dict:
+        rules = active_rules()
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "rules": {
+                "file": self.rules_file,
+                "source": "file" if self._digests.get(self.rules_file) else "builtin",
+                "digest": rules.digest,
+                "targets": {lang: sum(len(c["targets"]) for c in table.values())
+                            for lang, table in rules.tables.items()},
+                "corrections": len(rules.corrections),
+            },
+            "env_file": self.env_file,
+            "watch_interval_seconds": self.interval,
+            "config": {name: getattr(Config, name) for name in Config.RELOADABLE},
+            "pending_restart": self.pending_restart,
+            "last_reload": self.last_reload,
+            "last_error": self.last_error,
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="指令规则文件工具")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--export", metavar="FILE", help="导出内置指令词典与纠错表")
+    group.add_argument("--check", metavar="FILE", help="校验规则文件并显示摘要")
+    args = parser.parse_args()
+    if args.export:
+        if os.path.exists(args.export):
+            parser.error(f"{args.export} 已存在")
+        with open(args.export, "w", encoding="utf-8") as f:
+            json.dump(compile_rules().to_dict(), f, ensure_ascii=False, indent=2)
+        print(f"✅ 内置规则已导出到 {args.export}")
+        return
+    try:
+        rules = load_rules_file(args.check)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+    print(f"✅ 规则有效: 摘要 {rules.digest}，{len(rules.corrections)} 条纠错，"
+          + "，".join(f"{lang} {len(table)} 类指令" for lang, table in rules.tables.items()))
+
+
+if __name__ == "__main__":
+    main()
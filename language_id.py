@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+自动语言识别
+- 在第一个30秒窗口上运行一次Whisper语言识别，只在支持的语言中选择
+- 识别用的窗口与转录第一次解码的窗口完全一致，编码器输出由请求级特征缓存复用，
+  语言识别只多一步解码器前向
+- 按用户记录最近识别出的语言，识别置信度不够时退回该用户的常用语言
+"""
+
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from typing import Optional, Sequence
+
+import torch
+
+from feature_cache import RequestFeatures
+from metrics import metrics
+
+# 各语言的初始提示，引导模型输出正确的应用程序名称
+INITIAL_PROMPTS = {
+    "zh": "以下是普通话的转录，请准确识别应用程序名称如记事本、计算器等。",
+    "en": "Voice commands such as open Notepad, open Calculator, open GitHub, or open PowerShell.",
+}
+
+
+class LanguagePreferences:
+    """按用户缓存最近识别出的语言 (LRU，超出容量淘汰最久未出现的用户)"""
+
+    def __init__(self, max_users: int = 1024, history: int = 8):
+        self.max_users = max_users
+        self.history = history
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def preferred(self, user: str) -> Optional[str]:
+        with self._lock:
+            recent = self._users.get(user)
+            if not recent:
+                return None
+            self._users.move_to_end(user)
+            return Counter(recent).most_common(1)[0][0]
+
+    def record(self, user: str, language: str) -> None:
+        with self._lock:
+            recent = self._users.get(user)
+            if recent is None:
+                recent = self._users[user] = deque(maxlen=self.history)
+            recent.append(language)
+            self._users.move_to_end(user)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+
+def first_window(model, features: RequestFeatures, dtype: torch.dtype) -> torch.Tensor:
+    """按 whisper.transcribe 切第一个窗口的方式取mel，保证与解码时的编码器输入逐位一致"""
+    from whisper.audio import N_FRAMES, pad_or_trim
+
+    mel = features.log_mel(model.dims.n_mels)
+    content_frames = mel.shape[-1] - N_FRAMES
+    segment = mel[:, :min(N_FRAMES, content_frames)]
+    return pad_or_trim(segment, N_FRAMES).to(model.device).to(dtype)
+
+
+def identify_language(model, features: RequestFeatures, candidates: Sequence[str],
+                      fp16: bool = False) -> dict:
+    """在第一个窗口上识别语言，返回 {language, probability, ms}
+
+    只在 candidates 中取概率最高者，概率为候选集合内归一化后的值。
+    """
+    start = time.perf_counter()
+    if not model.is_multilingual:
+        language, probability = "en", 1.0
+    else:
+        segment = first_window(model, features, torch.float16 if fp16 else torch.float32)
+        _, probs = model.detect_language(segment)
+        scores = {lang: probs.get(lang, 0.0) for lang in candidates}
+        total = sum(scores.values()) or 1.0
+        language = max(scores, key=scores.get)
+        probability = scores[language] / total
+    seconds = time.perf_counter() - start
+    metrics.observe("language_id", seconds)
+    return {"language": language, "probability": round(probability, 3), "ms": round(seconds * 1000, 1)}
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Ollama模型预热与保温
+- 后台线程定期检查回复模型是否仍在Ollama中加载；已加载时发送空prompt请求刷新 keep_alive
+  (不生成、不占显存)，被卸载后按需重新加载
+- 转录结果判定为普通对话 (非指令) 时立即预取: 在后台加载模型，与后续的指令执行、
+  文本插入和用户提交并行，真正调用LLM时不再等待加载
+- 加载通过 llm_slot 进行，与Whisper之间的显存仍由仲裁器协调；启用仲裁器时仲裁器主动卸载的模型
+  不在定期检查中重新加载，只在预取时加载
+- 每次加载 (预热、预取或请求本身触发的冷启动) 都记入指标
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import Callable, Optional
+
+import requests
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 最近的加载事件，供 /health 展示
+recent_loads: deque = deque(maxlen=20)
+
+
+def record_load(model: str, seconds: float, reason: str) -> None:
+    """记录一次Ollama模型加载 (reason: warm/prefetch/request)"""
+    metrics.incr("llm_loads")
+    metrics.incr(f"llm_loads_{reason}")
+    metrics.observe("llm_load", seconds)
+    recent_loads.append({"model": model, "reason": reason, "load_seconds": round(seconds, 3), "at": time.time()})
+    logger.info(f"🔥 Ollama模型 {model} 已加载 ({reason})，加载耗时 {seconds:.2f}s")
+
+
+def load_seconds(result: dict) -> float:
+    """Ollama应答中的加载耗时 (load_duration，纳秒)"""
+    return (result.get("load_duration") or 0) / 1e9
+
+
+class OllamaWarmKeeper:
+    """让回复模型保持加载状态
+
+    slot 为LLM显存占用上下文 (llm_slot)，加载模型时持有；
+    reload_unloaded=False 时定期检查只刷新已加载的模型，不重新加载 (启用显存仲裁时)。
+    """
+
+    def __init__(self, base_url: str, model: str, keep_alive: str = "30m", interval: float = 240,
+                 slot: Callable = nullcontext, reload_unloaded: bool = True, timeout: float = 120):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.keep_alive = keep_alive
+        self.interval = interval
+        self.slot = slot
+        self.reload_unloaded = reload_unloaded
+        self.timeout = timeout
+        self.loaded: Optional[bool] = None
+        self.last_ping: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._prefetch = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def is_loaded(self) -> bool:
+        response = requests.get(f"{self.base_url}/ps", timeout=5)
+        response.raise_for_status()
+        names = {model.get("name") or model.get("model") for model in response.json().get("models", [])}
+        # 未写标签的模型名在Ollama中显示为 name:latest
+        return self.model in names or f"{self.model}:latest" in names
+
+    def _ping(self) -> float:
+        """空prompt请求: 未加载时加载模型，已加载时只刷新 keep_alive - 返回加载耗时"""
+        response = requests.post(
+            f"{self.base_url}/generate",
+            json={"model": self.model, "prompt": "", "keep_alive": self.keep_alive},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        self.last_ping = time.time()
+        return load_seconds(response.json())
+
+    def _load(self, reason: str) -> None:
+        with self.slot():
+            seconds = self._ping()
+        self.loaded = True
+        record_load(self.model, seconds, reason)
+
+    def check(self, reason: Optional[str] = None) -> bool:
+        """已加载则刷新保温；未加载时，预热/预取 (reason) 或允许重新加载时加载 - 返回本次是否发生了加载"""
+        if self.is_loaded():
+            self._ping()
+            self.loaded = True
+            metrics.incr("llm_keepalive_pings")
+            return False
+        if self.loaded:
+            metrics.incr("llm_unloaded_detected")
+            logger.info(f"📉 Ollama模型 {self.model} 已被卸载")
+        self.loaded = False
+        if reason is None and not self.reload_unloaded:
+            return False
+        self._load(reason or "warm")
+        return True
+
+    def prefetch(self) -> None:
+        """请求预取 (不阻塞): 唤醒后台线程立即检查并加载模型，连续多次请求合并为一次"""
+        metrics.incr("llm_prefetch_requests")
+        self._prefetch.set()
+
+    def start(self, warm_now: bool = True) -> None:
+        """启动后台线程；warm_now 时启动后立即加载一次模型"""
+        def loop():
+            reason = "warm" if warm_now else None
+            while not self._stop.is_set():
+                try:
+                    self.check(reason)
+                    self.last_error = None
+                except Exception as e:
+                    if self.last_error != str(e):
+                        logger.warning(f"⚠️ Ollama模型保温失败: {e}")
+                    self.last_error = str(e)
+                woke = self._prefetch.wait(self.interval)
+                self._prefetch.clear()
+                reason = "prefetch" if woke else None
+
+        self._thread = threading.Thread(target=loop, name="ollama-warm", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._prefetch.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def status(self) -> dict:
+        return {
+            "model": self.model,
+            "keep_alive": self.keep_alive,
+            "interval_seconds": self.interval,
+            "loaded": self.loaded,
+            "last_ping": self.last_ping,
+            "last_error": self.last_error,
+            "recent_loads": list(recent_loads),
+        }
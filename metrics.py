@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+运行时性能指标
+- 计数器 + 耗时采样，线程安全
+- 通过 /metrics 接口查看
+"""
+
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+
+class Metrics:
+    """轻量级指标收集器"""
+
+    def __init__(self, max_samples: int = 1000):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._timings = defaultdict(lambda: deque(maxlen=max_samples))
+        self._timing_counts = defaultdict(int)
+
+    def incr(self, name: str, value: float = 1) -> None:
+        """计数器累加"""
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """记录一次耗时(秒)"""
+        with self._lock:
+            self._timings[name].append(seconds)
+            self._timing_counts[name] += 1
+
+    @contextmanager
+    def timer(self, name: str):
+        """计时上下文，退出时自动记录耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        """导出当前指标，耗时单位为毫秒"""
+        with self._lock:
+            counters = dict(self._counters)
+            timings = {}
+            for name, samples in self._timings.items():
+                if not samples:
+                    continue
+                ordered = sorted(samples)
+                timings[name] = {
+                    "count": self._timing_counts[name],
+                    "avg_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+                    "p50_ms": round(ordered[len(ordered) // 2] * 1000, 2),
+                    "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+                    "max_ms": round(ordered[-1] * 1000, 2),
+                }
+        return {"counters": counters, "timings": timings}
+
+
+# 全局指标实例
+metrics = Metrics()
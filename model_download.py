@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+Whisper模型下载 (断点续传、并行分块、SHA-256校验)
+- 按 HTTP Range 把文件切成固定大小的块，多个线程并行下载；每块完成后记入状态文件，
+  中断后再次运行只补下缺失的块
+- 镜像列表按顺序排列，各块从不同镜像开始轮换以分摊流量，某个镜像出错时该块改用下一个镜像
+- 边下载边校验: 从头开始连续完成的块立即计入SHA-256，下载结束时只需补算最后几块；
+  官方模型的期望摘要取自 whisper 内置的下载地址
+- 先写入目标目录下的 .part 文件，校验通过后落盘并原子改名，服务不会读到不完整的模型；校验失败时删除
+- 下载完成后转换为服务使用的 safetensors 格式 (convert_whisper_weights)
+- 镜像不支持 Range 时退回单线程整体下载 (此时不能续传)
+
+用法:
+    python model_download.py large-v3-turbo
+    python model_download.py large-v3 --mirror "https://mirror.example.com/whisper/{sha256}/{file}" --workers 8
+    python model_download.py --url http://host/model.pt --sha256 <摘要> --output ~/.cache/whisper/custom.pt
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Set
+
+import requests
+
+from config import Config
+
+WHISPER_CACHE = Path.home() / ".cache" / "whisper"
+READ_BLOCK = 1024 * 1024
+
+
+class DownloadError(Exception):
+    """所有镜像都无法完成下载"""
+
+
+class ChecksumMismatch(DownloadError):
+    """下载完成但SHA-256不符 (下载的文件已删除)"""
+
+
+def official_url(model_name: str) -> str:
+    """whisper 内置的官方下载地址"""
+    import whisper
+
+    if model_name not in whisper._MODELS:
+        raise ValueError(f"未知模型: {model_name} (可选: {', '.join(whisper._MODELS)})")
+    return whisper._MODELS[model_name]
+
+
+def expected_sha256(url: str) -> Optional[str]:
+    """官方地址形如 .../models/<sha256>/<name>.pt，从中取出期望摘要"""
+    parts = url.rstrip("/").split("/")
+    digest = parts[-2] if len(parts) >= 2 else ""
+    return digest if re.fullmatch(r"[0-9a-f]{64}", digest) else None
+
+
+def mirror_urls(model_name: str, mirrors: Iterable[str] = ()) -> List[str]:
+    """镜像地址模板展开为下载地址 (占位符 {name}、{sha256}、{file})，官方地址排在最后"""
+    official = official_url(model_name)
+    fields = {"name": model_name, "sha256": expected_sha256(official) or "", "file": f"{model_name}.pt"}
+    return list(dict.fromkeys([mirror.format(**fields) for mirror in mirrors] + [official]))
+
+
+def file_sha256(path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_BLOCK), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+@dataclass
+class RemoteFile:
+    """镜像上的文件信息"""
+    url: str
+    size: int
+    ranges: bool                  # 是否支持 Range 分块
+    validator: Optional[str]      # ETag 或 Last-Modified，没有期望摘要时用于判断续传的是否为同一文件
+
+
+class StreamingSHA256:
+    """按块顺序增量计算摘要: 从头开始连续完成的块立即读入哈希，与后续块的下载重叠进行"""
+
+    def __init__(self, path: Path, chunk_size: int, size: int):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.size = size
+        self.next_chunk = 0
+        self._hasher = hashlib.sha256()
+
+    def advance(self, done: Set[int]) -> None:
+        if self.next_chunk not in done:
+            return
+        with open(self.path, "rb") as f:
+            while self.next_chunk in done:
+                offset = self.next_chunk * self.chunk_size
+                remaining = min(self.chunk_size, self.size - offset)
+                f.seek(offset)
+                while remaining > 0:
+                    block = f.read(min(READ_BLOCK, remaining))
+                    if not block:
+                        raise DownloadError(f"分块 {self.next_chunk} 数据不完整")
+                    self._hasher.update(block)
+                    remaining -= len(block)
+                self.next_chunk += 1
+
+    def hexdigest(self) -> str:
+        return self._hasher.hexdigest()
+
+
+class ModelDownloader:
+    """把一个文件从若干镜像下载到 target
+
+    progress(done_bytes, total_bytes) 在每块完成时调用。
+    """
+
+    def __init__(self, urls: Iterable[str], target, sha256: Optional[str] = None, workers: int = 4,
+                 chunk_size: int = 16 * 1024 * 1024, timeout: float = 30, retries: int = 3,
+                 progress: Optional[Callable[[int, int], None]] = None):
+        self.urls = list(dict.fromkeys(urls))
+        if not self.urls:
+            raise ValueError("至少需要一个下载地址")
+        self.target = Path(target).expanduser()
+        self.part = self.target.with_name(self.target.name + ".part")
+        self.state_file = self.target.with_name(self.target.name + ".part.json")
+        self.sha256 = sha256.lower() if sha256 else None
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.retries = max(1, retries)
+        self.progress = progress
+        self.stats = {"size": 0, "resumed_bytes": 0, "downloaded_bytes": 0, "seconds": 0.0, "sha256": None}
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+
+    def _session(self) -> requests.Session:
+        # 每个下载线程一个连接池
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    # ---- 探测镜像 ----
+
+    def probe(self, url: str) -> RemoteFile:
+        """请求第一个字节，得到文件大小以及是否支持 Range"""
+        with self._session().get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+            if response.status_code == 206:
+                match = re.fullmatch(r"bytes 0-0/(\d+)", response.headers.get("Content-Range", ""))
+                if match:
+                    return RemoteFile(url, int(match.group(1)), True, validator)
+            return RemoteFile(url, int(response.headers.get("Content-Length", 0)), False, validator)
+
+    def _probe_mirrors(self) -> List[RemoteFile]:
+        """可用的镜像 (大小与第一个可用镜像一致)，支持 Range 的排在前面"""
+        remotes, errors = [], []
+        for url in self.urls:
+            try:
+                remote = self.probe(url)
+            except requests.RequestException as e:
+                errors.append(f"{url}: {e}")
+                continue
+            if remotes and remote.size != remotes[0].size:
+                errors.append(f"{url}: 文件大小 {remote.size} 与其它镜像 ({remotes[0].size}) 不一致")
+                continue
+            remotes.append(remote)
+        if not remotes:
+            raise DownloadError("没有可用的镜像: " + "; ".join(errors))
+        for error in errors:
+            print(f"⚠️ 跳过镜像 {error}")
+        return sorted(remotes, key=lambda r: not r.ranges)
+
+    # ---- 续传状态 ----
+
+    def _load_state(self, remote: RemoteFile) -> Set[int]:
+        """读取上次中断时已完成的块；文件或参数不一致时从头开始"""
+        try:
+            with open(self.state_file, encoding="utf-8") as f:
+                state = json.load(f)
+            same_file = (state["size"] == remote.size and state["chunk_size"] == self.chunk_size
+                         and state["sha256"] == self.sha256
+                         and (self.sha256 or state["validator"] == remote.validator)
+                         and self.part.stat().st_size == remote.size)
+            if same_file:
+                return set(state["done"])
+        except (OSError, ValueError, KeyError):
+            pass
+        with open(self.part, "wb") as f:
+            f.truncate(remote.size)
+        return set()
+
+    def _save_state(self, remote: RemoteFile, done: Set[int]) -> None:
+        tmp = self.state_file.with_name(self.state_file.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"size": remote.size, "chunk_size": self.chunk_size, "sha256": self.sha256,
+                       "validator": remote.validator, "done": sorted(done)}, f)
+        os.replace(tmp, self.state_file)
+
+    # ---- 下载 ----
+
+    def _count(self, nbytes: int) -> None:
+        with self._stats_lock:
+            self.stats["downloaded_bytes"] += nbytes
+
+    def _fetch_chunk(self, index: int, size: int, mirrors: List[str]) -> None:
+        """下载一块并写入 .part 的对应位置；从第 index 个镜像开始轮换重试"""
+        start = index * self.chunk_size
+        end = min(size, start + self.chunk_size) - 1
+        last_error = None
+        for attempt in range(self.retries):
+            url = mirrors[(index + attempt) % len(mirrors)]
+            try:
+                with self._session().get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True,
+                                         timeout=self.timeout) as response:
+                    if (response.status_code != 206
+                            or not response.headers.get("Content-Range", "").startswith(f"bytes {start}-{end}/")):
+                        raise DownloadError(f"未按请求返回分块 (HTTP {response.status_code})")
+                    written = 0
+                    with open(self.part, "r+b") as f:
+                        f.seek(start)
+                        for block in response.iter_content(READ_BLOCK):
+                            f.write(block)
+                            written += len(block)
+                    self._count(written)
+                    if written != end - start + 1:
+                        raise DownloadError(f"分块不完整 ({written}/{end - start + 1} 字节)")
+                return
+            except (requests.RequestException, DownloadError) as e:
+                last_error = f"{url}: {e}"
+        raise DownloadError(f"分块 {index} 下载失败: {last_error}")
+
+    def _download_chunks(self, remote: RemoteFile, mirrors: List[str]) -> str:
+        done = self._load_state(remote)
+        chunks = (remote.size + self.chunk_size - 1) // self.chunk_size
+        self.stats["resumed_bytes"] = sum(min(self.chunk_size, remote.size - i * self.chunk_size) for i in done)
+        if done:
+            print(f"♻️ 续传: 已有 {len(done)}/{chunks} 块 ({self.stats['resumed_bytes'] / 1024**2:.1f} MB)")
+        verifier = StreamingSHA256(self.part, self.chunk_size, remote.size)
+        verifier.advance(done)
+
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="download")
+        futures = {pool.submit(self._fetch_chunk, i, remote.size, mirrors): i
+                   for i in range(chunks) if i not in done}
+        failure = None
+        try:
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except CancelledError:
+                    continue
+                except DownloadError as e:
+                    if failure is None:
+                        failure = e
+                        for other in futures:
+                            other.cancel()
+                    continue
+                done.add(futures[future])
+                self._save_state(remote, done)
+                if failure is None:
+                    verifier.advance(done)
+                    if self.progress:
+                        self.progress(min(len(done) * self.chunk_size, remote.size), remote.size)
+        except BaseException:
+            for other in futures:
+                other.cancel()
+            raise
+        finally:
+            pool.shutdown(wait=True)
+        if failure is not None:
+            raise failure
+        verifier.advance(done)
+        return verifier.hexdigest()
+
+    def _download_whole(self, remote: RemoteFile) -> str:
+        """镜像不支持 Range: 单线程整体下载，边写边算摘要"""
+        last_error = None
+        for attempt in range(self.retries):
+            hasher, written = hashlib.sha256(), 0
+            try:
+                with self._session().get(remote.url, stream=True, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    with open(self.part, "wb") as f:
+                        for block in response.iter_content(READ_BLOCK):
+                            f.write(block)
+                            hasher.update(block)
+                            written += len(block)
+                            if self.progress:
+                                self.progress(written, remote.size)
+                self._count(written)
+                if remote.size and written != remote.size:
+                    raise DownloadError(f"下载不完整 ({written}/{remote.size} 字节)")
+                return hasher.hexdigest()
+            except (requests.RequestException, DownloadError) as e:
+                last_error = e
+        raise DownloadError(f"下载失败: {last_error}")
+
+    def download(self) -> Path:
+        """下载、校验并原子移动到 target - 返回 target；失败时保留已完成的块供下次续传 (校验失败除外)"""
+        start = time.perf_counter()
+        self.target.parent.mkdir(parents=True, exist_ok=True)
+        remotes = self._probe_mirrors()
+        remote = remotes[0]
+        self.stats["size"] = remote.size
+        if remote.ranges and remote.size > 0:
+            digest = self._download_chunks(remote, [r.url for r in remotes if r.ranges])
+        else:
+            digest = self._download_whole(remote)
+        self.stats["seconds"] = round(time.perf_counter() - start, 3)
+        self.stats["sha256"] = digest
+
+        if self.sha256 and digest != self.sha256:
+            self._discard()
+            raise ChecksumMismatch(f"SHA-256不符: 期望 {self.sha256}，实际 {digest}")
+        with open(self.part, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(self.part, self.target)
+        self.state_file.unlink(missing_ok=True)
+        return self.target
+
+    def _discard(self) -> None:
+        self.part.unlink(missing_ok=True)
+        self.state_file.unlink(missing_ok=True)
+
+
+def convert_for_serving(path: Path) -> Optional[Path]:
+    """转换为safetensors格式，服务启动时可内存映射快速加载 - 未安装safetensors或转换失败时返回None"""
+    try:
+        from convert_whisper_weights import convert_checkpoint
+    except ImportError:
+        print("💡 未安装safetensors，跳过格式转换 (pip install safetensors 后可运行 convert_whisper_weights.py)")
+        return None
+    print("🔄 转换为内存映射格式 (safetensors)...")
+    try:
+        target = convert_checkpoint(path)
+    except Exception as e:
+        print(f"⚠️ 格式转换失败，服务将使用原始.pt文件加载: {e}")
+        return None
+    print(f"✅ 已生成快速加载权重: {target}")
+    return target
+
+
+def print_progress(start: float) -> Callable[[int, int], None]:
+    def report(done: int, total: int) -> None:
+        speed = done / max(time.perf_counter() - start, 1e-6) / 1024**2
+        percent = done / total * 100 if total else 0
+        print(f"\r📥 {done / 1024**2:8.1f} / {total / 1024**2:.1f} MB ({percent:5.1f}%)  {speed:6.1f} MB/s",
+              end="", flush=True)
+    return report
+
+
+def download_model(model_name: str, cache_dir=WHISPER_CACHE, mirrors: Iterable[str] = (), workers: int = 4,
+                   chunk_mb: float = 16, convert: bool = True, progress=None) -> Path:
+    """下载官方Whisper模型到 cache_dir/<模型名>.pt (已存在且校验通过时跳过)，并转换为服务使用的格式"""
+    urls = mirror_urls(model_name, mirrors)
+    sha256 = expected_sha256(urls[-1])
+    target = Path(cache_dir).expanduser() / f"{model_name}.pt"
+    if target.exists() and sha256 and file_sha256(target) == sha256:
+        print(f"✅ 模型已存在且校验通过: {target}")
+    else:
+        downloader = ModelDownloader(urls, target, sha256, workers=workers,
+                                     chunk_size=int(chunk_mb * 1024 * 1024), progress=progress)
+        downloader.download()
+        stats = downloader.stats
+        print(f"\n✅ 已下载 {target} ({stats['size'] / 1024**3:.2f} GB，本次下载 "
+              f"{stats['downloaded_bytes'] / 1024**2:.1f} MB，耗时 {stats['seconds']:.1f}s，SHA-256校验通过)")
+    if convert:
+        convert_for_serving(target)
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Whisper模型下载 (断点续传、并行分块、SHA-256校验)")
+    parser.add_argument("model", nargs="?", help="官方模型名 (如 large-v3-turbo)")
+    parser.add_argument("--mirror", action="append", default=None,
+                        help="镜像地址模板，可重复；占位符 {name} {sha256} {file} (默认 WHISPER_DOWNLOAD_MIRRORS)")
+    parser.add_argument("--workers", type=int, default=Config.WHISPER_DOWNLOAD_WORKERS, help="并行下载线程数")
+    parser.add_argument("--chunk-mb", type=float, default=Config.WHISPER_DOWNLOAD_CHUNK_MB, help="分块大小 (MB)")
+    parser.add_argument("--cache-dir", default=str(WHISPER_CACHE), help="模型目录")
+    parser.add_argument("--no-convert", action="store_true", help="下载后不转换为safetensors")
+    parser.add_argument("--url", action="append", help="直接下载指定地址 (可重复作为镜像)，需配合 --output")
+    parser.add_argument("--sha256", help="期望的SHA-256 (--url 时使用)")
+    parser.add_argument("--output", help="--url 时的保存路径")
+    args = parser.parse_args()
+    mirrors = args.mirror if args.mirror is not None else Config.WHISPER_DOWNLOAD_MIRRORS
+    progress = print_progress(time.perf_counter())
+
+    try:
+        if args.url:
+            if not args.output:
+                parser.error("--url 需要配合 --output")
+            downloader = ModelDownloader(args.url, args.output, args.sha256, workers=args.workers,
+                                         chunk_size=int(args.chunk_mb * 1024 * 1024), progress=progress)
+            target = downloader.download()
+            print(f"\n✅ 已下载 {target} (SHA-256 {downloader.stats['sha256']})")
+            if not args.no_convert and target.suffix == ".pt":
+                convert_for_serving(target)
+        elif args.model:
+            download_model(args.model, args.cache_dir, mirrors, args.workers, args.chunk_mb,
+                           convert=not args.no_convert, progress=progress)
+        else:
+            parser.error("需要模型名或 --url")
+    except (DownloadError, ValueError) as e:
+        print(f"\n❌ {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\n⏸️ 已中断，再次运行同样的命令即可续传")
+        sys.exit(130)
+
+
+if __name__ == "__main__":
+    main()
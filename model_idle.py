@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+模型空闲卸载
+- 连续N分钟没有请求时把Whisper权重移出(GPU→CPU内存，或释放后改由mmap文件按需映射)
+- 下一次请求到来时快速重新加载，加载耗时记入指标
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class IdleOffloadManager:
+    """空闲超时后卸载模型，使用前自动唤醒
+
+    offload() 返回是否真的卸载成功；reload() 负责恢复模型。
+    两者都在锁内调用，调用时保证没有请求正在使用模型。
+    """
+
+    def __init__(self, timeout_seconds: float, target: str,
+                 offload: Callable[[], bool], reload: Callable[[], None]):
+        self.timeout_seconds = timeout_seconds
+        self.target = target
+        self._offload = offload
+        self._reload = reload
+        self._lock = threading.Lock()
+        self._active = 0
+        self.last_used = time.monotonic()
+        self.offloaded = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    @contextmanager
+    def in_use(self):
+        """请求使用模型期间持有，卸载状态下先唤醒"""
+        with self._lock:
+            if self.offloaded:
+                logger.info(f"⏰ 模型已空闲卸载({self.target})，重新加载...")
+                start = time.perf_counter()
+                self._reload()
+                seconds = time.perf_counter() - start
+                self.offloaded = False
+                metrics.incr("idle_wakeups")
+                metrics.observe("idle_wake_load", seconds)
+                logger.info(f"✅ 模型唤醒完成，耗时 {seconds:.2f}s")
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+                self.last_used = time.monotonic()
+
+    def check(self) -> bool:
+        """空闲超时则卸载模型，返回本次是否执行了卸载"""
+        with self._lock:
+            idle = time.monotonic() - self.last_used
+            if self.offloaded or self._active or idle < self.timeout_seconds:
+                return False
+            start = time.perf_counter()
+            if not self._offload():
+                # 无法卸载(如缺少mmap文件)时推迟到下一个周期再试
+                self.last_used = time.monotonic()
+                return False
+            self.offloaded = True
+            metrics.incr("idle_offloads")
+            metrics.observe("idle_offload", time.perf_counter() - start)
+            logger.info(f"💤 模型已空闲 {idle / 60:.1f} 分钟，已卸载到 {self.target}")
+            return True
+
+    def start(self) -> None:
+        """启动后台检查线程"""
+        interval = max(1.0, min(60.0, self.timeout_seconds / 4))
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.check()
+                except Exception as e:
+                    logger.error(f"空闲卸载检查失败: {e}")
+
+        self._thread = threading.Thread(target=loop, name="idle-offload", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "offloaded": self.offloaded,
+                "target": self.target,
+                "idle_seconds": round(time.monotonic() - self.last_used, 1),
+                "timeout_seconds": self.timeout_seconds,
+            }
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+多进程预加载(pre-fork)部署模式
+- 主进程先加载Whisper模型，再fork出多个uvicorn worker
+- 模型权重只读，各worker通过写时复制(copy-on-write)共享同一份物理内存
+- 每个worker各自持有解码状态(KV cache等)，互不干扰
+- 仅适用于CPU推理，CUDA上下文无法跨fork使用
+- worker异常退出时重新fork；启动即崩溃的worker按指数退避重启，避免反复fork占满CPU
+"""
+
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def process_memory_report(pid: Optional[int] = None) -> dict:
+    """进程内存统计(MB) - 区分共享与私有内存
+
+    rss: 驻留内存(含共享页)；pss: 按共享进程数均摊后的内存；
+    private: 该进程独占的内存，即每个worker的额外开销。
+    """
+    path = f"/proc/{pid or 'self'}/smaps_rollup"
+    try:
+        fields = {}
+        with open(path, "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])  # kB
+        return {
+            "rss_mb": round(fields.get("Rss", 0) / 1024, 1),
+            "pss_mb": round(fields.get("Pss", 0) / 1024, 1),
+            "shared_mb": round((fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)) / 1024, 1),
+            "private_mb": round((fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)) / 1024, 1),
+        }
+    except (FileNotFoundError, PermissionError):
+        pass
+
+    # 非Linux平台退回psutil (uss即私有内存)
+    try:
+        import psutil
+        info = psutil.Process(pid).memory_full_info()
+        uss = getattr(info, "uss", 0)
+        return {
+            "rss_mb": round(info.rss / 1024**2, 1),
+            "pss_mb": round(getattr(info, "pss", uss) / 1024**2, 1),
+            "shared_mb": round((info.rss - uss) / 1024**2, 1),
+            "private_mb": round(uss / 1024**2, 1),
+        }
+    except Exception:
+        return {}
+
+
+def format_memory_report(report: dict) -> str:
+    """格式化内存统计用于日志"""
+    if not report:
+        return "不可用"
+    return (f"RSS {report['rss_mb']}MB, 共享 {report['shared_mb']}MB, "
+            f"私有 {report['private_mb']}MB, PSS {report['pss_mb']}MB")
+
+
+def _bind_socket(host: str, port: int) -> socket.socket:
+    """在主进程中绑定监听端口，所有worker共享同一个socket"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+class RestartBackoff:
+    """worker重启退避: 启动后 min_uptime 秒内退出视为启动失败，连续失败时重启等待从 base 秒起翻倍，
+    最长 max_delay 秒；运行超过 min_uptime 后退出的worker立即重启并清零失败次数"""
+
+    def __init__(self, base: float = 0.5, max_delay: float = 30.0, min_uptime: float = 10.0):
+        self.base = base
+        self.max_delay = max_delay
+        self.min_uptime = min_uptime
+        self.failures: Dict[int, int] = {}
+
+    def delay(self, index: int, uptime: float) -> float:
+        """第 index 个worker运行 uptime 秒后退出 - 返回重启前应等待的秒数"""
+        if uptime >= self.min_uptime:
+            self.failures[index] = 0
+            return 0.0
+        self.failures[index] = self.failures.get(index, 0) + 1
+        return min(self.max_delay, self.base * 2 ** (self.failures[index] - 1))
+
+
+def _wait_child(timeout: Optional[float]) -> Optional[Tuple[int, int]]:
+    """等待任一子进程退出 - 返回(pid, status)；timeout 秒内没有子进程退出时返回None"""
+    if timeout is None:
+        return os.wait()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid, status = 0, 0  # 暂时没有子进程 (都在等待重启)
+        if pid:
+            return pid, status
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(0.1, remaining))
+
+
+def _run_worker(app, sock: socket.socket, threads: int, cpus: Optional[List[int]] = None) -> None:
+    """worker进程入口 (cpus 不为空时绑定到这些CPU)"""
+    import torch
+    import uvicorn
+
+    # 主进程收到的信号由主进程统一转发，worker恢复默认处理
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(threads)
+    config = uvicorn.Config(app, log_level="info")
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def serve_prefork(app, host: str, port: int, workers: int,
+                  preload: Callable[[], None], threads_per_worker: Optional[int] = None,
+                  worker_cpus: Optional[List[List[int]]] = None) -> None:
+    """预加载模型后fork多个worker提供服务 (worker_cpus[i] 为第i个worker绑定的CPU)"""
+    import torch
+    import uvicorn
+
+    if not hasattr(os, "fork"):
+        logger.warning("⚠️ 当前平台不支持fork，退回单进程模式")
+        uvicorn.run(app, host=host, port=port)
+        return
+
+    if torch.cuda.is_available():
+        logger.warning("⚠️ CUDA上下文无法跨fork共享，GPU模式下退回单进程")
+        uvicorn.run(app, host=host, port=port)
+        return
+
+    cpu_count = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    threads = threads_per_worker or max(1, cpu_count // workers)
+
+    # 主进程只用单线程加载，避免OpenMP线程池在fork前被初始化
+    torch.set_num_threads(1)
+    load_start = time.perf_counter()
+    preload()
+    logger.info(f"📦 主进程模型加载完成，耗时 {time.perf_counter() - load_start:.1f}s")
+    logger.info(f"📊 主进程内存: {format_memory_report(process_memory_report())}")
+
+    # 把已加载对象移入永久代，避免worker中的GC遍历改写对象头导致共享页被复制
+    gc.collect()
+    gc.freeze()
+
+    sock = _bind_socket(host, port)
+    logger.info(f"🚀 启动 {workers} 个worker，每个worker {threads} 个推理线程，监听 {host}:{port}")
+
+    children = {}    # pid -> (worker序号, 启动时间)
+    pending = {}     # worker序号 -> 计划重启的时间
+    backoff = RestartBackoff()
+    shutting_down = False
+
+    def spawn(index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(app, sock, threads, worker_cpus[index] if worker_cpus else None)
+            finally:
+                os._exit(0)
+        children[pid] = (index, time.monotonic())
+
+    def shutdown(signum, frame):
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    for i in range(workers):
+        spawn(i)
+
+    # 监控worker，异常退出时重新fork (新worker依然共享主进程的权重)；启动即崩溃的worker按退避间隔重启
+    while children or (pending and not shutting_down):
+        if shutting_down:
+            pending.clear()
+        for index, at in list(pending.items()):
+            if at <= time.monotonic():
+                del pending[index]
+                spawn(index)
+        timeout = max(0.0, min(pending.values()) - time.monotonic()) if pending else None
+        try:
+            reaped = _wait_child(timeout)
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        if reaped is None:
+            continue
+        pid, status = reaped
+        child = children.pop(pid, None)
+        if child is None or shutting_down:
+            continue
+        index, started = child
+        delay = backoff.delay(index, time.monotonic() - started)
+        if delay:
+            logger.warning(f"⚠️ worker {pid} 启动后很快退出 (status={status})，{delay:g}秒后重新启动")
+        else:
+            logger.warning(f"⚠️ worker {pid} 异常退出 (status={status})，重新启动")
+        pending[index] = time.monotonic() + delay
+
+    sock.close()
+    logger.info("🛑 所有worker已退出")
+    sys.exit(0)
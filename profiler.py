@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+线上按需性能剖析
+- 采样剖析: 后台线程定时读取所有线程的Python调用栈，输出折叠栈格式
+  (flamegraph.pl、speedscope、inferno 均可直接读取)
+- torch算子剖析: 剖析窗口内的推理包在 torch.profiler 中，汇总各算子的耗时；
+  torch.profiler 不能并发运行，推理重叠时只剖析其中一次，其余计为跳过
+- 内存分配: 临时开启 tracemalloc，对比窗口前后的快照，列出分配最多的代码位置
+- 未在剖析时不启动任何线程、不开启tracemalloc；推理路径上只有一次全局变量检查
+"""
+
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+_torch_session: Optional["TorchOpProfile"] = None
+
+# 栈顶为这些函数的采样是空闲等待 (线程池、事件循环)，热点汇总中不计入
+IDLE_FRAMES = ("threading:wait:", "threading:_wait_for_tstate_lock:", "selectors:select:", "queue:get:",
+               "concurrent.futures.thread:_worker:")
+
+
+class ProfilerBusy(RuntimeError):
+    """已有剖析在进行中"""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{code.co_name}:{frame.f_lineno}"
+
+
+class SamplingProfiler:
+    """定时采样所有线程的调用栈，按 "线程;外层;...;内层" 计数"""
+
+    def __init__(self, interval: float = 0.01, max_depth: int = 128):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        start = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+        self.elapsed = time.perf_counter() - start
+
+    def folded(self) -> str:
+        """折叠栈文本，每行 "栈 次数"，按次数降序"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = 20) -> dict:
+        """各函数的自身采样数 (栈顶) 和包含采样数，不含空闲等待"""
+        own, total = Counter(), Counter()
+        idle = 0
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            if frames[-1].startswith(IDLE_FRAMES):
+                idle += count
+                continue
+            own[frames[-1]] += count
+            for frame in set(frames[1:]):
+                total[frame] += count
+        return {
+            "samples": self.samples,
+            "seconds": round(self.elapsed, 3),
+            "interval_ms": self.interval * 1000,
+            "idle_samples": idle,
+            "self": [{"frame": frame, "samples": count} for frame, count in own.most_common(top)],
+            "inclusive": [{"frame": frame, "samples": count} for frame, count in total.most_common(top)],
+        }
+
+
+class TorchOpProfile:
+    """汇总剖析窗口内开始的推理的torch算子耗时 (torch.profiler按线程记录，需在推理线程中开启)
+
+    torch.profiler 同一时间只能有一个在运行，并发开启会互相打断；因此同一时刻只剖析一次推理，
+    与之重叠的推理照常执行但不记录，计入 skipped。
+    """
+
+    def __init__(self):
+        self.ops: Dict[str, dict] = {}
+        self.calls = 0
+        self.skipped = 0
+        self.in_flight = 0
+        self._done = threading.Condition()
+        self._profiling = threading.Lock()
+
+    @contextmanager
+    def record(self):
+        import torch
+
+        if not self._profiling.acquire(blocking=False):
+            with self._done:
+                self.skipped += 1
+            yield
+            return
+        with self._done:
+            self.in_flight += 1
+        try:
+            with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU]) as prof:
+                yield
+            events = prof.key_averages()
+            with self._done:
+                self.calls += 1
+                for event in events:
+                    op = self.ops.setdefault(event.key, {"count": 0, "self_cpu_ms": 0.0, "cpu_total_ms": 0.0})
+                    op["count"] += event.count
+                    op["self_cpu_ms"] += event.self_cpu_time_total / 1000
+                    op["cpu_total_ms"] += event.cpu_time_total / 1000
+        finally:
+            self._profiling.release()
+            with self._done:
+                self.in_flight -= 1
+                self._done.notify_all()
+
+    def wait(self, timeout: float) -> bool:
+        """等待窗口内开始的推理结束 (跨过窗口结束的推理也完整计入)，超时返回False"""
+        with self._done:
+            return self._done.wait_for(lambda: self.in_flight == 0, timeout)
+
+    def top(self, limit: int = 30) -> List[dict]:
+        with self._done:
+            ranked = sorted(self.ops.items(), key=lambda item: item[1]["self_cpu_ms"], reverse=True)[:limit]
+        return [{"op": name, "count": op["count"], "self_cpu_ms": round(op["self_cpu_ms"], 3),
+                 "cpu_total_ms": round(op["cpu_total_ms"], 3)} for name, op in ranked]
+
+
+def torch_profile_scope():
+    """推理调用处使用: 剖析窗口内记录torch算子，否则什么也不做"""
+    session = _torch_session
+    return session.record() if session is not None else nullcontext()
+
+
+_lock = threading.Lock()
+
+
+@contextmanager
+def profiling_session(interval: float, with_torch: bool = False):
+    """一次剖析窗口 (同一时间只允许一个) - 产出 (采样器, torch算子汇总或None)"""
+    global _torch_session
+    if not _lock.acquire(blocking=False):
+        raise ProfilerBusy("已有剖析在进行中")
+    sampler = SamplingProfiler(interval)
+    torch_ops = TorchOpProfile() if with_torch else None
+    try:
+        _torch_session = torch_ops
+        sampler.start()
+        yield sampler, torch_ops
+    finally:
+        sampler.stop()
+        _torch_session = None
+        _lock.release()
+
+
+@contextmanager
+def tracemalloc_session(frames: int = 1):
+    """临时开启tracemalloc (已由其他方式开启时沿用，结束时不关闭) - 产出起始快照"""
+    if not _lock.acquire(blocking=False):
+        raise ProfilerBusy("已有剖析在进行中")
+    started = not tracemalloc.is_tracing()
+    try:
+        if started:
+            tracemalloc.start(frames)
+        yield tracemalloc.take_snapshot()
+    finally:
+        if started:
+            tracemalloc.stop()
+        _lock.release()
+
+
+def top_allocations(before, after, group_by: str = "lineno", top: int = 20) -> dict:
+    """窗口内净增最多的分配位置，以及当前占用最多的位置"""
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")]
+    before, after = before.filter_traces(ignore), after.filter_traces(ignore)
+
+    def location(traceback) -> str:
+        return " <- ".join(f"{frame.filename}:{frame.lineno}" for frame in traceback)
+
+    growth = [
+        {"location": location(stat.traceback), "size_diff_kb": round(stat.size_diff / 1024, 1),
+         "count_diff": stat.count_diff, "size_kb": round(stat.size / 1024, 1)}
+        for stat in after.compare_to(before, group_by)[:top]
+    ]
+    current = [
+        {"location": location(stat.traceback), "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+        for stat in after.statistics(group_by)[:top]
+    ]
+    traced, peak = tracemalloc.get_traced_memory()
+    return {
+        "traced_kb": round(traced / 1024, 1),
+        "peak_kb": round(peak / 1024, 1),
+        "growth": growth,
+        "current": current,
+    }
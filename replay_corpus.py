@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+离线回放与回归测试
+- 把录音语料逐条送入与服务相同的流水线 (解码 → 识别引擎转录 → 文本纠错 → 指令识别)，多进程并行
+- 统计字错率(CER)、意图准确率、各阶段耗时和实时率(RTF)
+- 结果可保存为基线，之后修改 preprocess_chinese_text、COMMAND_PATTERNS 或解码参数时与基线对比
+- stub模式不加载模型，直接使用语料中记录的原始转录，只测试纠错和指令识别，秒级完成
+
+语料目录下放音频文件和 manifest.jsonl，每行一条:
+  {"audio": "open_notepad.webm", "text": "打开记事本", "intent": {"type": "应用程序", "target": "记事本"}}
+  - intent 为 null 或缺省表示非指令 (应走AI对话路径)
+  - asr_text (可选) 为录制时Whisper的原始输出，stub模式使用；缺省时使用 text
+  - language (可选) 为指令识别使用的语言，默认 zh
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+MANIFEST = "manifest.jsonl"
+STAGES = ("decode_ms", "transcribe_ms", "language_id_ms", "detect_ms")
+
+# 计算字错率前去掉标点和空白，只比较文字本身
+_IGNORED = re.compile(r"[\s\.,!?;:'\"，。！？；：、“”‘’（）()《》…\-]+")
+
+_server = None
+
+
+def normalize(text: str) -> str:
+    return _IGNORED.sub("", text).lower()
+
+
+def edit_distance(ref: str, hyp: str) -> int:
+    """字符级编辑距离 (替换、插入、删除各计1)"""
+    if len(ref) < len(hyp):
+        ref, hyp = hyp, ref
+    previous = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        current = [i]
+        for j, h in enumerate(hyp, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != h)))
+        previous = current
+    return previous[-1]
+
+
+def load_manifest(corpus: Path) -> List[dict]:
+    entries = []
+    with open(corpus / MANIFEST, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line)
+            entry.setdefault("id", entry.get("audio") or f"line{line_no}")
+            entries.append(entry)
+    return entries
+
+
+def _init_worker(mode: str, model: Optional[str], threads: int) -> None:
+    """worker进程初始化: full模式加载一次模型，之后每条语料直接复用"""
+    global _server
+    if mode != "full":
+        return
+    import logging
+    import torch
+
+    torch.set_num_threads(threads)
+    import voice_api_server as server
+    logging.getLogger().setLevel(logging.WARNING)
+    if model and server.Config.ASR_ENGINE == server.WhisperEngine.name:
+        import whisper
+        from convert_whisper_weights import load_mmap_model, mmap_weights_path
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        mmap_path = mmap_weights_path(model)
+        server.whisper_model = (load_mmap_model(mmap_path, device=device) if mmap_path.exists()
+                                else whisper.load_model(model, device=device))
+        server.prepare_whisper_model(server.whisper_model)
+        server.whisper_model_name, server.whisper_device = model, device
+        server.asr_engine = server.whisper_engine
+    else:
+        server.load_asr_engine()
+    _server = server
+
+
+def _transcribe(path: Path) -> Tuple[str, float, dict]:
+    """full模式: 与服务相同的解码和转录 - 返回(原始文本, 音频秒数, 耗时)"""
+    from audio_decoder import SAMPLE_RATE, decode_audio_stream
+
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        audio, _ = decode_audio_stream(f)
+    decode_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    result = _server.run_transcription(audio)
+    transcribe_seconds = time.perf_counter() - start
+    timings = {
+        "decode_ms": decode_seconds * 1000,
+        "transcribe_ms": transcribe_seconds * 1000,
+        "language_id_ms": result["language_id"].get("ms", 0.0),
+    }
+    return result["text"].strip(), len(audio) / SAMPLE_RATE, timings
+
+
+def replay_entry(entry: dict, corpus: str, mode: str) -> dict:
+    """回放一条语料，返回识别结果、误差和耗时"""
+    from command_detection import preprocess_chinese_text, smart_command_detection
+
+    language = entry.get("language", "zh")
+    if mode == "full":
+        raw, audio_seconds, timings = _transcribe(Path(corpus) / entry["audio"])
+    else:
+        raw, audio_seconds, timings = entry.get("asr_text", entry["text"]), entry.get("audio_seconds"), {}
+
+    start = time.perf_counter()
+    hypothesis = preprocess_chinese_text(raw)
+    is_command, cmd_type, target = smart_command_detection(hypothesis, language)
+    timings["detect_ms"] = (time.perf_counter() - start) * 1000
+
+    reference = normalize(entry["text"])
+    expected = entry.get("intent") or None
+    predicted = {"type": cmd_type, "target": target} if is_command else None
+    return {
+        "id": entry["id"],
+        "text": entry["text"],
+        "raw": raw,
+        "hypothesis": hypothesis,
+        "ref_chars": len(reference),
+        "edits_raw": edit_distance(reference, normalize(raw)),
+        "edits": edit_distance(reference, normalize(hypothesis)),
+        "intent_expected": expected,
+        "intent_predicted": predicted,
+        "intent_correct": predicted == ({"type": expected["type"], "target": expected["target"]}
+                                        if expected else None),
+        "audio_seconds": audio_seconds,
+        "timings": {name: round(ms, 3) for name, ms in timings.items()},
+    }
+
+
+def _replay_star(args) -> dict:
+    return replay_entry(*args)
+
+
+def run_corpus(corpus: Path, entries: List[dict], mode: str = "stub", workers: int = 1,
+               model: Optional[str] = None) -> List[dict]:
+    """多进程回放全部语料，结果顺序与manifest一致"""
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    tasks = [(entry, str(corpus), mode) for entry in entries]
+    if workers <= 1:
+        _init_worker(mode, model, threads)
+        return [_replay_star(task) for task in tasks]
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(mode, model, threads)) as pool:
+        return pool.map(_replay_star, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def summarize(results: List[dict]) -> dict:
+    ref_chars = sum(r["ref_chars"] for r in results) or 1
+    summary = {
+        "items": len(results),
+        "cer": round(sum(r["edits"] for r in results) / ref_chars, 4),
+        "cer_raw": round(sum(r["edits_raw"] for r in results) / ref_chars, 4),
+        "intent_accuracy": round(sum(r["intent_correct"] for r in results) / max(1, len(results)), 4),
+        # 非指令被识别成指令会误执行操作；指令没识别出来会落到较慢的AI对话路径
+        "false_commands": sum(1 for r in results if r["intent_predicted"] and not r["intent_expected"]),
+        "missed_commands": sum(1 for r in results if r["intent_expected"] and not r["intent_predicted"]),
+        "stages": {},
+    }
+    for stage in STAGES:
+        values = [r["timings"][stage] for r in results if stage in r["timings"]]
+        if values:
+            summary["stages"][stage] = {
+                "avg_ms": round(sum(values) / len(values), 3),
+                "p50_ms": round(_percentile(values, 0.5), 3),
+                "p95_ms": round(_percentile(values, 0.95), 3),
+            }
+    timed = [r for r in results if r["audio_seconds"] and "transcribe_ms" in r["timings"]]
+    if timed:
+        audio_seconds = sum(r["audio_seconds"] for r in timed)
+        summary["audio_seconds"] = round(audio_seconds, 2)
+        summary["rtf"] = round(sum(r["timings"]["transcribe_ms"] for r in timed) / 1000 / audio_seconds, 4)
+    return summary
+
+
+def compare(current: dict, baseline: dict, cer_tolerance: float = 0.005) -> dict:
+    """与基线对比 - 返回指标变化、逐条的退步/改进和是否出现准确率退步"""
+    now, before = current["summary"], baseline["summary"]
+    deltas = {}
+    for key in ("cer", "cer_raw", "intent_accuracy", "false_commands", "missed_commands", "rtf"):
+        if key in now and key in before:
+            deltas[key] = (before[key], now[key])
+    for stage, stats in now["stages"].items():
+        if stage in before.get("stages", {}):
+            deltas[f"{stage}.p50"] = (before["stages"][stage]["p50_ms"], stats["p50_ms"])
+
+    previous = {r["id"]: r for r in baseline["results"]}
+    regressions, improvements = [], []
+    for r in current["results"]:
+        old = previous.get(r["id"])
+        if old is None:
+            continue
+        change = {"id": r["id"], "text": r["text"], "before": old["hypothesis"], "after": r["hypothesis"],
+                  "intent_before": old["intent_predicted"], "intent_after": r["intent_predicted"]}
+        if old["intent_correct"] and not r["intent_correct"] or r["edits"] > old["edits"]:
+            regressions.append(change)
+        elif r["intent_correct"] and not old["intent_correct"] or r["edits"] < old["edits"]:
+            improvements.append(change)
+
+    regressed = (now["intent_accuracy"] < before["intent_accuracy"]
+                 or now["cer"] > before["cer"] + cer_tolerance)
+    return {"deltas": deltas, "regressions": regressions, "improvements": improvements, "regressed": regressed}
+
+
+def print_report(summary: dict, mode: str, wall_seconds: float) -> None:
+    print(f"📊 回放结果 ({mode}模式，{summary['items']} 条，耗时 {wall_seconds:.2f}s)")
+    print(f"   字错率: {summary['cer']:.2%} (纠错前 {summary['cer_raw']:.2%})")
+    print(f"   意图准确率: {summary['intent_accuracy']:.2%} "
+          f"(误识别为指令 {summary['false_commands']}，漏识别 {summary['missed_commands']})")
+    if "rtf" in summary:
+        print(f"   实时率(RTF): {summary['rtf']} (音频共 {summary['audio_seconds']}s)")
+    print(f"   {'阶段':<16}{'平均(ms)':>12}{'P50(ms)':>12}{'P95(ms)':>12}")
+    for stage, stats in summary["stages"].items():
+        print(f"   {stage:<16}{stats['avg_ms']:>12}{stats['p50_ms']:>12}{stats['p95_ms']:>12}")
+
+
+def print_diff(diff: dict, limit: int = 20) -> None:
+    print("📈 与基线对比")
+    for key, (before, after) in diff["deltas"].items():
+        mark = "" if before == after else (" ↑" if after > before else " ↓")
+        print(f"   {key:<22}{before!s:>12} → {after!s:<12}{mark}")
+    for title, items in (("❌ 退步", diff["regressions"]), ("✅ 改进", diff["improvements"])):
+        if not items:
+            continue
+        print(f"{title} {len(items)} 条:")
+        for item in items[:limit]:
+            print(f"   [{item['id']}] {item['text']}: {item['before']!r} → {item['after']!r} "
+                  f"(意图 {item['intent_before']} → {item['intent_after']})")
+        if len(items) > limit:
+            print(f"   ... 另有 {len(items) - limit} 条")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线回放录音语料，统计字错率、意图准确率和各阶段耗时")
+    parser.add_argument("corpus", help=f"语料目录 (包含音频文件和 {MANIFEST})")
+    parser.add_argument("--mode", choices=["full", "stub"], default="full",
+                        help="full: 解码并用Whisper转录；stub: 使用语料中记录的转录，只测纠错和指令识别")
+    parser.add_argument("--engine", help="识别引擎 (whisper/faster-whisper/stub)，默认 ASR_ENGINE")
+    parser.add_argument("--model", help="Whisper模型名或路径 (仅whisper引擎)，默认与服务相同的加载顺序")
+    parser.add_argument("--workers", type=int, default=max(1, min(4, os.cpu_count() or 1)), help="并行进程数")
+    parser.add_argument("--output", help="保存本次结果 (JSON)，可作为之后的基线")
+    parser.add_argument("--baseline", help="与之前保存的结果对比")
+    parser.add_argument("--cer-tolerance", type=float, default=0.005, help="字错率上升超过该值视为退步")
+    parser.add_argument("--fail-on-regression", action="store_true", help="准确率退步时以非0状态退出")
+    args = parser.parse_args()
+
+    corpus = Path(args.corpus)
+    if not (corpus / MANIFEST).exists():
+        print(f"❌ 未找到 {corpus / MANIFEST}")
+        sys.exit(1)
+    entries = load_manifest(corpus)
+    if args.engine:
+        # worker进程导入服务时按环境变量选择引擎
+        os.environ["ASR_ENGINE"] = args.engine
+
+    start = time.perf_counter()
+    results = run_corpus(corpus, entries, args.mode, args.workers, args.model)
+    wall_seconds = time.perf_counter() - start
+    current = {"mode": args.mode, "engine": os.getenv("ASR_ENGINE", "whisper"), "model": args.model, "summary": summarize(results), "results": results}
+    print_report(current["summary"], args.mode, wall_seconds)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            diff = compare(current, json.load(f), args.cer_tolerance)
+        print_diff(diff)
+        if diff["regressed"] and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+AI回复缓存
+- 按归一化后的问题缓存大模型回复: 全半角/大小写统一、去掉标点和多余空白 (保留运算符与英文词间空格)、
+  preprocess_chinese_text 纠错
+- 可选近似匹配: 问题表示为字符1/2-gram的哈希向量 (L2归一化)，所有条目存在一个矩阵中，
+  一次矩阵乘法求出与全部缓存问题的余弦相似度，超过阈值且数字与运算符一致即命中
+- 每个条目有过期时间；按总字节数 (回复、问题和向量) 限制内存，超出时淘汰最久未用的条目
+- 含时间、天气、新闻等时效性词语的问题不缓存
+- 统计命中率以及命中时省下的生成耗时
+"""
+
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from command_detection import preprocess_chinese_text
+
+# n-gram哈希向量维度
+VECTOR_DIM = 2048
+# 默认不缓存的时效性问题
+TIME_SENSITIVE_KEYWORDS = ("几点", "时间", "日期", "今天", "明天", "昨天", "星期", "周几", "礼拜",
+                           "天气", "气温", "新闻", "最新", "股价", "汇率", "比分")
+
+
+# 夹在字母数字之间才保留的符号 (3-5、3/5、3.14、10:30、e.g)，句末或单独出现时按标点去掉
+INFIX_SYMBOLS = "-*/.:^_"
+# 数字或字母后才保留的后缀符号 (50%、c#)
+SUFFIX_SYMBOLS = "%#"
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isascii() and ch.isalnum()
+
+
+def _keeps_symbol(text: str, i: int) -> bool:
+    """运算符、数学符号和货币符号改变问题的含义，不能当作标点去掉"""
+    ch = text[i]
+    if unicodedata.category(ch) in ("Sm", "Sc"):
+        return True
+    before = text[:i].rstrip()[-1:]
+    after = text[i + 1:].lstrip()[:1]
+    if ch in INFIX_SYMBOLS:
+        return _is_word_char(before) and _is_word_char(after)
+    if ch in SUFFIX_SYMBOLS:
+        return _is_word_char(before)
+    return False
+
+
+def normalize_query(text: str) -> str:
+    """缓存键: 纠错后统一全半角和大小写，去掉标点、表情和多余空白
+
+    运算符与数字保留 (3+5 与 3-5 是不同的问题)；拉丁字母单词之间保留一个空格，
+    "what is" 与 "whatis" 不会合并；中文之间的空白和标点全部去掉。
+    """
+    text = unicodedata.normalize("NFKC", preprocess_chinese_text(text)).lower()
+    out = []
+    separated = False
+    for i, ch in enumerate(text):
+        if unicodedata.category(ch)[0] in "LN" or _keeps_symbol(text, i):
+            if separated and out and _is_word_char(out[-1]) and _is_word_char(ch):
+                out.append(" ")
+            out.append(ch)
+            separated = False
+        else:
+            separated = True
+    return "".join(out)
+
+
+def literal_signature(key: str) -> Tuple[str, ...]:
+    """问题中的数字和符号序列 - 近似匹配只在两者一致时成立"""
+    return tuple(re.findall(r"\d+(?:\.\d+)?|[^\w\s]", key))
+
+
+def ngram_vector(key: str, dim: int = VECTOR_DIM) -> np.ndarray:
+    """字符1-gram与2-gram的哈希计数向量 (L2归一化)，2-gram权重更高以区分语序"""
+    vector = np.zeros(dim, dtype=np.float32)
+    for ch in key:
+        vector[zlib.crc32(ch.encode()) % dim] += 1.0
+    for i in range(len(key) - 1):
+        vector[zlib.crc32(key[i:i + 2].encode()) % dim] += 2.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+@dataclass
+class CachedReply:
+    """一条缓存的回复"""
+    key: str
+    reply: str
+    generation_seconds: float    # 生成这条回复实际花费的时间，命中一次即省下这么多
+    expires_at: float
+    row: int                     # 在相似度矩阵中的行号
+    size: int
+    hits: int = 0
+
+
+class ReplyCache:
+    """AI回复缓存 (线程安全)
+
+    similarity 为近似匹配的余弦相似度阈值，0 表示只做精确匹配。
+    """
+
+    def __init__(self, ttl_seconds: float = 6 * 3600, max_bytes: int = 16 * 1024 * 1024,
+                 similarity: float = 0.0, bypass_keywords: Iterable[str] = TIME_SENSITIVE_KEYWORDS,
+                 dim: int = VECTOR_DIM):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.similarity = similarity
+        self.dim = dim
+        keywords = [re.escape(normalize_query(k)) for k in bypass_keywords if normalize_query(k)]
+        self._bypass = re.compile("|".join(keywords)) if keywords else None
+        self._entries: "OrderedDict[str, CachedReply]" = OrderedDict()
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._row_keys = []            # 每行对应的键，空闲行为None
+        self._free_rows = []
+        self._lock = threading.Lock()
+        self.size = 0
+        self.lookups = 0
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+
+    def cacheable(self, key: str) -> bool:
+        return bool(key) and not (self._bypass and self._bypass.search(key))
+
+    def get(self, text: str, now: Optional[float] = None) -> Optional[Tuple[CachedReply, float]]:
+        """查找回复 - 命中时返回(条目, 相似度)，精确命中的相似度为1.0"""
+        now = time.time() if now is None else now
+        key = normalize_query(text)
+        with self._lock:
+            self.lookups += 1
+            if not self.cacheable(key):
+                self.bypassed += 1
+                return None
+            entry = self._entries.get(key)
+            score = 1.0
+            if entry is None and self.similarity > 0 and self._entries:
+                entry, score = self._nearest(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= now:
+                self._remove(entry)
+                return None
+            if score == 1.0:
+                self.exact_hits += 1
+            else:
+                self.near_hits += 1
+            entry.hits += 1
+            self.saved_seconds += entry.generation_seconds
+            self._entries.move_to_end(entry.key)
+            return entry, score
+
+    def _nearest(self, key: str) -> Tuple[Optional[CachedReply], float]:
+        scores = self._vectors @ ngram_vector(key, self.dim)
+        row = int(np.argmax(scores))
+        score = float(scores[row])
+        if score < self.similarity or self._row_keys[row] is None:
+            return None, score
+        if literal_signature(self._row_keys[row]) != literal_signature(key):
+            return None, score      # 字面相近但数字或运算符不同 (3+5 与 3-5)
+        return self._entries[self._row_keys[row]], score
+
+    def put(self, text: str, reply: str, generation_seconds: float, now: Optional[float] = None) -> bool:
+        """缓存一条成功生成的回复 - 时效性问题或超过内存上限的回复不缓存，返回是否缓存"""
+        now = time.time() if now is None else now
+        key = normalize_query(text)
+        size = len(reply.encode()) + len(key.encode()) + self.dim * 4
+        if not self.cacheable(key) or size > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None:
+                self._remove(old)
+            row = self._allocate_row()
+            self._vectors[row] = ngram_vector(key, self.dim)
+            self._row_keys[row] = key
+            self._entries[key] = CachedReply(key, reply, generation_seconds, now + self.ttl_seconds, row, size)
+            self.size += size
+            self._evict(now)
+        return True
+
+    def _allocate_row(self) -> int:
+        if not self._free_rows:
+            # 矩阵容量翻倍，新增的行 (全零向量，相似度为0) 进入空闲列表
+            old = len(self._row_keys)
+            grown = np.zeros((max(64, old * 2), self.dim), dtype=np.float32)
+            grown[:old] = self._vectors
+            self._vectors = grown
+            self._row_keys += [None] * (len(grown) - old)
+            self._free_rows = list(range(len(grown) - 1, old - 1, -1))
+        return self._free_rows.pop()
+
+    def _remove(self, entry: CachedReply) -> None:
+        del self._entries[entry.key]
+        self._vectors[entry.row] = 0.0
+        self._row_keys[entry.row] = None
+        self._free_rows.append(entry.row)
+        self.size -= entry.size
+
+    def _evict(self, now: float) -> None:
+        """先清理过期条目，仍超出内存上限时按最久未用淘汰"""
+        if self.size > self.max_bytes:
+            for entry in [e for e in self._entries.values() if e.expires_at <= now]:
+                self._remove(entry)
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries.values())))
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            for entry in list(self._entries.values()):
+                self._remove(entry)
+
+    def status(self) -> dict:
+        with self._lock:
+            hits = self.exact_hits + self.near_hits
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "similarity": self.similarity,
+                "lookups": self.lookups,
+                "exact_hits": self.exact_hits,
+                "near_hits": self.near_hits,
+                "bypassed": self.bypassed,
+                "hit_rate": round(hits / self.lookups, 4) if self.lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 2),
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+"""
+多实例路由 (水平扩展)
+- 独立的轻量进程，挡在多个 voice_api_server 实例前面转发请求，本身不加载任何模型
+- 健康检查: 定期请求各实例的 /health，连续失败的实例摘除、恢复后重新加入；
+  转发时连接失败立即摘除该实例并换一个实例重试 (请求尚未发出，POST也可安全重试)
+- 负载均衡: 选择进行中请求最少的实例 (least outstanding requests)，相同时选累计请求较少的
+- 亲和路由:
+  * 同一用户 (X-Client-Id，没有时按来源IP) 尽量固定在同一实例，用户档案与语言偏好保存在实例内存中
+  * 批量任务的轮询按 job_id、取消按 X-Request-Id 路由到持有该任务/请求的实例；
+    无法定位实例的取消广播到所有实例
+- 预热优先: 优先选择所需模型已在内存中的实例 (识别模型未被空闲卸载、LLM已保温)，
+  X-Model 头可指定需要的识别模型
+- 亲和与预热优先都有负载上限: 目标实例比最空闲的实例多出 slack 个以上进行中请求时不再偏好
+- 所有实例都满载 (max_outstanding) 时在路由层排队，超时返回503
+- /health 汇总各实例状态；/metrics 返回路由指标、排队深度以及各实例的进行中请求数和实例内排队数
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Collection, Dict, Iterable, Optional, Tuple
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from config import Config
+from metrics import metrics
+
+logging.basicConfig(level=logging.INFO)
+logging.getLogger("httpx").setLevel(logging.WARNING)  # 不逐条记录健康检查和转发请求
+logger = logging.getLogger(__name__)
+
+# 逐跳头部，不转发 (请求的 content-length 由 httpx 按缓存的请求体重新计算)
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+                      "te", "trailers", "transfer-encoding", "upgrade"}
+REQUEST_SKIP_HEADERS = HOP_BY_HOP_HEADERS | {"host", "content-length"}
+# 由路由自己的服务器重新生成的应答头
+RESPONSE_SKIP_HEADERS = HOP_BY_HOP_HEADERS | {"date", "server"}
+
+
+def request_kind(path: str) -> str:
+    """请求主要依赖的模型: asr (识别)、llm (对话)，其它请求不区分"""
+    if path.startswith("/transcribe") or path == "/voice":
+        return "asr"
+    if path == "/process":
+        return "llm"
+    return "any"
+
+
+class RouterBusy(Exception):
+    """没有可用实例 (全部下线，或排队超时)"""
+
+
+class Backend:
+    """一个API实例的路由状态"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.healthy = False
+        self.outstanding = 0          # 经路由转发、尚未结束的请求数
+        self.requests = 0
+        self.errors = 0
+        self.failures = 0             # 连续健康检查失败次数
+        self.health: dict = {}        # 最近一次 /health 的应答
+        self.last_check: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def warm(self, kind: str, model: Optional[str] = None) -> bool:
+        """所需模型是否已在该实例的内存中"""
+        if kind == "asr":
+            if model and self.health.get("asr_model") != model:
+                return False
+            idle = self.health.get("idle_offload") or {}
+            return bool(self.health.get("asr_engine")) and not idle.get("offloaded")
+        if kind == "llm":
+            llm = self.health.get("llm_warm") or {}
+            if model and llm.get("model") != model:
+                return False
+            return bool(llm.get("loaded"))
+        return True
+
+    def status(self) -> dict:
+        admission = self.health.get("admission") or {}
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "backend_queued": admission.get("queued"),
+            "asr_model": self.health.get("asr_model"),
+            "asr_warm": self.warm("asr"),
+            "llm_warm": self.warm("llm"),
+            "failures": self.failures,
+            "last_check": self.last_check,
+            "last_error": self.last_error,
+        }
+
+
+class BackendPool:
+    """实例选择与亲和记录 (在事件循环中调用，不加锁)
+
+    slack 为亲和实例和预热实例允许比最空闲实例多出的进行中请求数；
+    max_outstanding 为每个实例的并发上限 (0 为不限)。
+    """
+
+    def __init__(self, urls: Iterable[str], max_outstanding: int = 8, slack: int = 2,
+                 sticky_ttl: float = 1800, max_sticky: int = 10000):
+        self.backends = [Backend(url) for url in urls]
+        self.max_outstanding = max_outstanding
+        self.slack = slack
+        self.sticky_ttl = sticky_ttl
+        self.max_sticky = max_sticky
+        self._by_url: Dict[str, Backend] = {b.url: b for b in self.backends}
+        self._sticky: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    def available(self, exclude: Collection[str] = ()) -> list:
+        return [b for b in self.backends
+                if b.healthy and b.url not in exclude
+                and (not self.max_outstanding or b.outstanding < self.max_outstanding)]
+
+    def pin(self, key: str, backend: Backend, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        self._sticky[key] = (backend.url, now + self.sticky_ttl)
+        self._sticky.move_to_end(key)
+        while len(self._sticky) > self.max_sticky:
+            self._sticky.popitem(last=False)
+
+    def unpin(self, key: str) -> None:
+        self._sticky.pop(key, None)
+
+    def pinned(self, key: str, now: Optional[float] = None) -> Optional[Backend]:
+        item = self._sticky.get(key)
+        if item is None:
+            return None
+        url, expires_at = item
+        if expires_at <= (time.time() if now is None else now):
+            del self._sticky[key]
+            return None
+        return self._by_url.get(url)
+
+    def choose(self, kind: str = "any", model: Optional[str] = None, affinity: Optional[str] = None,
+               exclude: Collection[str] = (), now: Optional[float] = None) -> Optional[Backend]:
+        """选择实例: 亲和实例 > 已预热的实例 > 进行中请求最少的实例 - 没有可用实例时返回None"""
+        candidates = self.available(exclude)
+        if not candidates:
+            return None
+        least = min(b.outstanding for b in candidates)
+        close_enough = [b for b in candidates if b.outstanding <= least + self.slack]
+        warm = [b for b in close_enough if b.warm(kind, model)]
+        if affinity:
+            # 亲和实例需要同样已预热 (有预热实例可选时)，避免为了亲和重新加载模型
+            target = self.pinned(affinity, now)
+            if target in (warm or close_enough):
+                metrics.incr("router_sticky_hits")
+                self.pin(affinity, target, now)
+                return target
+        if warm and len(warm) < len(candidates):
+            metrics.incr("router_warm_preferred")
+        choice = min(warm or candidates, key=lambda b: (b.outstanding, b.requests))
+        if affinity:
+            self.pin(affinity, choice, now)
+        return choice
+
+    def status(self) -> list:
+        return [b.status() for b in self.backends]
+
+
+class RelayResponse(StreamingResponse):
+    """逐块转发上游响应；无论正常结束还是客户端中途断开都执行 on_close (关闭上游连接、释放实例)"""
+
+    def __init__(self, upstream: httpx.Response, on_close, extra_headers: Dict[str, str]):
+        super().__init__(upstream.aiter_raw(), status_code=upstream.status_code)
+        # 保留重复的头部 (如多个 set-cookie)；CORS头由路由自己的中间件添加
+        self.raw_headers.extend(
+            (key.lower().encode("latin-1"), value.encode("latin-1"))
+            for key, value in upstream.headers.multi_items()
+            if key.lower() not in RESPONSE_SKIP_HEADERS and not key.lower().startswith("access-control-")
+        )
+        self.raw_headers.extend((key.lower().encode("latin-1"), value.encode("latin-1"))
+                                for key, value in extra_headers.items())
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.on_close()
+
+
+class Router:
+    """转发请求到多个API实例"""
+
+    def __init__(self, urls: Iterable[str], max_outstanding: int = 8, slack: int = 2,
+                 sticky_ttl: float = 1800, health_interval: float = 2, unhealthy_after: int = 2,
+                 queue_timeout: float = 30, health_timeout: float = 2):
+        self.pool = BackendPool(urls, max_outstanding, slack, sticky_ttl)
+        self.health_interval = health_interval
+        self.unhealthy_after = unhealthy_after
+        self.queue_timeout = queue_timeout
+        self.health_timeout = health_timeout
+        self.waiting = 0
+        self.client: Optional[httpx.AsyncClient] = None
+        self._changed: Optional[asyncio.Condition] = None
+        self._health_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(None, connect=5),
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=64),
+        )
+        self._changed = asyncio.Condition()
+        await self.check_all()
+        self._health_task = asyncio.create_task(self._health_loop())
+        healthy = sum(b.healthy for b in self.pool.backends)
+        logger.info(f"🔀 路由已启动: {healthy}/{len(self.pool.backends)} 个实例可用")
+
+    async def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+        if self.client is not None:
+            await self.client.aclose()
+
+    # ---- 健康检查 ----
+
+    async def check(self, backend: Backend) -> None:
+        try:
+            response = await self.client.get(f"{backend.url}/health", timeout=self.health_timeout)
+            response.raise_for_status()
+            backend.health = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            backend.failures += 1
+            backend.last_error = str(e) or type(e).__name__
+            if backend.failures >= self.unhealthy_after:
+                self.mark_down(backend)
+        else:
+            backend.failures = 0
+            backend.last_error = None
+            if not backend.healthy:
+                backend.healthy = True
+                metrics.incr("router_backend_up")
+                logger.info(f"✅ 实例已可用: {backend.url}")
+                await self._notify()
+        backend.last_check = time.time()
+
+    async def check_all(self) -> None:
+        await asyncio.gather(*(self.check(b) for b in self.pool.backends))
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_all()
+
+    def mark_down(self, backend: Backend) -> None:
+        if backend.healthy:
+            metrics.incr("router_backend_down")
+            logger.warning(f"⚠️ 实例已摘除: {backend.url} ({backend.last_error})")
+        backend.healthy = False
+
+    # ---- 实例占用 ----
+
+    async def _notify(self) -> None:
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def acquire(self, kind: str, model: Optional[str], affinity: Optional[str],
+                      exclude: Collection[str] = ()) -> Backend:
+        """选出实例并占用；全部满载时排队等待，没有健康实例或等待超时时抛出 RouterBusy"""
+        backend = self.pool.choose(kind, model, affinity, exclude)
+        if backend is None:
+            if not any(b.healthy and b.url not in exclude for b in self.pool.backends):
+                raise RouterBusy("没有可用的实例")
+            backend = await self._wait_for_backend(kind, model, affinity, exclude)
+        self.occupy(backend)
+        return backend
+
+    async def _wait_for_backend(self, kind, model, affinity, exclude) -> Backend:
+        metrics.incr("router_queued")
+        self.waiting += 1
+        start = time.monotonic()
+        deadline = start + self.queue_timeout
+        try:
+            async with self._changed:
+                while True:
+                    backend = self.pool.choose(kind, model, affinity, exclude)
+                    if backend is not None:
+                        return backend
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        metrics.incr("router_queue_timeouts")
+                        raise RouterBusy("所有实例繁忙，排队超时")
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            self.waiting -= 1
+            metrics.observe("router_queue_wait", time.monotonic() - start)
+
+    def occupy(self, backend: Backend) -> None:
+        backend.outstanding += 1
+        backend.requests += 1
+
+    async def release(self, backend: Backend) -> None:
+        backend.outstanding -= 1
+        await self._notify()
+
+    # ---- 转发 ----
+
+    def _pinned_target(self, method: str, path: str, body: bytes) -> Tuple[Optional[str], Optional[Backend]]:
+        """按任务/请求定位实例 - 返回 (亲和键, 实例)"""
+        if method == "GET" and path.startswith("/transcribe/batch/"):
+            key = "job:" + path.rsplit("/", 1)[-1]
+            return key, self.pool.pinned(key)
+        if method == "POST" and path == "/cancel" and body:
+            try:
+                request_id = json.loads(body).get("request_id")
+            except (ValueError, AttributeError):
+                return None, None
+            if request_id:
+                key = f"req:{request_id}"
+                return key, self.pool.pinned(key)
+        return None, None
+
+    async def _locate_job(self, key: str, path: str, headers: list) -> Optional[Backend]:
+        for backend in self.pool.backends:
+            if not backend.healthy:
+                continue
+            try:
+                response = await self.client.get(backend.url + path, params={"limit": 1}, headers=headers,
+                                                 timeout=self.health_timeout)
+            except httpx.HTTPError:
+                continue
+            if response.status_code == 200:
+                self.pool.pin(key, backend)
+                return backend
+        return None
+
+    async def forward(self, request: Request) -> Response:
+        metrics.incr("router_requests")
+        start = time.perf_counter()
+        method, path = request.method, request.url.path
+        body = await request.body()
+        headers = [(k, v) for k, v in request.headers.items() if k.lower() not in REQUEST_SKIP_HEADERS]
+        client_host = request.client.host if request.client else None
+        if client_host:
+            forwarded = request.headers.get("x-forwarded-for")
+            headers = [(k, v) for k, v in headers if k.lower() != "x-forwarded-for"]
+            headers.append(("x-forwarded-for", f"{forwarded}, {client_host}" if forwarded else client_host))
+
+        pin_key, pinned = self._pinned_target(method, path, body)
+        if path == "/cancel" and pinned is None:
+            return await self.broadcast_cancel(headers, body)
+        if pin_key and pin_key.startswith("job:") and pinned is None:
+            # 路由重启等原因丢失了任务位置: 逐个实例查找
+            metrics.incr("router_sticky_misses")
+            pinned = await self._locate_job(pin_key, path, headers)
+            if pinned is None:
+                return JSONResponse(status_code=404, content={"detail": "任务不存在或已过期"})
+        if pinned is not None and not pinned.healthy:
+            return JSONResponse(status_code=503, content={"detail": f"持有该任务的实例不可用: {pinned.url}"})
+
+        kind = request_kind(path)
+        model = request.headers.get("x-model")
+        affinity = "client:" + (request.headers.get("x-client-id") or client_host or "unknown")
+        request_id = request.headers.get("x-request-id")
+        tried = set()
+        while True:
+            if pinned is not None:
+                backend = pinned
+                self.occupy(backend)
+            else:
+                try:
+                    backend = await self.acquire(kind, model, affinity, tried)
+                except RouterBusy as e:
+                    metrics.incr("router_rejected")
+                    return JSONResponse(status_code=503, content={"detail": str(e)},
+                                        headers={"Retry-After": str(max(1, round(self.health_interval)))})
+            if request_id:
+                self.pool.pin(f"req:{request_id}", backend)
+            upstream_request = self.client.build_request(
+                method, backend.url + path, params=request.url.query, headers=headers, content=body
+            )
+            try:
+                upstream = await self.client.send(upstream_request, stream=True)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                # 请求尚未送达: 摘除实例后换一个实例重试
+                backend.errors += 1
+                backend.last_error = str(e) or type(e).__name__
+                metrics.incr("router_backend_errors")
+                self.mark_down(backend)
+                await self._finish(backend, request_id)
+                if pinned is not None:
+                    return JSONResponse(status_code=503, content={"detail": f"持有该任务的实例不可用: {backend.url}"})
+                tried.add(backend.url)
+                metrics.incr("router_retries")
+                continue
+            except httpx.HTTPError as e:
+                backend.errors += 1
+                metrics.incr("router_backend_errors")
+                await self._finish(backend, request_id)
+                return JSONResponse(status_code=502, content={"detail": f"实例请求失败: {e}"})
+            break
+
+        metrics.observe("router_upstream_headers", time.perf_counter() - start)
+        if upstream.status_code >= 500:
+            backend.errors += 1
+            metrics.incr("router_upstream_5xx")
+        if method == "POST" and path == "/transcribe/batch" and upstream.status_code == 202:
+            # 批量任务: 记下任务所在的实例，后续轮询路由到同一实例
+            content = await upstream.aread()
+            await upstream.aclose()
+            await self._finish(backend, request_id)
+            try:
+                self.pool.pin("job:" + json.loads(content)["job_id"], backend)
+            except (ValueError, KeyError, TypeError):
+                logger.warning(f"⚠️ 无法从批量任务应答中解析 job_id: {backend.url}")
+            metrics.observe("router_request", time.perf_counter() - start)
+            response = Response(content=content, status_code=upstream.status_code,
+                                media_type=upstream.headers.get("content-type"))
+            response.headers["X-Backend"] = backend.url
+            return response
+
+        async def on_close():
+            await upstream.aclose()
+            await self._finish(backend, request_id)
+            metrics.observe("router_request", time.perf_counter() - start)
+
+        return RelayResponse(upstream, on_close, {"X-Backend": backend.url})
+
+    async def _finish(self, backend: Backend, request_id: Optional[str]) -> None:
+        if request_id:
+            self.pool.unpin(f"req:{request_id}")
+        await self.release(backend)
+
+    async def broadcast_cancel(self, headers: list, body: bytes) -> Response:
+        """无法定位实例的取消: 发给所有健康实例，汇总取消的请求数"""
+        async def cancel(backend: Backend) -> int:
+            try:
+                response = await self.client.post(f"{backend.url}/cancel", headers=headers, content=body,
+                                                  timeout=self.health_timeout)
+                return int(response.json().get("cancelled", 0)) if response.status_code == 200 else 0
+            except (httpx.HTTPError, ValueError, AttributeError):
+                return 0
+
+        metrics.incr("router_cancel_broadcasts")
+        counts = await asyncio.gather(*(cancel(b) for b in self.pool.backends if b.healthy))
+        return JSONResponse(content={"cancelled": sum(counts)})
+
+    def health(self) -> dict:
+        healthy = sum(b.healthy for b in self.pool.backends)
+        return {
+            "status": "healthy" if healthy else "unavailable",
+            "router": True,
+            "healthy_backends": healthy,
+            "backends": self.pool.status(),
+        }
+
+    def snapshot(self) -> dict:
+        return {
+            **metrics.snapshot(),
+            "queue_depth": self.waiting,
+            "outstanding": sum(b.outstanding for b in self.pool.backends),
+            "backends": self.pool.status(),
+        }
+
+
+def create_app(router: Router) -> FastAPI:
+    """路由服务: /health 与 /metrics 由路由自己应答，其它请求全部转发"""
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        await router.start()
+        yield
+        await router.close()
+
+    app = FastAPI(title="语音助手多实例路由", lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["Retry-After", "X-TTS-Cache", "X-Backend"],
+    )
+
+    @app.get("/health")
+    async def health():
+        status = router.health()
+        return JSONResponse(status_code=200 if status["healthy_backends"] else 503, content=status)
+
+    @app.get("/metrics")
+    async def get_metrics():
+        return router.snapshot()
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
+    async def proxy(request: Request):
+        return await router.forward(request)
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="语音助手多实例路由")
+    parser.add_argument("--backends", default=",".join(Config.ROUTER_BACKENDS),
+                        help="后端实例地址，逗号分隔 (默认 ROUTER_BACKENDS)")
+    parser.add_argument("--host", default=Config.ROUTER_HOST)
+    parser.add_argument("--port", type=int, default=Config.ROUTER_PORT)
+    args = parser.parse_args()
+    urls = [url.strip() for url in args.backends.split(",") if url.strip()]
+    if not urls:
+        parser.error("需要至少一个后端实例 (--backends 或 ROUTER_BACKENDS)")
+
+    router = Router(
+        urls,
+        max_outstanding=Config.ROUTER_MAX_OUTSTANDING,
+        slack=Config.ROUTER_AFFINITY_SLACK,
+        sticky_ttl=Config.ROUTER_STICKY_TTL_MINUTES * 60,
+        health_interval=Config.ROUTER_HEALTH_INTERVAL,
+        unhealthy_after=Config.ROUTER_UNHEALTHY_AFTER,
+        queue_timeout=Config.ROUTER_QUEUE_TIMEOUT,
+    )
+    print(f"🔀 多实例路由: {', '.join(urls)}")
+    uvicorn.run(create_app(router), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+本地Ollama桩服务，用于在没有Ollama/GPU的环境下测试
+- 支持 /api/generate (含流式与 keep_alive=0 卸载)、/api/ps、/api/tags
+- 记录收到的请求，便于断言调用顺序
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubOllama:
+    """可编程的Ollama桩"""
+
+    def __init__(self, model_vram: int = 0, load_seconds: float = 0.0, reply: str = "你好，我是测试模型"):
+        self.model_vram = model_vram
+        self.load_seconds = load_seconds
+        self.reply = reply
+        self.loaded = {}
+        self.requests = []
+        self.on_load = None      # 回调(model_name)，模型被加载时调用
+        self.on_unload = None    # 回调(model_name)，模型被卸载时调用
+        self.truncate_models = set()  # 这些模型的流式回复输出一半后断开 (没有 done)
+        self._lock = threading.Lock()
+        self.server = None
+
+    def start(self) -> str:
+        """在随机端口启动，返回API基础地址"""
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _json(self, payload, status=200):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/api/ps":
+                    with stub._lock:
+                        models = [{"name": name, "size_vram": size} for name, size in stub.loaded.items()]
+                    self._json({"models": models})
+                elif self.path == "/api/tags":
+                    self._json({"models": [{"name": "stub:latest"}]})
+                else:
+                    self._json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                with stub._lock:
+                    stub.requests.append((self.path, body))
+                if self.path != "/api/generate":
+                    self._json({"error": "not found"}, 404)
+                    return
+                stub.handle_generate(self, body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_address[1]}/api"
+
+    def stop(self) -> None:
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def handle_generate(self, handler, body: dict) -> None:
+        model = body.get("model", "")
+        if body.get("keep_alive") == 0 and not body.get("prompt"):
+            with self._lock:
+                self.loaded.pop(model, None)
+            if self.on_unload:
+                self.on_unload(model)
+            handler._json({"model": model, "done": True, "done_reason": "unload"})
+            return
+
+        load_duration = 0
+        with self._lock:
+            needs_load = model not in self.loaded
+        if needs_load:
+            if self.on_load:
+                self.on_load(model)
+            time.sleep(self.load_seconds)
+            load_duration = int(self.load_seconds * 1e9)
+            with self._lock:
+                self.loaded[model] = self.model_vram
+
+        if not body.get("prompt"):
+            # 空prompt仅加载模型，与Ollama行为一致
+            handler._json({"model": model, "response": "", "done": True, "load_duration": load_duration})
+            return
+
+        if body.get("stream", True):
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/x-ndjson")
+            handler.end_headers()
+            pieces = self.reply[:len(self.reply) // 2] if model in self.truncate_models else self.reply
+            for piece in pieces:
+                handler.wfile.write((json.dumps({"model": model, "response": piece, "done": False}) + "\n").encode())
+            if model in self.truncate_models:
+                return
+            handler.wfile.write((json.dumps({"model": model, "response": "", "done": True,
+                                             "load_duration": load_duration}) + "\n").encode())
+        else:
+            handler._json({"model": model, "response": self.reply, "done": True, "load_duration": load_duration})
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+准入控制测试 - 纯asyncio，无需模型；服务端按API Key/来源IP限速 (桩引擎)
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from admission import AdmissionController, AdmissionRejected, TokenBucket
+
+
+def silent_wav(seconds: float) -> bytes:
+    import io
+    import wave
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(b"\x00\x00" * int(16000 * seconds))
+    return buffer.getvalue()
+
+
+async def occupy(controller, client, seconds, order, hold, charge=True):
+    async with controller.admit(client, seconds, charge=charge):
+        order.append(client)
+        await hold.wait()
+
+
+async def run_order(controller, requests):
+    """先占住唯一的槽位，再按顺序排入请求，逐个放行并记录服务顺序"""
+    order = []
+    hold = asyncio.Event()
+    hold.set()
+    gate = asyncio.Event()
+    blocker = asyncio.create_task(occupy(controller, "blocker", 1, [], gate))
+    await asyncio.sleep(0)
+    tasks = []
+    for client, seconds in requests:
+        tasks.append(asyncio.create_task(occupy(controller, client, seconds, order, hold)))
+        await asyncio.sleep(0)
+    gate.set()
+    await asyncio.gather(blocker, *tasks)
+    return order
+
+
+def test_token_bucket_refills():
+    bucket = TokenBucket(rate=2.0, capacity=10.0)
+    assert bucket.try_take(8, now=bucket.updated) == 0
+    assert bucket.try_take(4, now=bucket.updated) == 1.0
+    assert bucket.try_take(4, now=bucket.updated + 1.0) == 0
+    # 超过容量的请求按满桶计费
+    assert bucket.try_take(100, now=bucket.updated + 10.0) == 0
+
+
+def test_rate_limited_client_rejected_others_admitted():
+    async def scenario():
+        controller = AdmissionController(rate=1.0, burst=30.0)
+        async with controller.admit("looper", 30):
+            pass
+        try:
+            async with controller.admit("looper", 30):
+                pass
+            raise AssertionError("应当被限速")
+        except AdmissionRejected as e:
+            assert e.reason == "rate_limited" and e.retry_after > 25
+        async with controller.admit("other", 3):
+            pass
+    asyncio.run(scenario())
+
+
+def test_short_commands_go_ahead_of_dictation():
+    async def scenario():
+        controller = AdmissionController(burst=600.0)
+        return await run_order(controller, [("dictation", 120), ("command", 3)])
+    assert asyncio.run(scenario()) == ["command", "dictation"]
+
+
+def test_fair_queuing_interleaves_clients():
+    """同一优先级内，排在后面的客户端不必等前一个客户端的全部请求"""
+    async def scenario():
+        controller = AdmissionController(burst=600.0)
+        return await run_order(controller, [("a", 60), ("a", 60), ("a", 60), ("b", 60)])
+    assert asyncio.run(scenario()) == ["a", "b", "a", "a"]
+
+
+def test_queue_full_and_timeout():
+    async def scenario():
+        controller = AdmissionController(burst=600.0, max_queue=1, queue_timeout=0.05)
+        gate = asyncio.Event()
+        blocker = asyncio.create_task(occupy(controller, "blocker", 1, [], gate))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(occupy(controller, "a", 1, [], gate))
+        await asyncio.sleep(0)
+        reasons = []
+        for task in (occupy(controller, "b", 1, [], gate), waiting):
+            try:
+                await task
+            except AdmissionRejected as e:
+                reasons.append(e.reason)
+        gate.set()
+        await blocker
+        assert controller.status()["queued"] == 0 and controller.status()["active"] == 0
+        return reasons
+    assert asyncio.run(scenario()) == ["queue_full", "queue_timeout"]
+
+
+def test_rotating_api_keys_do_not_reset_the_bucket():
+    """未配置的Key不作为身份: 每次换一个随机Key仍然共用来源IP的令牌桶；配置过的Key有自己的桶"""
+    import io
+    import uuid
+
+    import voice_api_server as server
+    from asr_engines import StubEngine
+    from config import Config
+    from fastapi.testclient import TestClient
+
+    buffer = io.BytesIO(silent_wav(2))
+    previous = (server.asr_engine, server.admission, Config.API_KEYS)
+    server.asr_engine = StubEngine(text="打开记事本")
+    server.admission = AdmissionController(rate=0.001, burst=4.0)
+    Config.API_KEYS = ("team-key",)
+    try:
+        client = TestClient(server.app)
+
+        def post(headers):
+            return client.post("/transcribe", headers=headers,
+                               files={"audio_file": ("a.wav", buffer.getvalue(), "audio/wav")}).status_code
+
+        assert post({"X-API-Key": uuid.uuid4().hex}) == 200
+        assert post({"Authorization": f"Bearer {uuid.uuid4().hex}"}) == 200
+        assert post({"X-API-Key": uuid.uuid4().hex}) == 429          # 同一IP的桶已用完
+        assert post({"X-Client-Id": uuid.uuid4().hex}) == 429
+        assert post({"X-API-Key": "team-key"}) == 200                # 有效Key单独计费
+        clients = sorted(server.admission._clients)
+        assert len(clients) == 2 and clients[0] == "ip:testclient" and clients[1].startswith("key:")
+    finally:
+        server.asr_engine, server.admission, Config.API_KEYS = previous
+
+
+def test_uncharged_admission_keeps_the_bucket():
+    """charge=False (批量任务) 不扣令牌，但仍要排队等待推理槽位"""
+    async def scenario():
+        controller = AdmissionController(rate=0.001, burst=30.0)
+        for _ in range(5):
+            async with controller.admit("batch", 30, charge=False):
+                pass
+        gate = asyncio.Event()
+        blocker = asyncio.create_task(occupy(controller, "blocker", 1, [], gate))
+        await asyncio.sleep(0)
+        order = []
+        waiting = asyncio.create_task(occupy(controller, "batch", 30, order, gate, charge=False))
+        await asyncio.sleep(0)
+        assert controller.status()["queued"] == 1 and not order
+        gate.set()
+        await asyncio.gather(blocker, waiting)
+        assert order == ["batch"]
+        async with controller.admit("batch", 30):           # 令牌未被批量任务用掉
+            pass
+    asyncio.run(scenario())
+
+
+def test_batch_jobs_are_not_charged_to_the_client_bucket():
+    """批量转录 (含逐条回退) 不消耗客户端令牌: 批量之后同一客户端的交互请求照常准入"""
+    import json
+
+    import voice_api_server as server
+    from asr_engines import StubEngine
+    from fastapi.testclient import TestClient
+
+    previous = (server.asr_engine, server.admission)
+    server.asr_engine = StubEngine(text="打开记事本")
+    server.admission = AdmissionController(rate=0.001, burst=4.0)
+    try:
+        client = TestClient(server.app)
+        response = client.post("/transcribe/batch", files=[
+            ("files", (f"{i}.wav", silent_wav(3), "audio/wav")) for i in range(4)
+        ])
+        assert response.status_code == 200
+        records = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+        assert records[-1]["completed"] == 4, records
+        assert server.admission._clients["ip:testclient"].bucket.tokens == 4.0
+        assert client.post("/transcribe", files={
+            "audio_file": ("a.wav", silent_wav(3), "audio/wav")
+        }).status_code == 200
+    finally:
+        server.asr_engine, server.admission = previous
+
+
+def main():
+    print("🧪 准入控制测试")
+    for test in (test_token_bucket_refills,
+                 test_rate_limited_client_rejected_others_admitted,
+                 test_short_commands_go_ahead_of_dictation,
+                 test_fair_queuing_interleaves_clients,
+                 test_queue_full_and_timeout,
+                 test_rotating_api_keys_do_not_reset_the_bucket,
+                 test_uncharged_admission_keeps_the_bucket,
+                 test_batch_jobs_are_not_charged_to_the_client_bucket):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
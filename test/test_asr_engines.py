@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+识别引擎一致性测试 - 每个可用引擎都要满足同样的接口约定
+- stub 始终测试；whisper 使用随机初始化的小模型
+- faster-whisper 仅在已安装且 FASTER_WHISPER_TEST_MODEL 指向本地模型时测试
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import numpy as np
+
+from asr_engines import ENGINES, FasterWhisperEngine, StubEngine, WhisperEngine, create_engine
+from cancellation import CancelToken, InferenceCancelled, cancel_scope, enable_cancellation
+from test_client_profiles import make_model
+
+SAMPLE_RATE = 16000
+
+
+def audio(seconds: float, seed: int = 0) -> np.ndarray:
+    return (np.random.default_rng(seed).standard_normal(int(seconds * SAMPLE_RATE)) * 0.05).astype(np.float32)
+
+
+def available_engines():
+    model = make_model()
+    enable_cancellation(model)
+    engines = [StubEngine(), WhisperEngine(lambda: model, temperatures=(0.0,), beam_size=2)]
+    local_model = os.getenv("FASTER_WHISPER_TEST_MODEL")
+    if local_model:
+        engines.append(FasterWhisperEngine(local_model, device="cpu"))
+    return engines
+
+
+def check_result(result: dict, word_timestamps: bool = False) -> None:
+    assert isinstance(result["text"], str) and isinstance(result["language"], str)
+    for segment in result["segments"]:
+        assert segment["end"] >= segment["start"] >= 0 and isinstance(segment["text"], str)
+        if word_timestamps:
+            assert "words" in segment
+
+
+def test_result_shape_and_determinism():
+    clip = audio(2)
+    for engine in available_engines():
+        first = engine.transcribe(clip, language="zh")
+        check_result(first)
+        assert first["language"] == "zh", engine.name
+        assert engine.transcribe(clip, language="zh")["text"] == first["text"], engine.name
+
+
+def test_word_timestamps_when_supported():
+    clip = audio(2)
+    for engine in available_engines():
+        if engine.capabilities.word_timestamps:
+            check_result(engine.transcribe(clip, language="zh", word_timestamps=True), word_timestamps=True)
+
+
+def test_batch_matches_single_count_and_order():
+    clips = [audio(1, seed=1), audio(2, seed=2), audio(3, seed=3)]
+    for engine in available_engines():
+        results = engine.transcribe_batch(clips, language="zh")
+        assert len(results) == len(clips), engine.name
+        for result in results:
+            check_result(result)
+            assert result["language"] == "zh"
+
+
+def test_stream_yields_segments():
+    clip = audio(2)
+    for engine in available_engines():
+        segments = list(engine.transcribe_stream(clip, language="zh"))
+        assert "".join(s["text"] for s in segments) == engine.transcribe(clip, language="zh")["text"], engine.name
+
+
+def test_detect_language_within_candidates():
+    clip = audio(2)
+    for engine in available_engines():
+        if engine.capabilities.language_id:
+            language, probability = engine.detect_language(clip, ["zh", "en"])
+            assert language in ("zh", "en") and 0.0 <= probability <= 1.0, engine.name
+
+
+def test_cancelled_token_stops_inference():
+    clip = audio(2)
+    for engine in available_engines():
+        token = CancelToken()
+        token.cancel("disconnected")
+        try:
+            with cancel_scope(token):
+                engine.transcribe(clip, language="zh")
+            raise AssertionError(f"{engine.name} 应当被取消")
+        except InferenceCancelled as e:
+            assert e.reason == "disconnected"
+
+
+def test_registry_and_describe():
+    assert set(ENGINES) == {"whisper", "faster-whisper", "stub"}
+    engine = create_engine("stub", text="截图")
+    assert engine.transcribe(audio(1))["text"] == "截图"
+    assert engine.describe()["capabilities"]["batching"] is True
+    try:
+        create_engine("onnx")
+        raise AssertionError("未知引擎应当报错")
+    except ValueError:
+        pass
+    try:
+        import faster_whisper  # noqa: F401
+    except ImportError:
+        try:
+            create_engine("faster-whisper")
+            raise AssertionError("未安装faster-whisper时应当提示安装")
+        except RuntimeError as e:
+            assert "pip install faster-whisper" in str(e)
+
+
+def test_server_dispatches_to_configured_engine():
+    import voice_api_server as server
+
+    previous = server.asr_engine
+    server.asr_engine = StubEngine(text="打开记事本")
+    try:
+        assert server.model_available()
+        server.client_profiles.set_custom_terms("engine-test", ["飞书"])
+        result = server.run_transcription(audio(1), "engine-test")
+        assert result["text"] == "打开记事本"
+        assert result["encoder"] == {"passes": 0, "cache_hits": 0}
+        assert result["language_id"]["language"] == result["language"]
+    finally:
+        server.asr_engine = previous
+
+
+def main():
+    print("🧪 识别引擎一致性测试")
+    for test in (test_result_shape_and_determinism,
+                 test_word_timestamps_when_supported,
+                 test_batch_matches_single_count_and_order,
+                 test_stream_yields_segments,
+                 test_detect_language_within_candidates,
+                 test_cancelled_token_stops_inference,
+                 test_registry_and_describe,
+                 test_server_dispatches_to_configured_engine):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
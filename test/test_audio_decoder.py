@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+音频解码测试 - wav/webm/ogg 往返解码、损坏输入报错、ffmpeg写出大量stderr时不死锁、
+configure_decoding 的并发槽位限制
+"""
+
+import io
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+
+from audio_decoder import SAMPLE_RATE, AudioDecodeError, configure_decoding, decode_audio_stream
+
+
+def sine_wav(seconds: float = 1.0, freq: float = 440.0) -> bytes:
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    pcm = (0.5 * 32767 * np.sin(2 * math.pi * freq * t)).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def encode(wav: bytes, fmt: str, codec: str) -> bytes:
+    """用ffmpeg把wav编码成浏览器常见的上传格式"""
+    result = subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+                             "-c:a", codec, "-f", fmt, "pipe:1"], input=wav, capture_output=True, check=True)
+    return result.stdout
+
+
+def dominant_frequency(audio: np.ndarray) -> float:
+    spectrum = np.abs(np.fft.rfft(audio))
+    return float(np.argmax(spectrum)) * SAMPLE_RATE / len(audio)
+
+
+def test_wav_round_trip_is_exact():
+    wav = sine_wav()
+    audio, received = decode_audio_stream(io.BytesIO(wav), chunk_size=1024)
+    assert received == len(wav) and len(audio) == SAMPLE_RATE
+    expected = np.frombuffer(wav[44:], np.int16).astype(np.float32) / 32768.0
+    assert np.array_equal(audio, expected)
+
+
+def test_webm_and_ogg_round_trip():
+    wav = sine_wav()
+    for fmt, codec in (("webm", "libopus"), ("ogg", "libopus"), ("ogg", "libvorbis")):
+        data = encode(wav, fmt, codec)
+        audio, received = decode_audio_stream(io.BytesIO(data), chunk_size=4096)
+        assert received == len(data), (fmt, codec)
+        assert abs(len(audio) - SAMPLE_RATE) < SAMPLE_RATE * 0.05, (fmt, codec, len(audio))
+        assert abs(dominant_frequency(audio) - 440) < 5, (fmt, codec)
+
+
+def test_corrupt_input_raises_decode_error():
+    for data in (os.urandom(64 * 1024), b"", sine_wav()[:40]):
+        try:
+            decode_audio_stream(io.BytesIO(data))
+            raise AssertionError("应当解码失败")
+        except AudioDecodeError as e:
+            assert "ffmpeg解码失败" in str(e)
+
+
+def test_verbose_stderr_does_not_deadlock():
+    """ffmpeg在输出PCM前写出超过管道缓冲区的stderr: 解码照常完成"""
+    fake = tempfile.mkdtemp(prefix="fake-ffmpeg-")
+    script = os.path.join(fake, "ffmpeg")
+    with open(script, "w") as f:
+        f.write(f"#!{sys.executable}\n"
+                "import sys\n"
+                "sys.stdin.buffer.read()\n"
+                "sys.stderr.write('warning: noisy decoder\\n' * 50000)\n"
+                "sys.stderr.flush()\n"
+                "sys.stdout.buffer.write(b'\\x00\\x00' * 16000)\n")
+    os.chmod(script, 0o755)
+    previous_path = os.environ["PATH"]
+    os.environ["PATH"] = fake + os.pathsep + previous_path
+    result = []
+    try:
+        thread = threading.Thread(target=lambda: result.append(decode_audio_stream(io.BytesIO(b"x" * 1000))),
+                                  daemon=True)
+        thread.start()
+        thread.join(timeout=20)
+    finally:
+        os.environ["PATH"] = previous_path
+    assert not thread.is_alive(), "解码卡死"
+    audio, received = result[0]
+    assert len(audio) == 16000 and received == 1000
+
+
+class SlowSource(io.BytesIO):
+    """记录同时处于解码中的上传数: 首次读取时进入，读到末尾时离开"""
+
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def __init__(self, data: bytes):
+        super().__init__(data)
+        self.started = False
+
+    def read(self, size: int = -1) -> bytes:
+        cls = type(self)
+        if not self.started:
+            self.started = True
+            with cls.lock:
+                cls.active += 1
+                cls.peak = max(cls.peak, cls.active)
+            time.sleep(0.2)
+        chunk = super().read(size)
+        if not chunk:
+            with cls.lock:
+                cls.active -= 1
+        return chunk
+
+
+def run_concurrently(count: int) -> int:
+    wav = sine_wav(0.2)
+    SlowSource.active = SlowSource.peak = 0
+    threads = [threading.Thread(target=decode_audio_stream, args=(SlowSource(wav),)) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return SlowSource.peak
+
+
+def test_decode_slots_limit_concurrent_ffmpeg():
+    configure_decoding(1)
+    try:
+        assert run_concurrently(3) == 1
+    finally:
+        configure_decoding()
+    assert run_concurrently(3) > 1                    # 不限时并行解码
+
+
+def main():
+    print("🧪 音频解码测试")
+    for test in (test_wav_round_trip_is_exact,
+                 test_webm_and_ogg_round_trip,
+                 test_corrupt_input_raises_decode_error,
+                 test_verbose_stderr_does_not_deadlock,
+                 test_decode_slots_limit_concurrent_ffmpeg):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+审计日志测试 - 临时SQLite文件
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from audit_log import AuditLog
+
+
+def make_log(directory):
+    log = AuditLog(os.path.join(directory, "audit.sqlite3"), flush_interval=0.05)
+    log.start()
+    return log
+
+
+def test_records_are_flushed_and_paginated():
+    with tempfile.TemporaryDirectory() as directory:
+        log = make_log(directory)
+        for i in range(5):
+            log.record("alice" if i % 2 == 0 else "bob", "/voice", text=f"打开记事本{i}",
+                       is_command=True, command_type="应用程序", command_target="记事本",
+                       command_executed=True, command_result="✅", timings={"total_ms": i})
+        log.close()
+
+        items, cursor = log.query(limit=2)
+        assert [item["text"] for item in items] == ["打开记事本4", "打开记事本3"]
+        assert items[0]["timings"] == {"total_ms": 4} and items[0]["is_command"] is True
+        items, cursor = log.query(limit=2, before=cursor)
+        assert [item["text"] for item in items] == ["打开记事本2", "打开记事本1"]
+
+        items, cursor = log.query(client="alice", limit=10)
+        assert [item["text"] for item in items] == ["打开记事本4", "打开记事本2", "打开记事本0"]
+        assert cursor is None
+
+
+def test_record_does_not_wait_for_disk():
+    """请求路径每条记录的开销远低于0.5ms"""
+    with tempfile.TemporaryDirectory() as directory:
+        log = make_log(directory)
+        count = 5000
+        start = time.perf_counter()
+        for i in range(count):
+            log.record("alice", "/voice", text="打开记事本", timings={"total_ms": 1.0})
+        per_record_ms = (time.perf_counter() - start) * 1000 / count
+        log.close()
+        print(f"   每条记录 {per_record_ms * 1000:.1f}µs")
+        assert per_record_ms < 0.5
+        assert len(log.query(limit=count)[0]) == count
+
+
+def test_history_endpoint_limits_other_clients_to_admin():
+    """不带管理令牌只能查询自己的记录"""
+    import voice_api_server as server
+    from config import Config
+    from fastapi.testclient import TestClient
+
+    with tempfile.TemporaryDirectory() as directory:
+        log = make_log(directory)
+        # 用户标识为 身份/X-Client-Id: alice 来自测试客户端地址，bob 来自另一个地址
+        alice_key, bob_key = "ip:testclient/alice", "ip:10.0.0.5/bob"
+        for key in (alice_key, bob_key):
+            log.record(key, "/voice", text=f"{key.rsplit('/', 1)[1]}的记录")
+        log.close()
+        previous = (server.audit_log, Config.ADMIN_TOKEN)
+        server.audit_log = log
+        try:
+            client = TestClient(server.app)
+            alice = {"X-Client-Id": "alice"}
+
+            def texts(response):
+                assert response.status_code == 200, response.text
+                return [item["text"] for item in response.json()["items"]]
+
+            Config.ADMIN_TOKEN = ""
+            assert texts(client.get("/history", headers=alice)) == ["alice的记录"]
+            assert texts(client.get(f"/history?client={alice_key}", headers=alice)) == ["alice的记录"]
+            assert client.get(f"/history?client={bob_key}", headers=alice).status_code == 404
+            assert client.get("/history?all_clients=true", headers=alice).status_code == 404
+
+            Config.ADMIN_TOKEN = "secret"
+            assert client.get(f"/history?client={bob_key}", headers=alice).status_code == 403
+            assert client.get("/history?all_clients=true",
+                              headers={**alice, "X-Admin-Token": "wrong"}).status_code == 403
+            # 伪造 X-Client-Id 冒充bob: 身份仍是本机地址，既查不到bob的记录也不能指定bob
+            for spoofed in ("bob", bob_key):
+                assert texts(client.get("/history", headers={"X-Client-Id": spoofed})) == []
+                assert client.get(f"/history?client={bob_key}",
+                                  headers={"X-Client-Id": spoofed}).status_code == 403
+            assert client.get("/history?client=bob", headers={"X-Client-Id": "bob"}).status_code == 403
+            admin = {**alice, "X-Admin-Token": "secret"}
+            assert texts(client.get(f"/history?client={bob_key}", headers=admin)) == ["bob的记录"]
+            assert texts(client.get("/history?all_clients=true", headers=admin)) == ["bob的记录", "alice的记录"]
+        finally:
+            server.audit_log, Config.ADMIN_TOKEN = previous
+
+
+def main():
+    print("🧪 审计日志测试")
+    for test in (test_records_are_flushed_and_paginated,
+                 test_record_does_not_wait_for_disk,
+                 test_history_endpoint_limits_other_clients_to_admin):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+批量转录测试 - 随机初始化的小模型，CPU环境即可运行
+"""
+
+import io
+import os
+import sys
+import tarfile
+import tempfile
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import numpy as np
+
+from batch_transcription import BatchInputError, BatchJobStore, expand_upload, transcribe_batch
+from feature_cache import enable_feature_cache
+from test_client_profiles import make_model
+
+
+def test_expand_zip_and_tar_archives():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("notes/a.webm", b"a")
+        archive.writestr("b.wav", b"bb")
+        archive.writestr("readme.txt", b"skip")
+    items = expand_upload("notes.zip", buffer.getvalue(), max_files=10, max_bytes=100)
+    assert items == [("notes.zip/notes/a.webm", b"a"), ("notes.zip/b.wav", b"bb")]
+
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        info = tarfile.TarInfo("c.mp3")
+        info.size = 3
+        archive.addfile(info, io.BytesIO(b"ccc"))
+    assert expand_upload("x.tar.gz", buffer.getvalue(), 10, 100) == [("x.tar.gz/c.mp3", b"ccc")]
+    assert expand_upload("plain.webm", b"raw", 10, 100) == [("plain.webm", b"raw")]
+
+
+def test_archive_limits_checked_before_extraction():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("big.wav", b"\0" * 10000)
+    for max_files, max_bytes in ((0, 10 ** 6), (10, 1000)):
+        try:
+            expand_upload("bomb.zip", buffer.getvalue(), max_files, max_bytes)
+            raise AssertionError("超出上限时应拒绝")
+        except BatchInputError:
+            pass
+
+
+def test_batch_matches_single_and_encodes_once():
+    """一次批量推理与逐条解码结果相同，每条音频只过一次编码器"""
+    model = make_model()
+    enable_feature_cache(model)
+    rng = np.random.default_rng(0)
+    audios = [(rng.standard_normal(16000 * seconds) * 0.1).astype(np.float32) for seconds in (1, 2, 3)]
+
+    calls = []
+    model.encoder.conv1.register_forward_hook(lambda module, args, output: calls.append(args[0].shape[0]))
+    batched = transcribe_batch(model, audios, lambda mel: ["zh", "en", "zh"])
+    assert sum(calls) == 3
+    assert [r.language for r in batched] == ["zh", "en", "zh"]
+
+    for audio, result in zip(audios, batched):
+        single = transcribe_batch(model, [audio], result.language)[0]
+        assert single.text == result.text
+
+
+def test_job_store_progress_and_results():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = BatchJobStore(tmp)
+        job_id = store.create(total=3)
+        store.append(job_id, {"type": "result", "index": 1})
+        store.append(job_id, {"type": "error", "index": 0})
+        status = store.status(job_id)
+        assert (status["status"], status["completed"], status["failed"]) == ("running", 1, 1)
+        assert [r["index"] for r in store.results(job_id, offset=1)] == [0]
+        store.finish(job_id)
+        assert store.status(job_id)["status"] == "done"
+        assert store.status("../" + job_id) is None
+
+
+def main():
+    print("🧪 批量转录测试")
+    for test in (test_expand_zip_and_tar_archives,
+                 test_archive_limits_checked_before_extraction,
+                 test_batch_matches_single_and_encodes_once,
+                 test_job_store_progress_and_results):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+协作式取消测试 - 随机初始化的小模型与纯asyncio准入控制，CPU环境即可运行
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import torch
+
+from admission import AdmissionController, AdmissionRejected
+from cancellation import CancelRegistry, CancelToken, InferenceCancelled, cancel_scope, enable_cancellation
+from test_client_profiles import make_model
+
+
+def test_decode_aborts_between_tokens_and_model_stays_usable():
+    model = make_model()
+    enable_cancellation(model)
+    mel = torch.zeros(80, 3000)
+    expected = model.decode(mel, language="zh", without_timestamps=True, fp16=False, sample_len=8).text
+
+    token = CancelToken()
+    steps = []
+
+    def cancel_after_three(module, args, output):
+        steps.append(1)
+        if len(steps) == 3:
+            token.cancel("disconnected")
+
+    hook = model.decoder.token_embedding.register_forward_hook(cancel_after_three)
+    try:
+        with cancel_scope(token):
+            model.decode(mel, language="zh", without_timestamps=True, fp16=False, sample_len=50)
+        raise AssertionError("应当被取消")
+    except InferenceCancelled as e:
+        assert e.reason == "disconnected"
+    finally:
+        hook.remove()
+    assert len(steps) == 3 and token.windows == 1
+
+    # 取消后kv缓存已清理，下一次解码结果不受影响
+    assert model.decode(mel, language="zh", without_timestamps=True, fp16=False, sample_len=8).text == expected
+
+
+def test_deadline_cancels_token():
+    token = CancelToken(deadline=time.monotonic() - 1)
+    try:
+        token.check()
+        raise AssertionError("超过截止时间应当取消")
+    except InferenceCancelled as e:
+        assert e.reason == "deadline" and token.cancelled
+
+
+def test_registry_cancels_by_request_or_client():
+    registry = CancelRegistry()
+    with registry.register("alice", "r1") as first, registry.register("alice", "r2") as second, \
+            registry.register("bob", "r1") as other:
+        assert registry.cancel("alice", "r1") == 1
+        assert first.cancelled and not second.cancelled
+        assert registry.cancel("alice") == 2
+        assert second.cancelled and not other.cancelled
+    assert registry.in_flight() == 0
+
+
+def test_cancel_endpoint_ignores_spoofed_client_id():
+    """POST /cancel 只作用于调用者身份 (来源IP或有效API Key) 下的请求，伪造 X-Client-Id 取消不了别人的请求"""
+    import voice_api_server as server
+    from fastapi.testclient import TestClient
+
+    client = TestClient(server.app)
+    registry = server.inference_requests
+    # victim 来自另一个地址，own 为测试客户端地址下的同名 X-Client-Id
+    with registry.register("ip:10.0.0.5/victim", "v1") as victim, \
+            registry.register("ip:testclient/victim", "o1") as own:
+        for spoofed in ("victim", "ip:10.0.0.5/victim"):
+            response = client.post("/cancel", json={"request_id": "v1"}, headers={"X-Client-Id": spoofed})
+            assert response.json() == {"cancelled": 0}
+        assert client.post("/cancel", headers={"X-Client-Id": "ip:10.0.0.5/victim"}).json() == {"cancelled": 0}
+        assert not victim.cancelled and not own.cancelled
+        # 不带 request_id: 只取消调用者自己身份下的同名用户
+        assert client.post("/cancel", headers={"X-Client-Id": "victim"}).json() == {"cancelled": 1}
+        assert own.cancelled and not victim.cancelled
+
+
+def test_cancelled_request_leaves_queue():
+    async def scenario():
+        controller = AdmissionController(concurrency=1, rate=1.0, burst=100.0)
+        order = []
+
+        async def request(name, cancelled=None):
+            async with controller.admit(name, 5, cancelled):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        gate = asyncio.Event()
+
+        async def blocker():
+            async with controller.admit("blocker", 1):
+                await gate.wait()
+
+        first = asyncio.create_task(blocker())
+        await asyncio.sleep(0)
+        token = CancelToken()
+        abandoned = asyncio.create_task(request("abandoned", token.event))
+        live = asyncio.create_task(request("live"))
+        await asyncio.sleep(0)
+        assert controller.status()["queued"] == 2
+
+        token.cancel("cancelled")
+        try:
+            await abandoned
+            raise AssertionError("排队中的请求应当被移出")
+        except AdmissionRejected as e:
+            assert e.reason == "cancelled"
+        assert controller.status()["queued"] == 1
+        gate.set()
+        await asyncio.gather(first, live)
+        assert order == ["live"]
+        # 放弃排队的请求已退还令牌
+        assert controller._clients["abandoned"].bucket.tokens > 99
+    asyncio.run(scenario())
+
+
+def main():
+    print("🧪 协作式取消测试")
+    for test in (test_decode_aborts_between_tokens_and_model_stays_usable,
+                 test_deadline_cancels_token,
+                 test_registry_cancels_by_request_or_client,
+                 test_cancel_endpoint_ignores_spoofed_client_id,
+                 test_cancelled_request_leaves_queue):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+用户档案与词汇偏置测试 - 随机初始化的小模型，CPU环境即可运行；档案接口按可信身份隔离
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import torch
+from whisper.model import ModelDimensions, Whisper
+from whisper.tokenizer import get_tokenizer
+
+from client_profiles import ClientProfileStore, enable_profile_decoding, use_profile_prompt
+from metrics import metrics
+
+
+def make_model():
+    torch.manual_seed(0)
+    dims = ModelDimensions(
+        n_mels=80, n_audio_ctx=1500, n_audio_state=64, n_audio_head=2, n_audio_layer=1,
+        n_vocab=51865, n_text_ctx=448, n_text_state=64, n_text_head=2, n_text_layer=1
+    )
+    model = Whisper(dims).eval()
+    # 解码器位置编码由torch.empty创建，正常情况下会被权重覆盖，这里需要显式初始化
+    torch.nn.init.normal_(model.decoder.positional_embedding, std=0.02)
+    return model
+
+
+def tokenizer():
+    return get_tokenizer(True, num_languages=99, language="zh", task="transcribe")
+
+
+def test_prompt_tokens_cached_until_profile_changes():
+    store = ClientProfileStore()
+    tok = tokenizer()
+    store.set_custom_terms("alice", ["VS Code", "飞书"])
+    first = store.prompt("alice", "zh", tok)
+    hits = metrics.snapshot()["counters"].get("profile_prompt_hits", 0)
+    assert store.prompt("alice", "zh", tok) is first
+    assert metrics.snapshot()["counters"]["profile_prompt_hits"] == hits + 1
+    assert "飞书" in first.text and first.tokens == tok.encode(" " + first.text)
+
+    # 重复同一个指令不改变档案，缓存继续有效
+    store.record_command("alice", "记事本")
+    second = store.prompt("alice", "zh", tok)
+    assert second is not first and second.text.index("记事本") < second.text.index("VS Code")
+    store.record_command("alice", "记事本")
+    assert store.prompt("alice", "zh", tok) is second
+
+
+def test_store_evicts_least_recent_client():
+    store = ClientProfileStore(max_clients=2)
+    store.record_command("a", "记事本")
+    store.record_command("b", "计算器")
+    store.get("a")
+    store.record_command("c", "GitHub")
+    assert store.get("b") is None
+    assert store.get("a") is not None and len(store) == 2
+
+
+def test_bias_steers_decoding_toward_profile_terms():
+    """偏置足够大时，随机模型也会输出档案中的词汇"""
+    model = make_model()
+    enable_profile_decoding(model)
+    store = ClientProfileStore(bias=1e4)
+    store.set_custom_terms("alice", ["飞书"])
+    prompt = store.prompt("alice", "zh", tokenizer())
+    mel = torch.zeros(80, 3000)
+
+    with use_profile_prompt(prompt):
+        biased = model.decode(mel, language="zh", without_timestamps=True, fp16=False, sample_len=8)
+    plain = model.decode(mel, language="zh", without_timestamps=True, fp16=False, sample_len=8)
+    assert "飞书" in biased.text
+    assert "飞书" not in plain.text
+
+
+def test_cjk_term_bias_leaves_unrelated_transcript_alone():
+    """中文词汇不加空格变体，词首token只在词边界上提高: 无关语句中间不会冒出空格或半个汉字"""
+    tok = tokenizer()
+    store = ClientProfileStore(bias=1.0)
+    store.set_custom_terms("alice", ["记事本", "计算器", "VS Code"])
+    bias = store.prompt("alice", "zh", tok).bias
+    assert 220 not in bias.first_tokens
+    assert tok.encode(" VS Code")[0] in bias.spaced_first_tokens
+
+    # 模拟的模型: 每一步以0.4的差距偏好无关语句的下一个token (句首更有把握)，
+    # 空格与词汇的词首token紧随其后
+    transcript = tok.encode("今天天气很好，我们去公园散步吧")
+    competitors = bias.first_tokens + [220]
+
+    def greedy(logit_filter):
+        tokens = []
+        for step, expected in enumerate(transcript):
+            logits = torch.zeros(1, 51865)
+            logits[0, competitors] = 0.6
+            logits[0, expected] = 1.0 if step else 2.0
+            if logit_filter is not None:
+                logit_filter.apply(logits, torch.tensor([tokens], dtype=torch.long).reshape(1, -1))
+            tokens.append(int(logits.argmax()))
+        return tokens
+
+    assert greedy(None) == transcript
+    assert greedy(bias) == transcript
+
+    # 已输出词汇的前缀时仍然补全，英文单词后仍可接以空格开头的词首
+    logits = torch.zeros(1, 51865)
+    bias.apply(logits, torch.tensor([tok.encode("打开记事")]))
+    assert logits[0, tok.encode("记事本")[-1]] == 1.0 and logits[0, 220] == 0
+    logits = torch.zeros(1, 51865)
+    bias.apply(logits, torch.tensor([tok.encode(" open")]))
+    assert logits[0, tok.encode(" VS Code")[0]] == 0.5 and logits[0, tok.encode("记事本")[0]] == 0
+
+
+def test_profile_endpoint_ignores_spoofed_client_id():
+    """PUT /profile 写入调用者身份下的档案: 伪造 X-Client-Id 改不了其他IP/API Key下用户的词汇"""
+    import voice_api_server as server
+    from config import Config
+    from fastapi.testclient import TestClient
+
+    previous = (server.client_profiles, Config.API_KEYS)
+    server.client_profiles = ClientProfileStore()
+    Config.API_KEYS = ("alice-key",)
+    try:
+        client = TestClient(server.app)
+        alice = {"X-API-Key": "alice-key", "X-Client-Id": "laptop"}
+        victim = client.put("/profile", json={"custom_terms": ["飞书"]}, headers=alice).json()
+        assert victim["client"].startswith("key:") and victim["custom_terms"] == ["飞书"]
+
+        for spoofed in ({"X-Client-Id": "laptop"}, {"X-Client-Id": victim["client"]},
+                        {"X-API-Key": "guessed-key", "X-Client-Id": "laptop"}):
+            response = client.put("/profile", json={"custom_terms": ["恶意词"]}, headers=spoofed).json()
+            assert response["client"].startswith("ip:testclient/")
+        assert client.get("/profile", headers=alice).json()["custom_terms"] == ["飞书"]
+        assert server.client_profiles.get(victim["client"]).terms() == ["飞书"]
+    finally:
+        server.client_profiles, Config.API_KEYS = previous
+
+
+def main():
+    print("🧪 用户档案测试")
+    for test in (test_prompt_tokens_cached_until_profile_changes,
+                 test_store_evicts_least_recent_client,
+                 test_bias_steers_decoding_toward_profile_terms,
+                 test_cjk_term_bias_leaves_unrelated_transcript_alone,
+                 test_profile_endpoint_ignores_spoofed_client_id):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
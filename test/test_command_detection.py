@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+中英文指令识别测试 - 纯文本，无需模型
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from benchmark_command_detection import generate_utterances, load_pinned, mismatches
+from command_detection import smart_command_detection
+from language_id import LanguagePreferences
+
+
+def test_chinese_commands_unchanged():
+    assert smart_command_detection("打开记事本") == (True, "应用程序", "记事本")
+    assert smart_command_detection("去知乎看看") == (True, "网站", "知乎")
+    assert smart_command_detection("锁屏") == (True, "系统操作", "锁屏")
+    assert smart_command_detection("今天天气怎么样") == (False, "", "")
+
+
+def test_english_and_mixed_commands():
+    """中英混说在任一语言下都能一次匹配"""
+    for language in ("zh", "en"):
+        assert smart_command_detection("open GitHub", language) == (True, "网站", "GitHub")
+        assert smart_command_detection("打开 GitHub", language) == (True, "网站", "GitHub")
+        assert smart_command_detection("open 记事本", language) == (True, "应用程序", "记事本")
+    assert smart_command_detection("Open PowerShell.", "en") == (True, "应用程序", "PowerShell")
+    assert smart_command_detection("take a screenshot", "en") == (True, "系统操作", "截图")
+    assert smart_command_detection("what's the weather like today", "en") == (False, "", "")
+
+
+def test_ascii_aliases_match_whole_words():
+    """短英文别名不再命中单词内部 (如 https 中的 ps)"""
+    assert smart_command_detection("打开https网站") == (False, "", "")
+    assert smart_command_detection("打开ps") == (True, "应用程序", "PowerShell")
+    assert smart_command_detection("I want to run a marathon", "en") == (False, "", "")
+
+
+def test_english_system_actions_need_command_phrasing():
+    """sleep/lock/restart 等常见英文单词只在完整的指令说法中触发系统操作"""
+    for text in ("I did not sleep well last night, tell me a joke",
+                 "how do I lock a git branch",
+                 "can you restart the story from the beginning",
+                 "how do I turn off dark mode"):
+        for language in ("en", "zh"):
+            assert smart_command_detection(text, language) == (False, "", ""), (text, language)
+    assert smart_command_detection("put the computer to sleep", "en") == (True, "系统操作", "休眠")
+    assert smart_command_detection("please lock the screen", "en") == (True, "系统操作", "锁屏")
+    assert smart_command_detection("restart the computer now", "en") == (True, "系统操作", "重启")
+    assert smart_command_detection("shut down my computer", "en") == (True, "系统操作", "关机")
+
+
+def test_short_phrases_do_not_trigger_system_actions():
+    """短句不能只凭目标名触发关机、休眠等系统操作，中文的"关机"这类说法本身就是关键词"""
+    for text in ("Sleep tight", "Sleep well", "lock it", "Turn off", "Restart."):
+        assert smart_command_detection(text, "en") == (False, "", ""), text
+    for text in ("Sleep well", "lock it"):
+        assert smart_command_detection(text, "zh") == (False, "", ""), text
+    assert smart_command_detection("关机", "zh") == (True, "系统操作", "关机")
+    assert smart_command_detection("锁屏", "zh") == (True, "系统操作", "锁屏")
+    assert smart_command_detection("请登出。", "zh") == (True, "系统操作", "注销")
+    assert smart_command_detection("记事本", "zh") == (True, "应用程序", "记事本")
+
+
+def test_language_preferences_lru():
+    prefs = LanguagePreferences(max_users=2, history=3)
+    prefs.record("alice", "en")
+    prefs.record("alice", "en")
+    prefs.record("alice", "zh")
+    prefs.record("bob", "zh")
+    assert prefs.preferred("alice") == "en"
+    prefs.record("carol", "zh")
+    # alice刚被访问过，淘汰的是bob
+    assert prefs.preferred("bob") is None
+    assert len(prefs) == 2
+
+
+def test_pinned_intents_unchanged():
+    """固定期望意图表: 修改词典或纠错后若有意改变行为，用 --write-pinned 重新生成"""
+    pinned = load_pinned()
+    assert len(pinned) >= 500
+    diff = mismatches(smart_command_detection, pinned)
+    assert not diff, diff[:5]
+
+
+def test_fuzz_corpus_is_deterministic():
+    first = generate_utterances(300, seed=7)
+    assert first == generate_utterances(300, seed=7)
+    assert {u["kind"] for u in first} == {"clean", "homophone", "mixed", "bare", "typo", "chitchat"}
+    # 闲聊语句一律不应识别为指令
+    assert not any(smart_command_detection(u["text"], u["language"])[0]
+                   for u in first if u["kind"] == "chitchat")
+
+
+def main():
+    print("🧪 指令识别测试")
+    for test in (test_chinese_commands_unchanged,
+                 test_english_and_mixed_commands,
+                 test_ascii_aliases_match_whole_words,
+                 test_english_system_actions_need_command_phrasing,
+                 test_short_phrases_do_not_trigger_system_actions,
+                 test_language_preferences_lru,
+                 test_pinned_intents_unchanged,
+                 test_fuzz_corpus_is_deterministic):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
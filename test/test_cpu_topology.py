@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+CPU规划测试 - 用临时目录模拟cgroup与sysfs拓扑，不依赖本机核数
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from audio_decoder import configure_decoding, decode_audio_stream
+from cpu_topology import cgroup_cpu_quota, physical_cores, plan_cpus
+
+
+def test_cgroup_quota_v2_and_v1():
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        assert cgroup_cpu_quota(root) is None
+        (root / "cpu.max").write_text("max 100000\n")
+        assert cgroup_cpu_quota(root) is None
+        (root / "cpu.max").write_text("650000 100000\n")
+        assert cgroup_cpu_quota(root) == 6.5
+        (root / "cpu.max").unlink()
+        (root / "cpu").mkdir()
+        (root / "cpu" / "cpu.cfs_quota_us").write_text("-1\n")
+        (root / "cpu" / "cpu.cfs_period_us").write_text("100000\n")
+        assert cgroup_cpu_quota(root) is None
+        (root / "cpu" / "cpu.cfs_quota_us").write_text("200000\n")
+        assert cgroup_cpu_quota(root) == 2.0
+
+
+def test_physical_cores_groups_hyperthread_siblings():
+    with tempfile.TemporaryDirectory() as tmp:
+        sysfs = Path(tmp)
+        for cpu in range(8):
+            topology = sysfs / f"cpu{cpu}" / "topology"
+            topology.mkdir(parents=True)
+            (topology / "physical_package_id").write_text("0\n")
+            (topology / "core_id").write_text(f"{cpu % 4}\n")
+        assert physical_cores(range(8), sysfs) == [[0, 4], [1, 5], [2, 6], [3, 7]]
+        # 读不到拓扑的CPU单独成组
+        assert physical_cores([0, 9], sysfs) == [[0], [9]]
+
+
+def test_auto_plan_splits_cores_without_oversubscription():
+    plan = plan_cpus(list(range(32)))
+    assert (plan.workers, plan.torch_threads, plan.decode_slots) == (7, 4, 1)
+    assert plan.workers * plan.torch_threads + 4 <= 32 and plan.overrides == []
+
+    # cgroup配额向下取整后才是实际可用的核数
+    limited = plan_cpus(list(range(32)), quota=6.5)
+    assert limited.budget == 6 and limited.workers * limited.torch_threads <= 6
+
+    assert plan_cpus(list(range(32)), gpu=True).workers == 1
+    single = plan_cpus([0])
+    assert (single.workers, single.torch_threads, single.decode_slots) == (1, 1, 1)
+
+
+def test_config_overrides_take_precedence():
+    plan = plan_cpus(list(range(32)), workers=2, decode_slots=3)
+    assert (plan.workers, plan.torch_threads, plan.decode_slots) == (2, 14, 3)
+    assert plan.overrides == ["workers", "decode_slots"]
+
+
+def test_pinning_keeps_physical_cores_within_one_worker():
+    groups = [[core, core + 16] for core in range(16)]
+    plan = plan_cpus(list(range(32)), core_groups=groups, pin=True)
+    owners = {}
+    for index, cpus in enumerate(plan.worker_cpus):
+        assert len(cpus) == plan.torch_threads
+        for cpu in cpus:
+            owners.setdefault(cpu % 16, set()).add(index)
+    assert all(len(workers) == 1 for workers in owners.values())
+    assert plan.decode_cpus and not set(plan.decode_cpus) & {c for cpus in plan.worker_cpus for c in cpus}
+    assert plan.cpus_for_worker(1) == plan.worker_cpus[1]
+
+    # 放不下时不绑核
+    assert plan_cpus([0, 1], workers=2, torch_threads=2, pin=True).worker_cpus is None
+
+
+def test_decode_slots_still_decode():
+    import wave
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "silence.wav")
+        with wave.open(path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(16000)
+            f.writeframes(b"\x00\x00" * 16000)
+        configure_decoding(1, sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None)
+        try:
+            with open(path, "rb") as f:
+                audio, _ = decode_audio_stream(f)
+        finally:
+            configure_decoding()
+    assert len(audio) == 16000
+
+
+def main():
+    print("🧪 CPU规划测试")
+    for test in (test_cgroup_quota_v2_and_v1,
+                 test_physical_cores_groups_hyperthread_siblings,
+                 test_auto_plan_splits_cores_without_oversubscription,
+                 test_config_overrides_take_precedence,
+                 test_pinning_keeps_physical_cores_within_one_worker,
+                 test_decode_slots_still_decode):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
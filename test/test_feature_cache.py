@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+请求级特征缓存测试 - 随机初始化的小模型，CPU环境即可运行
+
+随机权重的输出压缩率很高，每个温度都会触发回退，正好用来统计编码器调用次数。
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+import torch
+from whisper.model import ModelDimensions, Whisper
+
+from feature_cache import enable_cached_log_mel, enable_feature_cache, request_features
+
+TEMPERATURES = (0.0, 0.2, 0.4)
+
+
+def make_model():
+    torch.manual_seed(0)
+    dims = ModelDimensions(
+        n_mels=80, n_audio_ctx=1500, n_audio_state=64, n_audio_head=2, n_audio_layer=1,
+        n_vocab=51865, n_text_ctx=448, n_text_state=64, n_text_head=2, n_text_layer=1
+    )
+    model = Whisper(dims).eval()
+    # 解码器位置编码由torch.empty创建，正常情况下会被权重覆盖，这里需要显式初始化
+    torch.nn.init.normal_(model.decoder.positional_embedding, std=0.02)
+    return model
+
+
+def count_encoder_calls(model):
+    """统计真正执行的编码器前向次数"""
+    calls = []
+    # 挂在第一层卷积上: 命中缓存时编码器被调用但不会真正执行
+    model.encoder.conv1.register_forward_hook(lambda module, args, output: calls.append(args[0].shape[0]))
+    return calls
+
+
+def transcribe(model, audio):
+    return model.transcribe(audio, language="zh", temperature=TEMPERATURES, fp16=False,
+                            condition_on_previous_text=False, without_timestamps=True)
+
+
+def make_audio(seconds=3):
+    t = np.arange(16000 * seconds) / 16000
+    return (0.3 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+
+
+def test_fallback_reuses_encoder_output():
+    """温度回退的每次重新解码都复用第一次的编码结果"""
+    audio = make_audio()
+
+    baseline = make_model()
+    baseline_calls = count_encoder_calls(baseline)
+    transcribe(baseline, audio)
+
+    cached = make_model()
+    enable_feature_cache(cached)
+    cached_calls = count_encoder_calls(cached)
+    with request_features(audio) as features:
+        transcribe(cached, audio)
+
+    print(f"   编码器调用: 无缓存 {len(baseline_calls)} 次, 有缓存 {len(cached_calls)} 次")
+    assert len(baseline_calls) == len(TEMPERATURES)
+    assert len(cached_calls) == 1
+    assert features.stats() == {"passes": 1, "cache_hits": len(TEMPERATURES) - 1}
+
+
+def test_batch_encodes_only_missing_rows():
+    """批量输入中已缓存的行不再编码，未命中的行合并为一个批次"""
+    model = make_model()
+    enable_feature_cache(model)
+    calls = count_encoder_calls(model)
+    mel = torch.randn(3, 80, 3000)
+    with request_features() as features:
+        first = model.encoder(mel[:1])
+        batch = model.encoder(mel)
+    assert calls == [1, 2]
+    assert torch.allclose(batch[0], first[0])
+    assert features.stats() == {"passes": 3, "cache_hits": 1}
+
+    # 请求上下文之外不走缓存
+    model.encoder(mel[:1])
+    assert calls == [1, 2, 1]
+
+
+def test_transcribe_reuses_request_log_mel():
+    """语言识别算过的log-mel直接给 whisper.transcribe 用，整段频谱只计算一次"""
+    audio = make_audio()
+    model = make_model()
+    expected = transcribe(model, audio)["text"]
+    enable_cached_log_mel()
+    stft = torch.stft
+    calls = []
+    torch.stft = lambda *args, **kwargs: calls.append(1) or stft(*args, **kwargs)
+    try:
+        with request_features(audio) as features:
+            features.log_mel(model.dims.n_mels)
+            text = transcribe(model, audio)["text"]
+        assert len(calls) == 1 and text == expected
+        # 请求上下文之外照常计算
+        transcribe(model, audio)
+        assert len(calls) == 2
+    finally:
+        torch.stft = stft
+
+
+def main():
+    print("🧪 特征缓存测试")
+    for test in (test_fallback_reuses_encoder_output,
+                 test_batch_encodes_only_missing_rows,
+                 test_transcribe_reuses_request_log_mel):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
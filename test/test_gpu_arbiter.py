@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+显存仲裁器测试 - 模拟显存 + 本地Ollama桩，CPU环境即可运行
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import requests
+
+from gpu_arbiter import GB, GPUMemoryArbiter, OllamaMemoryClient, SimulatedMemoryAccountant
+from stub_ollama import StubOllama
+
+
+def make_arbiter(total_gb=10, whisper_gb=3, llm_gb=8):
+    """搭建模拟环境: Whisper已在'GPU'上，Ollama桩加载模型时占用模拟显存"""
+    accountant = SimulatedMemoryAccountant(total_gb * GB)
+    accountant.allocate("whisper", whisper_gb * GB)
+    moves = []
+
+    def move_model(device):
+        moves.append(device)
+        if device == "cuda":
+            accountant.allocate("whisper", whisper_gb * GB)
+        else:
+            accountant.release("whisper")
+
+    stub = StubOllama(model_vram=llm_gb * GB)
+    stub.on_load = lambda model: accountant.allocate("ollama", llm_gb * GB)
+    stub.on_unload = lambda model: accountant.release("ollama")
+    base_url = stub.start()
+    arbiter = GPUMemoryArbiter(
+        accountant, move_model, whisper_bytes=whisper_gb * GB, llm_bytes=llm_gb * GB,
+        ollama=OllamaMemoryClient(base_url)
+    )
+    return arbiter, accountant, stub, base_url, moves
+
+
+def call_llm(arbiter, base_url):
+    with arbiter.llm_call():
+        response = requests.post(f"{base_url}/generate",
+                                 json={"model": "stub:latest", "prompt": "你好", "stream": False}, timeout=5)
+        return response.json()["response"]
+
+
+def test_llm_offloads_whisper_and_transcription_reloads():
+    """LLM显存不够时卸载Whisper，下次转录前通知Ollama卸载并把Whisper搬回"""
+    arbiter, accountant, stub, base_url, moves = make_arbiter()
+    try:
+        assert call_llm(arbiter, base_url) == stub.reply
+        assert moves == ["cpu"]
+        assert "ollama" in accountant.allocations
+
+        with arbiter.transcription() as device:
+            assert device == "cuda"
+        assert moves == ["cpu", "cuda"]
+        assert "ollama" not in accountant.allocations
+        assert any(body.get("keep_alive") == 0 for _, body in stub.requests)
+    finally:
+        stub.stop()
+
+
+def test_llm_waits_for_running_transcription():
+    """转录进行中时LLM调用排队，转录结束后才开始"""
+    arbiter, accountant, stub, base_url, moves = make_arbiter(total_gb=24)
+    events = []
+    try:
+        with arbiter.transcription():
+            worker = threading.Thread(target=lambda: events.append(("llm", call_llm(arbiter, base_url))))
+            worker.start()
+            time.sleep(0.2)
+            assert arbiter.status()["queued_llm_calls"] == 1
+            events.append(("asr_done", None))
+        worker.join(5)
+        assert [name for name, _ in events] == ["asr_done", "llm"]
+        # 显存充足时不需要搬移Whisper
+        assert moves == []
+    finally:
+        stub.stop()
+
+
+def test_transcription_stays_on_cpu_while_llm_active():
+    """LLM占用显存期间到来的转录留在CPU执行，不与LLM争抢"""
+    arbiter, accountant, stub, base_url, moves = make_arbiter()
+    try:
+        with arbiter.llm_call():
+            with arbiter.transcription() as device:
+                assert device == "cpu"
+        assert moves == ["cpu"]
+    finally:
+        stub.stop()
+
+
+def main():
+    print("🧪 显存仲裁器测试")
+    for test in (test_llm_offloads_whisper_and_transcription_reloads,
+                 test_llm_waits_for_running_transcription,
+                 test_transcription_stays_on_cpu_while_llm_active):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
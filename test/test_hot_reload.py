@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+配置热更新测试 - 指令规则编译与整体替换、文件监视、非法规则与配置回退、管理接口
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from command_detection import (COMMAND_PATTERNS, COMMAND_TABLES, active_rules, compile_rules, install_rules,
+                               preprocess_chinese_text, smart_command_detection)
+from config import Config
+from hot_reload import HotReloader
+
+
+def custom_rules(target: str, alias: str) -> dict:
+    zh = json.loads(json.dumps(COMMAND_PATTERNS, ensure_ascii=False))
+    zh["应用程序"]["targets"][target] = [alias]
+    return {"commands": {"zh": zh}, "corrections": {"记事薄": "记事本"}}
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_compiled_rules_swap_as_one_version():
+    original = active_rules()
+    try:
+        assert compile_rules().digest == original.digest
+        rules = compile_rules({**COMMAND_TABLES, "zh": custom_rules("音乐播放器", "播放器")["commands"]["zh"]},
+                              {"记事薄": "记事本"})
+        assert rules.digest != original.digest
+        assert smart_command_detection("打开播放器") == (False, "", "")
+        assert install_rules(rules) is original
+        assert smart_command_detection("打开播放器") == (True, "应用程序", "音乐播放器")
+        assert preprocess_chinese_text("打开记事薄") == "打开记事本"
+        assert preprocess_chinese_text("计时版") == "计时版"      # 纠错表整体替换
+    finally:
+        install_rules(original)
+    assert smart_command_detection("打开记事本") == (True, "应用程序", "记事本")
+
+
+def test_invalid_rules_are_rejected():
+    for tables, corrections in (({"en": {}}, {}),
+                                ({"zh": {"应用程序": {"keywords": ["打开"], "targets": {"记事本": [""]}}}}, {}),
+                                ({"zh": {"应用程序": {"keywords": "打开", "targets": {}}}}, {}),
+                                (COMMAND_TABLES, {"错": 1})):
+        try:
+            compile_rules(tables, corrections)
+            raise AssertionError(f"应当拒绝: {tables} {corrections}")
+        except ValueError:
+            pass
+
+
+def test_detection_never_sees_half_swapped_rules():
+    original = active_rules()
+    a = compile_rules({**COMMAND_TABLES, "zh": custom_rules("记事本", "小本本")["commands"]["zh"]})
+    b = compile_rules({**COMMAND_TABLES, "zh": custom_rules("画图", "小本本")["commands"]["zh"]})
+    seen, errors, stop = set(), [], threading.Event()
+
+    def detect():
+        while not stop.is_set():
+            try:
+                seen.add(smart_command_detection("打开小本本"))
+            except Exception as e:
+                errors.append(e)
+
+    install_rules(a)
+    threads = [threading.Thread(target=detect) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        deadline, i = time.monotonic() + 0.3, 0
+        while time.monotonic() < deadline:
+            install_rules(a if i % 2 else b)
+            i += 1
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        stop.set()
+        install_rules(original)
+    assert not errors
+    assert seen == {(True, "应用程序", "记事本"), (True, "应用程序", "画图")}
+
+
+def test_file_watch_applies_rules_and_reloadable_config():
+    workdir = tempfile.mkdtemp(prefix="hot-reload-")
+    rules_file, env_file = os.path.join(workdir, "rules.json"), os.path.join(workdir, ".env")
+    original_rules = active_rules()
+    saved = {name: getattr(Config, name) for name in Config.RELOADABLE}
+    saved_environ = {key: os.environ.get(key) for key in ("WHISPER_LANGUAGE", "WHISPER_MODEL")}
+    applied = []
+    reloader = HotReloader(rules_file, env_file, interval=0.05, on_config=applied.append)
+    reloader.start()
+    try:
+        assert reloader.reload() == {"version": 1, "changed": False}
+        with open(rules_file, "w", encoding="utf-8") as f:
+            json.dump(custom_rules("音乐播放器", "播放器"), f, ensure_ascii=False)
+        assert wait_for(lambda: smart_command_detection("打开播放器")[0])
+        assert reloader.version == 2 and reloader.status()["rules"]["source"] == "file"
+
+        # 不合法的规则: 保持当前版本，记录错误；修正后自动恢复
+        with open(rules_file, "w", encoding="utf-8") as f:
+            f.write("{broken")
+        assert wait_for(lambda: reloader.last_error is not None)
+        assert reloader.version == 2 and smart_command_detection("打开播放器")[0]
+        os.remove(rules_file)
+        assert wait_for(lambda: active_rules().digest == original_rules.digest)
+        assert reloader.version == 3 and reloader.last_error is None
+
+        # .env: 解码参数直接生效，模型名改动只提示需要重启
+        with open(env_file, "w", encoding="utf-8") as f:
+            f.write("WHISPER_LANGUAGE=auto\nWHISPER_MODEL=tiny\n")
+        assert wait_for(lambda: Config.WHISPER_LANGUAGE == "auto")
+        assert reloader.version == 4 and applied == [{"WHISPER_LANGUAGE": "auto"}]
+        assert reloader.pending_restart == ["WHISPER_MODEL"] and Config.WHISPER_MODEL != "tiny"
+        status = reloader.status()
+        assert status["config"]["WHISPER_LANGUAGE"] == "auto" and status["pending_restart"] == ["WHISPER_MODEL"]
+        assert {key: os.environ.get(key) for key in saved_environ} == saved_environ   # 不写环境变量
+
+        # 不合法的值: 整份.env不生效
+        with open(env_file, "w", encoding="utf-8") as f:
+            f.write("WHISPER_LANGUAGE=en\nWHISPER_LANGUAGES=zh,xx\n")
+        assert wait_for(lambda: reloader.last_error is not None)
+        assert "WHISPER_LANGUAGES" in reloader.last_error and reloader.version == 4
+        assert Config.WHISPER_LANGUAGE == "auto" and Config.WHISPER_LANGUAGES == saved["WHISPER_LANGUAGES"]
+
+        # 从.env删除的配置恢复为启动时的值
+        with open(env_file, "w", encoding="utf-8") as f:
+            f.write("# 空\n")
+        assert wait_for(lambda: Config.WHISPER_LANGUAGE == saved["WHISPER_LANGUAGE"])
+        assert reloader.version == 5 and reloader.pending_restart == [] and reloader.last_error is None
+    finally:
+        reloader.stop()
+        install_rules(original_rules)
+        for name, value in saved.items():
+            setattr(Config, name, value)
+
+
+def test_reloadable_values_are_validated():
+    defaults = Config.read_reloadable({})
+    assert defaults["WHISPER_LANGUAGE"] == "zh" and defaults["WHISPER_LANGUAGES"] == ("zh", "en")
+    values = Config.read_reloadable({"WHISPER_LANGUAGES": "ja, ko", "WHISPER_TEMPERATURES": "0,0.5",
+                                     "AI_REPLY_ENABLED": "False", "OLLAMA_KEEP_ALIVE": "-1"})
+    assert values["WHISPER_LANGUAGES"] == ("ja", "ko") and values["WHISPER_TEMPERATURES"] == (0.0, 0.5)
+    assert values["AI_REPLY_ENABLED"] is False and values["OLLAMA_KEEP_ALIVE"] == "-1"
+    for name, value in (("WHISPER_LANGUAGE", "chinese"), ("WHISPER_LANGUAGES", ""), ("LANGUAGE_ID_MIN_PROB", "1.5"),
+                        ("WHISPER_TEMPERATURES", "0,abc"), ("REQUEST_TIMEOUT_SECONDS", "-1"),
+                        ("BATCH_MAX_FILES", "0"), ("OLLAMA_KEEP_ALIVE", "forever")):
+        try:
+            Config.read_reloadable({name: value})
+            raise AssertionError(f"应当拒绝: {name}={value}")
+        except ValueError as e:
+            assert str(e).startswith(f"{name}={value} ")
+
+
+def test_admin_endpoints_reload_without_touching_model():
+    import voice_api_server as server
+    from asr_engines import StubEngine
+    from fastapi.testclient import TestClient
+
+    workdir = tempfile.mkdtemp(prefix="hot-reload-")
+    rules_file = os.path.join(workdir, "rules.json")
+    engine = StubEngine()
+    previous = (server.asr_engine, server.config_reloader, Config.ADMIN_TOKEN)
+    original_rules = active_rules()
+    server.asr_engine = engine
+    server.config_reloader = HotReloader(rules_file, os.path.join(workdir, ".env"), interval=0)
+    try:
+        client = TestClient(server.app)
+        Config.ADMIN_TOKEN = ""
+        assert client.post("/admin/reload").status_code == 404
+        Config.ADMIN_TOKEN = "secret"
+        assert client.get("/admin/config", headers={"X-Admin-Token": "wrong"}).status_code == 403
+        headers = {"X-Admin-Token": "secret"}
+
+        with open(rules_file, "w", encoding="utf-8") as f:
+            json.dump(custom_rules("音乐播放器", "播放器"), f, ensure_ascii=False)
+        result = client.post("/admin/reload", headers=headers).json()
+        assert result["changed"] and result["version"] == 2 and result["rules_digest"] == active_rules().digest
+        assert client.post("/process", json={"text": "打开播放器", "execute_commands": False}).json()["command_type"] == "应用程序"
+        assert server.asr_engine is engine                   # 模型始终未重新加载
+
+        with open(rules_file, "w", encoding="utf-8") as f:
+            f.write("[]")
+        response = client.post("/admin/reload", headers=headers)
+        assert response.status_code == 400 and "JSON对象" in response.json()["detail"]
+        config = client.get("/admin/config", headers=headers).json()
+        assert config["version"] == 2 and config["last_error"] and config["rules"]["digest"] == active_rules().digest
+        health = client.get("/health").json()
+        assert health["config_version"] == 2 and health["command_rules"] == active_rules().digest
+    finally:
+        install_rules(original_rules)
+        server.asr_engine, server.config_reloader, Config.ADMIN_TOKEN = previous
+
+
+def main():
+    print("🧪 配置热更新测试")
+    for test in (test_compiled_rules_swap_as_one_version,
+                 test_invalid_rules_are_rejected,
+                 test_detection_never_sees_half_swapped_rules,
+                 test_file_watch_applies_rules_and_reloadable_config,
+                 test_reloadable_values_are_validated,
+                 test_admin_endpoints_reload_without_touching_model):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+空闲卸载测试 - IdleOffloadManager 的卸载/唤醒/使用中判定，以及服务端mmap卸载目标的后台权重转换
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import torch
+from whisper.model import ModelDimensions, Whisper
+
+from model_idle import IdleOffloadManager
+
+
+class FakeModel:
+    """记录卸载与唤醒次数"""
+
+    def __init__(self, offload_ok: bool = True):
+        self.offload_ok = offload_ok
+        self.offloads = 0
+        self.reloads = 0
+
+    def offload(self) -> bool:
+        if self.offload_ok:
+            self.offloads += 1
+        return self.offload_ok
+
+    def reload(self) -> None:
+        time.sleep(0.05)
+        self.reloads += 1
+
+
+def make_manager(model: FakeModel, timeout: float = 0.05) -> IdleOffloadManager:
+    return IdleOffloadManager(timeout, "cpu", offload=model.offload, reload=model.reload)
+
+
+def test_offloads_only_after_timeout_and_wakes_on_use():
+    model = FakeModel()
+    manager = make_manager(model)
+    assert not manager.check()                       # 刚创建，未到超时
+    time.sleep(0.08)
+    assert manager.check() and manager.offloaded and model.offloads == 1
+    assert not manager.check()                       # 已卸载，不重复卸载
+
+    with manager.in_use():
+        assert not manager.offloaded and model.reloads == 1
+    assert not manager.check()                       # 使用结束后重新计时
+    time.sleep(0.08)
+    assert manager.check() and model.offloads == 2
+    assert manager.status()["offloaded"] is True
+
+
+def test_never_offloads_while_in_use():
+    model = FakeModel()
+    manager = make_manager(model)
+    with manager.in_use():
+        time.sleep(0.08)
+        assert not manager.check() and model.offloads == 0
+    time.sleep(0.08)
+    assert manager.check()
+
+
+def test_concurrent_requests_wake_model_once():
+    model = FakeModel()
+    manager = make_manager(model)
+    time.sleep(0.08)
+    manager.check()
+
+    def use():
+        with manager.in_use():
+            time.sleep(0.02)
+
+    threads = [threading.Thread(target=use) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert model.reloads == 1 and not manager.offloaded
+
+
+def test_failed_offload_is_retried_next_period():
+    model = FakeModel(offload_ok=False)
+    manager = make_manager(model)
+    time.sleep(0.08)
+    assert not manager.check() and not manager.offloaded
+    assert not manager.check()                       # 失败后推迟一个超时周期
+    model.offload_ok = True
+    time.sleep(0.08)
+    assert manager.check() and manager.offloaded
+
+
+def test_mmap_target_converts_in_background_and_skips_until_ready():
+    """mmap权重在独立进程中转换，转换完成前不卸载；完成后卸载并从映射文件唤醒"""
+    import convert_whisper_weights
+    import voice_api_server as server
+    from config import Config
+
+    cache = Path(tempfile.mkdtemp(prefix="idle-offload-"))
+    dims = ModelDimensions(n_mels=80, n_audio_ctx=1500, n_audio_state=64, n_audio_head=2, n_audio_layer=1,
+                           n_vocab=51865, n_text_ctx=448, n_text_state=64, n_text_head=2, n_text_layer=1)
+    model = Whisper(dims).eval()
+    torch.nn.init.normal_(model.decoder.positional_embedding)
+    torch.save({"dims": dims.__dict__, "model_state_dict": model.state_dict()}, cache / "tiny-idle.pt")
+
+    names = ("whisper_model", "whisper_model_name", "whisper_device", "idle_manager", "asr_engine",
+             "whisper_engine", "WHISPER_CACHE", "gpu_arbiter")
+    previous = {name: getattr(server, name) for name in names}
+    previous_cache = convert_whisper_weights.WHISPER_CACHE
+    previous_config = (Config.IDLE_OFFLOAD_MINUTES, Config.IDLE_OFFLOAD_TARGET)
+    try:
+        server.WHISPER_CACHE = convert_whisper_weights.WHISPER_CACHE = cache
+        server.whisper_model, server.whisper_model_name, server.whisper_device = model, "tiny-idle", "cpu"
+        server.asr_engine = server.whisper_engine = object()
+        server.gpu_arbiter = None
+
+        # CPU上的cpu目标没有可释放的内存: 不启用
+        Config.IDLE_OFFLOAD_MINUTES, Config.IDLE_OFFLOAD_TARGET = 60, "cpu"
+        server.idle_manager = None
+        server.start_idle_offload()
+        assert server.idle_manager is None
+
+        server.idle_manager = IdleOffloadManager(0, "mmap", server.offload_idle_model, server.reload_idle_model)
+        assert not server.offload_idle_model()          # 尚未转换: 跳过，模型保持加载
+        assert server.whisper_model is model
+
+        thread = server.prepare_mmap_weights()
+        assert server.prepare_mmap_weights() is None    # 锁文件: 不重复转换
+        thread.join(timeout=120)
+        assert (cache / "tiny-idle.safetensors").exists()
+        assert not (cache / "tiny-idle.safetensors.lock").exists()
+
+        assert server.idle_manager.check() and server.whisper_model is None
+        with server.idle_manager.in_use():
+            reloaded = server.whisper_model
+            assert reloaded is not None
+            assert torch.equal(reloaded.decoder.positional_embedding, model.decoder.positional_embedding)
+    finally:
+        for name, value in previous.items():
+            setattr(server, name, value)
+        convert_whisper_weights.WHISPER_CACHE = previous_cache
+        Config.IDLE_OFFLOAD_MINUTES, Config.IDLE_OFFLOAD_TARGET = previous_config
+
+
+def main():
+    print("🧪 空闲卸载测试")
+    for test in (test_offloads_only_after_timeout_and_wakes_on_use,
+                 test_never_offloads_while_in_use,
+                 test_concurrent_requests_wake_model_once,
+                 test_failed_offload_is_retried_next_period,
+                 test_mmap_target_converts_in_background_and_skips_until_ready):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
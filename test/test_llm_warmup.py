@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Ollama保温与预取测试 - 使用本地Ollama桩服务
+"""
+
+import io
+import os
+import sys
+import time
+import wave
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import llm_warmup
+from llm_warmup import OllamaWarmKeeper
+from metrics import metrics
+from stub_ollama import StubOllama
+
+MODEL = "qwen3:14b"
+
+
+def counter(name: str) -> float:
+    return metrics.snapshot()["counters"].get(name, 0)
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_check_loads_once_then_only_refreshes_keep_alive():
+    stub = StubOllama(load_seconds=0.1)
+    keeper = OllamaWarmKeeper(stub.start(), MODEL, keep_alive="10m")
+    try:
+        pings = counter("llm_keepalive_pings")
+        assert keeper.check("warm") is True and MODEL in stub.loaded
+        assert llm_warmup.recent_loads[-1]["reason"] == "warm"
+        assert llm_warmup.recent_loads[-1]["load_seconds"] >= 0.1
+        assert keeper.check() is False and counter("llm_keepalive_pings") == pings + 1
+        generates = [body for path, body in stub.requests if path == "/api/generate"]
+        assert all(body["keep_alive"] == "10m" and body["prompt"] == "" for body in generates)
+    finally:
+        stub.stop()
+
+
+def test_unloaded_model_respects_arbiter_policy():
+    stub = StubOllama()
+    keeper = OllamaWarmKeeper(stub.start(), MODEL, reload_unloaded=False)
+    try:
+        keeper.check("warm")
+        stub.loaded.clear()            # 被仲裁器或Ollama空闲策略卸载
+        detected = counter("llm_unloaded_detected")
+        assert keeper.check() is False and MODEL not in stub.loaded
+        assert counter("llm_unloaded_detected") == detected + 1 and keeper.loaded is False
+        # 预取时仍然加载
+        assert keeper.check("prefetch") is True and MODEL in stub.loaded
+    finally:
+        stub.stop()
+
+
+def test_prefetch_loads_in_background_inside_llm_slot():
+    stub = StubOllama(load_seconds=0.2)
+    slots = []
+
+    @contextmanager
+    def slot():
+        slots.append("enter")
+        yield
+
+    keeper = OllamaWarmKeeper(stub.start(), MODEL, interval=60, slot=slot, reload_unloaded=False)
+    keeper.start(warm_now=False)
+    try:
+        time.sleep(0.1)
+        assert MODEL not in stub.loaded and not slots
+        start = time.perf_counter()
+        keeper.prefetch()
+        keeper.prefetch()
+        assert time.perf_counter() - start < 0.05       # 不阻塞调用方
+        assert wait_for(lambda: MODEL in stub.loaded)
+        assert wait_for(lambda: keeper.loaded)
+        assert slots == ["enter"] and llm_warmup.recent_loads[-1]["reason"] == "prefetch"
+    finally:
+        keeper.stop()
+        stub.stop()
+
+
+def test_prefetch_only_when_ai_reply_is_possible_and_request_loads_are_recorded():
+    import voice_api_server as server
+    from asr_engines import StubEngine
+    from config import Config
+    from fastapi.testclient import TestClient
+
+    stub = StubOllama(load_seconds=0.05)
+    base = stub.start()
+    previous = (server.asr_engine, server.llm_keeper, server.OLLAMA_API_BASE, server.reply_cache,
+                Config.AI_REPLY_ENABLED)
+    server.OLLAMA_API_BASE = base
+    server.reply_cache = None
+    server.llm_keeper = OllamaWarmKeeper(base, server.reply_models()[0], interval=60, reload_unloaded=False)
+    server.llm_keeper.start(warm_now=False)
+    prefetches = []
+    prefetch = server.llm_keeper.prefetch
+    server.llm_keeper.prefetch = lambda: (prefetches.append(1), prefetch())
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(b"\x00\x00" * 16000)
+
+    def post(path: str, **form):
+        files = {"audio_file": ("a.wav", buffer.getvalue(), "audio/wav")}
+        return client.post(path, files=files, data={"execute_commands": "false", **form})
+
+    try:
+        client = TestClient(server.app)
+        server.asr_engine = StubEngine(text="打开记事本")
+        assert post("/voice", ai_reply="true").json()["is_command"]
+        time.sleep(0.2)
+        assert not prefetches and not stub.loaded
+
+        # 普通对话但不会请求AI回复: 只转录、未要求回复、AI回复已关闭，都不预取
+        server.asr_engine = StubEngine(text="给我讲讲黑洞是怎么形成的")
+        assert not post("/transcribe").json()["is_command"]
+        post("/voice", ai_reply="false")
+        Config.AI_REPLY_ENABLED = False
+        post("/voice", ai_reply="true")
+        Config.AI_REPLY_ENABLED = True
+        assert not prefetches
+
+        response = post("/voice", ai_reply="true", stream="true")
+        assert response.text.splitlines()[-1] == '{"type": "done"}'
+        assert prefetches == [1] and server.reply_models()[0] in stub.loaded
+
+        # 模型被卸载后由请求本身承担加载 (冷启动)，同样记入加载事件
+        stub.loaded.clear()
+        loads = counter("llm_loads_request")
+        server.get_ai_response("黑洞是什么")
+        assert counter("llm_loads_request") == loads + 1
+        assert llm_warmup.recent_loads[-1]["reason"] == "request"
+    finally:
+        server.llm_keeper.stop()
+        stub.stop()
+        (server.asr_engine, server.llm_keeper, server.OLLAMA_API_BASE, server.reply_cache,
+         Config.AI_REPLY_ENABLED) = previous
+
+
+def main():
+    print("🧪 Ollama保温与预取测试")
+    for test in (test_check_loads_once_then_only_refreshes_keep_alive,
+                 test_unloaded_model_respects_arbiter_policy,
+                 test_prefetch_loads_in_background_inside_llm_slot,
+                 test_prefetch_only_when_ai_reply_is_possible_and_request_loads_are_recorded):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
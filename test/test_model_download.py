@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+模型下载测试 - 在本地HTTP文件服务上验证并行分块下载、断点续传、镜像切换、
+SHA-256校验失败处理、不支持Range时的整体下载，以及下载后转换为safetensors
+"""
+
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from model_download import ChecksumMismatch, DownloadError, ModelDownloader, expected_sha256
+
+PAYLOAD = os.urandom(1024 * 1024 + 12345)
+SHA256 = hashlib.sha256(PAYLOAD).hexdigest()
+CHUNK = 64 * 1024
+
+
+class FileServer(ThreadingHTTPServer):
+    """提供 /model.pt 的本地服务；fail_after 次分块请求后返回503模拟网络中断，ranges=False 时忽略Range"""
+    daemon_threads = True
+
+    def __init__(self, payload: bytes, ranges: bool = True):
+        super().__init__(("127.0.0.1", 0), FileHandler)
+        self.payload = payload
+        self.ranges = ranges
+        self.fail_after = None
+        self.range_requests = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/model.pt"
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if self.path != "/model.pt":
+            self.send_error(404)
+            return
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if match and server.ranges:
+            start, end = int(match.group(1)), min(int(match.group(2)), len(server.payload) - 1)
+            with server.lock:
+                server.range_requests += 1
+                failing = server.fail_after is not None and server.range_requests > server.fail_after
+            if failing and start > 0:
+                self.send_error(503)
+                return
+            body = server.payload[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(server.payload)}")
+        else:
+            body = server.payload
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+        with server.lock:
+            server.bytes_sent += len(body)
+
+
+@contextmanager
+def file_server(payload: bytes = PAYLOAD, ranges: bool = True):
+    server = FileServer(payload, ranges)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def leftovers(target: Path) -> list:
+    return sorted(p.name for p in target.parent.iterdir() if p.name != target.name)
+
+
+def test_expected_sha256_from_official_url():
+    url = "https://openaipublic.azureedge.net/main/whisper/models/" + "ab" * 32 + "/tiny.pt"
+    assert expected_sha256(url) == "ab" * 32
+    assert expected_sha256("http://mirror/tiny.pt") is None
+
+
+def test_parallel_download_verifies_and_moves_atomically():
+    with file_server() as server:
+        target = Path(tempfile.mkdtemp(prefix="download-")) / "model.pt"
+        progress = []
+        downloader = ModelDownloader([server.url], target, SHA256, workers=4, chunk_size=CHUNK,
+                                     progress=lambda done, total: progress.append((done, total)))
+        assert downloader.download() == target
+        assert target.read_bytes() == PAYLOAD
+        assert leftovers(target) == []                        # 不留 .part 与状态文件
+        assert downloader.stats["sha256"] == SHA256 and downloader.stats["downloaded_bytes"] == len(PAYLOAD)
+        assert server.range_requests == 1 + (len(PAYLOAD) + CHUNK - 1) // CHUNK
+        assert progress[-1] == (len(PAYLOAD), len(PAYLOAD))
+
+
+def test_interrupted_download_resumes_missing_chunks():
+    with file_server() as server:
+        target = Path(tempfile.mkdtemp(prefix="download-")) / "model.pt"
+        server.fail_after = 6                                 # 探测1次 + 5个分块后“断网”
+        try:
+            ModelDownloader([server.url], target, SHA256, workers=2, chunk_size=CHUNK, retries=1).download()
+            raise AssertionError("应当下载失败")
+        except DownloadError:
+            pass
+        assert not target.exists() and leftovers(target) == ["model.pt.part", "model.pt.part.json"]
+
+        server.fail_after = None
+        server.bytes_sent = 0
+        downloader = ModelDownloader([server.url], target, SHA256, workers=2, chunk_size=CHUNK)
+        downloader.download()
+        assert target.read_bytes() == PAYLOAD and leftovers(target) == []
+        assert downloader.stats["resumed_bytes"] >= 5 * CHUNK
+        assert server.bytes_sent <= len(PAYLOAD) - 5 * CHUNK + 1
+
+
+def test_dead_mirror_fails_over_to_next():
+    with file_server() as server:
+        target = Path(tempfile.mkdtemp(prefix="download-")) / "model.pt"
+        dead = "http://127.0.0.1:9/model.pt"
+        missing = server.url.replace("model.pt", "missing.pt")
+        ModelDownloader([dead, missing, server.url], target, SHA256, workers=3, chunk_size=CHUNK,
+                        timeout=2).download()
+        assert target.read_bytes() == PAYLOAD
+
+    with file_server() as flaky, file_server() as good:
+        target = Path(tempfile.mkdtemp(prefix="download-")) / "model.pt"
+        flaky.fail_after = 3                                  # 第一个镜像中途出错: 后续分块改用第二个镜像
+        ModelDownloader([flaky.url, good.url], target, SHA256, workers=2, chunk_size=CHUNK).download()
+        assert target.read_bytes() == PAYLOAD and good.range_requests > 1
+
+
+def test_checksum_mismatch_discards_download():
+    with file_server() as server:
+        target = Path(tempfile.mkdtemp(prefix="download-")) / "model.pt"
+        try:
+            ModelDownloader([server.url], target, "0" * 64, chunk_size=CHUNK).download()
+            raise AssertionError("应当校验失败")
+        except ChecksumMismatch:
+            pass
+        assert leftovers(target) == [] and not target.exists()
+
+
+def test_server_without_range_downloads_whole_file():
+    with file_server(ranges=False) as server:
+        target = Path(tempfile.mkdtemp(prefix="download-")) / "model.pt"
+        downloader = ModelDownloader([server.url], target, SHA256, workers=4, chunk_size=CHUNK)
+        downloader.download()
+        assert target.read_bytes() == PAYLOAD and downloader.stats["sha256"] == SHA256
+
+
+def test_downloaded_checkpoint_converts_to_serving_format():
+    import io
+
+    import torch
+    from whisper.model import ModelDimensions, Whisper
+
+    from convert_whisper_weights import load_mmap_model
+    from model_download import convert_for_serving
+
+    dims = ModelDimensions(n_mels=80, n_audio_ctx=1500, n_audio_state=64, n_audio_head=2, n_audio_layer=1,
+                           n_vocab=51865, n_text_ctx=448, n_text_state=64, n_text_head=2, n_text_layer=1)
+    model = Whisper(dims)
+    torch.nn.init.normal_(model.decoder.positional_embedding)
+    buffer = io.BytesIO()
+    torch.save({"dims": dims.__dict__, "model_state_dict": model.state_dict()}, buffer)
+    payload = buffer.getvalue()
+
+    with file_server(payload) as server:
+        target = Path(tempfile.mkdtemp(prefix="download-")) / "tiny-test.pt"
+        ModelDownloader([server.url], target, hashlib.sha256(payload).hexdigest(), chunk_size=CHUNK).download()
+    converted = convert_for_serving(target)
+    assert converted == target.with_suffix(".safetensors") and converted.exists()
+    loaded = load_mmap_model(converted, "cpu")
+    assert torch.equal(loaded.decoder.positional_embedding, model.decoder.positional_embedding)
+
+
+def main():
+    print("🧪 模型下载测试")
+    for test in (test_expected_sha256_from_official_url,
+                 test_parallel_download_verifies_and_moves_atomically,
+                 test_interrupted_download_resumes_missing_chunks,
+                 test_dead_mirror_fails_over_to_next,
+                 test_checksum_mismatch_discards_download,
+                 test_server_without_range_downloads_whole_file,
+                 test_downloaded_checkpoint_converts_to_serving_format):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+多进程预加载测试
+- 重启退避: 启动即崩溃的worker重启间隔翻倍，正常运行后退出的worker立即重启
+- 以桩引擎 (ASR_ENGINE=stub) 启动2个worker: 两个worker都响应 /health，被杀掉的worker重新fork
+- 启动即崩溃的worker不会被反复fork
+"""
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import requests
+
+from prefork import RestartBackoff
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SERVER = os.path.join(ROOT, "voice_api_server.py")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def seen_pids(url: str, want: set, timeout: float = 60) -> set:
+    """反复请求 /health (每次新连接，由不同worker accept)，直到见到的pid包含 want 的所有条件或超时"""
+    pids = set()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            pids.add(requests.get(f"{url}/health", timeout=2).json()["worker_pid"])
+        except requests.RequestException:
+            time.sleep(0.1)
+            continue
+        if want(pids):
+            break
+    return pids
+
+
+def test_restart_backoff_doubles_for_startup_crashes():
+    backoff = RestartBackoff(base=0.5, max_delay=4, min_uptime=10)
+    assert [backoff.delay(0, 0.1) for _ in range(5)] == [0.5, 1, 2, 4, 4]
+    assert backoff.delay(1, 0.1) == 0.5                      # 各worker分别计数
+    assert backoff.delay(0, 60) == 0                          # 正常运行过: 立即重启并清零
+    assert backoff.delay(0, 0.1) == 0.5
+
+
+def test_prefork_workers_serve_and_killed_worker_is_reforked():
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, ASR_ENGINE="stub", VOICE_API_HOST="127.0.0.1", VOICE_API_PORT=str(port),
+               VOICE_API_WORKERS="2", LLM_WARM_ENABLED="false", AUDIT_LOG_ENABLED="false",
+               CONFIG_WATCH_INTERVAL="0", IDLE_OFFLOAD_MINUTES="0")
+    master = subprocess.Popen([sys.executable, SERVER], cwd=tempfile.mkdtemp(prefix="prefork-test-"), env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        workers = seen_pids(url, lambda pids: len(pids) >= 2)
+        assert len(workers) == 2 and master.pid not in workers, workers
+
+        killed = min(workers)
+        os.kill(killed, signal.SIGKILL)
+        pids = seen_pids(url, lambda pids: pids - workers)
+        assert pids - workers, "被杀掉的worker没有重新fork"
+        assert killed not in seen_pids(url, lambda pids: len(pids) >= 2 and killed not in pids, timeout=10)
+        assert master.poll() is None
+    finally:
+        master.terminate()
+        assert master.wait(timeout=30) == 0
+
+
+def test_worker_crashing_at_startup_is_not_reforked_in_a_tight_loop():
+    workdir = tempfile.mkdtemp(prefix="prefork-crash-")
+    starts = os.path.join(workdir, "starts")
+    script = textwrap.dedent(f"""
+        import sys
+        from contextlib import asynccontextmanager
+        sys.path.insert(0, {ROOT!r})
+        from fastapi import FastAPI
+        from prefork import serve_prefork
+
+        @asynccontextmanager
+        async def lifespan(app):
+            with open({starts!r}, "a") as f:
+                f.write("start\\n")
+            raise RuntimeError("启动失败")
+            yield
+
+        serve_prefork(FastAPI(lifespan=lifespan), "127.0.0.1", {free_port()}, 1, preload=lambda: None)
+    """)
+    master = subprocess.Popen([sys.executable, "-c", script], cwd=workdir,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # 主进程导入torch等依赖可能要好几秒，从第一个worker启动起计时
+        deadline = time.monotonic() + 60
+        while not os.path.exists(starts) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        time.sleep(4)
+        assert master.poll() is None
+    finally:
+        master.terminate()
+        assert master.wait(timeout=30) == 0
+    with open(starts) as f:
+        count = len(f.readlines())
+    # 退避间隔 0.5、1、2秒: 4秒内最多启动4次 (不退避时为数十次)
+    assert 2 <= count <= 4, count
+
+
+def main():
+    print("🧪 多进程预加载测试")
+    for test in (test_restart_backoff_doubles_for_startup_crashes,
+                 test_prefork_workers_serve_and_killed_worker_is_reforked,
+                 test_worker_crashing_at_startup_is_not_reforked_in_a_tight_loop):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+线上剖析测试 - 采样剖析、torch算子汇总 (重叠推理跳过)、tracemalloc窗口
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from contextlib import nullcontext
+
+import profiler
+from profiler import ProfilerBusy, profiling_session, top_allocations, torch_profile_scope, tracemalloc_session
+
+
+def busy_loop(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(i * i for i in range(1000))
+
+
+def test_sampler_captures_busy_thread():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name="busy-worker")
+    worker.start()
+    try:
+        with profiling_session(0.005) as (sampler, torch_ops):
+            time.sleep(0.3)
+    finally:
+        stop.set()
+        worker.join()
+    assert torch_ops is None and sampler.samples > 0
+    folded = sampler.folded()
+    assert any(line.startswith("busy-worker;") and ":busy_loop:" in line for line in folded.splitlines())
+    # 每行以空格加采样次数结尾
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in folded.splitlines())
+    summary = sampler.summary()
+    assert any(":busy_loop:" in item["frame"] for item in summary["inclusive"])
+    assert all(not item["frame"].startswith(profiler.IDLE_FRAMES) for item in summary["self"])
+
+
+def test_torch_scope_only_records_inside_session():
+    import torch
+
+    assert isinstance(torch_profile_scope(), nullcontext)
+    with profiling_session(0.01, with_torch=True) as (_, torch_ops):
+        with torch_profile_scope():
+            torch.mm(torch.ones(32, 32), torch.ones(32, 32))
+    assert torch_ops.wait(1) and torch_ops.calls == 1
+    assert any(op["op"] == "aten::mm" and op["count"] >= 1 for op in torch_ops.top())
+    assert isinstance(torch_profile_scope(), nullcontext)
+
+
+def test_overlapping_inferences_are_skipped_not_clobbered():
+    """同一时刻只剖析一次推理: 重叠的推理照常执行、计为跳过，已剖析的推理算子完整"""
+    import torch
+
+    entered, release = threading.Event(), threading.Event()
+
+    def long_inference():
+        with torch_profile_scope():
+            torch.mm(torch.ones(32, 32), torch.ones(32, 32))
+            entered.set()
+            release.wait(5)
+
+    with profiling_session(0.01, with_torch=True) as (_, torch_ops):
+        thread = threading.Thread(target=long_inference)
+        thread.start()
+        assert entered.wait(5)
+        with torch_profile_scope():
+            result = torch.mm(torch.ones(8, 8), torch.ones(8, 8))
+        release.set()
+        thread.join()
+    assert result[0, 0] == 8
+    assert torch_ops.wait(1) and torch_ops.calls == 1 and torch_ops.skipped == 1
+    assert any(op["op"] == "aten::mm" and op["count"] == 1 for op in torch_ops.top())
+
+    with profiling_session(0.01, with_torch=True) as (_, torch_ops):
+        for _ in range(2):
+            with torch_profile_scope():
+                torch.mm(torch.ones(8, 8), torch.ones(8, 8))
+    assert torch_ops.calls == 2 and torch_ops.skipped == 0
+
+
+def test_sessions_are_exclusive():
+    with profiling_session(0.01):
+        for session in (profiling_session(0.01), tracemalloc_session()):
+            try:
+                with session:
+                    raise AssertionError("应当拒绝并发剖析")
+            except ProfilerBusy:
+                pass
+    # 结束后可以再次开始
+    with profiling_session(0.01):
+        pass
+
+
+def test_tracemalloc_window_reports_growth_and_stops():
+    assert not tracemalloc.is_tracing()
+    kept = []
+    with tracemalloc_session() as before:
+        kept.append(bytearray(2 * 1024 * 1024))
+        report = top_allocations(before, tracemalloc.take_snapshot(), top=5)
+    assert not tracemalloc.is_tracing()
+    assert report["growth"][0]["size_diff_kb"] >= 2048
+    assert os.path.basename(__file__) in report["growth"][0]["location"]
+
+
+def main():
+    print("🧪 线上剖析测试")
+    for test in (test_sampler_captures_busy_thread,
+                 test_torch_scope_only_records_inside_session,
+                 test_overlapping_inferences_are_skipped_not_clobbered,
+                 test_sessions_are_exclusive,
+                 test_tracemalloc_window_reports_growth_and_stops):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+离线回放工具测试 - stub模式，无需模型和音频
+"""
+
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from replay_corpus import compare, edit_distance, load_manifest, run_corpus, summarize
+
+ENTRIES = [
+    {"audio": "a.webm", "text": "打开记事本", "asr_text": "打开记事版",
+     "intent": {"type": "应用程序", "target": "记事本"}},
+    {"audio": "b.webm", "text": "打开计算器", "asr_text": "打开计时器",
+     "intent": {"type": "应用程序", "target": "计算器"}},
+    {"audio": "c.webm", "text": "今天天气怎么样", "intent": None},
+    {"audio": "d.webm", "text": "open GitHub", "asr_text": "Open GitHub.", "language": "en",
+     "intent": {"type": "网站", "target": "GitHub"}},
+]
+
+
+def write_corpus(directory: str, entries) -> Path:
+    corpus = Path(directory)
+    with open(corpus / "manifest.jsonl", "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return corpus
+
+
+def test_edit_distance():
+    assert edit_distance("打开记事本", "打开记事本") == 0
+    assert edit_distance("打开记事本", "打开计事本") == 1
+    assert edit_distance("记事本", "打开记事本") == 2
+    assert edit_distance("", "abc") == 3
+
+
+def test_stub_replay_in_worker_processes():
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = write_corpus(tmp, ENTRIES)
+        entries = load_manifest(corpus)
+        results = run_corpus(corpus, entries, mode="stub", workers=2)
+    assert [r["id"] for r in results] == ["a.webm", "b.webm", "c.webm", "d.webm"]
+    summary = summarize(results)
+    assert summary["intent_accuracy"] == 1.0
+    assert summary["false_commands"] == summary["missed_commands"] == 0
+    # "计时器" 被纠正为 "计算器"，纠错后的字错率低于原始转录
+    assert summary["cer"] < summary["cer_raw"]
+    assert "detect_ms" in summary["stages"] and "rtf" not in summary
+
+
+def test_baseline_diff_flags_regressions():
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = write_corpus(tmp, ENTRIES)
+        baseline_results = run_corpus(corpus, load_manifest(corpus), mode="stub")
+        worse = [dict(ENTRIES[0], asr_text="打开日记本"), *ENTRIES[1:]]
+        corpus = write_corpus(tmp, worse)
+        results = run_corpus(corpus, load_manifest(corpus), mode="stub")
+
+    baseline = {"summary": summarize(baseline_results), "results": baseline_results}
+    current = {"summary": summarize(results), "results": results}
+    diff = compare(current, baseline)
+    assert diff["regressed"]
+    assert [item["id"] for item in diff["regressions"]] == ["a.webm"]
+    assert diff["deltas"]["intent_accuracy"] == (1.0, 0.75)
+    assert not compare(baseline, baseline)["regressed"]
+
+
+def main():
+    print("🧪 离线回放测试")
+    for test in (test_edit_distance,
+                 test_stub_replay_in_worker_processes,
+                 test_baseline_diff_flags_regressions):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
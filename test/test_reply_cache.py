@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+AI回复缓存测试 - 归一化、近似匹配、过期、时效性问题、内存上限与统计
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from reply_cache import ReplyCache, normalize_query
+
+
+def test_normalization_strips_punctuation_and_corrects():
+    assert normalize_query(" 介绍一下你自己？ ") == normalize_query("介绍一下，你自己!") == "介绍一下你自己"
+    assert normalize_query("ＨＥＬＬＯ， World") == normalize_query("hello,world") == "hello world"
+    # 与指令识别共用纠错表
+    assert normalize_query("记事版是什么") == "记事本是什么"
+    assert normalize_query("✅ ...") == ""
+
+
+def test_operators_and_word_boundaries_keep_questions_apart():
+    questions = ["3+5等于几", "3-5等于几", "3*5等于几", "3/5等于几", "35等于几", "3.5等于几", "35%等于几"]
+    assert len({normalize_query(q) for q in questions}) == len(questions)
+    assert normalize_query("what is 3+5?") == normalize_query("What is 3 + 5") == "what is 3+5"
+    assert normalize_query("what is it") != normalize_query("whatis it")
+    assert normalize_query("c#和c++的区别") == "c#和c++的区别"
+
+    for similarity in (0.0, 0.5):
+        cache = ReplyCache(similarity=similarity)
+        cache.put("3+5等于几", "8", 1.0)
+        assert cache.get("3 + 5 等于几？")[0].reply == "8"
+        for other in questions[1:]:
+            assert cache.get(other) is None, (similarity, other)
+
+
+def test_exact_and_near_duplicate_lookup():
+    exact_only = ReplyCache()
+    exact_only.put("介绍一下你自己", "我是语音助手", 2.0)
+    entry, score = exact_only.get("介绍一下 你自己。")
+    assert entry.reply == "我是语音助手" and score == 1.0
+    assert exact_only.get("请介绍一下你自己") is None
+
+    cache = ReplyCache(similarity=0.85)
+    cache.put("介绍一下你自己", "我是语音助手", 2.0)
+    cache.put("讲个故事", "从前有座山", 3.0)
+    entry, score = cache.get("请介绍一下你自己")
+    assert entry.reply == "我是语音助手" and 0.85 <= score < 1.0
+    assert cache.get("介绍一下你的家乡") is None
+    assert cache.get("讲个笑话") is None
+
+
+def test_near_duplicate_search_among_many_entries():
+    cache = ReplyCache(similarity=0.85)
+    for i in range(500):
+        cache.put(f"第{i}个问题是关于主题{i * 7}的", f"回答{i}", 1.0)
+    entry, _ = cache.get("第123个问题是关于主题861的呢")
+    assert entry.reply == "回答123"
+
+
+def test_ttl_and_time_sensitive_bypass():
+    cache = ReplyCache(ttl_seconds=60, similarity=0.85)
+    assert cache.put("讲个笑话", "哈哈", 1.0, now=1000)
+    assert cache.get("讲个笑话", now=1059) is not None
+    assert cache.get("讲个笑话", now=1061) is None
+    assert cache.status()["entries"] == 0
+
+    assert not cache.put("现在几点了", "下午三点", 1.0)
+    assert not cache.put("今天天气怎么样", "晴", 1.0)
+    assert cache.get("现在几点了") is None and cache.status()["bypassed"] == 1
+    custom = ReplyCache(bypass_keywords=["股票"])
+    assert custom.put("现在几点了", "下午三点", 1.0) and not custom.put("推荐一只股票", "不推荐", 1.0)
+
+
+def test_memory_bound_evicts_least_recently_used():
+    dim = 16
+    entry_bytes = lambda key, reply: len(reply.encode()) + len(key.encode()) + dim * 4
+    budget = entry_bytes("问题a", "x" * 100) * 2
+    cache = ReplyCache(max_bytes=budget, similarity=0.5, dim=dim)
+    cache.put("问题a", "x" * 100, 1.0)
+    cache.put("问题b", "x" * 100, 1.0)
+    assert cache.get("问题a") is not None     # a 变为最近使用
+    cache.put("问题c", "x" * 100, 1.0)
+    status = cache.status()
+    assert status["entries"] == 2 and status["bytes"] <= budget and status["evictions"] == 1
+    assert cache.get("问题a")[0].reply and cache.get("问题c") is not None
+    # 被淘汰条目的向量已清零，不会被近似匹配命中
+    found = cache.get("问题b")
+    assert found is None or found[0].key != "问题b"
+    assert not cache.put("超大回复", "x" * budget, 1.0)
+
+
+def test_stats_report_hit_rate_and_saved_latency():
+    cache = ReplyCache(similarity=0.85)
+    cache.put("介绍一下你自己", "我是语音助手", 2.5)
+    cache.get("介绍一下你自己")
+    cache.get("请介绍一下你自己")
+    cache.get("讲个故事")
+    status = cache.status()
+    assert (status["exact_hits"], status["near_hits"], status["lookups"]) == (1, 1, 3)
+    assert status["hit_rate"] == round(2 / 3, 4) and status["saved_seconds"] == 5.0
+
+
+def test_server_serves_repeated_question_from_cache():
+    import voice_api_server as server
+    from stub_ollama import StubOllama
+
+    stub = StubOllama(reply="我是语音助手")
+    previous = (server.OLLAMA_API_BASE, server.reply_cache)
+    server.OLLAMA_API_BASE = stub.start()
+    server.reply_cache = ReplyCache()
+    try:
+        assert server.get_ai_response("介绍一下你自己") == "我是语音助手"
+        assert server.get_ai_response("介绍一下你自己？") == "我是语音助手"
+        assert "".join(server.stream_ai_response("介绍一下，你自己")) == "我是语音助手"
+        generates = [path for path, _ in stub.requests if path == "/api/generate"]
+        assert len(generates) == 1
+        assert server.reply_cache.status()["exact_hits"] == 2
+
+        # 流式生成的完整回复同样缓存
+        assert "".join(server.stream_ai_response("讲个故事")) == "我是语音助手"
+        assert server.get_ai_response("讲个故事") == "我是语音助手"
+        assert len([path for path, _ in stub.requests if path == "/api/generate"]) == 2
+    finally:
+        stub.stop()
+        server.OLLAMA_API_BASE, server.reply_cache = previous
+
+
+def test_stream_interrupted_midway_is_not_cached():
+    """首选模型中途断开、由备用模型补上的回复，以及不可用提示，都不写入缓存"""
+    import voice_api_server as server
+    from stub_ollama import StubOllama
+
+    stub = StubOllama(reply="我是语音助手")
+    stub.truncate_models = {server.reply_models()[0]}
+    previous = (server.OLLAMA_API_BASE, server.reply_cache)
+    server.OLLAMA_API_BASE = stub.start()
+    server.reply_cache = ReplyCache()
+    try:
+        reply = "".join(server.stream_ai_response("讲个故事"))
+        assert reply == "我是语" + "我是语音助手"
+        assert server.reply_cache.status()["entries"] == 0
+
+        stub.truncate_models = set(server.reply_models())
+        assert "".join(server.stream_ai_response("讲个笑话")).endswith(server.AI_UNAVAILABLE_REPLY)
+        assert server.reply_cache.status()["entries"] == 0
+
+        stub.truncate_models = set()
+        assert "".join(server.stream_ai_response("讲个故事")) == "我是语音助手"
+        assert server.reply_cache.status()["entries"] == 1
+    finally:
+        stub.stop()
+        server.OLLAMA_API_BASE, server.reply_cache = previous
+
+
+def main():
+    print("🧪 AI回复缓存测试")
+    for test in (test_normalization_strips_punctuation_and_corrects,
+                 test_operators_and_word_boundaries_keep_questions_apart,
+                 test_exact_and_near_duplicate_lookup,
+                 test_near_duplicate_search_among_many_entries,
+                 test_ttl_and_time_sensitive_bypass,
+                 test_memory_bound_evicts_least_recently_used,
+                 test_stats_report_hit_rate_and_saved_latency,
+                 test_server_serves_repeated_question_from_cache,
+                 test_stream_interrupted_midway_is_not_cached):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
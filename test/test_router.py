@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+多实例路由测试
+- 实例选择逻辑 (最少进行中请求、亲和、预热优先、满载与下线)
+- 在本地不同端口启动多个桩引擎实例 (ASR_ENGINE=stub)，验证负载分摊、批量任务与取消的路由、
+  故障转移和按模型路由
+"""
+
+import io
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import requests
+
+from router import BackendPool, Router, create_app
+
+SERVER = os.path.join(os.path.dirname(__file__), "..", "voice_api_server.py")
+
+
+def wav_bytes(seconds: float) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(b"\x00\x00" * int(16000 * seconds))
+    return buffer.getvalue()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_pool(*outstanding, **kwargs) -> BackendPool:
+    pool = BackendPool([f"http://b{i}" for i in range(len(outstanding))], **kwargs)
+    for backend, count in zip(pool.backends, outstanding):
+        backend.healthy = True
+        backend.outstanding = count
+        backend.health = {"asr_engine": {"name": "stub"}, "asr_model": "large-v3-turbo"}
+    return pool
+
+
+@contextmanager
+def local_backends(*models, rtf: float = 0.5):
+    """在空闲端口上启动桩引擎实例 (每个实例一个worker)，返回地址列表和进程列表"""
+    processes, urls = [], []
+    for model in models:
+        workdir = tempfile.mkdtemp(prefix="router-test-")     # 各实例的任务库等数据互相独立
+        port = free_port()
+        env = dict(os.environ, ASR_ENGINE="stub", STUB_RTF=str(rtf), WHISPER_MODEL=model,
+                   VOICE_API_HOST="127.0.0.1", VOICE_API_PORT=str(port), VOICE_API_WORKERS="1",
+                   LLM_WARM_ENABLED="false", AUDIT_LOG_ENABLED="false")
+        processes.append(subprocess.Popen([sys.executable, os.path.abspath(SERVER)], cwd=workdir, env=env,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        urls.append(f"http://127.0.0.1:{port}")
+    try:
+        deadline = time.monotonic() + 60
+        for url in urls:
+            while True:
+                try:
+                    if requests.get(f"{url}/health", timeout=1).ok:
+                        break
+                except requests.RequestException:
+                    pass
+                assert time.monotonic() < deadline, f"实例启动超时: {url}"
+                time.sleep(0.1)
+        yield urls, processes
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+
+@contextmanager
+def running_router(urls, **kwargs):
+    """在本地端口运行路由，返回路由地址"""
+    import uvicorn
+
+    router = Router(urls, health_interval=0.2, unhealthy_after=1, **kwargs)
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(create_app(router), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.02)
+    try:
+        yield f"http://127.0.0.1:{port}", router
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+
+def transcribe(base: str, seconds: float = 1.0, **headers) -> requests.Response:
+    headers = {k.replace("_", "-"): v for k, v in headers.items()}
+    return requests.post(f"{base}/transcribe", headers=headers, timeout=30,
+                         files={"audio_file": ("a.wav", wav_bytes(seconds), "audio/wav")})
+
+
+def test_pool_prefers_least_outstanding_then_fewest_requests():
+    pool = make_pool(2, 0, 1)
+    assert pool.choose().url == "http://b1"
+    pool = make_pool(0, 0, 0)
+    pool.backends[0].requests = 5
+    pool.backends[1].requests = 2
+    pool.backends[2].requests = 3
+    assert pool.choose().url == "http://b1"
+
+
+def test_pool_affinity_and_warm_preference_yield_under_load():
+    pool = make_pool(0, 0, slack=2)
+    first = pool.choose(affinity="client:u1")
+    first.outstanding = 2
+    assert pool.choose(affinity="client:u1") is first       # 多出2个请求仍在容忍范围内
+    first.outstanding = 3
+    other = pool.choose(affinity="client:u1")
+    assert other is not first
+    assert pool.choose(affinity="client:u1") is other        # 亲和改到新实例
+
+    pool = make_pool(1, 0, slack=1)
+    pool.backends[1].health["idle_offload"] = {"offloaded": True}
+    assert pool.choose("asr").url == "http://b0"             # 已加载模型的实例优先
+    assert pool.choose("asr", model="tiny").url == "http://b1"  # 都没有该模型时按负载
+    pool.backends[0].outstanding = 2
+    assert pool.choose("asr").url == "http://b1"             # 负载差距过大时不再偏好
+
+
+def test_pool_skips_unhealthy_and_saturated_backends():
+    pool = make_pool(0, 1, max_outstanding=2)
+    pool.backends[0].healthy = False
+    assert pool.choose().url == "http://b1"
+    pool.backends[1].outstanding = 2
+    assert pool.choose() is None
+    assert pool.choose(exclude={"http://b1"}) is None
+
+
+def test_router_spreads_load_and_routes_jobs_and_cancels():
+    with local_backends("large-v3-turbo", "large-v3-turbo", "large-v3-turbo") as (urls, _), \
+            running_router(urls) as (base, router):
+        assert requests.get(f"{base}/health").json()["healthy_backends"] == 3
+
+        # 三个用户同时请求: 各自落在不同实例上并行处理
+        results = []
+        threads = [threading.Thread(target=lambda i=i: results.append(transcribe(base, X_Client_Id=f"user{i}")))
+                   for i in range(3)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        assert all(r.status_code == 200 and r.json()["transcribed_text"] for r in results)
+        assert {r.headers["X-Backend"] for r in results} == set(urls)
+        assert elapsed < 1.2, elapsed                         # 单个实例串行需要1.5秒
+
+        # 同一用户的后续请求回到同一实例
+        placed = {r.request.headers["X-Client-Id"]: r.headers["X-Backend"] for r in results}
+        for user in ("user0", "user1"):
+            assert transcribe(base, 0.2, X_Client_Id=user).headers["X-Backend"] == placed[user]
+
+        # 批量任务的轮询路由到创建任务的实例，路由丢失记录后逐个实例查找
+        files = [("files", (f"{i}.wav", wav_bytes(0.2), "audio/wav")) for i in range(2)]
+        created = requests.post(f"{base}/transcribe/batch", files=files, data={"mode": "job"})
+        assert created.status_code == 202
+        job_id = created.json()["job_id"]
+        polled = requests.get(f"{base}/transcribe/batch/{job_id}")
+        assert polled.status_code == 200 and polled.headers["X-Backend"] == created.headers["X-Backend"]
+        router.pool.unpin(f"job:{job_id}")
+        polled = requests.get(f"{base}/transcribe/batch/{job_id}")
+        assert polled.status_code == 200 and polled.headers["X-Backend"] == created.headers["X-Backend"]
+        assert requests.get(f"{base}/transcribe/batch/no-such-job").status_code == 404
+
+        # 按 X-Request-Id 取消进行中的请求
+        slow = []
+        thread = threading.Thread(target=lambda: slow.append(
+            transcribe(base, 6.0, X_Client_Id="user9", X_Request_Id="req-1")))
+        thread.start()
+        deadline = time.monotonic() + 5
+        while router.pool.pinned("req:req-1") is None and time.monotonic() < deadline:
+            time.sleep(0.02)
+        time.sleep(0.3)
+        start = time.perf_counter()
+        cancel = requests.post(f"{base}/cancel", json={"request_id": "req-1"}, headers={"X-Client-Id": "user9"})
+        assert cancel.json() == {"cancelled": 1}
+        thread.join()
+        assert time.perf_counter() - start < 2.0 and slow[0].status_code != 200
+        assert requests.post(f"{base}/cancel", headers={"X-Client-Id": "user9"}).json() == {"cancelled": 0}
+
+        snapshot = requests.get(f"{base}/metrics").json()
+        assert snapshot["counters"]["router_requests"] >= 8 and snapshot["counters"]["router_sticky_hits"] >= 1
+        assert snapshot["queue_depth"] == 0 and snapshot["outstanding"] == 0
+        assert sum(b["requests"] for b in snapshot["backends"]) >= 8
+
+
+def test_router_fails_over_and_queues_when_saturated():
+    with local_backends("large-v3-turbo", "large-v3-turbo") as (urls, processes), \
+            running_router(urls, max_outstanding=1, queue_timeout=5) as (base, router):
+        # 两个实例各允许1个并发: 第三个请求在路由排队
+        results = []
+        threads = [threading.Thread(target=lambda i=i: results.append(transcribe(base, X_Client_Id=f"u{i}")))
+                   for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert all(r.status_code == 200 for r in results)
+        assert requests.get(f"{base}/metrics").json()["counters"]["router_queued"] >= 1
+
+        # 一个实例宕机: 后续请求全部由另一个实例处理
+        processes[0].terminate()
+        processes[0].wait(timeout=10)
+        responses = [transcribe(base, 0.2, X_Client_Id=f"u{i}") for i in range(4)]
+        assert all(r.status_code == 200 and r.headers["X-Backend"] == urls[1] for r in responses)
+        health = requests.get(f"{base}/health").json()
+        assert health["healthy_backends"] == 1
+        assert [b["healthy"] for b in health["backends"]] == [False, True]
+
+
+def test_router_prefers_backend_holding_requested_model():
+    with local_backends("large-v3-turbo", "tiny", rtf=0) as (urls, _), running_router(urls) as (base, _):
+        for _ in range(3):
+            assert transcribe(base, 0.2, X_Model="tiny").headers["X-Backend"] == urls[1]
+            assert transcribe(base, 0.2, X_Model="large-v3-turbo").headers["X-Backend"] == urls[0]
+        counters = requests.get(f"{base}/metrics").json()["counters"]
+        assert counters["router_warm_preferred"] >= 6
+
+
+def main():
+    print("🧪 多实例路由测试")
+    for test in (test_pool_prefers_least_outstanding_then_fewest_requests,
+                 test_pool_affinity_and_warm_preference_yield_under_load,
+                 test_pool_skips_unhealthy_and_saturated_backends,
+                 test_router_spreads_load_and_routes_jobs_and_cancels,
+                 test_router_fails_over_and_queues_when_saturated,
+                 test_router_prefers_backend_holding_requested_model):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
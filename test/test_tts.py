@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+语音合成测试 - 使用桩引擎，不依赖系统语音
+- 断句 (流式与一次性结果一致)、按字节预算淘汰的短语缓存
+- 缓存命中延迟、并发去重、边生成边合成的顺序
+- worker子进程的合成与错误传递、超时重启，单句合成失败时流式回复照常结束
+"""
+
+import io
+import os
+import sys
+import time
+import wave
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from tts import AudioCache, SentenceSplitter, Speaker, speakable_text, split_sentences
+
+
+def wav_seconds(audio: bytes) -> float:
+    with wave.open(io.BytesIO(audio)) as f:
+        return f.getnframes() / f.getframerate()
+
+
+def test_sentence_splitting_streaming_matches_whole_text():
+    text = "好的！圆周率约为3.14，是个常数。Python is great. 最后一句没有标点"
+    expected = ["好的！", "圆周率约为3.14，是个常数。", "Python is great.", "最后一句没有标点"]
+    assert split_sentences(text) == expected
+    splitter = SentenceSplitter()
+    streamed = [s for ch in text for s in splitter.feed(ch)] + splitter.flush()
+    assert streamed == expected
+    # 过长的句子在逗号处断开
+    long = "这是一段很长的说明，" * 5 + "结束。"
+    assert all(len(s) <= 20 for s in split_sentences(long, max_chars=20))
+    assert "".join(split_sentences(long, max_chars=20)) == long
+
+
+def test_speakable_text_drops_status_icons():
+    assert speakable_text("✅ 已为您打开记事本") == "已为您打开记事本"
+    assert speakable_text("⚠️ 截图工具启动可能失败") == "截图工具启动可能失败"
+    assert speakable_text("✅ ") == ""
+
+
+def test_audio_cache_evicts_by_bytes():
+    cache = AudioCache(max_bytes=100)
+    cache.put("a", b"x" * 40)
+    cache.put("b", b"x" * 40)
+    assert cache.get("a") is not None      # a 变为最近使用
+    cache.put("c", b"x" * 40)
+    assert cache.get("b") is None and cache.get("a") is not None and "c" in cache
+    cache.put("huge", b"x" * 101)          # 超过预算的条目不缓存
+    assert "huge" not in cache
+    status = cache.status()
+    assert status["bytes"] == 80 and status["evictions"] == 1
+
+
+def test_cached_phrase_returns_fast_and_concurrent_requests_share_one_synthesis():
+    speaker = Speaker("stub", {"delay": 0.2}, workers=0)
+    try:
+        first, hit = speaker.submit("✅ 已为您打开记事本")
+        second, hit2 = speaker.submit("已为您打开记事本")
+        assert first is second and not hit and not hit2
+        assert wav_seconds(first.result(timeout=5)) > 0
+        time.sleep(0.05)
+
+        start = time.perf_counter()
+        audio = speaker.cached("✅ 已为您打开记事本")
+        assert audio == first.result() and (time.perf_counter() - start) < 0.02
+        assert speaker.speak("已为您打开记事本") == (audio, True)
+        assert speaker.cached("没有合成过") is None
+    finally:
+        speaker.close()
+
+
+def test_narrate_yields_deltas_and_ordered_sentences():
+    speaker = Speaker("stub", {"delay": 0.05}, workers=0)
+    try:
+        deltas = ["你好", "！今天", "天气不错。", "要带伞", "吗"]
+        events = list(speaker.narrate(deltas))
+        assert [item for kind, item in events if kind == "delta"] == deltas
+        spoken = [item for kind, item in events if kind == "audio"]
+        assert [s.index for s in spoken] == [0, 1, 2]
+        assert [s.text for s in spoken] == ["你好！", "今天天气不错。", "要带伞吗"]
+        assert all(wav_seconds(s.audio) > 0 for s in spoken)
+        # 长回复的句子不放入短语缓存
+        assert speaker.cache.status()["entries"] == 0
+    finally:
+        speaker.close()
+
+
+def test_worker_process_synthesizes_and_reports_errors():
+    speaker = Speaker("stub", workers=1)
+    try:
+        audio, hit = speaker.speak("子进程合成")
+        assert not hit and abs(wav_seconds(audio) - 5 * 0.05) < 0.01
+    finally:
+        speaker.close()
+
+    broken = Speaker("no-such-engine", workers=1)
+    try:
+        broken.speak("测试")
+        raise AssertionError("应当传递引擎错误")
+    except RuntimeError as e:
+        assert "no-such-engine" in str(e)
+    finally:
+        broken.close()
+
+
+def test_narrate_keeps_streaming_when_a_sentence_fails():
+    speaker = Speaker("stub", {"fail_text": "坏"}, workers=0)
+    try:
+        deltas = ["第一句。", "坏句子。", "第三句"]
+        events = list(speaker.narrate(deltas))
+        assert [item for kind, item in events if kind == "delta"] == deltas
+        kinds = [(kind, item.index) for kind, item in events if kind != "delta"]
+        assert kinds == [("audio", 0), ("audio_error", 1), ("audio", 2)]
+        error = next(item for kind, item in events if kind == "audio_error")
+        assert error.text == "坏句子。" and "模拟合成失败" in error.to_dict()["detail"]
+    finally:
+        speaker.close()
+
+
+def test_hung_worker_is_killed_on_timeout():
+    """卡住的合成进程超时后被杀掉并在下次使用时重启，收发线程不会被永久占用"""
+    speaker = Speaker("stub", {"hang_text": "卡住"}, workers=1, timeout=1.0)
+    try:
+        start = time.perf_counter()
+        try:
+            speaker.speak("卡住了")
+            raise AssertionError("应当超时")
+        except TimeoutError:
+            pass
+        assert time.perf_counter() - start < 5
+        audio, _ = speaker.speak("恢复正常")
+        assert wav_seconds(audio) > 0
+
+        events = list(speaker.narrate(["你好。", "卡住了。", "再见。"]))
+        assert [kind for kind, _ in events if kind != "delta"] == ["audio", "audio_error", "audio"]
+    finally:
+        speaker.close()
+
+
+def test_voice_stream_finishes_when_speech_fails():
+    """/voice 流式回复中语音合成失败: 推送 audio_error，文本照常推送并以 done 结束"""
+    import json
+
+    import voice_api_server as server
+    from asr_engines import StubEngine
+    from fastapi.testclient import TestClient
+    from stub_ollama import StubOllama
+
+    stub = StubOllama(reply="你好。今天不错。")
+    previous = (server.asr_engine, server.speaker, server.OLLAMA_API_BASE, server.reply_cache, server.llm_keeper)
+    server.OLLAMA_API_BASE = stub.start()
+    server.reply_cache = server.llm_keeper = None
+    server.asr_engine = StubEngine(text="给我讲讲黑洞")
+    server.speaker = Speaker("stub", {"fail_text": "今天"}, workers=0)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(b"\x00\x00" * 16000)
+    try:
+        response = TestClient(server.app).post(
+            "/voice", files={"audio_file": ("a.wav", buffer.getvalue(), "audio/wav")},
+            data={"ai_reply": "true", "stream": "true", "speak": "true", "execute_commands": "false"})
+        events = [json.loads(line) for line in response.text.splitlines() if line]
+        assert events[-1] == {"type": "done"}
+        assert "".join(e["text"] for e in events if e["type"] == "ai_delta") == "你好。今天不错。"
+        assert [(e["type"], e["index"]) for e in events if e["type"].startswith("audio")] == \
+            [("audio", 0), ("audio_error", 1)]
+    finally:
+        server.speaker.close()
+        stub.stop()
+        server.asr_engine, server.speaker, server.OLLAMA_API_BASE, server.reply_cache, server.llm_keeper = previous
+
+
+def main():
+    print("🧪 语音合成测试")
+    for test in (test_sentence_splitting_streaming_matches_whole_text,
+                 test_speakable_text_drops_status_icons,
+                 test_audio_cache_evicts_by_bytes,
+                 test_cached_phrase_returns_fast_and_concurrent_requests_share_one_synthesis,
+                 test_narrate_yields_deltas_and_ordered_sentences,
+                 test_worker_process_synthesizes_and_reports_errors,
+                 test_narrate_keeps_streaming_when_a_sentence_fails,
+                 test_hung_worker_is_killed_on_timeout,
+                 test_voice_stream_finishes_when_speech_fails):
+        test()
+        print(f"   ✅ {test.__name__}")
+    print("✅ 全部通过")
+
+
+if __name__ == "__main__":
+    main()
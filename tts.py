@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+"""
+语音合成 (回复播报)
+- TTSEngine 统一合成接口，输出WAV字节；pyttsx3 为系统语音 (SAPI5/NSSpeech/espeak)，stub 生成提示音用于联调
+- 合成在独立的worker子进程中进行 (pyttsx3引擎不是线程安全的，且合成期间会占满一个核)；
+  子进程以 python tts.py --worker 启动，只加载本模块，不会复制服务进程中的模型
+- 固定短语 (指令执行结果等) 的音频放在按字节预算淘汰的LRU缓存中，命中时不经过worker
+- 大模型的长回复按句切分，边生成边合成，按顺序逐句产出
+"""
+
+import argparse
+import base64
+import io
+import json
+import logging
+import math
+import os
+import queue
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 句末标点；英文句点只在其后是空白时断句 (避免拆开小数和缩写)
+SENTENCE_END = re.compile(r"[。！？!?；;…\n]+[”’」』）)\"']*|\.(?=\s)")
+# 句子过长时优先在这些位置断开
+SOFT_BREAK = re.compile(r"[，,、：:]")
+# 不朗读的符号 (状态图标、表情)
+UNSPOKEN = re.compile("[\u2190-\u21ff\u2300-\u23ff\u2460-\u27bf\u2b00-\u2bff\ufe0f\u200d\U0001f000-\U0001faff]")
+
+
+def speakable_text(text: str) -> str:
+    """去掉图标表情并合并空白，得到实际朗读的文本 (也是缓存键)"""
+    return " ".join(UNSPOKEN.sub("", text).split())
+
+
+class SentenceSplitter:
+    """把流式到达的文本切成句子: feed 产出已完整的句子，flush 产出剩余部分"""
+
+    def __init__(self, max_chars: int = 80):
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, delta: str) -> List[str]:
+        self._buffer += delta
+        sentences = []
+        while True:
+            match = SENTENCE_END.search(self._buffer)
+            if match and match.end() <= self.max_chars:
+                cut = match.end()
+            elif len(self._buffer) > self.max_chars:
+                breaks = [m.end() for m in SOFT_BREAK.finditer(self._buffer, 0, self.max_chars)]
+                cut = breaks[-1] if breaks else self.max_chars
+            else:
+                break
+            sentences.append(self._buffer[:cut])
+            self._buffer = self._buffer[cut:]
+        return [s.strip() for s in sentences if s.strip()]
+
+    def flush(self) -> List[str]:
+        rest, self._buffer = self._buffer.strip(), ""
+        return [rest] if rest else []
+
+
+def split_sentences(text: str, max_chars: int = 80) -> List[str]:
+    splitter = SentenceSplitter(max_chars)
+    return splitter.feed(text) + splitter.flush()
+
+
+def wav_bytes(samples: bytes, sample_rate: int) -> bytes:
+    """16位单声道PCM封装为WAV"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(samples)
+    return buffer.getvalue()
+
+
+class TTSEngine:
+    """语音合成引擎基类 - synthesize 返回完整的WAV文件字节"""
+
+    name = "base"
+
+    def synthesize(self, text: str) -> bytes:
+        raise NotImplementedError
+
+    def describe(self) -> dict:
+        return {"name": self.name}
+
+
+class Pyttsx3Engine(TTSEngine):
+    """pyttsx3 调用系统语音引擎，需要 pip install pyttsx3 (Linux另需 espeak-ng)"""
+
+    name = "pyttsx3"
+
+    def __init__(self, voice: str = "", rate: int = 0):
+        try:
+            import pyttsx3
+        except ImportError:
+            raise RuntimeError("pyttsx3 引擎需要先安装: pip install pyttsx3")
+        self.engine = pyttsx3.init()
+        if voice:
+            self.engine.setProperty("voice", voice)
+        if rate:
+            self.engine.setProperty("rate", rate)
+
+    def synthesize(self, text: str) -> bytes:
+        fd, path = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            self.engine.save_to_file(text, path)
+            self.engine.runAndWait()
+            with open(path, "rb") as f:
+                return f.read()
+        finally:
+            os.unlink(path)
+
+
+class StubTTSEngine(TTSEngine):
+    """不依赖系统语音的桩引擎: 按字数生成正弦提示音，可模拟合成耗时"""
+
+    name = "stub"
+
+    def __init__(self, sample_rate: int = 16000, seconds_per_char: float = 0.05, delay: float = 0.0,
+                 fail_text: str = "", hang_text: str = ""):
+        self.sample_rate = sample_rate
+        self.seconds_per_char = seconds_per_char
+        self.delay = delay
+        self.fail_text = fail_text    # 含该文本的句子合成失败 (测试错误处理)
+        self.hang_text = hang_text    # 含该文本的句子永不返回 (测试超时)
+
+    def synthesize(self, text: str) -> bytes:
+        if self.fail_text and self.fail_text in text:
+            raise RuntimeError(f"模拟合成失败: {text}")
+        if self.hang_text and self.hang_text in text:
+            threading.Event().wait()
+        if self.delay:
+            time.sleep(self.delay)
+        frames = int(len(text) * self.seconds_per_char * self.sample_rate)
+        pcm = bytearray()
+        for i in range(frames):
+            pcm += int(8000 * math.sin(2 * math.pi * 440 * i / self.sample_rate)).to_bytes(2, "little", signed=True)
+        return wav_bytes(bytes(pcm), self.sample_rate)
+
+
+ENGINES = {
+    Pyttsx3Engine.name: Pyttsx3Engine,
+    StubTTSEngine.name: StubTTSEngine,
+}
+
+
+def create_engine(name: str, **kwargs) -> TTSEngine:
+    try:
+        engine_class = ENGINES[name]
+    except KeyError:
+        raise ValueError(f"未知的语音合成引擎: {name} (可选: {', '.join(ENGINES)})")
+    return engine_class(**kwargs)
+
+
+class WorkerProcess:
+    """一个合成子进程: 每行一个JSON请求，应答为一行JSON头 + WAV字节；退出后下次使用时重启
+
+    单次合成超过 timeout 秒时杀掉子进程 (下次使用时重启)，收发线程不会被卡住的引擎永久占用。
+    """
+
+    def __init__(self, engine: str, options: dict, timeout: float = 30.0):
+        self.args = [sys.executable, os.path.abspath(__file__), "--worker", engine, json.dumps(options)]
+        self.timeout = timeout
+        self.process: Optional[subprocess.Popen] = None
+
+    def synthesize(self, text: str) -> bytes:
+        if self.process is None or self.process.poll() is not None:
+            self.process = subprocess.Popen(self.args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        process = self.process
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            process.kill()
+
+        watchdog = threading.Timer(self.timeout, kill)
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            process.stdin.write(json.dumps({"text": text}, ensure_ascii=False).encode() + b"\n")
+            process.stdin.flush()
+            header = process.stdout.readline()
+            if not header:
+                if timed_out.is_set():
+                    raise TimeoutError(f"合成超时 ({self.timeout:g}秒)，已重启合成进程")
+                raise RuntimeError(f"合成进程已退出 (exit={process.wait()})")
+            reply = json.loads(header)
+            audio = process.stdout.read(reply["size"]) if reply["ok"] else b""
+            if timed_out.is_set():
+                raise TimeoutError(f"合成超时 ({self.timeout:g}秒)，已重启合成进程")
+        except (OSError, ValueError):     # 含 TimeoutError
+            self.close()
+            raise
+        finally:
+            watchdog.cancel()
+        if not reply["ok"]:
+            raise RuntimeError(reply["error"])
+        return audio
+
+    def close(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+
+class LocalWorker:
+    """在本进程内合成 (workers=0)，引擎在首次使用时创建；无法中断卡住的合成，只用于桩引擎和测试"""
+
+    def __init__(self, engine: str, options: dict):
+        self.engine_name = engine
+        self.options = options
+        self.engine: Optional[TTSEngine] = None
+
+    def synthesize(self, text: str) -> bytes:
+        if self.engine is None:
+            self.engine = create_engine(self.engine_name, **self.options)
+        return self.engine.synthesize(text)
+
+    def close(self) -> None:
+        pass
+
+
+def worker_main(engine: str, options: dict) -> None:
+    """子进程入口: 引擎初始化失败时对每个请求应答错误，而不是退出后被反复重启"""
+    # 应答走原stdout，引擎自身的输出重定向到stderr，避免混入音频
+    out = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)
+    try:
+        tts_engine, error = create_engine(engine, **options), None
+    except Exception as e:
+        tts_engine, error = None, str(e)
+    for line in sys.stdin.buffer:
+        audio = b""
+        try:
+            if tts_engine is None:
+                raise RuntimeError(error)
+            audio = tts_engine.synthesize(json.loads(line)["text"])
+            header = {"ok": True, "size": len(audio)}
+        except Exception as e:
+            header = {"ok": False, "error": str(e)}
+        out.write(json.dumps(header, ensure_ascii=False).encode() + b"\n" + audio)
+        out.flush()
+
+
+class AudioCache:
+    """按总字节数淘汰的LRU音频缓存"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str, record_miss: bool = True) -> Optional[bytes]:
+        with self._lock:
+            audio = self._items.get(key)
+            if audio is None:
+                self.misses += record_miss
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return audio
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._items
+
+    def put(self, key: str, audio: bytes) -> None:
+        if len(audio) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = audio
+            self.size += len(audio)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._items), "bytes": self.size, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+@dataclass
+class SpokenSentence:
+    """流式播报中的一句"""
+    index: int
+    text: str
+    audio: bytes
+    cached: bool
+
+    def to_dict(self) -> dict:
+        return {"index": self.index, "text": self.text, "cached": self.cached,
+                "audio": base64.b64encode(self.audio).decode("ascii")}
+
+
+@dataclass
+class SpeechError:
+    """流式播报中合成失败的一句 (文本照常推送，只是这一句没有音频)"""
+    index: int
+    text: str
+    detail: str
+
+    def to_dict(self) -> dict:
+        return {"index": self.index, "text": self.text, "detail": self.detail}
+
+
+class Speaker:
+    """语音合成服务: worker子进程池 + 短语缓存
+
+    workers=0 时在本进程内的单个线程中合成 (用于桩引擎和测试)。
+    同一短语并发请求只合成一次。
+    """
+
+    def __init__(self, engine: str = "pyttsx3", options: Optional[dict] = None, workers: int = 2,
+                 cache_bytes: int = 32 * 1024 * 1024, timeout: float = 30.0, max_sentence_chars: int = 80):
+        options = options or {}
+        self.engine_name = engine
+        self.workers = workers
+        self.timeout = timeout
+        self.max_sentence_chars = max_sentence_chars
+        self.cache = AudioCache(cache_bytes)
+        self._workers = ([WorkerProcess(engine, options, timeout) for _ in range(workers)] if workers > 0
+                         else [LocalWorker(engine, options)])
+        self._idle: "queue.Queue" = queue.Queue()
+        for worker in self._workers:
+            self._idle.put(worker)
+        # 每个worker对应一个收发线程
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="tts")
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _run(self, text: str) -> bytes:
+        worker = self._idle.get()
+        try:
+            return worker.synthesize(text)
+        finally:
+            self._idle.put(worker)
+
+    def cached(self, text: str) -> Optional[bytes]:
+        """只查缓存 (不提交合成，未命中不计数)，供事件循环中直接返回命中的短语"""
+        audio = self.cache.get(speakable_text(text), record_miss=False)
+        if audio is not None:
+            metrics.incr("tts_cache_hits")
+        return audio
+
+    def submit(self, text: str, cache: bool = True) -> Tuple[Future, bool]:
+        """提交一段文本 - 返回(产出WAV字节的Future, 是否命中缓存)
+
+        cache=False 时命中仍然复用，但新合成的结果不放入缓存 (大模型回复很少重复，避免挤掉固定短语)。
+        """
+        key = speakable_text(text)
+        if not key:
+            raise ValueError("没有可朗读的文本")
+        audio = self.cache.get(key)
+        if audio is not None:
+            metrics.incr("tts_cache_hits")
+            future = Future()
+            future.set_result(audio)
+            return future, True
+        with self._lock:
+            future = self._inflight.get(key)
+            submitted = future is None
+            if submitted:
+                start = time.perf_counter()
+                future = self._pool.submit(self._run, key)
+                self._inflight[key] = future
+        if submitted:
+            # 在锁外注册: 合成已完成时回调会立即在当前线程执行，而回调本身也要取锁
+            future.add_done_callback(lambda f: self._finished(key, f, cache, start))
+        return future, False
+
+    def _finished(self, key: str, future: Future, cache: bool, start: float) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        metrics.observe("tts_synthesize", time.perf_counter() - start)
+        if cache:
+            self.cache.put(key, future.result())
+
+    def speak(self, text: str) -> Tuple[bytes, bool]:
+        """合成一段文本 (阻塞) - 返回(WAV字节, 是否命中缓存)"""
+        future, hit = self.submit(text)
+        return future.result(timeout=self.timeout), hit
+
+    def preload(self, phrases: Iterable[str]) -> int:
+        """后台预合成固定短语放入缓存，不等待完成 - 返回提交的条数"""
+        count = 0
+        for phrase in dict.fromkeys(speakable_text(p) for p in phrases):
+            if phrase and phrase not in self.cache:
+                future, _ = self.submit(phrase)
+                future.add_done_callback(self._log_preload_error)
+                count += 1
+        return count
+
+    @staticmethod
+    def _log_preload_error(future: Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(f"⚠️ 短语预合成失败: {future.exception()}")
+
+    def narrate(self, deltas: Iterable[str]) -> Iterator[Tuple[str, object]]:
+        """边生成边播报: 原样转发文本片段 ("delta", str)，每凑满一句提交合成，
+        按顺序产出已合成的句子 ("audio", SpokenSentence)；合成与后续文本的生成并行进行
+
+        某一句合成失败或超时时产出 ("audio_error", SpeechError)，文本和后续句子照常继续。
+        """
+        splitter = SentenceSplitter(self.max_sentence_chars)
+        pending = deque()
+        index = 0
+
+        def enqueue(sentences: List[str]) -> None:
+            nonlocal index
+            for sentence in sentences:
+                if speakable_text(sentence):
+                    try:
+                        future, hit = self.submit(sentence, cache=False)
+                    except Exception as e:
+                        future, hit = Future(), False
+                        future.set_exception(e)
+                    pending.append((index, sentence, future, hit))
+                    index += 1
+
+        def ready(block: bool) -> Iterator[Tuple[str, object]]:
+            while pending and (block or pending[0][2].done()):
+                i, sentence, future, hit = pending.popleft()
+                try:
+                    audio = future.result(timeout=self.timeout)
+                except Exception as e:
+                    detail = f"合成超时 ({self.timeout:g}秒)" if isinstance(e, FutureTimeout) else str(e)
+                    logger.warning(f"⚠️ 第{i + 1}句语音合成失败: {detail}")
+                    metrics.incr("tts_errors")
+                    yield "audio_error", SpeechError(i, sentence, detail)
+                    continue
+                yield "audio", SpokenSentence(i, sentence, audio, hit)
+
+        for delta in deltas:
+            yield "delta", delta
+            enqueue(splitter.feed(delta))
+            yield from ready(False)
+        enqueue(splitter.flush())
+        yield from ready(True)
+
+    def status(self) -> dict:
+        return {"engine": self.engine_name, "workers": self.workers, "inflight": len(self._inflight),
+                "cache": self.cache.status()}
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        for worker in self._workers:
+            worker.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="语音合成worker子进程 (由 Speaker 启动)")
+    parser.add_argument("--worker", nargs=2, metavar=("ENGINE", "OPTIONS"), required=True)
+    args = parser.parse_args()
+    worker_main(args.worker[0], json.loads(args.worker[1]))
@@ -2,28 +2,62 @@
 """
 优化版语音助手API服务器 - GPU内存优化版
 - 支持Whisper-large-v3-turbo模型，显存占用更少
-- 优化GPU内存管理，支持多模型共存
-- 优先执行指令，跳过AI回复避免GPU冲突
+- 显存仲裁器协调Whisper与Ollama，指令与AI回复可同时启用
 - 集成ModelScope快速下载
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, Request, UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 import whisper
 import requests
+import asyncio
+import base64
+import io
+import json
 import os
 import platform
 import subprocess
+import sys
 import tempfile
+import threading
 import uvicorn
 from pydantic import BaseModel
 from typing import Optional, List
+import gc
+import hashlib
+import hmac
 import logging
+import math
 import torch
-import re
+import time
+import tracemalloc
 from pathlib import Path
 
+from asr_engines import ASREngine, WhisperEngine, create_engine
+from cancellation import CancelRegistry, InferenceCancelled, avoided_audio_seconds, cancel_scope, enable_cancellation
+from command_detection import active_rules, preprocess_chinese_text, smart_command_detection
+from admission import AdmissionController, AdmissionRejected
+from audit_log import AuditLog
+from batch_transcription import BatchInputError, BatchJobStore, detect_languages, expand_upload, transcribe_batch
+from audio_decoder import AudioDecodeError, configure_decoding, decode_audio_stream, upload_stats
+from config import Config
+from client_profiles import ClientProfileStore, build_prompt_text, enable_profile_decoding, use_profile_prompt
+from feature_cache import enable_cached_log_mel, enable_feature_cache, request_features
+from cpu_topology import CPUPlan, apply_worker_plan, available_cpus, cgroup_cpu_quota, physical_cores, plan_cpus
+from convert_whisper_weights import WHISPER_CACHE, load_mmap_model, mmap_weights_path
+from language_id import LanguagePreferences, identify_language
+from llm_warmup import OllamaWarmKeeper, load_seconds, record_load
+from gpu_arbiter import GB, CudaMemoryAccountant, GPUMemoryArbiter, OllamaMemoryClient
+from hot_reload import HotReloader
+from model_idle import IdleOffloadManager
+from metrics import metrics
+from reply_cache import TIME_SENSITIVE_KEYWORDS, ReplyCache
+from profiler import ProfilerBusy, profiling_session, top_allocations, torch_profile_scope, tracemalloc_session
+from prefork import format_memory_report, process_memory_report, serve_prefork
+from tts import Speaker
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -32,11 +66,61 @@ logger = logging.getLogger(__name__)
 
 # 全局变量
 whisper_model = None
-OLLAMA_API_BASE = "http://localhost:11434/api"
+whisper_model_name: Optional[str] = None
+whisper_device = "cpu"
+# 当前识别引擎；whisper 引擎通过 provider 读取 whisper_model，卸载/重新加载后自动跟随
+whisper_engine = WhisperEngine(lambda: whisper_model, temperatures=Config.WHISPER_TEMPERATURES)
+asr_engine: Optional[ASREngine] = None
+gpu_arbiter: Optional[GPUMemoryArbiter] = None
+cpu_plan: Optional[CPUPlan] = None
+idle_manager: Optional[IdleOffloadManager] = None
+audit_log: Optional[AuditLog] = None
+speaker: Optional[Speaker] = None
+llm_keeper: Optional[OllamaWarmKeeper] = None
+config_reloader: Optional[HotReloader] = None
+reply_cache = ReplyCache(
+    ttl_seconds=Config.REPLY_CACHE_TTL_MINUTES * 60,
+    max_bytes=int(Config.REPLY_CACHE_MAX_MB * 1024 * 1024),
+    similarity=Config.REPLY_CACHE_SIMILARITY,
+    bypass_keywords=Config.REPLY_CACHE_BYPASS_KEYWORDS or TIME_SENSITIVE_KEYWORDS
+) if Config.REPLY_CACHE_ENABLED else None
+batch_jobs = BatchJobStore(Config.BATCH_JOB_DIR, ttl_hours=Config.BATCH_JOB_TTL_HOURS)
+batch_tasks = set()
+inference_requests = CancelRegistry()
+language_preferences = LanguagePreferences()
+client_profiles = ClientProfileStore(max_clients=Config.PROFILE_MAX_CLIENTS, bias=Config.PROFILE_BIAS)
+admission = AdmissionController(
+    concurrency=Config.ADMISSION_CONCURRENCY,
+    rate=Config.CLIENT_AUDIO_RATE,
+    burst=Config.CLIENT_AUDIO_BURST,
+    max_queue=Config.ADMISSION_MAX_QUEUE,
+    queue_timeout=Config.ADMISSION_QUEUE_TIMEOUT,
+    short_clip_seconds=Config.SHORT_CLIP_SECONDS
+) if Config.ADMISSION_ENABLED else None
+OLLAMA_API_BASE = Config.OLLAMA_BASE_URL
+AI_MODELS = ['minicpm-v:latest', 'qwen3:14b', 'deepseek-r1:14b', 'llama3.2-vision:11b']
+AI_UNAVAILABLE_REPLY = "抱歉，我无法连接到AI模型。请确保Ollama正在运行并且已安装模型。"
+
+def reply_models() -> list:
+    """依次尝试的回复模型，首选模型 (保温的模型) 在最前"""
+    preferred = Config.AI_REPLY_MODEL or AI_MODELS[0]
+    return [preferred] + [model for model in AI_MODELS if model != preferred]
 
 class VoiceRequest(BaseModel):
     text: str
     execute_commands: bool = True
+    language: str = "zh"  # 指令词典优先使用的语言 (zh/en)
+    speak: bool = False  # 同时返回回复的合成语音
+
+class SpeakRequest(BaseModel):
+    text: str
+    stream: bool = False  # 按句合成，逐句以NDJSON返回
+
+class CancelRequest(BaseModel):
+    request_id: Optional[str] = None  # 插件随请求发送的 X-Request-Id，为空时取消该用户全部请求
+
+class ProfileUpdate(BaseModel):
+    custom_terms: List[str]
 
 class VoiceResponse(BaseModel):
     transcribed_text: str
@@ -44,70 +128,291 @@ class VoiceResponse(BaseModel):
     command_executed: bool = False
     command_result: Optional[str] = None
     command_type: Optional[str] = None
+    reply_audio: Optional[str] = None  # 回复语音 (base64编码的WAV)，speak=true时返回
 
-# 扩展的指令识别词典
-COMMAND_PATTERNS = {
-    "应用程序": {
-        "keywords": ["打开", "启动", "运行", "开启"],
-        "targets": {
-            "记事本": ["记事本", "notepad", "文本编辑器"],
-            "计算器": ["计算器", "calculator", "计时器", "计时版", "计算机"],
-            "画图": ["画图", "画板", "绘图", "paint"],
-            "文件管理器": ["文件管理器", "资源管理器", "文件夹", "explorer"],
-            "浏览器": ["浏览器", "browser", "网页", "上网"],
-            "任务管理器": ["任务管理器", "进程管理", "task manager"],
-            "控制面板": ["控制面板", "设置", "系统设置"],
-            "命令提示符": ["命令提示符", "cmd", "终端", "控制台"],
-            "PowerShell": ["powershell", "ps", "power shell"]
-        }
-    },
-    "网站": {
-        "keywords": ["打开", "访问", "进入", "去", "看看"],
-        "targets": {
-            "百度": ["百度", "baidu"],
-            "谷歌": ["谷歌", "google", "搜索"],
-            "知乎": ["知乎", "zhihu"],
-            "微博": ["微博", "weibo"],
-            "哔哩哔哩": ["哔哩哔哩", "bilibili", "b站", "B站"],
-            "淘宝": ["淘宝", "taobao", "购物"],
-            "京东": ["京东", "jd", "商城"],
-            "GitHub": ["github", "代码", "开源"],
-            "YouTube": ["youtube", "油管", "视频"],
-            "网易云音乐": ["网易云", "音乐", "歌曲"]
-        }
-    },
-    "系统操作": {
-        "keywords": ["关闭", "退出", "结束", "停止", "重启", "关机", "锁屏", "休眠", "待机", "睡眠", "截图"],
-        "targets": {
-            "关机": ["关机", "shutdown", "关闭电脑"],
-            "重启": ["重启", "restart", "重新启动"],
-            "注销": ["注销", "logout", "登出"],
-            "锁屏": ["锁屏", "lock", "锁定屏幕"],
-            "休眠": ["休眠", "sleep", "待机", "睡眠"],
-            "截图": ["截图", "screenshot", "屏幕截图"]
-        }
-    },
-    "文件操作": {
-        "keywords": ["新建", "创建", "删除", "复制", "移动"],
-        "targets": {
-            "新建文件夹": ["新建文件夹", "创建文件夹", "建文件夹"],
-            "新建文件": ["新建文件", "创建文件", "建文件"],
-            "截图": ["截图", "截屏", "抓图", "screenshot"]
-        }
-    }
-}
+from contextlib import asynccontextmanager, nullcontext
 
-from contextlib import asynccontextmanager
 
 
+def move_whisper_model(device: str) -> None:
+    """把Whisper搬到指定设备 (供显存仲裁器调用)"""
+    global whisper_model
+    whisper_model = whisper_model.to(device)
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """应用生命周期管理"""
-    # 启动时执行
+def setup_gpu_memory_policy() -> None:
+    """GPU显存策略: 默认启用仲裁器动态分配，否则退回固定比例"""
+    global gpu_arbiter
+    if Config.GPU_ARBITER:
+        gpu_arbiter = GPUMemoryArbiter(
+            CudaMemoryAccountant(),
+            move_model=move_whisper_model,
+            whisper_bytes=torch.cuda.memory_allocated(),
+            llm_bytes=int(Config.LLM_MEMORY_RESERVE_GB * GB),
+            ollama=OllamaMemoryClient(OLLAMA_API_BASE)
+        )
+        logger.info(f"🔧 GPU显存仲裁已启用 (LLM预留估计 {Config.LLM_MEMORY_RESERVE_GB}GB)")
+    else:
+        torch.cuda.set_per_process_memory_fraction(Config.GPU_MEMORY_FRACTION)
+        logger.info(f"🔧 GPU内存分配: {Config.GPU_MEMORY_FRACTION * 100:.0f}% (固定比例)")
+
+def asr_slot():
+    """转录显存占用上下文，产出本次转录使用的设备"""
+    if gpu_arbiter:
+        return gpu_arbiter.transcription()
+    return nullcontext(next(whisper_model.parameters()).device.type)
+
+def llm_slot():
+    """LLM调用显存占用上下文"""
+    return gpu_arbiter.llm_call() if gpu_arbiter else nullcontext()
+
+def model_in_use():
+    """请求使用模型期间持有，模型被空闲卸载时自动唤醒"""
+    return idle_manager.in_use() if idle_manager else nullcontext()
+
+def model_available() -> bool:
+    """识别引擎已加载；whisper 模型已空闲卸载但可随时唤醒时也视为可用"""
+    if asr_engine is not None and asr_engine is not whisper_engine:
+        return True
+    return whisper_model is not None or (idle_manager is not None and idle_manager.offloaded)
+
+def resolve_offload_target() -> str:
+    """解析空闲卸载目标: auto时GPU卸载到CPU内存，CPU改为释放后从mmap文件重新映射"""
+    target = Config.IDLE_OFFLOAD_TARGET
+    if target == "auto":
+        target = "cpu" if whisper_device == "cuda" else "mmap"
+    return target
+
+def offload_idle_model() -> bool:
+    """空闲卸载Whisper (由 IdleOffloadManager 在无请求时调用)"""
     global whisper_model
-    logger.info("🚀 正在启动优化版语音助手API服务...")
+    if idle_manager.target == "cpu":
+        if whisper_device != "cuda":
+            return False
+        if gpu_arbiter:
+            return gpu_arbiter.offload()
+        move_whisper_model("cpu")
+        torch.cuda.empty_cache()
+        return True
     
+    # mmap: 释放模型，唤醒时从safetensors文件映射；权重文件由启动时的后台转换生成，未完成时本周期不卸载
+    mmap_path = mmap_weights_path(whisper_model_name)
+    if not mmap_path.exists():
+        logger.info(f"💡 mmap权重尚未就绪 ({mmap_path})，推迟空闲卸载")
+        return False
+    whisper_model = None
+    gc.collect()
+    if whisper_device == "cuda":
+        torch.cuda.empty_cache()
+    return True
+
+def prepare_mmap_weights() -> Optional[threading.Thread]:
+    """mmap卸载目标缺少safetensors权重时在后台转换
+
+    转换在独立进程中进行: 反序列化checkpoint的内存不叠加在本worker已加载的模型上，也不持有空闲卸载的锁；
+    多个worker通过锁文件保证只有一个在转换。返回转换线程 (无需转换时为None)。
+    """
+    mmap_path = mmap_weights_path(whisper_model_name)
+    source = WHISPER_CACHE / f"{whisper_model_name}.pt"
+    if mmap_path.exists():
+        return None
+    if not source.exists():
+        logger.warning(f"⚠️ 未找到 {source}，无法生成mmap权重，空闲卸载将被跳过 "
+                       f"(可用 convert_whisper_weights.py 手动转换)")
+        return None
+    lock_path = mmap_path.with_name(mmap_path.name + ".lock")
+    try:
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        logger.info(f"💡 其他进程正在转换mmap权重: {mmap_path}")
+        return None
+
+    def convert():
+        logger.info(f"🔄 后台转换mmap权重: {source} → {mmap_path}")
+        try:
+            result = subprocess.run(
+                [sys.executable, str(Path(__file__).with_name("convert_whisper_weights.py")), str(source),
+                 "--output", str(mmap_path)],
+                capture_output=True, text=True
+            )
+            if result.returncode == 0:
+                logger.info(f"✅ mmap权重转换完成: {mmap_path}")
+            else:
+                logger.warning(f"⚠️ mmap权重转换失败，空闲卸载将被跳过: {(result.stderr or result.stdout).strip()[-500:]}")
+        finally:
+            lock_path.unlink(missing_ok=True)
+
+    thread = threading.Thread(target=convert, name="mmap-convert", daemon=True)
+    thread.start()
+    return thread
+
+def reload_idle_model() -> None:
+    """空闲卸载后的快速唤醒"""
+    global whisper_model
+    if idle_manager.target == "cpu":
+        if gpu_arbiter:
+            gpu_arbiter.ensure_resident()
+        else:
+            move_whisper_model(whisper_device)
+        return
+    device = gpu_arbiter.model_device if gpu_arbiter else whisper_device
+    whisper_model = load_mmap_model(mmap_weights_path(whisper_model_name), device=device)
+    prepare_whisper_model(whisper_model)
+
+def make_cpu_plan() -> CPUPlan:
+    """按可用核数、cgroup配额和 Config 中的覆盖值规划worker、推理线程与解码槽位"""
+    cpus = available_cpus()
+    return plan_cpus(
+        cpus, cgroup_cpu_quota(), physical_cores(cpus),
+        workers=Config.WORKERS, torch_threads=Config.TORCH_THREADS, decode_slots=Config.DECODE_SLOTS,
+        pin=Config.CPU_PINNING, gpu=torch.cuda.is_available()
+    )
+
+def setup_cpu_plan() -> None:
+    """CPU规划在本进程生效 (prefork的worker已在fork后绑核并设置线程数，这里只配置解码槽位)"""
+    global cpu_plan
+    if cpu_plan is None:
+        cpu_plan = make_cpu_plan()
+        apply_worker_plan(cpu_plan)
+    configure_decoding(cpu_plan.decode_slots, cpu_plan.decode_cpus)
+    logger.info(f"🧮 CPU规划: {cpu_plan.budget}/{cpu_plan.cpus} 核可用，{cpu_plan.workers} 个worker × "
+                f"{cpu_plan.torch_threads} 推理线程，每worker {cpu_plan.decode_slots} 个解码槽位"
+                + ("，已绑核" if cpu_plan.worker_cpus else ""))
+
+def start_audit_log() -> None:
+    """按配置启用审计日志 (每个worker独立的写线程，共用同一个WAL数据库)"""
+    global audit_log
+    if not Config.AUDIT_LOG_ENABLED:
+        return
+    audit_log = AuditLog(Config.AUDIT_DB_PATH)
+    audit_log.start()
+    logger.info(f"📝 审计日志: {Config.AUDIT_DB_PATH}")
+
+def command_reply_phrases() -> list:
+    """指令执行结果等固定回复短语 (按当前指令词典)，启动和词典热更新时预合成"""
+    table = active_rules().tables["zh"]
+    targets = lambda cmd_type: table.get(cmd_type, {}).get("targets", {})
+    phrases = [f"✅ 已为您打开{target}" for cmd_type in ("应用程序", "网站") for target in targets(cmd_type)]
+    phrases += [f"✅ 已执行{target}" for target in targets("系统操作")]
+    phrases += ["✅ 系统正在进入休眠状态", "✅ 屏幕已锁定", "✅ 截图工具已启动", "指令已处理",
+                "抱歉，AI服务暂时不可用", "语音指令模式下暂不支持AI对话，请直接在聊天框中输入文字进行AI对话"]
+    return phrases
+
+def start_tts() -> None:
+    """按配置启动语音合成进程池，并在后台预合成固定短语"""
+    global speaker
+    if not Config.TTS_ENABLED:
+        return
+    options = {"voice": Config.TTS_VOICE, "rate": Config.TTS_RATE} if Config.TTS_ENGINE == "pyttsx3" else {}
+    speaker = Speaker(Config.TTS_ENGINE, options, workers=Config.TTS_WORKERS,
+                      cache_bytes=int(Config.TTS_CACHE_MB * 1024 * 1024), timeout=Config.TTS_TIMEOUT)
+    preloaded = speaker.preload(command_reply_phrases()) if Config.TTS_PRELOAD else 0
+    logger.info(f"🔊 语音合成: {Config.TTS_ENGINE}，{Config.TTS_WORKERS} 个合成进程，预合成 {preloaded} 条短语")
+
+def apply_reloaded_config(changes: dict) -> None:
+    """热更新的配置同步到启动时已读取该配置的对象"""
+    if "WHISPER_TEMPERATURES" in changes:
+        for engine in {whisper_engine, asr_engine}:
+            if engine is not None and hasattr(engine, "temperatures"):
+                engine.temperatures = type(engine.temperatures)(changes["WHISPER_TEMPERATURES"])
+    if "OLLAMA_KEEP_ALIVE" in changes and llm_keeper:
+        llm_keeper.keep_alive = changes["OLLAMA_KEEP_ALIVE"]
+
+def preload_command_phrases(rules) -> None:
+    """指令词典更新后预合成新增的回复短语"""
+    if speaker and Config.TTS_PRELOAD:
+        speaker.preload(command_reply_phrases())
+
+def start_hot_reload() -> None:
+    """加载指令规则文件 (存在时) 并监视规则文件与.env的变化；规则文件不合法时沿用内置词典"""
+    global config_reloader
+    config_reloader = HotReloader(
+        Config.COMMAND_RULES_FILE, interval=Config.CONFIG_WATCH_INTERVAL,
+        on_config=apply_reloaded_config, on_rules=preload_command_phrases
+    )
+    try:
+        config_reloader.reload()
+    except ValueError:
+        pass  # 已记录，修正文件后自动重新加载
+    config_reloader.start()
+    logger.info(f"🔄 指令规则 {active_rules().digest} ({config_reloader.status()['rules']['source']})，"
+                + (f"每 {Config.CONFIG_WATCH_INTERVAL:g} 秒检查更新" if Config.CONFIG_WATCH_INTERVAL > 0 else "不监视文件"))
+
+def start_llm_warmup() -> None:
+    """按配置启动Ollama回复模型保温 (启用显存仲裁时不主动重新加载被仲裁器卸载的模型)"""
+    global llm_keeper
+    if not Config.LLM_WARM_ENABLED:
+        return
+    llm_keeper = OllamaWarmKeeper(
+        OLLAMA_API_BASE, reply_models()[0],
+        keep_alive=Config.OLLAMA_KEEP_ALIVE,
+        interval=Config.LLM_WARM_INTERVAL_SECONDS,
+        slot=llm_slot,
+        reload_unloaded=gpu_arbiter is None
+    )
+    llm_keeper.start(warm_now=gpu_arbiter is None)
+    logger.info(f"🔥 Ollama模型保温: {llm_keeper.model} (keep_alive={Config.OLLAMA_KEEP_ALIVE}，"
+                f"每 {Config.LLM_WARM_INTERVAL_SECONDS:g} 秒检查)")
+
+async def speak_reply(text: Optional[str]) -> Optional[str]:
+    """合成回复语音 (base64 WAV)；未启用或合成失败时返回None，不影响文本回复"""
+    if speaker is None or not text:
+        return None
+    try:
+        audio = speaker.cached(text)
+        if audio is None:
+            audio, _ = await run_in_threadpool(speaker.speak, text)
+    except Exception as e:
+        logger.warning(f"回复语音合成失败: {e}")
+        return None
+    return base64.b64encode(audio).decode("ascii")
+
+def audit(request: Request, endpoint: str, result: dict) -> None:
+    """记录一次请求的转录、指令与执行结果 (只入队，不等待写盘)"""
+    if audit_log is None:
+        return
+    audit_log.record(
+        client_key(request), endpoint,
+        text=result.get("transcribed_text", ""),
+        language=result.get("language", ""),
+        is_command=result.get("is_command", False),
+        command_type=result.get("command_type") or "",
+        command_target=result.get("command_target") or "",
+        command_executed=result.get("command_executed", False),
+        command_result=result.get("command_result"),
+        timings=result.get("timings")
+    )
+
+def start_idle_offload() -> None:
+    """按配置启用空闲卸载"""
+    global idle_manager
+    if Config.IDLE_OFFLOAD_MINUTES <= 0 or asr_engine is not whisper_engine:
+        return
+    target = resolve_offload_target()
+    if target == "cpu" and whisper_device != "cuda":
+        logger.warning("⚠️ IDLE_OFFLOAD_TARGET=cpu 但模型本来就在CPU上，卸载不会释放内存，空闲卸载未启用 "
+                       "(CPU上请使用 mmap 或 auto)")
+        return
+    if target == "mmap":
+        prepare_mmap_weights()
+    idle_manager = IdleOffloadManager(
+        Config.IDLE_OFFLOAD_MINUTES * 60,
+        target=target,
+        offload=offload_idle_model,
+        reload=reload_idle_model
+    )
+    idle_manager.start()
+    logger.info(f"💤 空闲卸载已启用: {Config.IDLE_OFFLOAD_MINUTES} 分钟无请求后卸载到 {idle_manager.target}")
+
+def prepare_whisper_model(model) -> None:
+    """加载后启用请求级特征缓存、按用户的解码提示和协作式取消 (每次重新加载都要调用)"""
+    enable_cached_log_mel()
+    enable_feature_cache(model)
+    enable_profile_decoding(model)
+    enable_cancellation(model)
+
+def load_whisper_model() -> None:
+    """按优先级加载Whisper模型到全局 whisper_model"""
+    global whisper_model, whisper_model_name, whisper_device
     logger.info("📥 开始加载Whisper模型（首次运行可能需要下载模型文件）...")
     
     # 导入必要的模块
@@ -157,8 +462,14 @@ async def lifespan(app: FastAPI):
                 torch.cuda.empty_cache()
                 gc.collect()
             
+            # 优先使用已转换的safetensors权重，内存映射加载，无需反序列化整个checkpoint
+            load_start = time.perf_counter()
+            mmap_path = mmap_weights_path(model_name)
+            if mmap_path.exists():
+                logger.info(f"⚡ 内存映射加载模型权重: {mmap_path}")
+                whisper_model = load_mmap_model(mmap_path, device=device)
             # 特殊处理turbo模型 - 直接从文件加载
-            if model_name == "large-v3-turbo":
+            elif model_name == "large-v3-turbo":
                 turbo_path = Path.home() / ".cache" / "whisper" / "large-v3-turbo.pt"
                 if turbo_path.exists():
                     logger.info(f"🎯 直接加载turbo模型文件: {turbo_path}")
@@ -167,19 +478,20 @@ async def lifespan(app: FastAPI):
                     logger.warning(f"⚠️ turbo模型文件不存在: {turbo_path}")
                     continue
             else:
-                # 加载官方模型
-                whisper_model = whisper.load_model(
-                    model_name, 
-                    device=device,
-                    in_memory=True  # 保持在内存中以提高性能
-                )
+                # 加载官方模型 (不使用in_memory，避免checkpoint字节与权重同时驻留内存)
+                whisper_model = whisper.load_model(model_name, device=device)
+            
+            load_seconds = time.perf_counter() - load_start
+            metrics.observe("model_load", load_seconds)
+            logger.info(f"⏱️ 模型加载耗时: {load_seconds:.1f}s")
             
             # 如果是GPU模式，设置内存分配策略
             if device == "cuda":
-                # 设置更保守的内存分配，为其他模型预留更多空间
-                torch.cuda.set_per_process_memory_fraction(0.5)  # 只使用50%GPU内存
-                logger.info("🔧 GPU内存分配: 50% (为其他AI模型预留50%)")
+                setup_gpu_memory_policy()
+            prepare_whisper_model(whisper_model)
             
+            whisper_model_name = model_name
+            whisper_device = device
             logger.info(f"✅ 成功加载 Whisper {model_name} 模型到 {device}")
             
             # 显示模型信息
@@ -196,6 +508,53 @@ async def lifespan(app: FastAPI):
     if whisper_model is None:
         logger.error("💥 所有模型加载失败！")
         raise RuntimeError("无法加载任何Whisper模型")
+
+def load_asr_engine() -> None:
+    """按 Config.ASR_ENGINE 加载识别引擎 (whisper 沿用 load_whisper_model 的加载顺序)"""
+    global asr_engine
+    if Config.ASR_ENGINE == WhisperEngine.name:
+        load_whisper_model()
+        asr_engine = whisper_engine
+        return
+    options = {
+        "faster-whisper": {
+            "model": Config.WHISPER_MODEL,
+            "device": Config.WHISPER_DEVICE,
+            "compute_type": Config.ASR_COMPUTE_TYPE,
+            "temperatures": Config.WHISPER_TEMPERATURES
+        },
+        "stub": {"text": Config.STUB_TRANSCRIPT, "rtf": Config.STUB_RTF},
+    }.get(Config.ASR_ENGINE, {})
+    logger.info(f"📥 加载识别引擎: {Config.ASR_ENGINE}")
+    load_start = time.perf_counter()
+    asr_engine = create_engine(Config.ASR_ENGINE, **options)
+    metrics.observe("model_load", time.perf_counter() - load_start)
+    logger.info(f"✅ 识别引擎已加载: {asr_engine.describe()}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期管理"""
+    # 启动时执行
+    logger.info("🚀 正在启动优化版语音助手API服务...")
+    setup_cpu_plan()
+    
+    if asr_engine is None:
+        load_asr_engine()
+    else:
+        # 多进程模式下模型已在主进程fork前加载，各worker通过写时复制共享权重
+        logger.info(f"♻️ 复用主进程预加载的识别引擎 {asr_engine.name} (worker pid={os.getpid()})")
+        logger.info(f"📊 worker内存: {format_memory_report(process_memory_report())}")
+    
+    start_hot_reload()
+    start_idle_offload()
+    start_audit_log()
+    start_tts()
+    start_llm_warmup()
+    if Config.DEBUG_ENDPOINTS:
+        if Config.DEBUG_TOKEN:
+            logger.warning("🔬 调试剖析接口已启用 (/debug/profile, /debug/tracemalloc)")
+        else:
+            logger.warning("⚠️ DEBUG_ENDPOINTS已开启但未设置DEBUG_TOKEN，调试接口保持关闭")
     
     logger.info("🎉 语音助手API服务启动完成！")
     logger.info(f"🌐 服务地址: http://localhost:8889")
@@ -205,6 +564,16 @@ async def lifespan(app: FastAPI):
     
     # 关闭时执行
     logger.info("🛑 正在关闭语音助手API服务...")
+    if idle_manager:
+        idle_manager.stop()
+    if audit_log:
+        audit_log.close()
+    if speaker:
+        speaker.close()
+    if llm_keeper:
+        llm_keeper.stop()
+    if config_reloader:
+        config_reloader.stop()
 
 # 重新创建FastAPI应用，正确设置lifespan参数
 app = FastAPI(
@@ -221,6 +590,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "X-TTS-Cache"],
 )
 
 @app.get("/")
@@ -235,134 +605,569 @@ async def health_check():
         "status": "healthy", 
         "whisper_loaded": whisper_model is not None,
         "device": device_info,
-        "model_info": str(whisper_model) if whisper_model else None
+        "model_info": str(whisper_model) if whisper_model else None,
+        "asr_engine": asr_engine.describe() if asr_engine else None,
+        "asr_model": whisper_model_name or Config.WHISPER_MODEL,
+        "gpu_arbiter": gpu_arbiter.status() if gpu_arbiter else None,
+        "admission": admission.status() if admission else None,
+        "idle_offload": idle_manager.status() if idle_manager else None,
+        "cpu_plan": cpu_plan.to_dict() if cpu_plan else None,
+        "tts": speaker.status() if speaker else None,
+        "reply_cache": reply_cache.status() if reply_cache else None,
+        "llm_warm": llm_keeper.status() if llm_keeper else None,
+        "config_version": config_reloader.version if config_reloader else None,
+        "command_rules": active_rules().digest,
+        "worker_pid": os.getpid(),
+        "memory": process_memory_report()
     }
 
-def preprocess_chinese_text(text: str) -> str:
-    """预处理中文文本，修正常见识别错误"""
-    corrections = {
-        # 常见的中文识别错误修正
-        "计时版": "记事本",
-        "计时器": "计算器", 
-        "计算机": "计算器",
-        "记事版": "记事本",
-        "文件管理": "文件管理器",
-        "资源管理": "文件管理器",
-        "任务管理": "任务管理器",
-        "控制版": "控制面板",
-        "哔哩哔哩": "bilibili",
-        "B站": "bilibili",
-        "b站": "bilibili",
-        "网易云": "网易云音乐",
-        "谷歌": "google",
-        "百度一下": "百度",
-        # 新增的常见错误
-        "大开": "打开",
-        "打开浏览器访问": "打开",
-        "浏览器访问": "打开",
-        "访问知乎网站": "知乎",
-        "知乎网站": "知乎",
-        "百度网站": "百度",
-        "谷歌网站": "谷歌",
-        "微博网站": "微博",
-        "计算机器": "计算器",
-        "记事簿": "记事本",
-        "文本编辑": "记事本"
-    }
+def client_host(request: Request) -> str:
+    """来源地址 (经路由等可信代理转发时为 X-Forwarded-For 中的客户端地址)
     
-    corrected_text = text
-    for wrong, correct in corrections.items():
-        corrected_text = corrected_text.replace(wrong, correct)
+    X-Forwarded-For 中全是可信代理地址 (如本机客户端经本机路由) 时 uvicorn 给出的 host 为空，按 unknown 处理
+    """
+    return (request.client.host if request.client else None) or "unknown"
+
+def valid_api_key(request: Request) -> Optional[str]:
+    """请求携带的API Key (X-API-Key 或 Authorization: Bearer)，不在 API_KEYS 中时为None"""
+    api_key = request.headers.get("x-api-key")
+    authorization = request.headers.get("authorization", "")
+    if not api_key and authorization.lower().startswith("bearer "):
+        api_key = authorization[7:].strip()
+    if not api_key:
+        return None
+    valid = [hmac.compare_digest(api_key.encode(), key.encode()) for key in Config.API_KEYS]
+    return api_key if any(valid) else None
+
+def admission_key(request: Request) -> str:
+    """限速用的客户端标识: 有效的API Key按Key，否则按来源IP
     
-    return corrected_text
+    X-Client-Id 和未配置的Key都可由客户端随意更换，不用于限速 (否则每换一次就得到一个满的令牌桶)
+    """
+    api_key = valid_api_key(request)
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    return "ip:" + client_host(request)
 
-def smart_command_detection(text: str) -> tuple[bool, str, str]:
-    """智能指令检测 - 返回(是否为指令, 指令类型, 目标)"""
-    text = preprocess_chinese_text(text.strip())
-    text_lower = text.lower()
+def client_key(request: Request) -> str:
+    """识别用户: 可信身份 (有效API Key或来源IP，见 admission_key) 下再按插件传来的 X-Client-Id 区分
     
-    # 检查每种指令类型
-    for cmd_type, config in COMMAND_PATTERNS.items():
-        keywords = config["keywords"]
-        targets = config["targets"]
-        
-        # 检查是否包含关键词
-        has_keyword = any(keyword in text for keyword in keywords)
-        
-        if has_keyword:
-            # 检查目标
-            for target_name, target_aliases in targets.items():
-                if any(alias in text_lower for alias in target_aliases):
-                    return True, cmd_type, target_name
-    
-    # 特殊情况：直接说目标名称 (扩展到所有指令类型)
-    for cmd_type, config in COMMAND_PATTERNS.items():
-        for target_name, target_aliases in config["targets"].items():
-            if any(alias in text_lower for alias in target_aliases):
-                # 如果文本很短且主要是目标名称，认为是指令
-                if len(text.strip()) <= 10:
-                    return True, cmd_type, target_name
-    
-    return False, "", ""
+    X-Client-Id 由客户端自行选择，只在同一身份内区分设备；伪造它拿不到其他Key或IP下用户的
+    历史记录、档案和进行中的请求
+    """
+    identity = admission_key(request)
+    client_id = request.headers.get("x-client-id")
+    return f"{identity}/{client_id}" if client_id else identity
 
-@app.post("/transcribe", response_model=dict)
-async def transcribe_audio(audio_file: UploadFile = File(...)):
-    """优化的语音转文字接口"""
-    if not whisper_model:
-        raise HTTPException(status_code=500, detail="Whisper模型未加载")
+def admission_slot(client: str, audio_seconds: float, cancelled: Optional[asyncio.Event] = None,
+                   charge: bool = True):
+    """推理准入: 限速、分级排队，未启用时不做限制；cancelled 置位时放弃排队，charge=False 时不扣令牌"""
+    return admission.admit(client, audio_seconds, cancelled, charge=charge) if admission else nullcontext()
+
+def choose_language(detect, user: Optional[str]) -> dict:
+    """确定解码语言: 固定语言直接使用；auto模式调用 detect() 识别，置信度不足时退回用户常用语言
+    
+    detect 返回 {language, probability, ms}
+    """
+    if Config.WHISPER_LANGUAGE != "auto":
+        return {"language": Config.WHISPER_LANGUAGE, "source": "fixed"}
+    
+    language_id = detect()
+    preferred = language_preferences.preferred(user) if user else None
+    if language_id["probability"] >= Config.LANGUAGE_ID_MIN_PROB:
+        language_id["source"] = "detected"
+        if user:
+            language_preferences.record(user, language_id["language"])
+    elif preferred:
+        language_id.update(language=preferred, source="preference")
+    else:
+        language_id["source"] = "detected"
+    return language_id
+
+def profile_prompt_scope(user: Optional[str], language: str):
+    """在该用户、该语言的档案提示下解码"""
+    tokenizer = whisper.tokenizer.get_tokenizer(
+        whisper_model.is_multilingual, num_languages=whisper_model.num_languages,
+        language=language, task="transcribe"
+    )
+    return use_profile_prompt(client_profiles.prompt(user, language, tokenizer))
+
+def run_transcription(audio, user: Optional[str] = None, token=None) -> dict:
+    """用当前识别引擎转录 (同步阻塞，需在线程池中调用)"""
+    with torch_profile_scope():
+        if asr_engine is None or asr_engine is whisper_engine:
+            return run_whisper_transcription(audio, user, token)
+        return run_engine_transcription(audio, user, token)
+
+def engine_language_id(audio) -> dict:
+    """用非whisper引擎识别语言 - 返回 {language, probability, ms}"""
+    start = time.perf_counter()
+    language, probability = asr_engine.detect_language(audio, Config.WHISPER_LANGUAGES)
+    seconds = time.perf_counter() - start
+    metrics.observe("language_id", seconds)
+    return {"language": language, "probability": round(probability, 3), "ms": round(seconds * 1000, 1)}
+
+def run_engine_transcription(audio, user: Optional[str] = None, token=None) -> dict:
+    """用非whisper引擎转录 (同步阻塞，需在线程池中调用)
+    
+    用户档案以文本提示 (initial_prompt) 传入，没有预分词提示和词汇偏置；
+    没有编码器缓存，encoder 统计恒为0；取消令牌由引擎在分段之间检查
+    """
+    with cancel_scope(token):
+        language_id = choose_language(lambda: engine_language_id(audio), user)
+        language = language_id["language"]
+        profile = client_profiles.get(user) if user else None
+        result = asr_engine.transcribe(
+            audio,
+            language=language,
+            initial_prompt=build_prompt_text(language, profile.terms() if profile else [])
+        )
+    result["encoder"] = {"passes": 0, "cache_hits": 0}
+    result["language_id"] = language_id
+    return result
+
+def run_whisper_transcription(audio, user: Optional[str] = None, token=None) -> dict:
+    """执行Whisper转录 (同步阻塞，需在线程池中调用)
     
+    温度回退重新解码时复用请求级缓存的编码器输出，结果中的 encoder 为本次编码次数与缓存命中数；
+    token 被取消时在下一个窗口或下一个token前抛出 InferenceCancelled
+    """
+    with cancel_scope(token), model_in_use(), asr_slot() as device, request_features(audio) as features:
+        language_id = choose_language(
+            lambda: identify_language(whisper_model, features, Config.WHISPER_LANGUAGES, fp16=device == "cuda"),
+            user
+        )
+        language = language_id["language"]
+        # 用户档案生成的提示已预先分词，由decode包装直接注入，不再走initial_prompt
+        with profile_prompt_scope(user, language):
+            # GPU时使用fp16加速 (模型被临时卸载到CPU时关闭)
+            result = whisper_engine.transcribe(audio, language=language, fp16=device == "cuda")
+    result["encoder"] = features.stats()
+    result["language_id"] = language_id
+    return result
+
+def decode_upload(audio_file: UploadFile):
+    """流式解码上传音频 (同步阻塞，需在线程池中调用) - 返回(波形, 接收字节数)"""
+    return decode_audio_source(audio_file.file, audio_file.filename)
+
+def decode_audio_source(source, filename: Optional[str]):
+    """流式解码，失败时回退到临时文件 - 返回(波形, 接收字节数)"""
     try:
-        # 保存上传的音频文件
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-            content = await audio_file.read()
+        return decode_audio_stream(source)
+    except AudioDecodeError as e:
+        # moov在末尾的m4a等容器无法从管道解码，回退到临时文件
+        logger.warning(f"流式解码失败，回退到临时文件: {e}")
+        source.seek(0)
+        content = source.read()
+        with tempfile.NamedTemporaryFile(delete=False, suffix=Path(filename or "").suffix) as temp_file:
             temp_file.write(content)
             temp_file_path = temp_file.name
-        
-        # 优化的Whisper转录参数
-        logger.info("开始转录音频...")
-        result = whisper_model.transcribe(
-            temp_file_path,
-            language="zh",  # 强制中文
-            initial_prompt="以下是普通话的转录，请准确识别应用程序名称如记事本、计算器等。",
-            temperature=0.0,  # 降低随机性
-            beam_size=5,      # 增加beam search
-            best_of=5,        # 多次尝试取最佳
-            fp16=torch.cuda.is_available(),  # GPU时使用fp16加速
-            condition_on_previous_text=False,  # 不依赖前文
-            no_speech_threshold=0.6,
-            logprob_threshold=-1.0,
-            compression_ratio_threshold=2.4
+        try:
+            return whisper.load_audio(temp_file_path), len(content)
+        finally:
+            os.unlink(temp_file_path)
+
+def request_timeout(request: Request) -> float:
+    """请求截止时间: 默认 REQUEST_TIMEOUT_SECONDS，客户端可用 X-Request-Timeout 缩短"""
+    timeout = Config.REQUEST_TIMEOUT_SECONDS
+    try:
+        requested = float(request.headers.get("x-request-timeout", "0"))
+    except ValueError:
+        requested = 0
+    if requested > 0:
+        timeout = min(timeout, requested) if timeout > 0 else requested
+    return timeout
+
+async def watch_cancellation(request: Request, token) -> None:
+    """客户端断开或超过截止时间时取消令牌"""
+    while not token.cancelled:
+        if await request.is_disconnected():
+            token.cancel("disconnected")
+            return
+        remaining = token.remaining()
+        if remaining is not None and remaining <= 0:
+            token.cancel("deadline")
+            return
+        await asyncio.sleep(min(Config.DISCONNECT_POLL_SECONDS, remaining) if remaining is not None
+                            else Config.DISCONNECT_POLL_SECONDS)
+
+def cancelled_response(reason: str, audio_seconds: float, avoided_seconds: float, queued: bool) -> HTTPException:
+    """记录被取消的推理并生成响应 (断开/显式取消499，超时504)"""
+    metrics.incr(f"inference_cancelled_{reason}")
+    metrics.incr("inference_cancelled_queued" if queued else "inference_cancelled_inflight")
+    metrics.incr("cancel_avoided_audio_seconds", avoided_seconds)
+    logger.info(f"🚫 推理已取消 ({reason}，{'排队中' if queued else '解码中'})，"
+                f"省去 {avoided_seconds:.1f}/{audio_seconds:.1f} 秒音频的推理")
+    if reason == "deadline":
+        return HTTPException(status_code=504, detail="转录超时，已取消")
+    return HTTPException(status_code=499, detail="请求已取消")
+
+async def transcribe_upload(audio_file: UploadFile, request: Request, prefetch_llm: bool = False) -> dict:
+    """解码上传音频并转录，返回转录文本与一次性的指令检测结果
+    
+    解码后按音频时长申请推理槽位，未准入时抛出429；
+    客户端断开、超时或显式取消 (POST /cancel) 时放弃排队或中止解码。
+    prefetch_llm: 本请求随后会请求AI回复，转录为普通对话时提前在后台加载LLM
+    """
+    user = client_key(request)
+    with inference_requests.register(user, request.headers.get("x-request-id"), request_timeout(request)) as token:
+        watcher = asyncio.create_task(watch_cancellation(request, token))
+        try:
+            return await _transcribe_upload(audio_file, request, user, token, prefetch_llm)
+        finally:
+            watcher.cancel()
+
+async def _transcribe_upload(audio_file: UploadFile, request: Request, user: str, token,
+                             prefetch_llm: bool) -> dict:
+    start = time.perf_counter()
+    audio, bytes_received = await run_in_threadpool(decode_upload, audio_file)
+    decode_seconds = time.perf_counter() - start
+    metrics.observe("decode", decode_seconds)
+    
+    upload = upload_stats(bytes_received, audio)
+    upload["content_type"] = audio_file.content_type
+    metrics.incr("upload_bytes", bytes_received)
+    metrics.incr("upload_audio_seconds", upload["audio_seconds"])
+    logger.info(f"收到音频: {bytes_received} 字节, {upload['audio_seconds']}秒, "
+                f"{upload['bytes_per_audio_second']} 字节/秒 ({audio_file.content_type})")
+    
+    if token.cancelled:
+        raise cancelled_response(token.reason, upload["audio_seconds"], upload["audio_seconds"], queued=True)
+    
+    start = time.perf_counter()
+    try:
+        async with admission_slot(admission_key(request), upload["audio_seconds"], token.event):
+            queue_seconds = time.perf_counter() - start
+            logger.info("开始转录音频...")
+            start = time.perf_counter()
+            result = await run_in_threadpool(run_transcription, audio, user, token)
+    except InferenceCancelled as e:
+        raise cancelled_response(e.reason, upload["audio_seconds"],
+                                 avoided_audio_seconds(token, upload["audio_seconds"]), queued=False)
+    except AdmissionRejected as e:
+        if e.reason == "cancelled":
+            raise cancelled_response(token.reason, upload["audio_seconds"], upload["audio_seconds"], queued=True)
+        logger.warning(f"⛔ 请求未准入 ({e.reason})，{e.retry_after:.1f}秒后可重试")
+        raise HTTPException(
+            status_code=429,
+            detail=f"请求过多 ({e.reason})，请稍后重试",
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
         )
-        
-        # 清理临时文件
-        os.unlink(temp_file_path)
-        
-        # 预处理转录结果
-        transcribed_text = preprocess_chinese_text(result["text"].strip())
-        logger.info(f"转录结果: {transcribed_text}")
-        
-        # 智能指令检测
-        is_command, cmd_type, target = smart_command_detection(transcribed_text)
-        
+    transcribe_seconds = time.perf_counter() - start
+    metrics.observe("transcribe", transcribe_seconds)
+    
+    # 预处理转录结果
+    transcribed_text = preprocess_chinese_text(result["text"].strip())
+    logger.info(f"转录结果: {transcribed_text} (编码器 {result['encoder']['passes']} 次, "
+                f"复用 {result['encoder']['cache_hits']} 次)")
+    
+    # 智能指令检测 (只做一次，后续执行直接复用)
+    start = time.perf_counter()
+    language = result.get("language", "zh")
+    is_command, cmd_type, target = smart_command_detection(transcribed_text, language)
+    detect_seconds = time.perf_counter() - start
+    metrics.observe("detect", detect_seconds)
+    if is_command:
+        metrics.incr("transcripts_command")
+        if user:
+            client_profiles.record_command(user, target)
+    else:
+        # 请求AI回复时，未识别为指令的转录会走较慢的AI对话路径: 现在就开始加载LLM，与后续步骤并行
+        metrics.incr("transcripts_non_command")
+        if prefetch_llm and transcribed_text and llm_keeper and Config.LLM_PREFETCH:
+            llm_keeper.prefetch()
+    
+    return {
+        "transcribed_text": transcribed_text,
+        "language": language,
+        "language_id": result["language_id"],
+        "is_command": is_command,
+        "command_type": cmd_type,
+        "command_target": target,
+        "confidence": result.get("avg_logprob", 0),
+        "upload": upload,
+        "encoder": result["encoder"],
+        "timings": {
+            "decode_ms": round(decode_seconds * 1000, 1),
+            "queue_ms": round(queue_seconds * 1000, 1),
+            "transcribe_ms": round(transcribe_seconds * 1000, 1),
+            "language_id_ms": result["language_id"].get("ms", 0.0),
+            "detect_ms": round(detect_seconds * 1000, 3)
+        }
+    }
+
+@app.post("/transcribe", response_model=dict)
+async def transcribe_audio(request: Request, audio_file: UploadFile = File(...)):
+    """优化的语音转文字接口"""
+    if not model_available():
+        raise HTTPException(status_code=500, detail="Whisper模型未加载")
+    
+    try:
+        transcription = await transcribe_upload(audio_file, request)
+        audit(request, "/transcribe", transcription)
         return {
             "success": True,
-            "transcribed_text": transcribed_text,
-            "language": result.get("language", "zh"),
-            "is_command": is_command,
-            "command_type": cmd_type,
-            "command_target": target,
-            "confidence": result.get("avg_logprob", 0)
+            "transcribed_text": transcription["transcribed_text"],
+            "language": transcription["language"],
+            "language_id": transcription["language_id"],
+            "is_command": transcription["is_command"],
+            "command_type": transcription["command_type"],
+            "command_target": transcription["command_target"],
+            "confidence": transcription["confidence"],
+            "upload": transcription["upload"]
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"转录错误: {str(e)}")
-        if 'temp_file_path' in locals():
-            try:
-                os.unlink(temp_file_path)
-            except:
-                pass
         raise HTTPException(status_code=500, detail=f"转录失败: {str(e)}")
 
+async def read_batch_uploads(files: List[UploadFile]) -> list:
+    """读取批量上传的文件，压缩包展开为其中的音频文件 - 返回[(文件名, 内容)]"""
+    items = []
+    for upload in files:
+        data = await upload.read()
+        items += await run_in_threadpool(
+            expand_upload, upload.filename or f"file{len(items)}", data,
+            Config.BATCH_MAX_FILES, Config.BATCH_MAX_MB * 1024**2
+        )
+    if len(items) > Config.BATCH_MAX_FILES:
+        raise BatchInputError(f"共 {len(items)} 个音频文件，超过上限 {Config.BATCH_MAX_FILES}")
+    if sum(len(content) for _, content in items) > Config.BATCH_MAX_MB * 1024**2:
+        raise BatchInputError(f"音频总大小超过上限 {Config.BATCH_MAX_MB}MB")
+    return items
+
+@asynccontextmanager
+async def batch_admission_slot(key: str, audio_seconds: float):
+    """批量任务的推理准入: 不扣客户端令牌 (否则大批次按实时速率计费，回退的条目还会重复计费)，
+    只占用槽位并按公平排队；未准入时按Retry-After等待后重试，不中断整个批次"""
+    while True:
+        slot = admission_slot(key, audio_seconds, charge=False)
+        try:
+            await slot.__aenter__()
+            break
+        except AdmissionRejected as e:
+            metrics.incr("batch_admission_waits")
+            await asyncio.sleep(min(e.retry_after, Config.ADMISSION_QUEUE_TIMEOUT))
+    try:
+        yield
+    finally:
+        await slot.__aexit__(None, None, None)
+
+def run_batch_transcription(audios: list, user: str) -> list:
+    """批量转录30秒以内的音频 (同步阻塞，需在线程池中调用)"""
+    with torch_profile_scope(), model_in_use(), asr_slot() as device:
+        if Config.WHISPER_LANGUAGE == "auto":
+            def languages(mel):
+                preferred = language_preferences.preferred(user)
+                return [
+                    language if probability >= Config.LANGUAGE_ID_MIN_PROB or not preferred else preferred
+                    for language, probability in detect_languages(whisper_model, mel, Config.WHISPER_LANGUAGES)
+                ]
+        else:
+            languages = Config.WHISPER_LANGUAGE
+        return transcribe_batch(
+            whisper_model, audios, languages, fp16=device == "cuda",
+            prompt_scope=lambda language: profile_prompt_scope(user, language)
+        )
+
+def batch_record(request: Request, index: int, filename: str, audio, text: str, language: str,
+                 confidence: float, batched: bool, timings: dict) -> dict:
+    """单个文件的批量转录结果 (纠错与指令检测同 /transcribe，但不记入用户档案)"""
+    text = preprocess_chinese_text(text.strip())
+    start = time.perf_counter()
+    is_command, cmd_type, target = smart_command_detection(text, language)
+    timings["detect_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    record = {
+        "type": "result",
+        "index": index,
+        "filename": filename,
+        "transcribed_text": text,
+        "language": language,
+        "is_command": is_command,
+        "command_type": cmd_type,
+        "command_target": target,
+        "confidence": confidence,
+        "audio_seconds": round(len(audio) / whisper.audio.SAMPLE_RATE, 2),
+        "batched": batched,
+        "timings": timings
+    }
+    audit(request, "/transcribe/batch", record)
+    return record
+
+async def iter_batch_results(items: list, request: Request):
+    """并行解码、凑批推理，按完成顺序产出每个文件的结果，最后一条为汇总
+    
+    解码在线程池中与推理并行；攒够 BATCH_SIZE 条或等待 BATCH_LINGER_MS 后送入一次批量推理。
+    超过30秒的音频、批量结果未通过质量阈值的，以及非whisper引擎的全部音频，逐条走 /transcribe 相同的转录路径。
+    """
+    user, key = client_key(request), admission_key(request)
+    ready: asyncio.Queue = asyncio.Queue()
+    decode_limit = asyncio.Semaphore(cpu_plan.decode_slots if cpu_plan else os.cpu_count() or 4)
+    batch_start = time.perf_counter()
+    
+    async def decode(index: int, filename: str, data: bytes):
+        async with decode_limit:
+            start = time.perf_counter()
+            try:
+                audio, _ = await run_in_threadpool(decode_audio_source, io.BytesIO(data), filename)
+                await ready.put((index, filename, audio, time.perf_counter() - start, None))
+            except Exception as e:
+                # ffmpeg的错误输出很长，只保留最后一行
+                await ready.put((index, filename, None, 0.0, (str(e).strip().splitlines() or [""])[-1]))
+    
+    async def transcribe_single(index, filename, audio, decode_seconds):
+        start = time.perf_counter()
+        async with batch_admission_slot(key, len(audio) / whisper.audio.SAMPLE_RATE):
+            queue_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            result = await run_in_threadpool(run_transcription, audio, user)
+        return batch_record(request, index, filename, audio, result["text"], result["language"],
+                            result.get("avg_logprob", 0), False, {
+                                "decode_ms": round(decode_seconds * 1000, 1),
+                                "queue_ms": round(queue_seconds * 1000, 1),
+                                "transcribe_ms": round((time.perf_counter() - start) * 1000, 1)
+                            })
+    
+    tasks = [asyncio.create_task(decode(i, name, data)) for i, (name, data) in enumerate(items)]
+    remaining, completed, failed, batches = len(items), 0, 0, 0
+    loop = asyncio.get_running_loop()
+    try:
+        while remaining:
+            group = [await ready.get()]
+            deadline = loop.time() + Config.BATCH_LINGER_MS / 1000
+            while len(group) < Config.BATCH_SIZE and len(group) < remaining:
+                try:
+                    group.append(await asyncio.wait_for(ready.get(), max(0.0, deadline - loop.time())))
+                except asyncio.TimeoutError:
+                    break
+            remaining -= len(group)
+            
+            short, long = [], []
+            for index, filename, audio, decode_seconds, error in group:
+                if error is not None:
+                    failed += 1
+                    yield {"type": "error", "index": index, "filename": filename, "detail": f"解码失败: {error}"}
+                elif len(audio) > whisper.audio.N_SAMPLES or asr_engine is not whisper_engine:
+                    long.append((index, filename, audio, decode_seconds))
+                else:
+                    short.append((index, filename, audio, decode_seconds))
+            
+            if short:
+                audio_seconds = sum(len(item[2]) for item in short) / whisper.audio.SAMPLE_RATE
+                start = time.perf_counter()
+                try:
+                    async with batch_admission_slot(key, audio_seconds):
+                        queue_seconds = time.perf_counter() - start
+                        start = time.perf_counter()
+                        results = await run_in_threadpool(run_batch_transcription, [item[2] for item in short], user)
+                except Exception as e:
+                    logger.error(f"批量转录失败: {e}")
+                    results = [None] * len(short)
+                    queue_seconds = 0.0
+                transcribe_seconds = time.perf_counter() - start
+                batches += 1
+                metrics.observe("batch_transcribe", transcribe_seconds)
+                metrics.incr("batch_items", len(short))
+                for (index, filename, audio, decode_seconds), result in zip(short, results):
+                    if result is None or result.needs_fallback:
+                        # 批量解码未通过质量阈值，按单条路径做温度回退
+                        metrics.incr("batch_fallbacks")
+                        long.append((index, filename, audio, decode_seconds))
+                        continue
+                    completed += 1
+                    yield batch_record(request, index, filename, audio, result.text, result.language,
+                                       result.avg_logprob, True, {
+                                           "decode_ms": round(decode_seconds * 1000, 1),
+                                           "queue_ms": round(queue_seconds * 1000, 1),
+                                           "transcribe_ms": round(transcribe_seconds * 1000, 1),
+                                           "batch_size": len(short)
+                                       })
+            
+            for index, filename, audio, decode_seconds in long:
+                try:
+                    record = await transcribe_single(index, filename, audio, decode_seconds)
+                    completed += 1
+                    yield record
+                except Exception as e:
+                    logger.error(f"转录失败 {filename}: {e}")
+                    failed += 1
+                    yield {"type": "error", "index": index, "filename": filename, "detail": f"转录失败: {e}"}
+    finally:
+        for task in tasks:
+            task.cancel()
+    
+    yield {
+        "type": "done",
+        "total": len(items),
+        "completed": completed,
+        "failed": failed,
+        "batches": batches,
+        "elapsed_ms": round((time.perf_counter() - batch_start) * 1000, 1)
+    }
+
+async def run_batch_job(job_id: str, items: list, request: Request) -> None:
+    """后台执行批量任务，每条结果追加到任务文件"""
+    try:
+        async for record in iter_batch_results(items, request):
+            if record["type"] != "done":
+                await run_in_threadpool(batch_jobs.append, job_id, record)
+        await run_in_threadpool(batch_jobs.finish, job_id)
+        logger.info(f"📦 批量任务完成: {job_id} ({len(items)} 个文件)")
+    except Exception as e:
+        logger.error(f"批量任务失败 {job_id}: {e}")
+        await run_in_threadpool(batch_jobs.finish, job_id, str(e))
+
+@app.post("/transcribe/batch")
+async def transcribe_batch_files(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    mode: str = Form("stream")
+):
+    """批量转录 - 多个音频文件或zip/tar压缩包
+    
+    mode=stream: 按完成顺序流式返回NDJSON；mode=job: 立即返回任务ID，结果通过 GET /transcribe/batch/{job_id} 轮询
+    """
+    if not model_available():
+        raise HTTPException(status_code=500, detail="Whisper模型未加载")
+    if mode not in ("stream", "job"):
+        raise HTTPException(status_code=400, detail="mode 只能为 stream 或 job")
+    try:
+        items = await read_batch_uploads(files)
+    except BatchInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not items:
+        raise HTTPException(status_code=400, detail="上传内容中没有音频文件")
+    logger.info(f"📦 批量转录: {len(items)} 个文件 ({mode})")
+    
+    if mode == "job":
+        job_id = await run_in_threadpool(batch_jobs.create, len(items))
+        task = asyncio.create_task(run_batch_job(job_id, items, request))
+        batch_tasks.add(task)
+        task.add_done_callback(batch_tasks.discard)
+        return JSONResponse(status_code=202, content={
+            "job_id": job_id,
+            "status_url": f"/transcribe/batch/{job_id}",
+            "total": len(items)
+        })
+    
+    async def event_stream():
+        async for record in iter_batch_results(items, request):
+            yield json.dumps(record, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+@app.get("/transcribe/batch/{job_id}")
+async def get_batch_job(job_id: str, offset: int = 0, limit: int = 1000):
+    """批量任务进度与结果 (results 从 offset 开始，下次轮询传入 next_offset)"""
+    status = await run_in_threadpool(batch_jobs.status, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    offset = max(0, offset)
+    results = await run_in_threadpool(batch_jobs.results, job_id, offset, max(1, min(limit, 5000)))
+    return {**status, "results": results, "next_offset": offset + len(results)}
+
 def execute_enhanced_command(cmd_type: str, target: str, original_text: str) -> Optional[str]:
     """执行增强的系统命令"""
     system = platform.system().lower()
@@ -624,60 +1429,374 @@ def execute_enhanced_command(cmd_type: str, target: str, original_text: str) ->
     
     return None
 
+def run_detected_command(text: str, is_command: bool, cmd_type: str, target: str,
+                         execute_commands: bool) -> tuple[bool, Optional[str]]:
+    """根据已有的指令检测结果执行命令 - 返回(是否执行成功, 执行结果)"""
+    command_executed = False
+    command_result = None
+    
+    if execute_commands and is_command:
+        logger.info(f"开始执行指令: {cmd_type} - {target}")
+        command_result = execute_enhanced_command(cmd_type, target, text)
+        if command_result and not command_result.startswith("抱歉"):
+            command_executed = True
+            logger.info(f"指令执行成功: {command_result}")
+        else:
+            logger.warning(f"指令执行失败: {command_result}")
+    
+    return command_executed, command_result
+
 @app.post("/process", response_model=VoiceResponse)
-async def process_voice_command(request: VoiceRequest):
+async def process_voice_command(request: VoiceRequest, http_request: Request):
     """处理语音命令接口"""
     try:
         text = request.text
         logger.info(f"处理命令: {text}")
         
         # 智能指令检测
-        is_command, cmd_type, target = smart_command_detection(text)
+        is_command, cmd_type, target = smart_command_detection(text, request.language)
         logger.info(f"指令检测结果: is_command={is_command}, cmd_type={cmd_type}, target={target}")
         
         # 执行系统命令 (优先执行，不依赖AI回复)
-        command_executed = False
-        command_result = None
-        
-        if request.execute_commands and is_command:
-            logger.info(f"开始执行指令: {cmd_type} - {target}")
-            command_result = execute_enhanced_command(cmd_type, target, text)
-            if command_result and not command_result.startswith("抱歉"):
-                command_executed = True
-                logger.info(f"指令执行成功: {command_result}")
-            else:
-                logger.warning(f"指令执行失败: {command_result}")
+        command_executed, command_result = run_detected_command(
+            text, is_command, cmd_type, target, request.execute_commands
+        )
         
         # 获取AI回复 (只有非指令才需要AI回复)
         ai_response = "指令已处理" if is_command else "正在处理您的请求..."
         
-        # 只有普通对话才调用AI模型，避免GPU内存冲突
+        # 只有普通对话才调用AI模型，显存由仲裁器在Whisper与LLM之间协调
         if not is_command:
             try:
-                # 为了避免GPU内存冲突，暂时禁用AI回复
-                # ai_response = await get_ai_response(text)
-                ai_response = "语音指令模式下暂不支持AI对话，请直接在聊天框中输入文字进行AI对话"
+                if Config.AI_REPLY_ENABLED:
+                    ai_response = await run_in_threadpool(get_ai_response, text)
+                else:
+                    ai_response = "语音指令模式下暂不支持AI对话，请直接在聊天框中输入文字进行AI对话"
             except Exception as e:
                 logger.warning(f"AI回复获取失败: {e}")
                 ai_response = "抱歉，AI服务暂时不可用"
         
+        audit(http_request, "/process", {
+            "transcribed_text": text,
+            "language": request.language,
+            "is_command": is_command,
+            "command_type": cmd_type,
+            "command_target": target,
+            "command_executed": command_executed,
+            "command_result": command_result
+        })
+        reply_audio = None
+        if request.speak:
+            reply_audio = await speak_reply(command_result or ai_response)
         return VoiceResponse(
             transcribed_text=text,
             ai_response=ai_response,
             command_executed=command_executed,
             command_result=command_result,
-            command_type=cmd_type if is_command else None
+            command_type=cmd_type if is_command else None,
+            reply_audio=reply_audio
         )
         
     except Exception as e:
         logger.error(f"处理命令错误: {str(e)}")
         raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
 
-async def get_ai_response(text: str) -> str:
-    """获取AI回复"""
-    models_to_try = ['minicpm-v:latest', 'qwen3:14b', 'deepseek-r1:14b', 'llama3.2-vision:11b']
+@app.post("/voice")
+async def voice_round_trip(
+    request: Request,
+    audio_file: UploadFile = File(...),
+    execute_commands: bool = Form(True),
+    ai_reply: bool = Form(False),
+    stream: bool = Form(False),
+    speak: bool = Form(False)
+):
+    """一站式语音接口 - 转录、指令检测、执行一次完成，可选流式AI回复与回复语音"""
+    if not model_available():
+        raise HTTPException(status_code=500, detail="Whisper模型未加载")
+    
+    request_start = time.perf_counter()
+    try:
+        # 只有请求了AI回复且AI回复开启时才会调用LLM，此时才值得预加载
+        transcription = await transcribe_upload(audio_file, request,
+                                                prefetch_llm=ai_reply and Config.AI_REPLY_ENABLED)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"转录错误: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"转录失败: {str(e)}")
+    
+    text = transcription["transcribed_text"]
+    is_command = transcription["is_command"]
+    timings = transcription["timings"]
     
-    for model_name in models_to_try:
+    # 直接复用转录阶段的检测结果，不再重复 smart_command_detection
+    start = time.perf_counter()
+    command_executed, command_result = await run_in_threadpool(
+        run_detected_command,
+        text, is_command, transcription["command_type"], transcription["command_target"],
+        execute_commands
+    )
+    timings["execute_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    
+    payload = {
+        "success": True,
+        "transcribed_text": text,
+        "language": transcription["language"],
+        "language_id": transcription["language_id"],
+        "is_command": is_command,
+        "command_type": transcription["command_type"],
+        "command_target": transcription["command_target"],
+        "confidence": transcription["confidence"],
+        "command_executed": command_executed,
+        "command_result": command_result,
+        "ai_response": None,
+        "reply_audio": None,
+        "upload": transcription["upload"],
+        "encoder": transcription["encoder"],
+        "timings": timings
+    }
+    
+    want_ai_reply = ai_reply and bool(text) and not is_command
+    
+    if want_ai_reply and stream:
+        # NDJSON流: 先返回转录/指令结果，再逐段推送AI回复
+        timings["total_ms"] = round((time.perf_counter() - request_start) * 1000, 1)
+        metrics.observe("voice_total", time.perf_counter() - request_start)
+        audit(request, "/voice", payload)
+        
+        def event_stream():
+            yield json.dumps({"type": "result", **payload}, ensure_ascii=False) + "\n"
+            if speak and speaker is not None:
+                # 每生成完一句就提交合成，音频按句序穿插在文本片段之间
+                # 某句合成失败时推送 audio_error，文本照常继续 (与非流式一样，语音失败不影响文本回复)
+                for kind, item in speaker.narrate(stream_ai_response(text)):
+                    event = {"type": "ai_delta", "text": item} if kind == "delta" else {"type": kind, **item.to_dict()}
+                    yield json.dumps(event, ensure_ascii=False) + "\n"
+            else:
+                for delta in stream_ai_response(text):
+                    yield json.dumps({"type": "ai_delta", "text": delta}, ensure_ascii=False) + "\n"
+            yield json.dumps({"type": "done"}) + "\n"
+        
+        return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+    
+    if want_ai_reply:
+        start = time.perf_counter()
+        payload["ai_response"] = await run_in_threadpool(get_ai_response, text)
+        timings["ai_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    
+    if speak:
+        start = time.perf_counter()
+        payload["reply_audio"] = await speak_reply(payload["ai_response"] or command_result)
+        timings["tts_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    
+    timings["total_ms"] = round((time.perf_counter() - request_start) * 1000, 1)
+    metrics.observe("voice_total", time.perf_counter() - request_start)
+    audit(request, "/voice", payload)
+    return payload
+
+@app.post("/speak")
+async def speak_text(request: SpeakRequest):
+    """文本转语音 - 返回WAV；固定短语命中缓存时直接返回，stream=true时逐句返回NDJSON"""
+    if speaker is None:
+        raise HTTPException(status_code=503, detail="语音合成未启用 (TTS_ENABLED=false)")
+    
+    if request.stream:
+        def audio_stream():
+            try:
+                for kind, item in speaker.narrate([request.text]):
+                    if kind != "delta":
+                        yield json.dumps({"type": kind, **item.to_dict()}, ensure_ascii=False) + "\n"
+            except Exception as e:
+                logger.error(f"语音合成错误: {e}")
+                yield json.dumps({"type": "error", "detail": f"语音合成失败: {e}"}, ensure_ascii=False) + "\n"
+                return
+            yield json.dumps({"type": "done"}) + "\n"
+        
+        return StreamingResponse(audio_stream(), media_type="application/x-ndjson")
+    
+    # 命中缓存时不进入线程池
+    audio, cached = speaker.cached(request.text), True
+    if audio is None:
+        try:
+            audio, cached = await run_in_threadpool(speaker.speak, request.text)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            logger.error(f"语音合成错误: {e}")
+            raise HTTPException(status_code=500, detail=f"语音合成失败: {e}")
+    return Response(content=audio, media_type="audio/wav", headers={"X-TTS-Cache": "hit" if cached else "miss"})
+
+@app.get("/metrics")
+async def get_metrics():
+    """运行时性能指标"""
+    return metrics.snapshot()
+
+def require_debug_access(request: Request) -> None:
+    """调试接口: 未启用 (或未设置令牌) 时404，令牌不符时403"""
+    if not Config.DEBUG_ENDPOINTS or not Config.DEBUG_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get("x-debug-token", "")
+    if not hmac.compare_digest(token.encode(), Config.DEBUG_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="调试令牌无效")
+
+@app.get("/debug/profile")
+async def debug_profile(request: Request, seconds: float = 10, interval_ms: float = 10,
+                        torch_ops: bool = False, format: str = "folded"):
+    """采样剖析 seconds 秒内所有线程的Python调用栈
+    
+    format=folded 返回折叠栈文本 (flamegraph.pl / speedscope)；format=json 返回热点函数汇总和折叠栈，
+    torch_ops=true 时另外汇总窗口内各次推理的torch算子耗时
+    """
+    require_debug_access(request)
+    if format not in ("folded", "json"):
+        raise HTTPException(status_code=400, detail="format 只能为 folded 或 json")
+    seconds = max(0.1, min(seconds, Config.DEBUG_PROFILE_MAX_SECONDS))
+    try:
+        with profiling_session(max(1.0, interval_ms) / 1000, with_torch=torch_ops) as (sampler, ops):
+            await asyncio.sleep(seconds)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if ops:
+        await run_in_threadpool(ops.wait, Config.DEBUG_PROFILE_MAX_SECONDS)
+    logger.info(f"🔬 剖析完成: {seconds:g}秒，{sampler.samples} 次采样")
+    if format == "folded":
+        return PlainTextResponse(sampler.folded())
+    return {
+        **sampler.summary(),
+        "torch_ops": {"inferences": ops.calls, "skipped": ops.skipped, "unfinished": ops.in_flight,
+                      "top": ops.top()} if ops else None,
+        "folded": sampler.folded()
+    }
+
+@app.get("/debug/tracemalloc")
+async def debug_tracemalloc(request: Request, seconds: float = 10, top: int = 20,
+                            group_by: str = "lineno", frames: int = 1):
+    """临时开启tracemalloc，返回 seconds 秒内净增最多和占用最多的分配位置"""
+    require_debug_access(request)
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by 只能为 lineno、filename 或 traceback")
+    seconds = max(0.1, min(seconds, Config.DEBUG_PROFILE_MAX_SECONDS))
+    try:
+        with tracemalloc_session(max(1, min(frames, 50))) as before:
+            await asyncio.sleep(seconds)
+            after = await run_in_threadpool(tracemalloc.take_snapshot)
+            result = await run_in_threadpool(top_allocations, before, after, group_by, max(1, min(top, 200)))
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"seconds": seconds, **result}
+
+def require_admin_access(request: Request) -> None:
+    """管理接口: 未设置令牌时404，令牌不符时403"""
+    if not Config.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(token.encode(), Config.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="管理令牌无效")
+
+@app.get("/admin/config")
+async def admin_config(request: Request):
+    """当前生效的配置版本: 指令规则摘要、可热更新的配置值、待重启的改动"""
+    require_admin_access(request)
+    if config_reloader is None:
+        raise HTTPException(status_code=503, detail="热更新未启动")
+    return config_reloader.status()
+
+@app.post("/admin/reload")
+async def admin_reload(request: Request):
+    """立即重新读取指令规则文件与.env (在线程池中编译，不影响进行中的请求)；不合法时返回400，当前版本不变"""
+    require_admin_access(request)
+    if config_reloader is None:
+        raise HTTPException(status_code=503, detail="热更新未启动")
+    try:
+        result = await run_in_threadpool(config_reloader.reload, True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"热更新失败: {e}")
+    return {**result, "worker_pid": os.getpid()}
+
+@app.post("/cancel")
+async def cancel_inference(request: Request, body: Optional[CancelRequest] = None):
+    """取消当前用户进行中的转录 (指定 request_id 时只取消该请求)"""
+    request_id = body.request_id if body else None
+    cancelled = inference_requests.cancel(client_key(request), request_id)
+    return {"cancelled": cancelled}
+
+@app.get("/history")
+async def get_history(request: Request, client: Optional[str] = None, limit: int = 50,
+                      before: Optional[str] = None, all_clients: bool = False):
+    """审计历史 (按时间倒序，游标分页)
+    
+    只返回当前用户的记录；client 指定其他用户或 all_clients=true 返回全部需要管理令牌 (X-Admin-Token)
+    """
+    if audit_log is None:
+        raise HTTPException(status_code=404, detail="审计日志未启用")
+    limit = max(1, min(limit, 500))
+    own = client_key(request)
+    if all_clients or (client and client != own):
+        require_admin_access(request)
+    if not all_clients:
+        client = client or own
+    try:
+        items, next_cursor = await run_in_threadpool(
+            audit_log.query, None if all_clients else client, limit, before
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+    return {"items": items, "next": next_cursor}
+
+def profile_payload(client: str) -> dict:
+    profile = client_profiles.get(client)
+    terms = profile.terms() if profile else []
+    language = Config.WHISPER_LANGUAGE if Config.WHISPER_LANGUAGE != "auto" else "zh"
+    return {
+        "client": client,
+        **(profile.to_dict() if profile else {"recent_commands": [], "custom_terms": [], "version": 0}),
+        "prompt": build_prompt_text(language, terms)
+    }
+
+@app.get("/profile")
+async def get_profile(request: Request):
+    """当前用户的上下文档案 (最近指令、自定义词汇、生成的解码提示)"""
+    return profile_payload(client_key(request))
+
+@app.put("/profile")
+async def update_profile(request: Request, update: ProfileUpdate):
+    """设置当前用户的自定义应用名称等词汇，用于解码提示和词汇偏置"""
+    client = client_key(request)
+    client_profiles.set_custom_terms(client, update.custom_terms)
+    return profile_payload(client)
+
+def cached_ai_response(text: str) -> Optional[str]:
+    """回复缓存命中时直接返回，不占用LLM (也不触发显存仲裁)"""
+    if reply_cache is None:
+        return None
+    found = reply_cache.get(text)
+    if found is None:
+        metrics.incr("reply_cache_misses")
+        return None
+    entry, score = found
+    metrics.incr("reply_cache_hits")
+    metrics.incr("reply_cache_saved_seconds", entry.generation_seconds)
+    logger.info(f"♻️ AI回复缓存命中 (相似度 {score:.2f}，省下 {entry.generation_seconds:.1f}秒): {entry.key}")
+    return entry.reply
+
+def remember_ai_response(text: str, reply: str, generation_seconds: float) -> None:
+    """缓存成功生成的回复 (所有模型都不可用时的提示不缓存)"""
+    if reply_cache is not None and reply and reply != AI_UNAVAILABLE_REPLY:
+        reply_cache.put(text, reply, generation_seconds)
+
+def get_ai_response(text: str) -> str:
+    """获取AI回复 (同步阻塞，需在线程池中调用)"""
+    reply = cached_ai_response(text)
+    if reply is not None:
+        return reply
+    with llm_slot():
+        start = time.perf_counter()
+        reply = _generate_ai_response(text)
+        remember_ai_response(text, reply, time.perf_counter() - start)
+    return reply
+
+def _generate_ai_response(text: str) -> str:
+    for model_name in reply_models():
         try:
             logger.info(f"尝试模型: {model_name}")
             response = requests.post(
@@ -685,13 +1804,17 @@ async def get_ai_response(text: str) -> str:
                 json={
                     "model": model_name,
                     "prompt": f"请用中文回答这个问题: {text}",
-                    "stream": False
+                    "stream": False,
+                    "keep_alive": Config.OLLAMA_KEEP_ALIVE
                 },
                 timeout=30
             )
             
             if response.status_code == 200:
                 result = response.json()
+                if load_seconds(result):
+                    # 请求本身承担了模型加载 (冷启动)
+                    record_load(model_name, load_seconds(result), "request")
                 ai_response = result['response'].strip()
                 logger.info(f"成功使用模型: {model_name}")
                 return ai_response
@@ -703,13 +1826,85 @@ async def get_ai_response(text: str) -> str:
             logger.warning(f"模型 {model_name} 失败: {str(e)}")
             continue
     
-    return "抱歉，我无法连接到AI模型。请确保Ollama正在运行并且已安装模型。"
+    return AI_UNAVAILABLE_REPLY
 
-if __name__ == "__main__":
-    from config import Config
+def stream_ai_response(text: str):
+    """流式获取AI回复，逐段产出文本 (缓存命中时一次产出完整回复)"""
+    reply = cached_ai_response(text)
+    if reply is not None:
+        yield reply
+        return
+    with llm_slot():
+        start = time.perf_counter()
+        deltas = []
+        stream = _stream_ai_response(text)
+        while True:
+            try:
+                delta = next(stream)
+            except StopIteration as finished:
+                complete = finished.value
+                break
+            deltas.append(delta)
+            yield delta
+        # 客户端中途断开时不会执行到这里；模型中途失败、拼接了备用模型或不可用提示的回复也不缓存
+        if complete:
+            remember_ai_response(text, "".join(deltas), time.perf_counter() - start)
+
+def _stream_ai_response(text: str):
+    """逐段产出回复，依次尝试各模型 - 返回值表示回复是否完整 (由一个模型从头生成到 done，没有拼接)"""
+    emitted = False
+    for model_name in reply_models():
+        try:
+            logger.info(f"尝试模型(流式): {model_name}")
+            with requests.post(
+                f"{OLLAMA_API_BASE}/generate",
+                json={
+                    "model": model_name,
+                    "prompt": f"请用中文回答这个问题: {text}",
+                    "stream": True,
+                    "keep_alive": Config.OLLAMA_KEEP_ALIVE
+                },
+                stream=True,
+                timeout=30
+            ) as response:
+                if response.status_code != 200:
+                    logger.warning(f"模型 {model_name} HTTP错误: {response.status_code}")
+                    continue
+                
+                partial = emitted
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        raise RuntimeError(chunk["error"])
+                    if chunk.get("response"):
+                        emitted = True
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        if load_seconds(chunk):
+                            record_load(model_name, load_seconds(chunk), "request")
+                        logger.info(f"成功使用模型: {model_name}")
+                        return not partial
+                raise RuntimeError("流在 done 之前结束")
+                
+        except Exception as e:
+            logger.warning(f"模型 {model_name} 失败: {str(e)}")
+            continue
     
+    yield AI_UNAVAILABLE_REPLY
+    return False
+
+if __name__ == "__main__":
     # 打印配置信息
     Config.print_config()
     
     # 使用配置启动服务
-    uvicorn.run(app, host=Config.API_HOST, port=Config.API_PORT)
\ No newline at end of file
+    cpu_plan = make_cpu_plan()
+    if cpu_plan.workers > 1:
+        # 多进程模式: 主进程先加载模型再fork，worker共享只读权重
+        serve_prefork(app, Config.API_HOST, Config.API_PORT, cpu_plan.workers, preload=load_asr_engine,
+                      threads_per_worker=cpu_plan.torch_threads, worker_cpus=cpu_plan.worker_cpus)
+    else:
+        apply_worker_plan(cpu_plan)
+        uvicorn.run(app, host=Config.API_HOST, port=Config.API_PORT)
\ No newline at end of file